@@ -0,0 +1,64 @@
+-- Atomic seat booking for /travel/bookings and /travel/bookings/batch.
+-- Safe to run multiple times.
+
+ALTER TABLE public.bookings ADD COLUMN IF NOT EXISTS passenger_name TEXT;
+-- Seats each booking row holds; book_seats inserts one row per seat
+ALTER TABLE public.bookings ADD COLUMN IF NOT EXISTS seats INTEGER NOT NULL DEFAULT 1;
+
+-- Belt and braces: even a buggy writer can't take a trip below zero seats
+DO $$
+BEGIN
+    ALTER TABLE public.trips ADD CONSTRAINT trips_seats_available_nonnegative
+        CHECK (seats_available >= 0) NOT VALID;
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+-- Books one seat per passenger (names may be NULL) in a single transaction:
+-- checks availability, decrements trips.seats_available and inserts the
+-- bookings, or raises and changes nothing. Each seat costs p_unit_price (the
+-- API's price table, app/services/pricing.py), or the listed price if NULL.
+-- The API maps the errors:
+--   HINT 'sold_out' -> 409, ERRCODE P0002 -> 404, ERRCODE 22023 -> 400
+-- The three-argument version is dropped: with both, PostgREST couldn't choose
+DROP FUNCTION IF EXISTS public.book_seats(UUID, UUID, TEXT[]);
+CREATE OR REPLACE FUNCTION public.book_seats(p_trip_id UUID, p_user_id UUID, p_passengers TEXT[],
+                                             p_unit_price NUMERIC DEFAULT NULL)
+RETURNS SETOF public.bookings
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_seats INTEGER := COALESCE(array_length(p_passengers, 1), 0);
+    v_price NUMERIC;
+    v_left INTEGER;
+BEGIN
+    IF v_seats < 1 THEN
+        RAISE EXCEPTION 'at least one passenger is required' USING ERRCODE = '22023';
+    END IF;
+
+    -- Row lock on this trip only: buyers of the same trip queue here,
+    -- buyers of other trips don't wait at all
+    SELECT price, COALESCE(seats_available, 0) INTO v_price, v_left
+    FROM public.trips
+    WHERE id = p_trip_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'trip % not found', p_trip_id USING ERRCODE = 'P0002';
+    END IF;
+    IF v_left < v_seats THEN
+        RAISE EXCEPTION 'only % seat(s) left on this trip', v_left USING ERRCODE = 'P0001', HINT = 'sold_out';
+    END IF;
+
+    UPDATE public.trips SET seats_available = v_left - v_seats WHERE id = p_trip_id;
+
+    RETURN QUERY
+    INSERT INTO public.bookings (trip_id, user_id, status, seats, total_price, passenger_name)
+    SELECT p_trip_id, p_user_id, 'confirmed', 1, COALESCE(p_unit_price, v_price), passenger
+    FROM unnest(p_passengers) AS passenger
+    RETURNING *;
+END;
+$$;
+
+-- The caller sets the price, so only the API (service role) may call it
+REVOKE EXECUTE ON FUNCTION public.book_seats(UUID, UUID, TEXT[], NUMERIC) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.book_seats(UUID, UUID, TEXT[], NUMERIC) TO service_role;
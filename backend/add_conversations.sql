@@ -0,0 +1,29 @@
+-- Server-side AI chat history (see app/services/conversations.py). Safe to run multiple times.
+-- The API keeps the last few messages of a conversation verbatim and folds older
+-- ones into conversations.summary, so a prompt never needs more than one row here
+-- plus the newest CHAT_HISTORY_TURNS messages.
+
+CREATE TABLE IF NOT EXISTS public.conversations (
+    id uuid PRIMARY KEY,
+    user_id uuid REFERENCES public.profiles(id),  -- null for anonymous chats
+    summary jsonb NOT NULL DEFAULT '{}'::jsonb,   -- rolling summary of the messages before the window
+    message_count integer NOT NULL DEFAULT 0,     -- next messages.seq
+    created_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL,
+    updated_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+ALTER TABLE public.messages ADD COLUMN IF NOT EXISTS conversation_id uuid
+    REFERENCES public.conversations(id) ON DELETE CASCADE;
+ALTER TABLE public.messages ADD COLUMN IF NOT EXISTS seq integer;
+-- The assistant answers anonymous users too
+ALTER TABLE public.messages ALTER COLUMN user_id DROP NOT NULL;
+
+-- Loading a conversation: its newest messages, by position
+CREATE UNIQUE INDEX IF NOT EXISTS messages_conversation_seq_idx ON public.messages (conversation_id, seq);
+CREATE INDEX IF NOT EXISTS conversations_user_id_updated_at_idx ON public.conversations (user_id, updated_at DESC);
+
+-- The API writes with the service role; users can read their own conversations
+ALTER TABLE public.conversations ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Users can view own conversations." ON public.conversations;
+CREATE POLICY "Users can view own conversations." ON public.conversations
+    FOR SELECT USING (auth.uid() = user_id);
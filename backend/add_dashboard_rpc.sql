@@ -0,0 +1,25 @@
+-- Admin dashboard: server-side aggregates and the indexes that keep them cheap.
+-- Safe to run multiple times.
+
+-- Bookings carry the amount charged so revenue can be summed in the database
+ALTER TABLE public.bookings ADD COLUMN IF NOT EXISTS total_price NUMERIC NOT NULL DEFAULT 0;
+
+-- Range scans for "today's bookings" and the revenue aggregate
+CREATE INDEX IF NOT EXISTS bookings_created_at_idx ON public.bookings (created_at);
+
+-- Partial indexes for the dashboard counts (HEAD + Prefer: count=exact)
+CREATE INDEX IF NOT EXISTS trips_in_progress_idx ON public.trips (id) WHERE status = 'in_progress';
+CREATE INDEX IF NOT EXISTS support_tickets_open_idx ON public.support_tickets (created_at) WHERE status <> 'Closed';
+
+-- Revenue since a point in time, summed next to the data instead of in the API
+CREATE OR REPLACE FUNCTION public.dashboard_revenue(since TIMESTAMP WITH TIME ZONE)
+RETURNS NUMERIC
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(SUM(total_price), 0)
+    FROM public.bookings
+    WHERE created_at >= since;
+$$;
+
+GRANT EXECUTE ON FUNCTION public.dashboard_revenue(TIMESTAMP WITH TIME ZONE) TO anon, authenticated, service_role;
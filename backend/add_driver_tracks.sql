@@ -0,0 +1,28 @@
+-- Stored driver tracks (see app/services/driver_locations.py). Safe to run multiple times.
+-- Drivers' current positions live in the API's in-memory index; this table
+-- keeps a downsampled track (a point every DRIVER_TRACK_MIN_METERS moved or
+-- DRIVER_TRACK_MAX_INTERVAL seconds), written in batches, for trip replay
+-- and disputes.
+
+CREATE TABLE IF NOT EXISTS public.driver_tracks (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    driver_id uuid NOT NULL,
+    trip_id uuid,                                 -- the trip being driven, if any
+    recorded_at timestamp with time zone NOT NULL, -- time of the GPS fix
+    lat double precision NOT NULL CHECK (lat BETWEEN -90 AND 90),
+    lon double precision NOT NULL CHECK (lon BETWEEN -180 AND 180),
+    speed real,                                   -- m/s
+    heading real                                  -- degrees from north
+);
+
+-- A driver's track by time, and a trip's track
+CREATE INDEX IF NOT EXISTS driver_tracks_driver_recorded_idx
+    ON public.driver_tracks (driver_id, recorded_at, id);
+CREATE INDEX IF NOT EXISTS driver_tracks_trip_recorded_idx
+    ON public.driver_tracks (trip_id, recorded_at, id) WHERE trip_id IS NOT NULL;
+
+-- The API writes with the service role; drivers can read their own tracks
+ALTER TABLE public.driver_tracks ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Drivers can view own tracks." ON public.driver_tracks;
+CREATE POLICY "Drivers can view own tracks." ON public.driver_tracks
+    FOR SELECT USING (auth.uid() = driver_id);
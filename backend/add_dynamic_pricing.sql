@@ -0,0 +1,41 @@
+-- Route distances for the price table (see app/services/pricing.py). Safe to run multiple times.
+-- A trip on a route listed here starts from distance_km x PRICING_RATE_PER_KM;
+-- other trips start from their listed price. Either way the API adjusts it
+-- for seats left, time to departure and route demand, and charges that price
+-- through book_seats (re-run add_book_seats_rpc.sql for its p_unit_price).
+-- One row per pair of places serves both directions.
+
+CREATE TABLE IF NOT EXISTS public.route_distances (
+    origin text NOT NULL,         -- as trips name it ("Johannesburg")
+    destination text NOT NULL,
+    distance_km numeric NOT NULL CHECK (distance_km > 0), -- by road
+    PRIMARY KEY (origin, destination)
+);
+
+INSERT INTO public.route_distances (origin, destination, distance_km) VALUES
+    ('Johannesburg', 'Pretoria', 58),
+    ('Johannesburg', 'Durban', 568),
+    ('Johannesburg', 'Cape Town', 1398),
+    ('Johannesburg', 'Bloemfontein', 398),
+    ('Johannesburg', 'Polokwane', 320),
+    ('Johannesburg', 'Mbombela', 330),
+    ('Johannesburg', 'Gqeberha', 1045),
+    ('Johannesburg', 'East London', 985),
+    ('Pretoria', 'Polokwane', 265),
+    ('Pretoria', 'Durban', 625),
+    ('Durban', 'Pietermaritzburg', 80),
+    ('Durban', 'Bloemfontein', 630),
+    ('Durban', 'East London', 670),
+    ('Cape Town', 'Stellenbosch', 50),
+    ('Cape Town', 'Gqeberha', 760),
+    ('Cape Town', 'Bloemfontein', 1000),
+    ('Cape Town', 'Durban', 1640),
+    ('Gqeberha', 'East London', 300),
+    ('Bloemfontein', 'Gqeberha', 675)
+ON CONFLICT (origin, destination) DO NOTHING;
+
+-- Read by the API (any key); written by admins in the dashboard
+ALTER TABLE public.route_distances ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Route distances are viewable by everyone." ON public.route_distances;
+CREATE POLICY "Route distances are viewable by everyone." ON public.route_distances
+    FOR SELECT USING (true);
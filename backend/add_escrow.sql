@@ -0,0 +1,99 @@
+-- Escrow holds on trip fares (see app/services/escrow.py).
+-- Safe to run multiple times. Run after add_wallet_ledger.sql.
+-- A booking's fare is held (an escrow_hold ledger transaction, pending until
+-- settled) once its card payment has succeeded and covers it (add_payments.sql);
+-- a failed payment refunds what is still held for its bookings. Completing the trip schedules the release to the driver
+-- after the dispute window; cancelling it schedules an immediate refund. The
+-- API's scheduler settles what is due in batches through settle_escrow_holds,
+-- so nothing has to scan every booking at night.
+
+CREATE TABLE IF NOT EXISTS public.escrow_holds (
+    id uuid PRIMARY KEY,                          -- = the escrow_hold ledger transaction
+    booking_id uuid UNIQUE,
+    trip_id uuid NOT NULL,
+    payer_id uuid NOT NULL,
+    driver_id uuid NOT NULL,
+    amount_cents bigint NOT NULL CHECK (amount_cents > 0),
+    funded_by text NOT NULL DEFAULT 'card' CHECK (funded_by IN ('card', 'wallet')),  -- where a refund goes
+    status text NOT NULL DEFAULT 'held' CHECK (status IN ('held', 'disputed', 'released', 'refunded')),
+    settle_as text CHECK (settle_as IN ('release', 'refund')),  -- set with release_at by the trip's status
+    release_at timestamp with time zone,          -- NULL until the trip is completed or cancelled
+    dispute_reason text,
+    settlement_id uuid,                           -- the escrow_release / escrow_refund transaction
+    created_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL,
+    settled_at timestamp with time zone
+);
+
+-- Holds of a trip whose status changes; the scheduler's due holds, oldest first
+CREATE INDEX IF NOT EXISTS escrow_holds_trip_held_idx
+    ON public.escrow_holds (trip_id) WHERE status = 'held';
+CREATE INDEX IF NOT EXISTS escrow_holds_due_idx
+    ON public.escrow_holds (release_at, id) WHERE status = 'held' AND release_at IS NOT NULL;
+
+-- Opens a batch of holds, each with its escrow_hold ledger transaction, in one
+-- database transaction. A hold that already exists (a retried booking) is
+-- skipped. Returns how many were opened.
+CREATE OR REPLACE FUNCTION public.open_escrow_holds(p_holds jsonb)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    h jsonb;
+    v_opened integer := 0;
+BEGIN
+    FOR h IN SELECT value FROM jsonb_array_elements(p_holds) LOOP
+        INSERT INTO public.escrow_holds (id, booking_id, trip_id, payer_id, driver_id, amount_cents, funded_by)
+        SELECT r.id, r.booking_id, r.trip_id, r.payer_id, r.driver_id, r.amount_cents, COALESCE(r.funded_by, 'card')
+        FROM jsonb_populate_record(NULL::public.escrow_holds, h->'hold') AS r
+        ON CONFLICT DO NOTHING;
+        CONTINUE WHEN NOT FOUND;
+
+        PERFORM public.post_ledger_transaction(h->'transaction', h->'entries', (h->>'month')::date);
+        v_opened := v_opened + 1;
+    END LOOP;
+    RETURN v_opened;
+END;
+$$;
+
+-- Settles a batch of holds: each element moves one hold from its expected
+-- status ("from": held, or disputed when a dispute is resolved) to released /
+-- refunded and posts its ledger transaction. A hold no longer in that status
+-- (settled by another API instance, disputed meanwhile) is skipped, so a
+-- batch can be retried safely. Returns the ids of the holds it settled.
+CREATE OR REPLACE FUNCTION public.settle_escrow_holds(p_settlements jsonb)
+RETURNS SETOF uuid
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    s jsonb;
+    v_id uuid;
+BEGIN
+    -- In id order, so concurrent batches lock the holds in the same order
+    FOR s IN SELECT value FROM jsonb_array_elements(p_settlements) ORDER BY value->>'hold_id' LOOP
+        UPDATE public.escrow_holds
+        SET status = s->>'status',
+            settlement_id = (s->'transaction'->>'id')::uuid,
+            settled_at = timezone('utc'::text, now())
+        WHERE id = (s->>'hold_id')::uuid AND status = s->>'from'
+        RETURNING id INTO v_id;
+        CONTINUE WHEN NOT FOUND;
+
+        PERFORM public.post_ledger_transaction(s->'transaction', s->'entries', (s->>'month')::date);
+        -- The payer's "Trip Payment" is no longer pending
+        UPDATE public.ledger_transactions SET status = 'completed' WHERE id = v_id AND status = 'pending';
+        RETURN NEXT v_id;
+    END LOOP;
+END;
+$$;
+
+-- Only the API (service role) opens and settles holds
+REVOKE ALL ON FUNCTION public.open_escrow_holds(jsonb) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.open_escrow_holds(jsonb) TO service_role;
+REVOKE ALL ON FUNCTION public.settle_escrow_holds(jsonb) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.settle_escrow_holds(jsonb) TO service_role;
+
+-- Payers and drivers can see the holds on their trips
+ALTER TABLE public.escrow_holds ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Users can view own escrow holds." ON public.escrow_holds;
+CREATE POLICY "Users can view own escrow holds." ON public.escrow_holds
+    FOR SELECT USING (auth.uid() = payer_id OR auth.uid() = driver_id);
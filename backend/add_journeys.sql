@@ -0,0 +1,7 @@
+-- Trip durations for the journey planner (see app/services/journeys.py). Safe to run multiple times.
+-- /travel/journeys chains trips into itineraries with changes, which needs
+-- to know when each leg arrives. A driver may give the trip's duration;
+-- otherwise it is estimated from the route's distance (add_dynamic_pricing.sql)
+-- and trips on routes with neither aren't used as legs.
+
+ALTER TABLE public.trips ADD COLUMN IF NOT EXISTS duration_minutes integer CHECK (duration_minutes > 0);
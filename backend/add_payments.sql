@@ -0,0 +1,80 @@
+-- Payments verified in the background (see app/services/payment_verification.py).
+-- Safe to run multiple times.
+-- The API writes one row per checkout: pending when the checkout is created,
+-- then succeeded/failed from the provider's webhook or a status lookup.
+-- A checkout pays for the bookings it was created for (booking_ids), at
+-- their total price as the database has it.
+
+CREATE TABLE IF NOT EXISTS public.payments (
+    id uuid DEFAULT uuid_generate_v4() PRIMARY KEY,
+    checkout_id text NOT NULL UNIQUE,            -- what the payment switch returned as transactionId
+    transaction_id text,                         -- the provider's payment id, once paid
+    user_id uuid REFERENCES auth.users(id),
+    trip_id uuid REFERENCES public.trips(id),
+    booking_ids uuid[],                          -- the bookings this checkout pays for
+    seats integer,
+    amount_cents bigint,
+    currency text DEFAULT 'ZAR',
+    status text NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'succeeded', 'failed')),
+    provider_status text,                        -- the provider's own word for it, for support
+    verified_at timestamp with time zone,
+    created_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL,
+    updated_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+-- The poller: payments still pending some minutes after the checkout
+CREATE INDEX IF NOT EXISTS payments_status_created_at_idx ON public.payments (status, created_at);
+-- A user's payment history
+CREATE INDEX IF NOT EXISTS payments_user_trip_idx ON public.payments (user_id, trip_id, created_at DESC);
+-- The payments of a booking
+ALTER TABLE public.payments ADD COLUMN IF NOT EXISTS booking_ids uuid[];
+CREATE INDEX IF NOT EXISTS payments_booking_ids_idx ON public.payments USING gin (booking_ids);
+
+-- paid | underpaid | failed | pending, or NULL for bookings made without a card payment
+ALTER TABLE public.bookings ADD COLUMN IF NOT EXISTS payment_status text;
+CREATE INDEX IF NOT EXISTS bookings_user_trip_idx ON public.bookings (user_id, trip_id);
+
+-- When a payment gets its result, the bookings it was made for take it, in the
+-- same transaction as the payment write. A succeeded payment only makes them
+-- paid if it covers their total price (fares are in rand); a short one leaves
+-- them "underpaid"
+CREATE OR REPLACE FUNCTION public.payments_settle_bookings()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    due_cents bigint;
+    result text := CASE NEW.status WHEN 'succeeded' THEN 'paid' ELSE NEW.status END;
+BEGIN
+    IF NEW.status = 'succeeded' THEN
+        SELECT COALESCE(round(SUM(total_price) * 100), 0) INTO due_cents
+        FROM public.bookings WHERE id = ANY(NEW.booking_ids);
+        IF NEW.amount_cents IS NULL OR NEW.amount_cents < due_cents
+           OR upper(COALESCE(NEW.currency, 'ZAR')) <> 'ZAR' THEN
+            result := 'underpaid';
+        END IF;
+    END IF;
+
+    UPDATE public.bookings
+    SET payment_status = result
+    WHERE id = ANY(NEW.booking_ids)
+      AND (payment_status IS NULL OR payment_status <> 'paid');
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS payments_settle_bookings ON public.payments;
+CREATE TRIGGER payments_settle_bookings AFTER INSERT OR UPDATE OF status, booking_ids, amount_cents ON public.payments
+    FOR EACH ROW WHEN (NEW.status <> 'pending' AND NEW.booking_ids IS NOT NULL)
+    EXECUTE FUNCTION public.payments_settle_bookings();
+
+-- Bookings used to copy the latest payment of their user and trip at insert,
+-- so one payment of any amount marked later bookings paid too
+DROP TRIGGER IF EXISTS bookings_payment_status ON public.bookings;
+DROP FUNCTION IF EXISTS public.bookings_payment_status();
+
+-- The API writes with the service role; users can read their own payments
+ALTER TABLE public.payments ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Users can view own payments." ON public.payments;
+CREATE POLICY "Users can view own payments." ON public.payments
+    FOR SELECT USING (auth.uid() = user_id);
@@ -0,0 +1,46 @@
+-- Pickup zones and trip timeline events (see app/services/geofences.py). Safe to run multiple times.
+-- The API watches each upcoming trip's pickup zone against its driver's
+-- pings and records when the driver arrived, how long they waited and when
+-- they left, so dispute timelines come from data.
+
+ALTER TABLE public.trips ADD COLUMN IF NOT EXISTS pickup_lat double precision CHECK (pickup_lat BETWEEN -90 AND 90);
+ALTER TABLE public.trips ADD COLUMN IF NOT EXISTS pickup_lon double precision CHECK (pickup_lon BETWEEN -180 AND 180);
+ALTER TABLE public.trips ADD COLUMN IF NOT EXISTS pickup_radius_m real CHECK (pickup_radius_m > 0); -- default GEOFENCE_RADIUS_M
+-- date and time are local text; departs_at is the same moment as a timestamp
+ALTER TABLE public.trips ADD COLUMN IF NOT EXISTS departs_at timestamp with time zone;
+
+UPDATE public.trips
+SET departs_at = (date || ' ' || time)::timestamp AT TIME ZONE 'Africa/Johannesburg'
+WHERE departs_at IS NULL
+  AND date ~ '^\d{4}-\d{2}-\d{2}$'
+  AND time ~ '^\d{1,2}:\d{2}(:\d{2})?$';
+
+-- The geofence refresh: trips with a pickup point departing around now
+CREATE INDEX IF NOT EXISTS trips_pickup_departs_idx
+    ON public.trips (departs_at, id) WHERE pickup_lat IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS public.trip_events (
+    trip_id uuid NOT NULL REFERENCES public.trips(id) ON DELETE CASCADE,
+    driver_id uuid NOT NULL,
+    kind text NOT NULL CHECK (kind IN ('arrived', 'waited', 'left')),
+    at timestamp with time zone NOT NULL, -- time of the ping that crossed the zone edge
+    minutes integer NOT NULL DEFAULT 0,   -- time in the zone so far
+    lat double precision NOT NULL,
+    lon double precision NOT NULL,
+    distance_m real NOT NULL,             -- from the pickup point
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    -- A trip's timeline in order; a replayed or retried event isn't recorded twice
+    PRIMARY KEY (trip_id, at, kind)
+);
+
+-- The API writes with the service role; a trip's driver and passengers can read its events
+ALTER TABLE public.trip_events ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Trip members can view trip events." ON public.trip_events;
+CREATE POLICY "Trip members can view trip events." ON public.trip_events
+    FOR SELECT USING (
+        auth.uid() = driver_id
+        OR EXISTS (SELECT 1 FROM public.bookings b WHERE b.trip_id = trip_events.trip_id AND b.user_id = auth.uid())
+    );
+
+-- Disputes about a trip get its timeline in the admin console
+ALTER TABLE public.support_tickets ADD COLUMN IF NOT EXISTS trip_id uuid REFERENCES public.trips(id) ON DELETE SET NULL;
@@ -0,0 +1,32 @@
+-- Index-backed trip search. Safe to run multiple times.
+-- verify_search_indexes.py checks with EXPLAIN that these are actually used.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Normalized locations ("  Cape  town " -> "cape town"), kept in sync by Postgres.
+-- Must match trip_cache.normalize() on the API side.
+ALTER TABLE public.trips ADD COLUMN IF NOT EXISTS origin_norm TEXT
+    GENERATED ALWAYS AS (lower(regexp_replace(btrim(origin), '\s+', ' ', 'g'))) STORED;
+ALTER TABLE public.trips ADD COLUMN IF NOT EXISTS destination_norm TEXT
+    GENERATED ALWAYS AS (lower(regexp_replace(btrim(destination), '\s+', ' ', 'g'))) STORED;
+
+-- Prefix search (TRIP_SEARCH_MATCH=prefix): origin_norm LIKE 'cape%' [AND destination_norm LIKE 'stell%'] [AND date = ...].
+-- text_pattern_ops lets LIKE 'x%' use the btree whatever the database collation is.
+CREATE INDEX IF NOT EXISTS trips_route_date_idx
+    ON public.trips (origin_norm text_pattern_ops, destination_norm text_pattern_ops, date);
+CREATE INDEX IF NOT EXISTS trips_destination_date_idx
+    ON public.trips (destination_norm text_pattern_ops, date);
+
+-- Substring search, the default (TRIP_SEARCH_MATCH=contains): LIKE '%town%' via trigrams
+CREATE INDEX IF NOT EXISTS trips_origin_norm_trgm_idx ON public.trips USING gin (origin_norm gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS trips_destination_norm_trgm_idx ON public.trips USING gin (destination_norm gin_trgm_ops);
+
+-- Keyset pagination order of /travel/trips
+CREATE INDEX IF NOT EXISTS trips_date_time_id_idx ON public.trips (date, time, id);
+
+-- /travel/bookings (a user's bookings, newest first) and trip passenger lists
+CREATE INDEX IF NOT EXISTS bookings_user_id_created_at_idx ON public.bookings (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS bookings_trip_id_idx ON public.bookings (trip_id);
+
+ANALYZE public.trips;
+ANALYZE public.bookings;
@@ -0,0 +1,8 @@
+-- Record when a trip's status last changed so dashboard rollups can be
+-- rebuilt per day/hour from the trips table. Safe to run multiple times.
+ALTER TABLE public.trips ADD COLUMN IF NOT EXISTS status_updated_at TIMESTAMP WITH TIME ZONE;
+
+UPDATE public.trips SET status_updated_at = created_at WHERE status_updated_at IS NULL;
+
+-- Backfill pages through trips/bookings by id
+CREATE INDEX IF NOT EXISTS trips_status_updated_at_idx ON public.trips (status_updated_at);
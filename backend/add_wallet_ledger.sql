@@ -0,0 +1,288 @@
+-- Double-entry wallet ledger (see app/services/ledger.py).
+-- Safe to run multiple times.
+-- Money is integer cents. Every transaction is a set of entries on accounts
+-- (wallet:<user>, escrow:<driver>, platform:revenue, external:*) that sum to
+-- zero. Entries are append-only; balances and wallet counters are snapshots
+-- kept up to date by the same database transaction that appends the entries,
+-- so reading a wallet never sums its history.
+
+CREATE TABLE IF NOT EXISTS public.ledger_transactions (
+    id uuid PRIMARY KEY,                          -- generated by the API: a retried post is a no-op
+    kind text NOT NULL CHECK (kind IN ('deposit', 'withdrawal', 'escrow_hold', 'escrow_release', 'escrow_refund')),
+    user_id uuid NOT NULL,                        -- whose wallet lists it
+    counterparty_id uuid,
+    trip_id uuid,
+    amount_cents bigint NOT NULL,                 -- signed, as user_id sees it
+    description text,
+    reference text,                               -- card checkout, bank transfer, ...
+    counters jsonb NOT NULL DEFAULT '[]'::jsonb,  -- what it added to wallet_counters, for the consistency check
+    created_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+-- completed | pending | failed: where the money movement stands outside the
+-- ledger (a bank payout, say). The entries themselves never change
+ALTER TABLE public.ledger_transactions ADD COLUMN IF NOT EXISTS status text NOT NULL DEFAULT 'completed'
+    CHECK (status IN ('completed', 'pending', 'failed'));
+
+-- A user's transaction list, newest first, paged by (created_at, id) and
+-- optionally limited to a date range; then the same for one type or status
+CREATE INDEX IF NOT EXISTS ledger_transactions_user_created_idx
+    ON public.ledger_transactions (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ledger_transactions_user_kind_created_idx
+    ON public.ledger_transactions (user_id, kind, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ledger_transactions_user_status_created_idx
+    ON public.ledger_transactions (user_id, status, created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS public.ledger_entries (
+    id bigserial PRIMARY KEY,
+    transaction_id uuid NOT NULL REFERENCES public.ledger_transactions(id),
+    account text NOT NULL,
+    amount_cents bigint NOT NULL CHECK (amount_cents <> 0),  -- + debit / - credit; per transaction they sum to 0
+    created_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+-- A transaction's entries; history of one account
+CREATE INDEX IF NOT EXISTS ledger_entries_transaction_idx ON public.ledger_entries (transaction_id);
+CREATE INDEX IF NOT EXISTS ledger_entries_account_idx ON public.ledger_entries (account, id);
+
+-- Append-only: corrections are new, reversing transactions
+CREATE OR REPLACE FUNCTION public.ledger_entries_append_only()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RAISE EXCEPTION 'ledger entries are append-only' USING ERRCODE = '42501';
+END;
+$$;
+
+DROP TRIGGER IF EXISTS ledger_entries_append_only ON public.ledger_entries;
+CREATE TRIGGER ledger_entries_append_only BEFORE UPDATE OR DELETE ON public.ledger_entries
+    FOR EACH ROW EXECUTE FUNCTION public.ledger_entries_append_only();
+DROP TRIGGER IF EXISTS ledger_entries_no_truncate ON public.ledger_entries;
+CREATE TRIGGER ledger_entries_no_truncate BEFORE TRUNCATE ON public.ledger_entries
+    FOR EACH STATEMENT EXECUTE FUNCTION public.ledger_entries_append_only();
+
+-- Balance of every account as of its latest entry
+CREATE TABLE IF NOT EXISTS public.ledger_balances (
+    account text PRIMARY KEY,
+    balance_cents bigint NOT NULL DEFAULT 0,
+    entry_count bigint NOT NULL DEFAULT 0,
+    updated_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+-- Running totals behind the wallet card
+CREATE TABLE IF NOT EXISTS public.wallet_counters (
+    user_id uuid PRIMARY KEY,
+    total_earned_cents bigint NOT NULL DEFAULT 0,
+    total_spent_cents bigint NOT NULL DEFAULT 0,
+    trips_completed integer NOT NULL DEFAULT 0,
+    open_holds integer NOT NULL DEFAULT 0,       -- paid trips not completed or refunded yet
+    updated_at timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+-- The same per calendar month, for the change against last month
+CREATE TABLE IF NOT EXISTS public.wallet_monthly (
+    user_id uuid NOT NULL,
+    month date NOT NULL,
+    earned_cents bigint NOT NULL DEFAULT 0,
+    spent_cents bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month)
+);
+
+-- Posts one transaction: the header, its entries, and the balance / counter
+-- snapshots, all or nothing. Posting an id that already exists returns the
+-- existing transaction and changes nothing. The API maps the errors:
+--   HINT 'unbalanced' -> 400, HINT 'insufficient_funds' -> 409
+CREATE OR REPLACE FUNCTION public.post_ledger_transaction(p_transaction jsonb, p_entries jsonb, p_month date)
+RETURNS public.ledger_transactions
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_txn public.ledger_transactions;
+    v_sum bigint;
+    v_count integer;
+BEGIN
+    SELECT COALESCE(SUM((e->>'amount_cents')::bigint), 0), COUNT(*) INTO v_sum, v_count
+    FROM jsonb_array_elements(p_entries) AS e;
+    IF v_sum <> 0 OR v_count < 2 THEN
+        RAISE EXCEPTION 'entries must be two or more and sum to 0 (got % summing to %)', v_count, v_sum
+            USING ERRCODE = '22023', HINT = 'unbalanced';
+    END IF;
+
+    INSERT INTO public.ledger_transactions
+        (id, kind, user_id, counterparty_id, trip_id, amount_cents, description, reference, counters, status, created_at)
+    SELECT t.id, t.kind, t.user_id, t.counterparty_id, t.trip_id, t.amount_cents, t.description, t.reference,
+           COALESCE(t.counters, '[]'::jsonb), COALESCE(t.status, 'completed'),
+           COALESCE(t.created_at, timezone('utc'::text, now()))
+    FROM jsonb_populate_record(NULL::public.ledger_transactions, p_transaction) AS t
+    ON CONFLICT (id) DO NOTHING
+    RETURNING * INTO v_txn;
+
+    IF NOT FOUND THEN
+        SELECT * INTO v_txn FROM public.ledger_transactions WHERE id = (p_transaction->>'id')::uuid;
+        RETURN v_txn;
+    END IF;
+
+    INSERT INTO public.ledger_entries (transaction_id, account, amount_cents, created_at)
+    SELECT v_txn.id, e->>'account', (e->>'amount_cents')::bigint, v_txn.created_at
+    FROM jsonb_array_elements(p_entries) AS e;
+
+    -- In account order, so concurrent posts lock the snapshot rows in the same
+    -- order and can't deadlock
+    INSERT INTO public.ledger_balances AS b (account, balance_cents, entry_count, updated_at)
+    SELECT e->>'account', SUM((e->>'amount_cents')::bigint), COUNT(*), v_txn.created_at
+    FROM jsonb_array_elements(p_entries) AS e
+    GROUP BY e->>'account'
+    ORDER BY e->>'account'
+    ON CONFLICT (account) DO UPDATE SET
+        balance_cents = b.balance_cents + EXCLUDED.balance_cents,
+        entry_count = b.entry_count + EXCLUDED.entry_count,
+        updated_at = EXCLUDED.updated_at;
+
+    IF EXISTS (
+        SELECT 1 FROM public.ledger_balances
+        WHERE account IN (SELECT e->>'account' FROM jsonb_array_elements(p_entries) AS e)
+          AND account LIKE 'wallet:%' AND balance_cents < 0
+    ) THEN
+        RAISE EXCEPTION 'insufficient funds' USING ERRCODE = 'P0001', HINT = 'insufficient_funds';
+    END IF;
+
+    INSERT INTO public.wallet_counters AS w (user_id, total_earned_cents, total_spent_cents, trips_completed, open_holds, updated_at)
+    SELECT c.user_id, c.earned_cents, c.spent_cents, c.trips_completed, c.open_holds, v_txn.created_at
+    FROM jsonb_to_recordset(v_txn.counters) AS c(user_id uuid, earned_cents bigint, spent_cents bigint, trips_completed integer, open_holds integer)
+    ORDER BY c.user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        total_earned_cents = w.total_earned_cents + EXCLUDED.total_earned_cents,
+        total_spent_cents = w.total_spent_cents + EXCLUDED.total_spent_cents,
+        trips_completed = w.trips_completed + EXCLUDED.trips_completed,
+        open_holds = w.open_holds + EXCLUDED.open_holds,
+        updated_at = EXCLUDED.updated_at;
+
+    INSERT INTO public.wallet_monthly AS m (user_id, month, earned_cents, spent_cents)
+    SELECT c.user_id, p_month, c.earned_cents, c.spent_cents
+    FROM jsonb_to_recordset(v_txn.counters) AS c(user_id uuid, earned_cents bigint, spent_cents bigint)
+    WHERE c.earned_cents <> 0 OR c.spent_cents <> 0
+    ORDER BY c.user_id
+    ON CONFLICT (user_id, month) DO UPDATE SET
+        earned_cents = m.earned_cents + EXCLUDED.earned_cents,
+        spent_cents = m.spent_cents + EXCLUDED.spent_cents;
+
+    RETURN v_txn;
+END;
+$$;
+
+-- Only the API (service role) posts; users read their own rows
+REVOKE ALL ON FUNCTION public.post_ledger_transaction(jsonb, jsonb, date) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.post_ledger_transaction(jsonb, jsonb, date) TO service_role;
+
+-- Consistency check, for admins and nightly jobs: replays the entries and the
+-- counter deltas recorded on the transactions and compares them with the
+-- snapshots. One statement over one snapshot (a STABLE function doesn't take a
+-- new one per query, and PostgREST runs it at REPEATABLE READ as set below), so
+-- transactions posted while it runs can't show up as mismatches. Reports up to
+-- p_limit mismatches and unbalanced transactions, and how many there are.
+CREATE OR REPLACE FUNCTION public.ledger_check(p_limit integer DEFAULT 100)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+SET default_transaction_isolation = 'repeatable read'
+AS $$
+WITH account_sums AS (
+    SELECT account, SUM(amount_cents) AS balance_cents, COUNT(*) AS entry_count
+    FROM public.ledger_entries
+    GROUP BY account
+),
+unbalanced AS (
+    SELECT transaction_id, SUM(amount_cents) AS sum_cents
+    FROM public.ledger_entries
+    GROUP BY transaction_id
+    HAVING SUM(amount_cents) <> 0
+),
+deltas AS (
+    SELECT c.user_id, date_trunc('month', t.created_at AT TIME ZONE 'UTC')::date AS month,
+           COALESCE(c.earned_cents, 0) AS earned_cents, COALESCE(c.spent_cents, 0) AS spent_cents,
+           COALESCE(c.trips_completed, 0) AS trips_completed, COALESCE(c.open_holds, 0) AS open_holds
+    FROM public.ledger_transactions t
+    CROSS JOIN LATERAL jsonb_to_recordset(t.counters)
+        AS c(user_id uuid, earned_cents bigint, spent_cents bigint, trips_completed integer, open_holds integer)
+),
+user_sums AS (
+    SELECT user_id, SUM(earned_cents) AS earned_cents, SUM(spent_cents) AS spent_cents,
+           SUM(trips_completed) AS trips_completed, SUM(open_holds) AS open_holds
+    FROM deltas
+    GROUP BY user_id
+),
+month_sums AS (
+    SELECT user_id, month, SUM(earned_cents) AS earned_cents, SUM(spent_cents) AS spent_cents
+    FROM deltas
+    GROUP BY user_id, month
+),
+mismatches AS (
+    SELECT 'balance' AS kind, COALESCE(s.account, b.account) AS key,
+           jsonb_build_array(COALESCE(s.balance_cents, 0), COALESCE(s.entry_count, 0)) AS expected,
+           CASE WHEN b.account IS NULL THEN 'null'::jsonb
+                ELSE jsonb_build_array(b.balance_cents, b.entry_count) END AS actual
+    FROM account_sums s
+    FULL JOIN public.ledger_balances b ON b.account = s.account
+    WHERE (COALESCE(s.balance_cents, 0), COALESCE(s.entry_count, 0)) IS DISTINCT FROM (b.balance_cents, b.entry_count)
+    UNION ALL
+    SELECT 'counters', COALESCE(u.user_id, w.user_id)::text,
+           jsonb_build_object('earned_cents', COALESCE(u.earned_cents, 0), 'spent_cents', COALESCE(u.spent_cents, 0),
+                              'trips_completed', COALESCE(u.trips_completed, 0), 'open_holds', COALESCE(u.open_holds, 0)),
+           CASE WHEN w.user_id IS NULL THEN 'null'::jsonb
+                ELSE jsonb_build_object('earned_cents', w.total_earned_cents, 'spent_cents', w.total_spent_cents,
+                                        'trips_completed', w.trips_completed, 'open_holds', w.open_holds) END
+    FROM user_sums u
+    FULL JOIN public.wallet_counters w ON w.user_id = u.user_id
+    WHERE (COALESCE(u.earned_cents, 0), COALESCE(u.spent_cents, 0), COALESCE(u.trips_completed, 0),
+           COALESCE(u.open_holds, 0))
+          IS DISTINCT FROM (COALESCE(w.total_earned_cents, 0), COALESCE(w.total_spent_cents, 0),
+                            COALESCE(w.trips_completed, 0), COALESCE(w.open_holds, 0))
+    UNION ALL
+    -- wallet_monthly only has rows for months with earnings or spending
+    SELECT 'monthly', COALESCE(m.user_id, w.user_id)::text || '/' || COALESCE(m.month, w.month)::text,
+           jsonb_build_object('earned_cents', COALESCE(m.earned_cents, 0), 'spent_cents', COALESCE(m.spent_cents, 0)),
+           CASE WHEN w.user_id IS NULL THEN 'null'::jsonb
+                ELSE jsonb_build_object('earned_cents', w.earned_cents, 'spent_cents', w.spent_cents) END
+    FROM month_sums m
+    FULL JOIN public.wallet_monthly w ON w.user_id = m.user_id AND w.month = m.month
+    WHERE (COALESCE(m.earned_cents, 0), COALESCE(m.spent_cents, 0))
+          IS DISTINCT FROM (COALESCE(w.earned_cents, 0), COALESCE(w.spent_cents, 0))
+)
+SELECT jsonb_build_object(
+    'ok', NOT EXISTS (SELECT 1 FROM mismatches) AND NOT EXISTS (SELECT 1 FROM unbalanced),
+    'entries', (SELECT COALESCE(SUM(entry_count), 0) FROM account_sums),
+    'transactions', (SELECT COUNT(*) FROM public.ledger_transactions),
+    'accounts', (SELECT COUNT(*) FROM account_sums),
+    'unbalanced_count', (SELECT COUNT(*) FROM unbalanced),
+    'unbalanced_transactions', COALESCE((
+        SELECT jsonb_agg(jsonb_build_object('transaction_id', x.transaction_id, 'sum_cents', x.sum_cents))
+        FROM (SELECT * FROM unbalanced ORDER BY transaction_id LIMIT p_limit) x), '[]'::jsonb),
+    'mismatch_count', (SELECT COUNT(*) FROM mismatches),
+    'mismatches', COALESCE((
+        SELECT jsonb_agg(to_jsonb(x))
+        FROM (SELECT * FROM mismatches ORDER BY kind, key LIMIT p_limit) x), '[]'::jsonb)
+);
+$$;
+
+REVOKE ALL ON FUNCTION public.ledger_check(integer) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.ledger_check(integer) TO service_role;
+
+ALTER TABLE public.ledger_transactions ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Users can view own ledger transactions." ON public.ledger_transactions;
+CREATE POLICY "Users can view own ledger transactions." ON public.ledger_transactions
+    FOR SELECT USING (auth.uid() = user_id);
+
+ALTER TABLE public.wallet_counters ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Users can view own wallet counters." ON public.wallet_counters;
+CREATE POLICY "Users can view own wallet counters." ON public.wallet_counters
+    FOR SELECT USING (auth.uid() = user_id);
+
+ALTER TABLE public.wallet_monthly ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Users can view own monthly wallet counters." ON public.wallet_monthly;
+CREATE POLICY "Users can view own monthly wallet counters." ON public.wallet_monthly
+    FOR SELECT USING (auth.uid() = user_id);
+
+-- Entries and balances are read through the API only
+ALTER TABLE public.ledger_entries ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.ledger_balances ENABLE ROW LEVEL SECURITY;
@@ -20,7 +20,8 @@ env_path = os.path.join(base_dir, "config", ".env.development")
 print(f"Loading env from: {env_path}")
 load_dotenv(dotenv_path=env_path)
 
-from app.routers import travel, ai, payments, chatbase, admin, wallet
+from app.routers import travel, ai, payments, chatbase, admin, wallet, live, drivers
+from app.services.pagination import NEXT_CURSOR_HEADER
 
 app = FastAPI(title="UrbanSmart-34 Travel API")
 
@@ -30,6 +31,8 @@ app.include_router(payments.router)
 app.include_router(chatbase.router)
 app.include_router(admin.router)
 app.include_router(wallet.router)
+app.include_router(live.router)
+app.include_router(drivers.router)
 # Configure CORS
 origins = [
     "http://localhost:5173",
@@ -42,8 +45,160 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+@app.on_event("startup")
+async def backfill_dashboard_metrics():
+    import asyncio
+    from app.services.supabase_client import async_supabase_admin, async_supabase
+    from app.services import metrics
+
+    client = async_supabase_admin or async_supabase
+    if not client:
+        return
+
+    async def run():
+        try:
+            await metrics.backfill(client)
+        except Exception as e:
+            print(f"Dashboard metrics backfill failed: {e}")
+
+    # Don't hold up startup; the dashboard queries the tables until this finishes
+    asyncio.create_task(run())
+
+@app.on_event("startup")
+async def build_location_gazetteer():
+    import asyncio
+    from app.services.supabase_client import async_supabase
+    from app.services.gazetteer import keep_fresh
+
+    if async_supabase:
+        asyncio.create_task(keep_fresh(async_supabase))
+
+@app.on_event("startup")
+async def start_chat_history_writer():
+    from app.services.supabase_client import async_supabase_admin, async_supabase
+    from app.services.conversations import history_writer
+
+    # Service role: the API writes every user's chat history
+    client = async_supabase_admin or async_supabase
+    if client:
+        history_writer.start(client)
+
+@app.on_event("startup")
+async def start_payment_verification():
+    from app.services.supabase_client import async_supabase_admin, async_supabase
+    from app.services.payment_verification import payment_verifier
+
+    # Service role: the workers update every user's payments and bookings
+    client = async_supabase_admin or async_supabase
+    if client:
+        payment_verifier.start(client)
+
+@app.on_event("startup")
+async def start_escrow_scheduler():
+    from app.services.supabase_client import async_supabase_admin, async_supabase
+    from app.services.escrow import escrow_scheduler
+
+    # Service role: settlements post to every user's wallet
+    client = async_supabase_admin or async_supabase
+    if client:
+        escrow_scheduler.start(client)
+
+@app.on_event("startup")
+async def start_live_updates():
+    from app.services.pubsub import hub
+
+    # Joins the other workers' broker sockets when PUSH_BROKER=unix
+    hub.start()
+
+@app.on_event("startup")
+async def start_driver_tracks():
+    from app.services.supabase_client import async_supabase_admin, async_supabase
+    from app.services.driver_locations import driver_locations
+
+    # Service role: the API writes every driver's track
+    client = async_supabase_admin or async_supabase
+    if client:
+        driver_locations.start(client)
+
+@app.on_event("startup")
+async def start_pickup_geofences():
+    from app.services.supabase_client import async_supabase_admin, async_supabase
+    from app.services.driver_locations import driver_locations
+    from app.services.geofences import pickup_geofences
+
+    # Every applied driver ping is checked against the pickup zones of their trips
+    driver_locations.watchers.append(pickup_geofences.engine.observe)
+    # Service role: reads every upcoming trip and writes their events
+    client = async_supabase_admin or async_supabase
+    if client:
+        pickup_geofences.start(client)
+
+@app.on_event("startup")
+async def start_price_table():
+    from app.services.supabase_client import async_supabase_admin, async_supabase
+    from app.services.pricing import price_table
+
+    # Searches read prices from the table; until its first load they show the listed price
+    client = async_supabase_admin or async_supabase
+    if client:
+        price_table.start(client)
+
+@app.on_event("startup")
+async def start_journey_planner():
+    from app.services.supabase_client import async_supabase_admin, async_supabase
+    from app.services.journeys import journey_planner
+
+    # /travel/journeys plans over the in-memory trip graph; empty until its first load
+    client = async_supabase_admin or async_supabase
+    if client:
+        journey_planner.start(client)
+
+@app.on_event("startup")
+async def tune_garbage_collection():
+    import gc
+
+    # Opt-in, for nodes serving many live-update connections: they keep
+    # millions of objects alive and a full collection walks them all with the
+    # event loop stopped (about a second at 10k connections). A higher
+    # threshold such as GC_THRESHOLD=50000,20,10 lets short-lived objects die
+    # first, so full passes are rare, and what the startup hooks before this
+    # one loaded is frozen out of them. Unset leaves the collector alone
+    threshold = os.getenv("GC_THRESHOLD", "")
+    if not threshold:
+        return
+    gc.set_threshold(*(int(n) for n in threshold.split(",")))
+    gc.freeze()
+
+@app.on_event("shutdown")
+async def close_supabase_clients():
+    from app.services.supabase_client import close_async_clients
+    from app.services.conversations import history_writer
+    from app.services.payment_verification import payment_verifier
+    from app.services.escrow import escrow_scheduler
+    from app.services.pubsub import hub
+    from app.services.driver_locations import driver_locations
+    from app.services.geofences import pickup_geofences
+    from app.services.pricing import price_table
+    from app.services.journeys import journey_planner
+
+    # Flush queued chat history while the clients are still open
+    await history_writer.stop()
+    # Queued payment jobs stay on disk for the next start
+    await payment_verifier.stop()
+    # Due holds stay due in the database
+    await escrow_scheduler.stop()
+    hub.stop()
+    # Track points still waiting
+    await driver_locations.stop()
+    # Pickup zone events still waiting
+    await pickup_geofences.stop()
+    await price_table.stop()
+    await journey_planner.stop()
+    await close_async_clients()
+
 @app.get("/")
 def read_root():
     return {"message": "UrbanSmart-34 Travel API is running"}
@@ -51,3 +206,16 @@ def read_root():
 @app.get("/health")
 def health_check():
     return {"status": "ok", "minimax_configured": bool(os.getenv("MINIMAX_API_KEY"))}
+
+@app.get("/health/supabase")
+def supabase_pool_health():
+    """Connection pool counters for the Supabase REST transport."""
+    from app.services.supabase_client import supabase, supabase_admin, async_supabase, async_supabase_admin
+    from app.services.supabase_rest import shared_pool_stats
+    return {
+        "client": supabase.pool_stats() if supabase else None,
+        "admin": supabase_admin.pool_stats() if supabase_admin else None,
+        "async_client": async_supabase.pool_stats() if async_supabase else None,
+        "async_admin": async_supabase_admin.pool_stats() if async_supabase_admin else None,
+        "shared": shared_pool_stats(),
+    }
@@ -1,93 +1,173 @@
 from fastapi import APIRouter, HTTPException, Depends
 from datetime import datetime
-from pydantic import BaseModel
+import asyncio
+import os
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any
 
-import os
-from app.services.supabase_rest import SupabaseTable
+from app.services.supabase_client import async_supabase, async_supabase_admin
+from app.services import metrics, ledger
+from app.services.auth import require_admin
+from app.services.escrow import escrow_scheduler, HoldNotFound, HoldConflict
+from app.services.geofences import trip_timeline
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
 
 # NOTE: In a production app, we would verify the user is actually an admin role.
 # For the prototype, we assume any authenticated user hitting these endpoints is authorized.
+# Endpoints that read the whole ledger or move money do check (Depends(require_admin)).
+
+# "exact" is cheap with the partial indexes in add_dashboard_rpc.sql; "estimated" trades accuracy for speed
+DASHBOARD_COUNT_MODE = os.getenv("DASHBOARD_COUNT_MODE", "exact")
+
+
+async def _count_active_trips(client):
+    # 1. Active Trips: Count trips where status = 'in_progress'
+    response = await client.table("trips").select("id", count=DASHBOARD_COUNT_MODE, head=True).eq("status", "in_progress").execute()
+    return response.count or 0
+
+
+async def _count_todays_bookings(client, since):
+    # 2. Today's Bookings: Count bookings created today
+    response = await client.table("bookings").select("id", count=DASHBOARD_COUNT_MODE, head=True).gte("created_at", since).execute()
+    return response.count or 0
+
+
+async def _todays_revenue(client, since):
+    # 3. Revenue Est: Sum of total_price for today's bookings, aggregated in Postgres
+    response = await client.rpc("dashboard_revenue", {"since": since}).execute()
+    return float(response.data or 0)
+
+
+async def _count_pending_issues(client):
+    # 4. Pending Issues: Count support_tickets where status != 'Closed'
+    response = await client.table("support_tickets").select("id", count=DASHBOARD_COUNT_MODE, head=True).neq("status", "Closed").execute()
+    if response.status_code is None or response.status_code >= 400:
+        raise RuntimeError(f"support_tickets count failed with status {response.status_code}")
+    return response.count or 0
+
+
+async def fetch_dashboard_stats(client):
+    """
+    Issues the dashboard queries concurrently. Counts come back as PostgREST
+    Content-Range totals (HEAD requests) and revenue from an RPC, so no rows
+    are downloaded and latency is the slowest query rather than the sum.
+    """
+    since = f"{datetime.utcnow().strftime('%Y-%m-%d')}T00:00:00Z"
+    active_trips, todays_bookings, revenue_est, pending_issues = await asyncio.gather(
+        _count_active_trips(client),
+        _count_todays_bookings(client, since),
+        _todays_revenue(client, since),
+        _count_pending_issues(client),
+        return_exceptions=True,
+    )
+
+    if isinstance(active_trips, Exception):
+        print(f"Error fetching active trips: {active_trips}")
+        active_trips = 0
+    if isinstance(todays_bookings, Exception):
+        print(f"Error fetching today's bookings: {todays_bookings}")
+        todays_bookings = 0
+    if isinstance(revenue_est, Exception):
+        print(f"Error fetching today's revenue: {revenue_est}")
+        revenue_est = 0
+    if isinstance(pending_issues, Exception):
+        print(f"Error fetching pending issues: {pending_issues}")
+        # Mock fallback if the table doesn't exist yet
+        pending_issues = 7
+
+    return {
+        "activeTrips": active_trips,
+        "todaysBookings": todays_bookings,
+        "revenueEst": revenue_est,
+        "pendingIssues": pending_issues
+    }
+
 
 @router.get("/dashboard/stats")
-def get_dashboard_stats():
+async def get_dashboard_stats():
     """
     Returns aggregated stats for the admin command center.
     This includes active trips, today's bookings, revenue, and pending issues.
     """
-    # Initialize values
-    active_trips = 0
-    todays_bookings = 0
-    revenue_est = 0
-    pending_issues = 0
-    
-    supabase_url = os.getenv("SUPABASE_URL")
-    supabase_key = os.getenv("SUPABASE_KEY")
+    if not metrics.rollups.ready:
+        # Rollups not built yet (startup backfill still running or failed): query the tables
+        stats = await fetch_dashboard_stats(async_supabase)
+        return {**stats, "activeTripsTrend": 0, "todaysBookingsTrend": 0, "revenueTrend": 0}
 
-    # 1. Active Trips: Count trips where status = 'in_progress'
+    # Counts, revenue and trends come from the precomputed rollups; only the ticket count hits the DB
+    stats = metrics.rollups.dashboard()
     try:
-        trips_table = SupabaseTable(supabase_url, supabase_key, "trips")
-        trips_response = trips_table.select("id").eq("status", "in_progress").execute()
-        if trips_response and getattr(trips_response, "status_code", 200) == 200:
-             active_trips = len(trips_response.json())
+        stats["pendingIssues"] = await _count_pending_issues(async_supabase)
     except Exception as e:
-        print(f"Error fetching active trips: {e}")
+        print(f"Error fetching pending issues: {e}")
+        # Mock fallback if the table doesn't exist yet
+        stats["pendingIssues"] = 7
+    return stats
 
-    # 2. Today's Bookings: Count bookings created today
-    today_str = datetime.utcnow().strftime('%Y-%m-%d')
+
+@router.post("/metrics/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_metrics():
+    """Recomputes the dashboard rollups from the trips and bookings tables."""
     try:
-        bookings_table = SupabaseTable(supabase_url, supabase_key, "bookings")
-        bookings_table.params["created_at"] = f"gte.{today_str}T00:00:00Z"
-        bookings_response = bookings_table.select("id, total_price").execute()
-        
-        if bookings_response and getattr(bookings_response, "status_code", 200) == 200:
-             data = bookings_response.json()
-             todays_bookings = len(data)
-             # 3. Revenue Est: Sum of total_price for today's bookings
-             revenue_est = sum([float(b.get('total_price', 0)) for b in data])
+        counts = await metrics.backfill(async_supabase_admin or async_supabase)
     except Exception as e:
-         print(f"Error fetching today's bookings: {e}")
+        print(f"Error rebuilding metrics: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "rebuilt", **counts, "built_at": metrics.rollups.built_at}
 
-    # 4. Pending Issues: Count support_tickets where status != 'Closed'
+@router.get("/ledger/check", dependencies=[Depends(require_admin)])
+async def check_ledger():
+    """
+    Replays every ledger entry and compares the result with the balance
+    snapshots and wallet counters, in one database statement. Reads the
+    whole ledger: for admins and nightly jobs, not for request paths.
+    """
+    client = async_supabase_admin
+    if not client:
+        raise HTTPException(status_code=503, detail="Database connection unavailable")
     try:
-        tickets_table = SupabaseTable(supabase_url, supabase_key, "support_tickets")
-        tickets_table.params["status"] = "neq.Closed"
-        issues_response = tickets_table.select("id").execute()
-        if issues_response and getattr(issues_response, "status_code", 200) == 200:
-             pending_issues = len(issues_response.json())
+        return await ledger.check(client)
+
     except Exception as e:
-         print(f"Error fetching pending issues: {e}")
-         # Mock fallback if the table doesn't exist yet
-         pending_issues = 7
+        print(f"Error checking ledger: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
 
-    return {
-        "activeTrips": active_trips,
-        "activeTripsTrend": 12, # Mock trend
-        "todaysBookings": todays_bookings,
-        "todaysBookingsTrend": 8, # Mock trend
-        "revenueEst": revenue_est,
-        "revenueTrend": -2, # Mock trend
-        "pendingIssues": pending_issues
-    }
+class EscrowResolution(BaseModel):
+    outcome: str = Field(..., pattern="^(release|refund)$")
+
+@router.post("/escrow/{hold_id}/resolve", dependencies=[Depends(require_admin)])
+async def resolve_escrow_dispute(hold_id: str, resolution: EscrowResolution):
+    """Settles a disputed fare now: released to the driver or refunded to the payer."""
+    try:
+        return await escrow_scheduler.resolve(hold_id, resolution.outcome)
+
+    except HoldNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except HoldConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"Error resolving escrow dispute: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/issues")
-def get_recent_issues():
+async def get_recent_issues():
      """
      Returns a list of recent support tickets/disputes.
      """
      try:
-         supabase_url = os.getenv("SUPABASE_URL")
-         supabase_key = os.getenv("SUPABASE_KEY")
-         tickets_table = SupabaseTable(supabase_url, supabase_key, "support_tickets")
+         tickets_table = async_supabase.table("support_tickets")
          tickets_table.params["order"] = "created_at.desc"
          tickets_table.params["limit"] = "10"
-         issues_response = tickets_table.select().execute()
+         issues_response = await tickets_table.select().execute()
          
-         if issues_response and getattr(issues_response, "status_code", 200) == 200:
-             issues = issues_response.json()
+         if issues_response and issues_response.status_code == 200:
+             issues = issues_response.data
              # We want to format this for the frontend table
              formatted_issues = []
              for issue in issues:
@@ -114,20 +194,18 @@ def get_recent_issues():
      ]
 
 @router.get("/logs")
-def get_recent_logs():
+async def get_recent_logs():
      """
      Returns a list of recent system logs for the activity feed.
      """
      try:
-         supabase_url = os.getenv("SUPABASE_URL")
-         supabase_key = os.getenv("SUPABASE_KEY")
-         logs_table = SupabaseTable(supabase_url, supabase_key, "system_logs")
+         logs_table = async_supabase.table("system_logs")
          logs_table.params["order"] = "created_at.desc"
          logs_table.params["limit"] = "10"
-         logs_response = logs_table.select().execute()
+         logs_response = await logs_table.select().execute()
          
-         if logs_response and getattr(logs_response, "status_code", 200) == 200:
-             return logs_response.json()
+         if logs_response and logs_response.status_code == 200:
+             return logs_response.data
      except Exception as e:
          print(f"Error fetching logs: {e}")
          
@@ -137,17 +215,15 @@ def get_recent_logs():
      ]
 
 @router.get("/disputes")
-def get_disputes():
+async def get_disputes():
     """Returns a list of disputes."""
     try:
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_KEY")
-        tickets_table = SupabaseTable(supabase_url, supabase_key, "support_tickets")
+        tickets_table = async_supabase.table("support_tickets")
         tickets_table.params["type"] = "eq.Dispute"
         tickets_table.params["order"] = "created_at.desc"
-        response = tickets_table.select().execute()
-        if response and getattr(response, "status_code", 200) == 200:
-            return response.json()
+        response = await tickets_table.select().execute()
+        if response and response.status_code == 200:
+            return response.data
     except Exception as e:
         print(f"Error fetching disputes: {e}")
         
@@ -157,8 +233,30 @@ def get_disputes():
     ]
 
 @router.get("/disputes/{dispute_id}")
-def get_dispute_detail(dispute_id: str):
+async def get_dispute_detail(dispute_id: str):
     """Returns details for a specific dispute."""
+    try:
+        # A dispute about a trip gets the trip's recorded timeline (bookings, pickup zone, status)
+        client = async_supabase_admin or async_supabase
+        response = await client.table("support_tickets").select("*").eq("id", dispute_id).execute()
+        if response and response.status_code == 200 and response.data:
+            ticket = response.data[0]
+            timeline = await trip_timeline(client, ticket["trip_id"]) if ticket.get("trip_id") else None
+            if timeline is not None:
+                return {
+                    "id": ticket["id"],
+                    "type": ticket.get("type"),
+                    "status": ticket.get("status"),
+                    "created_at": ticket.get("created_at"),
+                    "reason": ticket.get("description"),
+                    "trip_id": ticket["trip_id"],
+                    "pickup": timeline["summary"],
+                    "timeline": timeline["timeline"],
+                    "chat_logs": []
+                }
+    except Exception as e:
+        print(f"Error fetching dispute {dispute_id}: {e}")
+
     return {
         "id": dispute_id,
         "type": "Non-arrival Complaint",
@@ -196,6 +294,6 @@ class DisputeResolution(BaseModel):
     note: str
 
 @router.post("/disputes/{dispute_id}/resolve")
-def resolve_dispute(dispute_id: str, payload: DisputeResolution):
+async def resolve_dispute(dispute_id: str, payload: DisputeResolution):
     """Resolve a dispute based on admin action."""
     return {"status": "success", "message": f"Dispute {dispute_id} resolved with action: {payload.action}", "note": payload.note}
@@ -1,7 +1,15 @@
-from fastapi import APIRouter, HTTPException
+import json
+import asyncio
+from contextlib import aclosing
+from typing import Optional
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.services.gemini import chat_completion
-from app.services.supabase_client import supabase  # Import the shared client
+from app.services.supabase_client import async_supabase, async_supabase_admin  # Import the shared clients
+from app.services.trip_context import build_trip_context
+from app.services.ai_cache import response_cache
+from app.services.llm_gateway import gateway
+from app.services.conversations import conversations, ConversationNotFound
 
 router = APIRouter(
     prefix="/ai",
@@ -10,30 +18,28 @@ router = APIRouter(
 )
 
 class ChatRequest(BaseModel):
-    messages: list
-    model: str = "gemini-1.5-flash"
+    # Either the new `message` (plus `conversation_id` after the first turn; the
+    # server keeps the history) or the whole conversation in `messages`
+    message: Optional[str] = None
+    conversation_id: Optional[str] = None
+    user_id: Optional[str] = None  # owner of a new conversation
+    messages: list = []
+    model: Optional[str] = None  # provider's default model if not given
     temperature: float = 0.7
+    # The provider to try first (a gateway provider, or "auto" for the fastest)
+    provider: str = "gemini"
 
-@router.post("/chat")
-async def chat(request: ChatRequest):
+async def build_context_messages(messages: list, summary: str = ""):
     """
-    Proxy chat requests to Gemini API, injecting real trip data context.
+    The system prompt with the trips relevant to the conversation (and the summary of
+    its older messages, if any), followed by the conversation.
+    Returns (messages, context) with context as build_trip_context returns it.
     """
-    
-    # 1. Fetch available trips from Supabase
-    trips_context = "No trips currently available."
+    # 1. Retrieve the trips relevant to what the user is asking (not the whole table)
+    context = {"text": "No trips currently available.", "trip_ids": [], "places": []}
     try:
-        if supabase:
-            response = supabase.table("trips").select("*").execute()
-            trips = response.data
-            
-            if trips:
-                trip_list = []
-                for t in trips:
-                    # Provide key details for the AI
-                    trip_str = f"- From {t.get('origin')} to {t.get('destination')} on {t.get('date')} at {t.get('time')}. Price: R{t.get('price')}. Vehicle: {t.get('vehicle')}. Driver: {t.get('driver_name')}."
-                    trip_list.append(trip_str)
-                trips_context = "Available Trips:\n" + "\n".join(trip_list)
+        if async_supabase:
+            context = await build_trip_context(async_supabase, messages)
     except Exception as e:
         print(f"Error fetching trips for AI context: {e}")
         # Continue without context if DB fails
@@ -44,8 +50,8 @@ async def chat(request: ChatRequest):
 You are an expert Travel Assistant for 'Travel by UrbanSmart-34'.
 Your goal is to help users find and book trips based on the REAL data provided below.
 
-{trips_context}
-
+{context["text"]}
+{summary}
 RULES:
 1. ONLY recommend trips listed above. from the 'Available Trips' list.
 2. If a user asks for a route not listed, politely say you don't have drivers for that route yet.
@@ -55,16 +61,179 @@ RULES:
 """
 
     # 3. Handle System Roles for Gemini (handled internally in our wrapper)
-    context_messages = [{"role": "system", "content": system_prompt}] + request.messages
-
-    # 4. Call Gemini
-    response = chat_completion(
-        messages=context_messages,
-        model=request.model,
-        temperature=request.temperature
-    )
-    
-    if "error" in response:
-        raise HTTPException(status_code=500, detail=response["error"])
-        
-    return response
+    return [{"role": "system", "content": system_prompt}] + messages, context
+
+async def load_conversation(request: ChatRequest):
+    """
+    (messages, conversation, summary) for `request`: the stored conversation's recent
+    messages plus the new one, or request.messages as sent (conversation None, no summary).
+    """
+    if request.message is None:
+        if not request.messages:
+            raise HTTPException(status_code=400, detail="Send a message (or the conversation's messages)")
+        return request.messages, None, ""
+    if request.conversation_id:
+        try:
+            # Service role: conversations are written (and RLS-protected) server-side
+            conversation = await conversations.load(async_supabase_admin or async_supabase, request.conversation_id)
+        except ConversationNotFound:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+    else:
+        conversation = conversations.start(request.user_id)
+    messages, summary = conversations.prompt(conversation, request.message)
+    return messages, conversation, summary
+
+@router.post("/chat")
+async def chat(request: ChatRequest):
+    """
+    Chat with the assistant, injecting real trip data context.
+    The LLM gateway picks the provider (request.provider first), hedges slow calls and
+    falls back to the smart mock, so this answers even when every provider is down.
+    Repeated (or near-identical) questions about the same trips are answered from the response cache.
+    """
+    check_provider(request.provider)
+    messages, conversation, summary = await load_conversation(request)
+    context_messages, context = await build_context_messages(messages, summary)
+    preferred = None if request.provider == "auto" else request.provider
+
+    async def call_llm():
+        return await gateway.complete(context_messages, provider=preferred,
+                                      model=request.model, temperature=request.temperature)
+
+    bucket, key = response_cache.key(request.provider, request.model, messages, context, summary)
+    if bucket is None:
+        response = await call_llm()
+    else:
+        response = await response_cache.answer(bucket, key, call_llm, context["trip_ids"])
+    if conversation is None:
+        return response
+    conversations.record(conversation, request.message, response["content"])
+    return {**response, "conversation_id": conversation["id"]}
+
+@router.get("/providers")
+async def get_providers():
+    """LLM gateway state: per-provider breaker state, latency percentiles, hedges and fallbacks."""
+    return gateway.info()
+
+@router.get("/history/stats")
+async def get_history_stats():
+    """Stored conversations: cache counters and the batched writer's progress."""
+    return conversations.info()
+
+
+# --- Streaming ---
+#
+# Both transports send the same events while the reply is generated:
+#   delta  {"delta": "next chunk"}
+#   done   {"content": "the full reply", "role": "assistant"} (+ "conversation_id")
+#   error  {"error": "..."}  (instead of done; part of the reply may have been sent)
+
+async def reply_events(request: ChatRequest):
+    """
+    (event, payload) pairs for the reply to `request`, as the model produces it.
+    The gateway picks the provider and falls back like /chat until the reply
+    starts; a provider failing or stalling after that ends it with an error.
+    """
+    preferred = None if request.provider == "auto" else request.provider
+    parts = []
+    try:
+        messages, conversation, summary = await load_conversation(request)
+        context_messages, context = await build_context_messages(messages, summary)
+        bucket, key = response_cache.key(request.provider, request.model, messages, context, summary)
+        reply, _ = response_cache.lookup(bucket, key) if bucket else (None, None)
+        if reply is not None:
+            # A cached reply goes out whole, as a single delta
+            yield "delta", {"delta": reply["content"]}
+        else:
+            response_cache.stats.incr("llm_calls")
+            async with aclosing(gateway.stream(context_messages, provider=preferred, model=request.model,
+                                               temperature=request.temperature)) as deltas:
+                async for delta in deltas:
+                    parts.append(delta)
+                    yield "delta", {"delta": delta}
+            reply = {"content": "".join(parts), "role": "assistant"}
+            if bucket:
+                response_cache.remember(bucket, key, reply, context["trip_ids"])
+    except HTTPException as e:
+        yield "error", {"error": e.detail}
+        return
+    except Exception as e:
+        print(f"AI stream error ({request.provider}): {e}")
+        yield "error", {"error": str(e)}
+        return
+    if conversation is not None:
+        conversations.record(conversation, request.message, reply["content"])
+        reply = {**reply, "conversation_id": conversation["id"]}
+    yield "done", reply
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """Response cache hit ratio and LLM calls saved since startup."""
+    return response_cache.info()
+
+def check_provider(provider: str):
+    if provider != "auto" and provider not in gateway.providers:
+        raise HTTPException(status_code=400, detail=f"Unknown provider '{provider}'. "
+                                                    f"Use one of: auto, {', '.join(gateway.providers)}")
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Same as /chat, but streams the reply as Server-Sent Events while it is generated
+    (delta events as unnamed `data:` lines, then `event: done` or `event: error`).
+    If the client disconnects, the model call is abandoned.
+    """
+    check_provider(request.provider)
+
+    async def sse():
+        async with aclosing(reply_events(request)) as events:
+            async for event, payload in events:
+                data = f"data: {json.dumps(payload)}\n\n"
+                yield data if event == "delta" else f"event: {event}\n{data}"
+
+    # no-cache / X-Accel-Buffering: keep proxies from holding the events back
+    return StreamingResponse(sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def send_reply(websocket: WebSocket, request: ChatRequest):
+    try:
+        async with aclosing(reply_events(request)) as events:
+            async for event, payload in events:
+                await websocket.send_json({"type": event, **payload})
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # client went away mid-reply; chat_ws notices on its next receive
+
+@router.websocket("/chat/ws")
+async def chat_ws(websocket: WebSocket):
+    """
+    Streaming chat over a WebSocket. Each JSON message from the client is a ChatRequest;
+    the reply comes back as {"type": "delta" | "done" | "error", ...} messages.
+    {"type": "cancel"}, a new request or disconnecting stops the reply in progress.
+    """
+    await websocket.accept()
+    replying = None
+    try:
+        while True:
+            text = await websocket.receive_text()
+            if replying:
+                replying.cancel()
+                await asyncio.wait([replying])
+                replying = None
+            try:
+                message = json.loads(text)
+                if message.get("type") == "cancel":
+                    continue
+                request = ChatRequest(**message)
+                check_provider(request.provider)
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "error": e.detail})
+                continue
+            except (ValueError, TypeError, AttributeError) as e:
+                await websocket.send_json({"type": "error", "error": f"Invalid request: {e}"})
+                continue
+            replying = asyncio.create_task(send_reply(websocket, request))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if replying:
+            replying.cancel()
@@ -0,0 +1,144 @@
+import hmac
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+from app.services.auth import current_user
+from app.services.supabase_client import async_supabase, async_supabase_admin
+from app.services.pagination import paginate, split_page, NEXT_CURSOR_HEADER
+from app.services.driver_locations import driver_locations, DRIVER_GATEWAY_KEY, DRIVER_PING_BATCH_MAX, DRIVER_RADIUS_MAX_M
+from app.services.geofences import pickup_geofences
+
+router = APIRouter(
+    prefix="/drivers",
+    tags=["drivers"]
+)
+
+# Stored track points, oldest first; id breaks ties
+TRACK_SORT = ("recorded_at", "id")
+TRACK_COLUMNS = "id,driver_id,trip_id,recorded_at,lat,lon,speed,heading"
+
+
+class LocationPing(BaseModel):
+    driver_id: str
+    lat: float = Field(..., ge=-90, le=90)
+    lon: float = Field(..., ge=-180, le=180)
+    at: Optional[float] = None        # Unix time of the fix (seconds); default: when received
+    available: bool = True            # offered for pickups
+    trip_id: Optional[str] = None     # the trip being driven, if any
+    speed: Optional[float] = None     # m/s
+    heading: Optional[float] = None   # degrees from north
+
+
+class LocationBatch(BaseModel):
+    pings: List[LocationPing] = Field(..., max_length=DRIVER_PING_BATCH_MAX)
+
+
+async def location_sender(authorization: Optional[str] = Header(None),
+                          x_gateway_key: Optional[str] = Header(None)):
+    """
+    FastAPI dependency: None for the fleet gateway (X-Gateway-Key matches
+    DRIVER_GATEWAY_KEY), otherwise the driver's token claims (see current_user).
+    """
+    if x_gateway_key is not None:
+        if not DRIVER_GATEWAY_KEY or not hmac.compare_digest(x_gateway_key, DRIVER_GATEWAY_KEY):
+            raise HTTPException(status_code=401, detail="Invalid gateway key")
+        return None
+    return await current_user(authorization)
+
+
+@router.post("/locations")
+async def post_locations(batch: LocationBatch, claims: Optional[dict] = Depends(location_sender)):
+    """
+    Takes a batch of pings (from one driver's phone, or a fleet gateway),
+    moves the drivers in the position index, queues the points of their
+    downsampled tracks and checks them against their trips' pickup zones. Pings older than a driver's current position are
+    ignored, so batches may arrive out of order. A driver may only post
+    their own pings; the gateway may post anyone's.
+    """
+    if claims is not None and any(ping.driver_id != claims["sub"] for ping in batch.pings):
+        raise HTTPException(status_code=403, detail="Pings for another driver")
+    try:
+        applied, ignored = driver_locations.ingest(batch.pings)
+        return {"accepted": applied, "ignored": ignored}
+
+    except Exception as e:
+        print(f"Error ingesting driver locations: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/nearby")
+async def get_nearby_drivers(lat: float = Query(..., ge=-90, le=90), lon: float = Query(..., ge=-180, le=180),
+                             radius_m: float = Query(1000, gt=0, le=DRIVER_RADIUS_MAX_M),
+                             limit: int = Query(20, ge=1, le=200), include_busy: bool = False):
+    """Drivers within radius_m of a pickup point, nearest first (available ones only unless include_busy)."""
+    return driver_locations.nearby(lat, lon, radius_m, limit, available_only=not include_busy)
+
+
+@router.get("/nearest")
+async def get_nearest_drivers(lat: float = Query(..., ge=-90, le=90), lon: float = Query(..., ge=-180, le=180),
+                              k: int = Query(5, ge=1, le=100),
+                              max_radius_m: float = Query(10000, gt=0, le=DRIVER_RADIUS_MAX_M),
+                              include_busy: bool = False):
+    """The k drivers nearest to a pickup point (at most max_radius_m away), nearest first."""
+    return driver_locations.nearest(lat, lon, k, max_radius_m, available_only=not include_busy)
+
+
+@router.get("/locations/stats")
+async def get_location_stats():
+    """Drivers and cells in this worker's index, and ingestion / track write counters."""
+    return driver_locations.info()
+
+
+@router.get("/geofences/stats")
+async def get_geofence_stats():
+    """Pickup zones watched by this worker, and arrival / wait / leave event counters."""
+    return pickup_geofences.info()
+
+
+@router.get("/{driver_id}/location")
+async def get_driver_location(driver_id: str):
+    """The driver's current position, or 404 if they haven't pinged recently."""
+    position = driver_locations.position(driver_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="No recent location for this driver")
+    return position
+
+
+@router.get("/{driver_id}/track", response_model=List[dict])
+async def get_driver_track(response: Response, driver_id: str, trip_id: Optional[str] = None,
+                           since: Optional[str] = None, until: Optional[str] = None,
+                           cursor: Optional[str] = None, limit: Optional[int] = None):
+    """
+    The driver's stored (downsampled) track, oldest first, optionally for one
+    trip and between two times (ISO 8601). Paged: follow the X-Next-Cursor header.
+    """
+    try:
+        client = async_supabase_admin or async_supabase
+        if not client:
+            raise HTTPException(status_code=503, detail="Database connection unavailable")
+        query = client.table("driver_tracks").select(TRACK_COLUMNS).eq("driver_id", driver_id)
+        if trip_id:
+            query = query.eq("trip_id", trip_id)
+        if since:
+            query = query.gte("recorded_at", since)
+        if until:
+            query = query.lt("recorded_at", until)
+        try:
+            query, size = paginate(query, TRACK_SORT, cursor, limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        result = await query.execute()
+        if result.status_code is None or result.status_code >= 400:
+            raise RuntimeError(f"driver_tracks query failed with status {result.status_code}")
+        points, next_cursor = split_page(result.data or [], TRACK_SORT, size)
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return points
+
+    except Exception as e:
+        print(f"Error fetching driver track: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,93 @@
+import asyncio
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from app.services.pubsub import hub, trip_topic, route_topic, PUSH_MAX_TOPICS, PUSH_HEARTBEAT, PUSH_MAX_AGE
+
+router = APIRouter(
+    prefix="/live",
+    tags=["live"]
+)
+
+
+def _topics(trip_id, from_loc, to_loc):
+    topics = [trip_topic(t) for t in trip_id]
+    if from_loc or to_loc:
+        if not (from_loc and to_loc):
+            raise HTTPException(status_code=400, detail="Give both from_loc and to_loc to follow a route")
+        topics.append(route_topic(from_loc, to_loc))
+    if not topics:
+        raise HTTPException(status_code=400, detail="Give a trip_id or a route (from_loc and to_loc)")
+    if len(topics) > PUSH_MAX_TOPICS:
+        raise HTTPException(status_code=400, detail=f"At most {PUSH_MAX_TOPICS} trips and routes per connection")
+    return topics
+
+
+@router.get("/trips")
+async def follow_trips(trip_id: List[str] = Query(default=[]), from_loc: Optional[str] = None,
+                       to_loc: Optional[str] = None):
+    """
+    Server-sent events for trips instead of polling /travel/trips/{id}: a
+    "trip" event (status, seats_available, ...) whenever one of the trips
+    (trip_id, repeatable) or any trip on the route (from_loc, to_loc)
+    changes. A burst of changes arrives as its latest state. On "subscribed"
+    (every connect and reconnect) fetch the trips, then apply the events;
+    "resync" means events were dropped because the client fell behind:
+    fetch them again. The stream ends after PUSH_MAX_AGE; reconnect.
+    """
+    sub = hub.subscribe(_topics(trip_id, from_loc, to_loc))
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + PUSH_MAX_AGE
+        try:
+            yield f"retry: 3000\nevent: subscribed\ndata: {{\"topics\":{len(sub.topics)}}}\n\n".encode()
+            while (left := deadline - loop.time()) > 0:
+                messages = await sub.next(min(PUSH_HEARTBEAT, left))
+                yield b"".join(m.sse for m in messages) if messages else b": ping\n\n"
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/ws")
+async def follow_trips_ws(websocket: WebSocket, trip_id: List[str] = Query(default=[]),
+                          from_loc: Optional[str] = None, to_loc: Optional[str] = None):
+    """The same events as /live/trips over a WebSocket, one JSON message each (no heartbeats)."""
+    try:
+        topics = _topics(trip_id, from_loc, to_loc)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    await websocket.accept()
+    sub = hub.subscribe(topics)
+
+    async def send():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + PUSH_MAX_AGE
+        while (left := deadline - loop.time()) > 0:
+            for message in await sub.next(min(PUSH_HEARTBEAT, left)):
+                await websocket.send_text(message.json)
+        await websocket.close(code=1012)  # "service restart": reconnect
+
+    sender = asyncio.create_task(send())
+    try:
+        # Nothing is expected from the client; this notices it leaving
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        hub.unsubscribe(sub)
+
+
+@router.get("/stats")
+async def get_live_stats():
+    """Subscribers, topics and publish / coalesce / delivery counters of this worker."""
+    return hub.info()
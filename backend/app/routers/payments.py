@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException, Body, Request
-from pydantic import BaseModel
-import uuid
-import time
-import random
+from typing import Optional, List
+from fastapi import APIRouter, HTTPException, Body, Request, Header
+from pydantic import BaseModel, Field
+from app.services.payment_switch import payment_switch, PaymentSwitchError, PaymentSwitchUnavailable
+from app.services.payment_verification import payment_verifier, verify_webhook, YOCO_WEBHOOK_SECRET
+from app.services.supabase_client import async_supabase, async_supabase_admin
+import json
+import asyncio
 
 router = APIRouter(
     prefix="/payments",
@@ -20,81 +23,165 @@ class PaymentResponse(BaseModel):
     success: bool
     transaction_id: str
     message: str
-
-import os
-import requests
-
-PAYMENT_SWITCH_URL = os.getenv("PAYMENT_SWITCH_URL", "https://payment-switch.urbansmart34.com")
-PAYMENT_SWITCH_STORE_ID = os.getenv("PAYMENT_SWITCH_STORE_ID", "811298f2-31aa-4e90-9071-41999bfe47a0")
+    status: str = "pending"  # the payment's verification status: pending | succeeded | failed
 
 class CheckoutRequest(BaseModel):
-    amount: float
-    currency: str = "ZAR"
+    # Bookings already made (POST /travel/bookings or /travel/bookings/batch), of one user and trip
+    booking_ids: List[str] = Field(..., min_length=1, max_length=50)
     metadata: dict = {}
 
+# Fares are in rand
+CHECKOUT_CURRENCY = "ZAR"
+
 @router.post("/create-checkout")
-def create_checkout(checkout: CheckoutRequest, request: Request):
+async def create_checkout(checkout: CheckoutRequest, request: Request,
+                          idempotency_key: Optional[str] = Header(None)):
     """
-    Initiates a new checkout session with the external Payment Switch.
+    Initiates a new checkout session with the external Payment Switch for
+    bookings already made. The amount is their total price as the database
+    has it, and the payment marks exactly these bookings paid.
     Returns the Checkout URL to redirect the user to.
+    Submitting the same bookings again (or the same Idempotency-Key header
+    with the same amount) returns the checkout already created instead of a second one.
     """
+    client = async_supabase_admin or async_supabase
+    if not client:
+        raise HTTPException(status_code=503, detail="Database connection unavailable")
     try:
-        # Convert amount to cents
-        amount_in_cents = int(checkout.amount * 100)
-        
+        bookings = await _bookings_to_pay(client, checkout.booking_ids)
+        # Convert amount to cents (round: 0.29 * 100 is 28.999...)
+        amount_in_cents = int(round(sum(float(b.get("total_price") or 0) for b in bookings) * 100))
+        metadata = {**checkout.metadata, "booking_ids": sorted(b["id"] for b in bookings),
+                    "user_id": bookings[0]["user_id"], "trip_id": bookings[0]["trip_id"],
+                    "seats": sum(int(b.get("seats") or 1) for b in bookings)}
         origin = request.headers.get("origin", "http://localhost:5173")
-        
-        headers = {
-            "Content-Type": "application/json",
-            "origin": origin
-        }
-        
-        payload = {
-            "amount": amount_in_cents,
-            "currency": checkout.currency,
-            "storeId": PAYMENT_SWITCH_STORE_ID,
-            "metadata": checkout.metadata
-        }
-        
-        # Call Payment Switch API
-        process_url = f"{PAYMENT_SWITCH_URL.rstrip('/')}/api/process-payment"
-        response = requests.post(process_url, json=payload, headers=headers)
-        
-        if not response.ok:
-            error_data = response.text
-            try:
-                error_data = response.json()
-            except:
-                pass
-            print(f"Payment Switch Error: {error_data}")
-            raise HTTPException(status_code=response.status_code, detail=f"Payment Switch Error: {error_data}")
-        
-        data = response.json()
-        return {"checkoutUrl": data.get("checkoutUrl"), "transactionId": data.get("transactionId")}
-        
-    except requests.exceptions.RequestException as e:
+        result = await asyncio.to_thread(payment_switch.create_checkout, amount_in_cents, CHECKOUT_CURRENCY,
+                                         metadata, origin=origin, key=idempotency_key)
+        if result.get("transactionId"):
+            _record_checkout(result["transactionId"], amount_in_cents, CHECKOUT_CURRENCY, metadata)
+        return result
+
+    except PaymentSwitchError as e:
+        print(f"Payment Switch Error: {e.detail}")
+        raise HTTPException(status_code=e.status, detail=str(e))
+    except PaymentSwitchUnavailable as e:
         print(f"Payment Switch Network Error: {str(e)}")
         raise HTTPException(status_code=503, detail="Payment service is currently unavailable.")
     except Exception as e:
         print(f"Internal Error: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _bookings_to_pay(client, booking_ids):
+    """The bookings a checkout is for: all found, of one user and trip, none paid yet."""
+    booking_ids = list(dict.fromkeys(booking_ids))
+    response = await client.table("bookings").select("id,user_id,trip_id,seats,total_price,payment_status") \
+        .in_("id", booking_ids).execute()
+    if response.status_code is None or response.status_code >= 400:
+        raise HTTPException(status_code=502, detail="Could not read the bookings")
+    rows = response.data or []
+    if len(rows) != len(booking_ids):
+        raise HTTPException(status_code=404, detail="Booking not found")
+    if len({(row["user_id"], row["trip_id"]) for row in rows}) > 1:
+        raise HTTPException(status_code=400, detail="A checkout pays for bookings of one user and trip")
+    if any(row.get("payment_status") == "paid" for row in rows):
+        raise HTTPException(status_code=409, detail="Booking already paid")
+    return rows
+
+def _record_checkout(checkout_id, amount_in_cents, currency, metadata):
+    # The pending payments row, written by the verification workers. The
+    # checkout already exists, so a failure here mustn't fail the request:
+    # the webhook or the verification creates the row anyway
+    details = {"amount_cents": amount_in_cents, "currency": currency}
+    details.update({k: metadata[k] for k in ("user_id", "trip_id", "booking_ids", "seats")
+                    if metadata.get(k) is not None})
+    try:
+        payment_verifier.record_checkout(checkout_id, details)
+    except Exception as e:
+        print(f"Could not queue checkout {checkout_id}: {e}")
+
+@router.get("/switch/stats")
+def get_switch_stats():
+    """Payment Switch client counters: checkouts created, repeats answered locally, pool reuse."""
+    return payment_switch.info()
+
 @router.post("/process", response_model=PaymentResponse)
 def process_payment(payment: PaymentRequest):
     """
-    Verifies the payment status with Yoco after frontend completion.
+    Called after the user comes back from the checkout page. Queues a
+    verification of the checkout (`token`) with the provider and returns at
+    once; the verification workers record the payment and mark the booking
+    paid or failed. GET /payments/{token}/status has the result. Who paid
+    and how much come from the checkout the API recorded and the provider,
+    not from this request.
     """
     print(f"Verifying payment {payment.token} for user {payment.user_id}")
-    
-    # In a real implementation with Yoco's new flow, we might need to verify the Checkout status here 
-    # using the ID provided in `payment.token` (which we are using to store the Checkout ID/Reference).
-    
-    # For now, we simulate success if we got this far, or we could verify against Yoco if needed.
-    # Verification Logic (Optional but recommended):
-    # verify_response = requests.get(f"https://payments-online.yoco.com/api/checkouts/{payment.token}", headers=headers)
-    
+    try:
+        payment_verifier.request_verification(payment.token)
+    except Exception as e:
+        print(f"Could not queue payment verification: {e}")
+        raise HTTPException(status_code=503, detail="Payment verification is currently unavailable.")
+
     return {
         "success": True,
-        "transaction_id": f"txn_{uuid.uuid4().hex[:12]}",
-        "message": "Payment verified and processed successfully"
+        "transaction_id": payment.token,
+        "message": "Payment received, verification in progress",
+        "status": "pending",
     }
+
+@router.post("/webhook", status_code=202)
+async def payment_webhook(request: Request):
+    """
+    Payment events from the provider. The event is queued for the
+    verification workers and acknowledged at once; a redelivered event
+    (same webhook-id) is acknowledged and ignored. Without YOCO_WEBHOOK_SECRET
+    nothing can be verified, so every event is refused.
+    """
+    if not YOCO_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Payment webhooks are not configured")
+    body = await request.body()
+    if not verify_webhook(YOCO_WEBHOOK_SECRET, request.headers, body):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        event = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    event_id = request.headers.get("webhook-id") or (event.get("id") if isinstance(event, dict) else None)
+    if not event_id:
+        raise HTTPException(status_code=400, detail="Missing event id")
+
+    try:
+        # A lock and a SQLite write: off the event loop
+        result = await asyncio.to_thread(payment_verifier.ingest_event, str(event_id), event)
+    except Exception as e:
+        # Not acknowledged: the provider delivers it again
+        print(f"Could not queue payment event {event_id}: {e}")
+        raise HTTPException(status_code=503, detail="Could not accept the event, retry later")
+    return {"received": True, "result": result}
+
+@router.get("/verification/stats")
+def get_verification_stats():
+    """Verification queue depth, jobs processed / retried / dead and provider lookups."""
+    return {**payment_verifier.info(), "dead_jobs": payment_verifier.dead_jobs(limit=10)}
+
+@router.get("/{checkout_id}/status")
+async def get_payment_status(checkout_id: str):
+    """The verification status of a checkout: pending until the workers have a result."""
+    client = async_supabase_admin or async_supabase
+    if not client:
+        raise HTTPException(status_code=503, detail="Database connection unavailable")
+    try:
+        response = await client.table("payments").select("checkout_id,status,transaction_id,verified_at") \
+            .eq("checkout_id", checkout_id).limit(1).execute()
+        if response.status_code is None or response.status_code >= 400:
+            raise HTTPException(status_code=502, detail="Could not read the payment")
+        if not response.data:
+            # Accepted but not written yet
+            return {"checkout_id": checkout_id, "status": "pending", "transaction_id": None, "verified_at": None}
+        return response.data[0]
+    except Exception as e:
+        print(f"Error reading payment status: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,8 +1,20 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import random
-from app.services.supabase_client import supabase, supabase_admin
+import asyncio
+from datetime import datetime
+from app.services.supabase_client import async_supabase, async_supabase_admin
+from app.services.metrics import rollups
+from app.services import trip_cache
+from app.services.trip_search import filter_location
+from app.services.gazetteer import gazetteer, SUGGEST_LIMIT
+from app.services.pagination import paginate, split_page, NEXT_CURSOR_HEADER
+from app.services.escrow import escrow_scheduler
+from app.services.pubsub import hub, TRIP_FIELDS
+from app.services.geofences import pickup_geofences, trip_timeline
+from app.services.pricing import price_table, PriceChanged
+from app.services.journeys import journey_planner, earliest_departure, SORT_ORDERS, JOURNEY_MAX_LEGS, JOURNEY_MAX_RESULTS
 
 
 router = APIRouter(
@@ -24,6 +36,9 @@ class Trip(BaseModel):
     driver_name: str
     driver_rating: float
     driver_image: str
+    # Where the driver picks passengers up (add_pickup_geofences.sql)
+    pickup_lat: Optional[float] = None
+    pickup_lon: Optional[float] = None
     
     # Optional fields for compatibility with frontend expectations if they differ
     title: Optional[str] = None
@@ -31,48 +46,102 @@ class Trip(BaseModel):
 class BookingRequest(BaseModel):
     trip_id: str
     user_id: str
+    # The price per seat the traveller was shown
+    quoted_price: Optional[float] = Field(None, gt=0)
 
 class BookingResponse(BaseModel):
     id: str
     status: str
     message: str
 
+# Largest group one batch request may book
+MAX_SEATS_PER_BOOKING = 10
+
+class Passenger(BaseModel):
+    name: Optional[str] = None
+
+class BatchBookingRequest(BaseModel):
+    trip_id: str
+    user_id: str
+    # Either a seat count or one entry per passenger (names are optional)
+    seats: Optional[int] = Field(None, ge=1, le=MAX_SEATS_PER_BOOKING)
+    passengers: List[Passenger] = Field(default_factory=list, max_length=MAX_SEATS_PER_BOOKING)
+    quoted_price: Optional[float] = Field(None, gt=0)
+
+class BatchBookingResponse(BaseModel):
+    ids: List[str]
+    status: str
+    seats: int
+    total_price: float
+    message: str
+
+# Stable sort orders for keyset pagination; the last column breaks ties
+TRIP_SORT = ("date", "time", "id")
+BOOKING_SORT = ("created_at", "id")
+
+# Seat publishes running off the booking's response time; the event loop only
+# keeps weak references to tasks, so they are held here until done
+_publishing = set()
+
 # --- Endpoints ---
 
 @router.get("/trips", response_model=List[Trip])
-def search_trips(
+async def search_trips(
+    response: Response,
     from_loc: Optional[str] = None, 
     to_loc: Optional[str] = None, 
     date: Optional[str] = None,
-    driver_id: Optional[str] = None
+    driver_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None
 ):
     """
-    Search for trips in Supabase.
+    Search for trips in Supabase, one page at a time ordered by date, time, id.
+    Pass the X-Next-Cursor response header back as `cursor` for the next page.
     """
-    if not supabase:
+    if not async_supabase:
         raise HTTPException(status_code=503, detail="Database connection unavailable")
 
     try:
+        # Every route search is demand for the route, cached or not
+        if from_loc and to_loc and not cursor:
+            price_table.record_search(gazetteer.resolve(from_loc) or from_loc, gazetteer.resolve(to_loc) or to_loc)
+
+        # Popular searches repeat constantly; serve them from the cache when we can.
+        # Prices come from the price table, never from the cached rows
+        cache_key = trip_cache.search_key(from_loc, to_loc, date, driver_id, cursor, limit)
+        cached = trip_cache.get_search(cache_key)
+        if cached is not trip_cache.MISSING:
+            if cached["next_cursor"]:
+                response.headers[NEXT_CURSOR_HEADER] = cached["next_cursor"]
+            return price_table.apply(cached["trips"])
+
         # Start building the query
-        query = supabase.table("trips").select("*")
+        query = async_supabase.table("trips").select("*")
         
         # Apply filters if provided
-        # Note: 'ilike' is case-insensitive matching
+        # Locations match on the normalized (lower-cased, trimmed) columns so the
+        # route indexes apply; see add_trip_search_indexes.sql
         if from_loc:
-            query = query.ilike("origin", f"%{from_loc}%")
+            query = filter_location(query, "origin", from_loc)
         if to_loc:
-            query = query.ilike("destination", f"%{to_loc}%")
+            query = filter_location(query, "destination", to_loc)
         if date:
             query = query.eq("date", date)
         if driver_id:
             query = query.eq("driver_id", driver_id)
+
+        try:
+            query, size = paginate(query, TRIP_SORT, cursor, limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
             
         # Execute query
-        response = query.execute()
+        result = await query.execute()
         
         # Transform data to match Pydantic model if necessary
         # Assuming table columns match model fields 1:1 for now
-        trips_data = response.data
+        trips_data, next_cursor = split_page(result.data, TRIP_SORT, size)
         
         # Fallback/Mock for required fields if missing in DB (temporary)
         for trip in trips_data:
@@ -83,8 +152,14 @@ def search_trips(
             if "seats_available" not in trip: trip["seats_available"] = 4
             if "driver_image" not in trip or not trip["driver_image"]: 
                 trip["driver_image"] = f"https://i.pravatar.cc/150?u={trip.get('driver_name', 'driver')}"
-            
-        return trips_data
+
+        # Only cache real answers, not the empty list the wrapper returns on errors
+        if result.status_code == 200:
+            trip_cache.set_search(cache_key, trips_data, next_cursor)
+
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return price_table.apply(trips_data)
 
     except Exception as e:
         print(f"Error fetching trips: {e}")
@@ -93,15 +168,19 @@ def search_trips(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/trips/{trip_id}", response_model=Trip)
-def get_trip(trip_id: str):
+async def get_trip(trip_id: str):
     """
     Get a single trip by ID.
     """
-    if not supabase:
+    if not async_supabase:
         raise HTTPException(status_code=503, detail="Database connection unavailable")
 
     try:
-        response = supabase.table("trips").select("*").eq("id", trip_id).execute()
+        cached = trip_cache.get_trip(trip_id)
+        if cached is not trip_cache.MISSING:
+            return price_table.apply([cached])[0]
+
+        response = await async_supabase.table("trips").select("*").eq("id", trip_id).execute()
         
         if not response.data:
             raise HTTPException(status_code=404, detail="Trip not found")
@@ -116,8 +195,10 @@ def get_trip(trip_id: str):
         if "seats_available" not in trip: trip["seats_available"] = 4
         if "driver_image" not in trip or not trip["driver_image"]: 
             trip["driver_image"] = f"https://i.pravatar.cc/150?u={trip.get('driver_name', 'driver')}"
+
+        trip_cache.set_trip(trip)
         
-        return trip
+        return price_table.apply([trip])[0]
 
     except Exception as e:
         print(f"Error fetching trip {trip_id}: {e}")
@@ -130,20 +211,36 @@ class TripStatusUpdate(BaseModel):
     status: str = Field(..., pattern="^(scheduled|in_progress|completed|cancelled)$")
 
 @router.patch("/trips/{trip_id}/status")
-def update_trip_status(trip_id: str, update: TripStatusUpdate):
+async def update_trip_status(trip_id: str, update: TripStatusUpdate):
     """
     Update the status of a trip (e.g., scheduled -> in_progress -> completed).
     """
-    if not supabase:
+    if not async_supabase:
         raise HTTPException(status_code=503, detail="Database connection unavailable")
 
     try:
         # Use ADMIN client to allow updates if RLS blocks standard users
-        client = supabase_admin if supabase_admin else supabase
-        response = client.table("trips").update({"status": update.status}).eq("id", trip_id).execute()
+        client = async_supabase_admin if async_supabase_admin else async_supabase
+        now = datetime.utcnow()
+        changes = {"status": update.status, "status_updated_at": now.isoformat() + "Z"}
+        response = await client.table("trips").update(changes).eq("id", trip_id).execute()
         
         if not response.data:
              raise HTTPException(status_code=404, detail="Trip not found or update failed")
+
+        rollups.record_trip_status(trip_id, update.status, now)
+        trip_cache.invalidate_trip(trip_id)
+        hub.publish_trip(response.data[0])
+        pickup_geofences.trip_status(trip_id, update.status)
+        price_table.observe_trip(response.data[0])
+        journey_planner.observe_trip(response.data[0])
+
+        # Fares held for this trip: released after the dispute window, or refunded.
+        # Safe to repeat, so a failure here is answered with 500 for the caller to retry
+        if update.status == "completed":
+            await escrow_scheduler.trip_completed(trip_id)
+        elif update.status == "cancelled":
+            await escrow_scheduler.trip_cancelled(trip_id)
              
         return {"message": "Trip status updated", "trip": response.data[0]}
 
@@ -154,11 +251,11 @@ def update_trip_status(trip_id: str, update: TripStatusUpdate):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/trips/{trip_id}/passengers")
-def get_trip_passengers(trip_id: str):
+async def get_trip_passengers(trip_id: str):
     """
     Get the passenger manifest for a trip.
     """
-    if not supabase:
+    if not async_supabase:
         raise HTTPException(status_code=503, detail="Database connection unavailable")
 
     try:
@@ -168,8 +265,8 @@ def get_trip_passengers(trip_id: str):
         # For now, we return bookings and hope frontend can handle user_id display,
         # or we assume 'bookings' table has some passenger info if we added it.
         # Actually, let's try to join but fallback safely.
-        client = supabase_admin if supabase_admin else supabase
-        response = client.table("bookings").select("*").eq("trip_id", trip_id).execute()
+        client = async_supabase_admin if async_supabase_admin else async_supabase
+        response = await client.table("bookings").select("*").eq("trip_id", trip_id).execute()
         
         return response.data
 
@@ -180,38 +277,100 @@ def get_trip_passengers(trip_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/trips/{trip_id}/timeline")
+async def get_trip_timeline(trip_id: str):
+    """
+    What happened on a trip, oldest first: bookings, the driver arriving at,
+    waiting in and leaving the pickup zone (from their GPS pings), and status
+    changes, with a pickup summary (arrival, wait, no-show).
+    """
+    try:
+        client = async_supabase_admin or async_supabase
+        if not client:
+            raise HTTPException(status_code=503, detail="Database connection unavailable")
+        timeline = await trip_timeline(client, trip_id)
+        if timeline is None:
+            raise HTTPException(status_code=404, detail="Trip not found")
+        return timeline
+
+    except Exception as e:
+        print(f"Error fetching trip timeline: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _publish_trip(trip_id):
+    try:
+        response = await async_supabase.table("trips").select(",".join(TRIP_FIELDS)).eq("id", trip_id).execute()
+        if response.data:
+            hub.publish_trip(response.data[0])
+            # Fewer seats left: the trip's price moves now, not at the next resync,
+            # and a full trip stops showing up in journeys
+            price_table.observe_trip(response.data[0])
+            journey_planner.observe_trip(response.data[0])
+    except Exception as e:
+        print(f"Error publishing trip {trip_id}: {e}")
+
+
+async def _book_seats(trip_id, user_id, passenger_names, quoted_price=None):
+    """
+    Books one seat per entry of `passenger_names` through the book_seats RPC
+    (add_book_seats_rpc.sql), which locks the trip row, checks and decrements
+    seats_available and inserts the bookings in one transaction: all or nothing.
+    Each seat costs the trip's price, or `quoted_price` if that is a little
+    higher (409 with the current price when it is further off).
+    """
+    try:
+        unit_price = price_table.charge(trip_id, quoted_price)
+    except PriceChanged as e:
+        raise HTTPException(status_code=409, detail={"message": "The price of this trip has changed",
+                                                     "price": e.price})
+    # Service Role writes 'as' the system since the user's JWT isn't forwarded
+    # through this REST wrapper; the endpoint logic is trusted instead.
+    result = await async_supabase_admin.rpc("book_seats", {
+        "p_trip_id": trip_id,
+        "p_user_id": user_id,
+        "p_passengers": passenger_names,
+        # None charges the listed price
+        "p_unit_price": unit_price,
+    }).execute()
+
+    if not result.data:
+        error = result.error or {}
+        if error.get("hint") == "sold_out":
+            raise HTTPException(status_code=409, detail=error.get("message") or "Not enough seats left")
+        if error.get("code") == "P0002":
+            raise HTTPException(status_code=404, detail="Trip not found")
+        print(f"Supabase Booking Error: {error}")
+        raise HTTPException(status_code=400, detail=error.get("message") or "Failed to create booking")
+
+    for row in result.data:
+        rollups.record_booking(row.get("total_price"), booking_id=row.get("id"))
+    price_table.record_booking(trip_id, len(result.data))
+    trip_cache.invalidate_trip(trip_id)
+    # Seats left, for live subscribers; off the booking's response time
+    task = asyncio.create_task(_publish_trip(trip_id))
+    _publishing.add(task)
+    task.add_done_callback(_publishing.discard)
+    # The fares are held in escrow once they are paid (payment verification)
+    return result.data
+
+
 @router.post("/bookings", response_model=BookingResponse)
-def create_booking(booking: BookingRequest):
+async def create_booking(booking: BookingRequest):
     """
-    Create a new booking in Supabase.
+    Book one seat on a trip. Answers 409 when the trip is full or its price
+    moved away from quoted_price.
     """
-    if not supabase:
+    if not async_supabase_admin:
         raise HTTPException(status_code=503, detail="Database connection unavailable")
 
     try:
-        # 1. Verify trip availability (optional enhancement: check seats)
-        
-        # 2. Insert booking using ADMIN client to bypass RLS (if acting on behalf of user)
-        # OR if we trust the user_id sent in request matching auth.uid() we could use 'supabase' 
-        # but 'supabase' here is static server-side client with anon key usually. 
-        # Server-side 'anon' client cannot INSERT for a user unless we pass their JWT.
-        # Since we are not forwarding the user's JWT in this specific REST wrapper setup easily,
-        # we use Service Role to write 'as' the system, trusting the endpoint logic.
-        
-        data = {
-            "trip_id": booking.trip_id,
-            "user_id": booking.user_id,
-            "status": "confirmed"
-        }
-        
-        result = supabase_admin.table("bookings").insert(data).execute()
-        
-        if not result.data:
-             print(f"Supabase Insert Error: {result}") # result object might contain error info depending on wrapper
-             raise HTTPException(status_code=400, detail="Failed to create booking")
+        rows = await _book_seats(booking.trip_id, booking.user_id, [None], booking.quoted_price)
 
         return {
-            "id": result.data[0]["id"],
+            "id": rows[0]["id"],
             "status": "confirmed",
             "message": "Booking successful!"
         }
@@ -223,24 +382,69 @@ def create_booking(booking: BookingRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/bookings/batch", response_model=BatchBookingResponse)
+async def create_bookings_batch(request: BatchBookingRequest):
+    """
+    Book several seats (or named passengers) on one trip in a single request.
+    Either every seat is booked or none is; 409 when not enough seats are left
+    or the price moved away from quoted_price.
+    """
+    if not async_supabase_admin:
+        raise HTTPException(status_code=503, detail="Database connection unavailable")
+
+    names = [p.name for p in request.passengers]
+    if request.seats is not None:
+        if names and len(names) != request.seats:
+            raise HTTPException(status_code=400, detail="seats must match the number of passengers")
+        names = names or [None] * request.seats
+    if not names:
+        raise HTTPException(status_code=400, detail="Give seats or passengers")
+
+    try:
+        rows = await _book_seats(request.trip_id, request.user_id, names, request.quoted_price)
+
+        return {
+            "ids": [row["id"] for row in rows],
+            "status": "confirmed",
+            "seats": len(rows),
+            "total_price": sum(float(row.get("total_price") or 0) for row in rows),
+            "message": f"{len(rows)} seat(s) booked!"
+        }
+
+    except Exception as e:
+        print(f"Error creating batch booking: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/bookings", response_model=List[dict])
-def get_my_bookings(user_id: str):
+async def get_my_bookings(response: Response, user_id: str, cursor: Optional[str] = None, limit: Optional[int] = None):
     """
-    Get all bookings for a user, including trip details.
+    Get a user's bookings, newest first, including trip details.
+    Paged like /trips: follow the X-Next-Cursor header.
     """
-    if not supabase:
+    if not async_supabase:
         raise HTTPException(status_code=503, detail="Database connection unavailable")
 
     try:
         # Fetch bookings and join with trips table
         # PostgREST syntax for joining: select=*,trips(*)
         # Use ADMIN to assume backend trust (since we lack user JWT forwarding in this prototype)
-        client = supabase_admin if supabase_admin else supabase
-        response = client.table("bookings").select("*,trips(*)").eq("user_id", user_id).execute()
+        client = async_supabase_admin if async_supabase_admin else async_supabase
+        query = client.table("bookings").select("*,trips(*)").eq("user_id", user_id)
+        try:
+            query, size = paginate(query, BOOKING_SORT, cursor, limit, desc=True)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        result = await query.execute()
         
-        data = response.data
+        data = result.data
         if data is None:
             return []
+        data, next_cursor = split_page(data, BOOKING_SORT, size)
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
         return data
 
     except Exception as e:
@@ -249,10 +453,86 @@ def get_my_bookings(user_id: str):
             raise e
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/locations/suggest")
+async def suggest_locations(q: str, limit: int = SUGGEST_LIMIT):
+    """
+    Autocomplete for origin/destination inputs: prefix, alias ("jozi", "jhb")
+    and typo-tolerant matches from the in-memory gazetteer of trip locations.
+    """
+    return gazetteer.suggest(q, max(1, min(limit, 20)))
+
+@router.get("/locations/stats")
+async def get_gazetteer_stats():
+    return gazetteer.info()
+
+@router.get("/trips/{trip_id}/price")
+async def get_trip_price(trip_id: str):
+    """How a trip's current price is made up: base fare and the seats, time and demand multipliers."""
+    explained = price_table.explain(trip_id)
+    if explained is None:
+        raise HTTPException(status_code=404, detail="Trip isn't priced (unknown, departed or closed)")
+    return explained
+
+@router.get("/pricing/stats")
+async def get_pricing_stats():
+    return price_table.info()
+
+@router.get("/journeys")
+async def plan_journeys(
+    from_loc: str,
+    to_loc: str,
+    depart_after: Optional[str] = None,
+    date: Optional[str] = None,
+    sort: str = "arrival",
+    k: int = 5,
+    max_legs: int = JOURNEY_MAX_LEGS,
+    seats: int = 1
+):
+    """
+    Ways to get from from_loc to to_loc, direct or with changes (Johannesburg
+    -> Durban -> Pietermaritzburg when no trip goes straight there): the k
+    best by estimated arrival or by total price, first leg leaving after
+    depart_after (ISO timestamp) or on `date`, else from now.
+    """
+    if not async_supabase:
+        raise HTTPException(status_code=503, detail="Database connection unavailable")
+    if sort not in SORT_ORDERS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(SORT_ORDERS)}")
+
+    try:
+        try:
+            after = earliest_departure(depart_after, date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="depart_after must be an ISO timestamp and date YYYY-MM-DD")
+
+        return journey_planner.plan(
+            gazetteer.resolve(from_loc) or from_loc, gazetteer.resolve(to_loc) or to_loc, after, sort=sort,
+            k=max(1, min(k, JOURNEY_MAX_RESULTS)), max_legs=max_legs,
+            seats=max(1, min(seats, MAX_SEATS_PER_BOOKING)), prices=price_table.prices
+        )
+
+    except Exception as e:
+        print(f"Error planning journeys: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/journeys/stats")
+async def get_journey_stats():
+    return journey_planner.info()
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Hit/miss/eviction counters for the trip search and detail caches.
+    """
+    return trip_cache.stats()
+
+
 @router.get("/flights")
-def search_flights():
+async def search_flights():
     return [] # Placeholder
 
 @router.get("/hotels")
-def search_hotels():
+async def search_hotels():
     return [] # Placeholder
@@ -1,103 +1,158 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
-import os
+
+from app.services.supabase_client import async_supabase, async_supabase_admin
+from app.services import ledger, wallet_history
+from app.services.pagination import paginate, split_page, NEXT_CURSOR_HEADER
+from app.services.auth import current_user
+from app.services.escrow import escrow_scheduler, HoldNotFound, HoldConflict
 
 router = APIRouter(
     prefix="/wallet",
     tags=["wallet"]
 )
 
-# Mock Data
-MOCK_WALLET_BALANCE = {
-    "available_balance": 2450.00,
-    "escrowed_funds": 350.00,
-    "total_earned": 5200.00,
-    "earned_change": 12.5,
-    "total_spent": 1100.00,
-    "spent_change": -5.0,
-    "trips_completed": 12,
-    "upcoming_trips": 2
-}
-
-MOCK_TRANSACTIONS = [
-    {
-        "id": "TX-1",
-        "date": "Oct 24, 2023",
-        "time": "14:30 PM",
-        "description": "Trip Payment - #TR-8821",
-        "sub_description": "Carpool: Sandton to Midrand",
-        "type": "Earnings",
-        "status": "Completed",
-        "amount": "+ R 450.00",
-        "icon": "local_taxi",
-        "icon_color": "blue"
-    },
-    {
-        "id": "TX-2",
-        "date": "Oct 22, 2023",
-        "time": "09:15 AM",
-        "description": "Ride Payment - #TR-8805",
-        "sub_description": "Ride: Centurion to Pretoria",
-        "type": "Spending",
-        "status": "Completed",
-        "amount": "- R 120.00",
-        "icon": "shopping_cart",
-        "icon_color": "slate"
-    },
-    {
-        "id": "TX-3",
-        "date": "Oct 20, 2023",
-        "time": "11:00 AM",
-        "description": "Wallet Top-Up",
-        "sub_description": "Credit Card **** 4242",
-        "type": "Deposit",
-        "status": "Success",
-        "amount": "+ R 1,000.00",
-        "icon": "add_card",
-        "icon_color": "teal"
-    },
-    {
-        "id": "TX-4",
-        "date": "Oct 18, 2023",
-        "time": "16:45 PM",
-        "description": "Trip Escrow - #TR-8830",
-        "sub_description": "Funds held for Trip #8830",
-        "type": "Escrow Hold",
-        "status": "Pending",
-        "amount": "(R 350.00)",
-        "icon": "timelapse",
-        "icon_color": "orange"
-    },
-    {
-        "id": "TX-5",
-        "date": "Oct 15, 2023",
-        "time": "08:00 AM",
-        "description": "Bank Withdrawal",
-        "sub_description": "Transfer to FNB Acc ...8901",
-        "type": "Withdrawal",
-        "status": "Completed",
-        "amount": "- R 2,000.00",
-        "icon": "account_balance",
-        "icon_color": "slate"
-    }
-]
+
+class DisputeRequest(BaseModel):
+    reason: Optional[str] = None
+
+
+def _client():
+    client = async_supabase_admin or async_supabase
+    if not client:
+        raise HTTPException(status_code=503, detail="Database connection unavailable")
+    return client
+
 
 @router.get("/balance")
-def get_wallet_balance():
-    """Returns the current user's wallet balance and aggregated statistics."""
-    # In a real implementation, we would query the `wallets` table in Supabase 
-    # using the authenticated user's ID.
-    return MOCK_WALLET_BALANCE
-
-@router.get("/transactions")
-def get_transactions(type: Optional[str] = None):
-    """Returns a list of transactions for the current user's wallet."""
-    # In a real implementation, we would query the `transactions` table in Supabase
-    # using the authenticated user's wallet_id, and apply filters based on `type`.
-    
-    if type and type != "All":
-        filtered = [tx for tx in MOCK_TRANSACTIONS if tx["type"] == type or (type == "Earnings" and tx["type"] == "Deposit")]
-        return filtered
-    
-    return MOCK_TRANSACTIONS
+async def get_wallet_balance(claims: dict = Depends(current_user)):
+    """
+    Returns the caller's wallet balance and aggregated statistics, read from
+    the balance snapshots and counters the ledger keeps up to date, so the
+    cost doesn't grow with the user's history.
+    """
+    try:
+        summary = await ledger.wallet_summary(_client(), claims["sub"])
+        return {
+            "available_balance": ledger.from_cents(summary["available_cents"]),
+            "escrowed_funds": ledger.from_cents(summary["escrowed_cents"]),
+            "total_earned": ledger.from_cents(summary["total_earned_cents"]),
+            "earned_change": summary["earned_change"],
+            "total_spent": ledger.from_cents(summary["total_spent_cents"]),
+            "spent_change": summary["spent_change"],
+            "trips_completed": summary["trips_completed"],
+            "upcoming_trips": summary["upcoming_trips"],
+            **{k: v for k, v in summary.items() if k.endswith("_cents")},
+        }
+
+    except Exception as e:
+        print(f"Error fetching wallet balance: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/transactions", response_model=List[dict])
+async def get_transactions(response: Response, type: Optional[str] = None,
+                           status: Optional[str] = None, date_from: Optional[str] = None,
+                           date_to: Optional[str] = None, cursor: Optional[str] = None,
+                           limit: Optional[int] = None, claims: dict = Depends(current_user)):
+    """
+    Returns the caller's ledger transactions, newest first, optionally of one
+    type (Earnings, Spending, ...), one status (Completed, Pending, Failed)
+    and between two dates (YYYY-MM-DD, inclusive). Filtered by the database
+    and paged like /travel/bookings: follow the X-Next-Cursor header.
+    """
+    try:
+        query = _client().table("ledger_transactions").select(wallet_history.HISTORY_COLUMNS)
+        try:
+            query = wallet_history.filter_history(query, claims["sub"], type, status, date_from, date_to)
+            query, size = paginate(query, wallet_history.HISTORY_SORT, cursor, limit, desc=True)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        result = await query.execute()
+        if result.status_code is None or result.status_code >= 400:
+            raise RuntimeError(f"ledger_transactions query failed with status {result.status_code}")
+
+        rows, next_cursor = split_page(result.data or [], wallet_history.HISTORY_SORT, size)
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return [wallet_history.transaction_view(row) for row in rows]
+
+    except Exception as e:
+        print(f"Error fetching wallet transactions: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/transactions/export")
+async def export_transactions(format: str = "csv", type: Optional[str] = None,
+                              status: Optional[str] = None, date_from: Optional[str] = None,
+                              date_to: Optional[str] = None, claims: dict = Depends(current_user)):
+    """
+    Downloads the caller's statement (same filters as /transactions) as CSV or
+    NDJSON, streamed page by page so any size of history exports in
+    constant memory.
+    """
+    if format not in wallet_history.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(wallet_history.EXPORT_FORMATS)}")
+    user_id = claims["sub"]
+    try:
+        client = _client()
+        # Validates the filters before anything is streamed
+        wallet_history.filter_history(client.table("ledger_transactions"), user_id, type, status, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def make_query():
+        query = client.table("ledger_transactions").select(wallet_history.HISTORY_COLUMNS)
+        return wallet_history.filter_history(query, user_id, type, status, date_from, date_to)
+
+    chunks = wallet_history.export(make_query, format)
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except Exception as e:
+        print(f"Error exporting wallet transactions: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def body():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(body(), media_type=wallet_history.EXPORT_FORMATS[format], headers={
+        "Content-Disposition": f'attachment; filename="wallet-statement.{format}"',
+    })
+
+
+@router.post("/escrow/{hold_id}/dispute")
+async def dispute_escrow_hold(hold_id: str, request: DisputeRequest, claims: dict = Depends(current_user)):
+    """
+    Keeps a trip fare in escrow past its release time while the payer's (or
+    driver's) complaint is looked into. Only while the dispute window is
+    open; 409 once the fare has been released or refunded. An admin settles
+    it (POST /admin/escrow/{hold_id}/resolve).
+    """
+    try:
+        return await escrow_scheduler.dispute(hold_id, claims["sub"], request.reason)
+
+    except HoldNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except HoldConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"Error disputing escrow hold: {e}")
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/escrow/scheduler")
+async def get_escrow_scheduler_stats():
+    """Escrow scheduler counters: holds opened, released, refunded, writes, what's queued next."""
+    return escrow_scheduler.info()
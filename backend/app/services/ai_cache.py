@@ -0,0 +1,223 @@
+import os
+import re
+import hashlib
+import threading
+
+from app.services import trip_cache
+from app.services.cache import create_cache, MISSING
+from app.services.singleflight import AsyncSingleFlight
+
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "1") != "0"
+AI_CACHE_MAXSIZE = int(os.getenv("AI_CACHE_MAXSIZE", "2048"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "600"))
+# Character-trigram Jaccard similarity at which two questions count as the same question
+AI_CACHE_SIMILARITY = float(os.getenv("AI_CACHE_SIMILARITY", "0.7"))
+# Questions compared per lookup; the rest of a context's questions are only found verbatim
+AI_CACHE_CANDIDATES = 64
+
+# Words that don't change what is being asked ("are there any trips" ~ "trips")
+STOPWORDS = {
+    "a", "an", "the", "any", "some", "is", "are", "was", "there", "do", "does", "you", "your",
+    "have", "has", "got", "can", "could", "would", "i", "me", "my", "we", "please", "pls",
+    "hi", "hey", "hello", "what", "which", "of", "available", "just", "ok", "okay",
+}
+
+_WORD = re.compile(r"[a-z0-9']+")
+_NUMBER = re.compile(r"\d+")
+
+
+def question_key(text, places=()):
+    """
+    Normalized form of a question: lower-cased content words, crude singulars,
+    without the `places` it is about (the bucket already pins those, and a long
+    name would otherwise make any two questions about it look alike).
+    "Are there any trips to Durban??", places=["Durban"] -> "trip to"
+    """
+    words = []
+    for word in _WORD.findall(str(text).lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    key = f" {' '.join(words)} "
+    for place in places:
+        key = key.replace(f" {question_key(place)} ", " ")
+    return key.strip()
+
+
+def shingles(key):
+    padded = f" {key} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def fingerprint(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:20]
+
+
+class AICacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.llm_calls = 0
+        self.stores = 0
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            answered = self.hits + self.near_hits + self.coalesced
+            requests = answered + self.llm_calls
+            return {
+                "requests": requests,
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "hit_ratio": round(answered / requests, 3) if requests else 0.0,
+                "llm_calls": self.llm_calls,
+                "llm_calls_saved": answered,
+                "stores": self.stores,
+            }
+
+
+class ResponseCache:
+    """
+    AI replies reused for the same or a near-identical question.
+
+    Replies live in a bucket per (provider, model, earlier conversation, trip
+    context): the context is what the retrieval stage put in the prompt, so
+    "trips to Durban?" and "trips to Dundee?" never share a bucket, and any
+    change to the listed trips (a booking, a new trip) moves questions to a
+    fresh bucket. Within a bucket a question matches verbatim (after
+    question_key) or by trigram similarity, provided the numbers in it agree.
+
+    Replies are stored in a TTL/LRU cache tagged with the context's trip ids,
+    so trip_cache.invalidate_trip drops them eagerly as well.
+    """
+    def __init__(self, maxsize=AI_CACHE_MAXSIZE, ttl=AI_CACHE_TTL, threshold=AI_CACHE_SIMILARITY):
+        self.store = create_cache("ai:responses", maxsize=maxsize, ttl=ttl)
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.stats = AICacheStats()
+        self.flight = AsyncSingleFlight()
+        self._lock = threading.Lock()
+        self._buckets = {}  # bucket -> {question key: shingles}, newest last
+        trip_cache.dependent_caches.append(self.store)
+
+    @staticmethod
+    def key(provider, model, messages, context, summary=""):
+        """
+        (bucket, question key) for the last message of `messages`, asked with the
+        trip `context` from the retrieval stage (and the conversation's `summary`
+        of older messages, if any); (None, None) when the conversation doesn't
+        end with a user question.
+        """
+        if not messages or messages[-1].get("role") != "user":
+            return None, None
+        turns = [(m.get("role"), trip_cache.normalize(m.get("content"))) for m in messages[:-1]
+                 if m.get("role") != "system"]
+        bucket = fingerprint(provider, model, turns, context["text"], summary)
+        return bucket, question_key(messages[-1].get("content") or "", context.get("places", ()))
+
+    def lookup(self, bucket, key):
+        """(reply, "hit" | "near_hit") or (None, None)."""
+        if not AI_CACHE_ENABLED:
+            return None, None
+        reply = self.store.get(f"{bucket}:{key}")
+        if reply is not MISSING:
+            self.stats.incr("hits")
+            return reply, "hit"
+
+        grams = shingles(key)
+        numbers = _NUMBER.findall(key)
+        with self._lock:
+            candidates = list(self._buckets.get(bucket, {}).items())[-AI_CACHE_CANDIDATES:]
+        best, best_score = None, self.threshold
+        for other, other_grams in candidates:
+            score = similarity(grams, other_grams)
+            if score >= best_score and _NUMBER.findall(other) == numbers:
+                best, best_score = other, score
+        if best is not None:
+            reply = self.store.get(f"{bucket}:{best}")
+            if reply is not MISSING:
+                self.stats.incr("near_hits")
+                return reply, "near_hit"
+            self._forget(bucket, best)
+        self.stats.incr("misses")
+        return None, None
+
+    def remember(self, bucket, key, reply, trip_ids=()):
+        if not AI_CACHE_ENABLED:
+            return
+        self.store.set(f"{bucket}:{key}", reply, tags=[str(t) for t in trip_ids])
+        self.stats.incr("stores")
+        with self._lock:
+            questions = self._buckets.pop(bucket, {})
+            questions.pop(key, None)
+            questions[key] = shingles(key)
+            self._buckets[bucket] = questions  # most recently used bucket last
+            while len(questions) > AI_CACHE_CANDIDATES:
+                del questions[next(iter(questions))]
+            while len(self._buckets) > self.maxsize:
+                del self._buckets[next(iter(self._buckets))]
+
+    def _forget(self, bucket, key):
+        with self._lock:
+            questions = self._buckets.get(bucket)
+            if questions is not None:
+                questions.pop(key, None)
+                if not questions:
+                    del self._buckets[bucket]
+
+    async def answer(self, bucket, key, call, trip_ids=()):
+        """
+        Cached reply for the question, or the result of `await call()`. Concurrent
+        misses for the same question share one call; replies with an "error"
+        key or a "fallback" flag (the smart mock answered) are passed through but
+        not cached.
+        """
+        if not AI_CACHE_ENABLED:
+            self.stats.incr("llm_calls")
+            return await call()
+        reply, _ = self.lookup(bucket, key)
+        if reply is not None:
+            return reply
+
+        led = False
+
+        async def call_and_store():
+            nonlocal led
+            led = True
+            self.stats.incr("llm_calls")
+            result = await call()
+            if "error" not in result and not result.get("fallback"):
+                self.remember(bucket, key, result, trip_ids)
+            return result
+
+        result = await self.flight.do(f"{bucket}:{key}", call_and_store)
+        if not led:
+            self.stats.incr("coalesced")
+        return result
+
+    def info(self):
+        with self._lock:
+            buckets = len(self._buckets)
+        return {"enabled": AI_CACHE_ENABLED, "threshold": self.threshold, "buckets": buckets,
+                **self.stats.snapshot(), "store": self.store.info()}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,50 @@
+import os
+from typing import Optional
+
+import jwt
+from fastapi import Depends, Header, HTTPException
+
+# The Supabase project's JWT secret (Settings > API): access tokens are HS256-signed with it.
+# Without it no caller can be identified, so endpoints that need one answer 503
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
+# Supabase access tokens are issued for this audience
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+
+
+def decode_token(token, secret=SUPABASE_JWT_SECRET, audience=SUPABASE_JWT_AUDIENCE):
+    """The claims of a Supabase access token. Raises jwt.InvalidTokenError if it isn't valid."""
+    return jwt.decode(token, secret, algorithms=["HS256"], audience=audience,
+                      options={"require": ["sub", "exp"]})
+
+
+def is_admin(claims):
+    """
+    Admins have role "admin" in app_metadata, which only the service role can
+    set (users can edit their user_metadata, so that doesn't count).
+    """
+    return (claims.get("app_metadata") or {}).get("role") == "admin"
+
+
+async def current_user(authorization: Optional[str] = Header(None)):
+    """
+    FastAPI dependency: the caller's token claims, from "Authorization: Bearer
+    <access token>". claims["sub"] is their user id. 401 without a valid token.
+    """
+    if not SUPABASE_JWT_SECRET:
+        raise HTTPException(status_code=503, detail="Authentication is not configured")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return decode_token(token.strip())
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+
+async def require_admin(claims: dict = Depends(current_user)):
+    """FastAPI dependency: 403 unless the caller is an admin."""
+    if not is_admin(claims):
+        raise HTTPException(status_code=403, detail="Admins only")
+    return claims
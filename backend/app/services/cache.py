@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # the shared backend is optional
+    redis = None
+
+# Set to e.g. redis://localhost:6379/0 so every uvicorn worker shares one cache
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+
+MISSING = object()
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class TTLCache:
+    """
+    In-process LRU cache with a per-entry TTL and a hard size bound.
+    Entries can carry tags (e.g. the trip ids a search returned) so that
+    invalidate_tag() drops every entry that depends on one record.
+    """
+    backend = "memory"
+
+    def __init__(self, name, maxsize=1024, ttl=30.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._data = OrderedDict()   # key -> (expires_at, value, tags)
+        self._tags = {}              # tag -> set of keys
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats.incr("misses")
+                return MISSING
+            expires_at, value, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.stats.incr("expirations")
+                self.stats.incr("misses")
+                return MISSING
+            self._data.move_to_end(key)
+            self.stats.incr("hits")
+            return value
+
+    def set(self, key, value, ttl=None, tags=()):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.stats.incr("evictions")
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+                self.stats.incr("invalidations")
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            keys = self._tags.pop(tag, set())
+            for key in keys:
+                if key in self._data:
+                    self._remove(key)
+                    self.stats.incr("invalidations")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def info(self):
+        with self._lock:
+            size = len(self._data)
+        return {"name": self.name, "backend": self.backend, "size": size, "maxsize": self.maxsize,
+                "ttl": self.ttl, **self.stats.snapshot()}
+
+
+class RedisCache:
+    """
+    Shared cache in a Redis-compatible store, same interface as TTLCache.
+    Values are stored as JSON; size bounding and eviction are left to the
+    server's maxmemory policy (allkeys-lru), TTLs are native expiries.
+    """
+    backend = "redis"
+
+    def __init__(self, name, client, maxsize=1024, ttl=30.0):
+        self.name = name
+        self.client = client
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    def _key(self, key):
+        return f"{self.name}:{key}"
+
+    def _tag(self, tag):
+        return f"{self.name}:tag:{tag}"
+
+    def get(self, key):
+        try:
+            raw = self.client.get(self._key(key))
+        except redis.RedisError as e:
+            print(f"Cache backend error: {e}")
+            raw = None
+        if raw is None:
+            self.stats.incr("misses")
+            return MISSING
+        self.stats.incr("hits")
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=None, tags=()):
+        ttl = ttl or self.ttl
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(self._key(key), json.dumps(value), px=int(ttl * 1000))
+            for tag in tags:
+                pipe.sadd(self._tag(tag), key)
+                pipe.pexpire(self._tag(tag), int(ttl * 1000))
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"Cache backend error: {e}")
+
+    def delete(self, key):
+        try:
+            if self.client.delete(self._key(key)):
+                self.stats.incr("invalidations")
+        except redis.RedisError as e:
+            print(f"Cache backend error: {e}")
+
+    def invalidate_tag(self, tag):
+        try:
+            keys = self.client.smembers(self._tag(tag))
+            names = [self._key(k.decode() if isinstance(k, bytes) else k) for k in keys]
+            if names:
+                self.stats.incr("invalidations", self.client.delete(*names))
+            self.client.delete(self._tag(tag))
+        except redis.RedisError as e:
+            print(f"Cache backend error: {e}")
+
+    def clear(self):
+        try:
+            for name in self.client.scan_iter(f"{self.name}:*"):
+                self.client.delete(name)
+        except redis.RedisError as e:
+            print(f"Cache backend error: {e}")
+
+    def info(self):
+        evicted = None
+        try:
+            evicted = self.client.info("stats").get("evicted_keys")
+        except redis.RedisError:
+            pass
+        stats = self.stats.snapshot()
+        stats["evictions"] = evicted
+        return {"name": self.name, "backend": self.backend, "maxsize": self.maxsize, "ttl": self.ttl, **stats}
+
+
+_redis_client = None
+
+
+def create_cache(name, maxsize=1024, ttl=30.0):
+    """Returns a shared Redis-backed cache when CACHE_REDIS_URL is set, else an in-process one."""
+    global _redis_client
+    if CACHE_REDIS_URL:
+        if redis is None:
+            print("Warning: CACHE_REDIS_URL is set but the redis package is not installed. Using in-process cache.")
+        else:
+            if _redis_client is None:
+                _redis_client = redis.Redis.from_url(CACHE_REDIS_URL, socket_timeout=0.5)
+            return RedisCache(name, _redis_client, maxsize=maxsize, ttl=ttl)
+    return TTLCache(name, maxsize=maxsize, ttl=ttl)
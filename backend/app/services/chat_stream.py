@@ -0,0 +1,63 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Chunks that may wait between a model's reader thread and the client. When the
+# client reads slower than the model writes, the reader blocks and stops pulling
+# from upstream instead of buffering the whole reply.
+CHAT_STREAM_QUEUE_SIZE = int(os.getenv("CHAT_STREAM_QUEUE_SIZE", "32"))
+# Each open stream holds one reader thread for the length of the reply
+CHAT_STREAM_MAX_WORKERS = int(os.getenv("CHAT_STREAM_MAX_WORKERS", "64"))
+
+_executor = ThreadPoolExecutor(max_workers=CHAT_STREAM_MAX_WORKERS, thread_name_prefix="chat-stream")
+_END = object()
+
+
+async def stream_reply(produce, *args, **kwargs):
+    """
+    Runs the blocking generator produce(*args, **kwargs) on a reader thread and
+    yields its chunks on the event loop. At most CHAT_STREAM_QUEUE_SIZE chunks
+    are buffered in between. Closing or cancelling this generator (e.g. on
+    client disconnect) stops the reader at its next chunk and closes `produce`,
+    which drops the upstream connection. Errors from `produce` are re-raised here.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    slots = threading.Semaphore(CHAT_STREAM_QUEUE_SIZE)
+    cancelled = threading.Event()
+
+    def push(item):
+        # Waits for a free slot, checking now and then whether the consumer is gone
+        while not slots.acquire(timeout=0.25):
+            if cancelled.is_set():
+                return False
+        if cancelled.is_set():
+            return False
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+        return True
+
+    def read():
+        chunks = produce(*args, **kwargs)
+        try:
+            for chunk in chunks:
+                if chunk and not push(chunk):
+                    return
+            push(_END)
+        except Exception as e:
+            push(e)
+        finally:
+            chunks.close()
+
+    loop.run_in_executor(_executor, read)
+    try:
+        while True:
+            item = await queue.get()
+            slots.release()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
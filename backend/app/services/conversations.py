@@ -0,0 +1,273 @@
+import os
+import uuid
+import asyncio
+import datetime
+import threading
+
+from app.services.cache import create_cache, MISSING
+from app.services.trip_context import extract_date, extract_places
+
+# Messages of a conversation kept verbatim in the prompt; older ones are folded
+# into the conversation's summary, so prompt size doesn't grow with the chat
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "12"))
+# Longest message (in characters) put back into a prompt
+CHAT_MESSAGE_MAX_CHARS = int(os.getenv("CHAT_MESSAGE_MAX_CHARS", "2000"))
+CHAT_HISTORY_CACHE_SIZE = int(os.getenv("CHAT_HISTORY_CACHE_SIZE", "4096"))
+CHAT_HISTORY_TTL = float(os.getenv("CHAT_HISTORY_TTL", "1800"))
+# Writes go out in batches: when this many messages are waiting, or every
+# CHAT_HISTORY_FLUSH_MS; past CHAT_HISTORY_MAX_PENDING (database down) the oldest are dropped
+CHAT_HISTORY_BATCH_SIZE = int(os.getenv("CHAT_HISTORY_BATCH_SIZE", "200"))
+CHAT_HISTORY_FLUSH_MS = float(os.getenv("CHAT_HISTORY_FLUSH_MS", "200"))
+CHAT_HISTORY_MAX_PENDING = int(os.getenv("CHAT_HISTORY_MAX_PENDING", "20000"))
+
+# What the summary remembers of the messages that left the window
+SUMMARY_PLACES = 6
+SUMMARY_DATES = 4
+SUMMARY_QUESTIONS = 4
+SUMMARY_QUESTION_CHARS = 120
+
+
+class ConversationNotFound(Exception):
+    pass
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def new_summary():
+    return {"messages": 0, "places": [], "dates": [], "questions": []}
+
+
+def _remember(items, item, limit):
+    # Most recent last, no repeats
+    if item in items:
+        items.remove(item)
+    items.append(item)
+    del items[:-limit]
+
+
+def fold(summary, message):
+    """Adds a message leaving the window to the (bounded) summary."""
+    summary["messages"] += 1
+    if message["role"] != "user":
+        return summary
+    text = str(message["content"])
+    said_on = datetime.date.fromisoformat(str(message.get("at") or _now())[:10])
+    for place in extract_places(text):
+        if place:
+            _remember(summary["places"], place, SUMMARY_PLACES)
+    date = extract_date(text, said_on)
+    if date:
+        _remember(summary["dates"], date.isoformat(), SUMMARY_DATES)
+    question = " ".join(text.split())
+    if len(question) > SUMMARY_QUESTION_CHARS:
+        question = question[:SUMMARY_QUESTION_CHARS - 3] + "..."
+    _remember(summary["questions"], question, SUMMARY_QUESTIONS)
+    return summary
+
+
+def render_summary(summary):
+    """The summary as a prompt section, or "" when nothing has left the window."""
+    if not summary or not summary.get("messages"):
+        return ""
+    lines = [f"Earlier in this conversation ({summary['messages']} older messages, summarized):"]
+    if summary["places"]:
+        lines.append(f"- Places discussed: {', '.join(summary['places'])}")
+    if summary["dates"]:
+        lines.append(f"- Travel dates mentioned: {', '.join(summary['dates'])}")
+    if summary["questions"]:
+        lines.append("- The user asked: " + "; ".join(f'"{q}"' for q in summary["questions"]))
+    return "\n".join(lines)
+
+
+class HistoryWriter:
+    """
+    Buffers chat history writes and sends them from a background task: per
+    flush, one upsert of the conversations that changed and one of their new
+    messages (per CHAT_HISTORY_BATCH_SIZE), instead of a few requests per chat
+    turn. Failed writes are retried on the next flush. Nothing is written
+    until start() gives it a client.
+    """
+    def __init__(self, batch_size=CHAT_HISTORY_BATCH_SIZE, flush_interval=CHAT_HISTORY_FLUSH_MS / 1000,
+                 max_pending=CHAT_HISTORY_MAX_PENDING):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.client = None
+        self._lock = threading.Lock()
+        self._conversations = {}  # id -> newest row
+        self._messages = []
+        self._wake = None
+        self._flushing = None
+        self._task = None
+        self.batches = 0
+        self.conversations_written = 0
+        self.messages_written = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def start(self, client):
+        """Starts the flush loop on the running event loop."""
+        self.client = client
+        self._wake = asyncio.Event()
+        self._flushing = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the loop and writes whatever is still waiting."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.client:
+            await self.flush()
+
+    def add(self, conversation_row, message_rows):
+        if self.client is None:
+            return
+        with self._lock:
+            self._conversations[conversation_row["id"]] = conversation_row
+            self._messages.extend(message_rows)
+            overflow = len(self._messages) - self.max_pending
+            if overflow > 0:
+                del self._messages[:overflow]
+                self.dropped += overflow
+            full = len(self._messages) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                # Shielded: stop() cancelling the loop mustn't lose the rows being written
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                print(f"Chat history flush failed: {e}")
+
+    async def flush(self):
+        async with self._flushing:
+            with self._lock:
+                conversations, self._conversations = list(self._conversations.values()), {}
+                messages, self._messages = self._messages, []
+            # Upserts, so a batch retried after a lost response doesn't duplicate rows
+            written = 0
+            try:
+                # Conversations first: messages reference them
+                await self._write("conversations", conversations, "id")
+                self.conversations_written += len(conversations)
+                for i in range(0, len(messages), self.batch_size):
+                    batch = messages[i:i + self.batch_size]
+                    await self._write("messages", batch, "conversation_id,seq")
+                    written += len(batch)
+                    self.messages_written += len(batch)
+            except Exception as e:
+                self.failures += 1
+                print(f"Chat history write failed, will retry: {e}")
+                with self._lock:
+                    # Put back what wasn't written; newer conversation rows win
+                    if written == 0:
+                        for row in conversations:
+                            self._conversations.setdefault(row["id"], row)
+                    self._messages[:0] = messages[written:]
+
+    async def _write(self, table, rows, on_conflict):
+        for i in range(0, len(rows), self.batch_size):
+            response = await self.client.table(table).upsert(rows[i:i + self.batch_size], on_conflict=on_conflict).execute()
+            if response.status_code is None or response.status_code >= 400:
+                raise RuntimeError(f"{table} write failed with status {response.status_code}")
+            self.batches += 1
+
+    def info(self):
+        with self._lock:
+            pending = len(self._messages)
+        return {"enabled": self.client is not None, "pending": pending, "batches": self.batches,
+                "conversations_written": self.conversations_written,
+                "messages_written": self.messages_written, "failures": self.failures, "dropped": self.dropped}
+
+
+class ConversationStore:
+    """
+    Server-side chat history, so clients send a conversation id and the new
+    message instead of the whole conversation.
+
+    A conversation is {"id", "user_id", "summary", "recent", "next_seq"}: the
+    last `window` messages verbatim plus a rolling summary of everything
+    before them (places, dates and the user's questions; see fold()), so the
+    prompt stays the same size however long the chat gets. Live conversations
+    are served from a cache; a cold one is read back with two small queries.
+    Writes are queued on the HistoryWriter.
+    """
+    def __init__(self, writer, window=CHAT_HISTORY_TURNS):
+        self.writer = writer
+        self.window = window
+        self.cache = create_cache("ai:conversations", maxsize=CHAT_HISTORY_CACHE_SIZE, ttl=CHAT_HISTORY_TTL)
+
+    def start(self, user_id=None):
+        """A new, empty conversation."""
+        conversation = {"id": str(uuid.uuid4()), "user_id": user_id, "summary": new_summary(),
+                        "recent": [], "next_seq": 0}
+        self.cache.set(conversation["id"], conversation)
+        return conversation
+
+    async def load(self, client, conversation_id):
+        """Raises ConversationNotFound."""
+        conversation = self.cache.get(str(conversation_id))
+        if conversation is not MISSING:
+            return conversation
+        if client is None:
+            raise ConversationNotFound(conversation_id)
+        response = await client.table("conversations").select("id,user_id,summary,message_count") \
+            .eq("id", str(conversation_id)).limit(1).execute()
+        if response.status_code is None or response.status_code >= 400:
+            raise RuntimeError(f"conversations query failed with status {response.status_code}")
+        if not response.data:
+            raise ConversationNotFound(conversation_id)
+        row = response.data[0]
+        response = await client.table("messages").select("role,content,seq,created_at") \
+            .eq("conversation_id", row["id"]).order("seq", desc=True).limit(self.window).execute()
+        if response.status_code is None or response.status_code >= 400:
+            raise RuntimeError(f"messages query failed with status {response.status_code}")
+        recent = [{"role": m["role"], "content": m["content"], "seq": m["seq"], "at": m.get("created_at")}
+                  for m in reversed(response.data or [])]
+        conversation = {"id": row["id"], "user_id": row.get("user_id"),
+                        "summary": {**new_summary(), **(row.get("summary") or {})},
+                        "recent": recent, "next_seq": row.get("message_count") or 0}
+        self.cache.set(conversation["id"], conversation)
+        return conversation
+
+    def prompt(self, conversation, message):
+        """(messages for the model: the window plus the new user message, summary text)."""
+        messages = [{"role": m["role"], "content": str(m["content"])[:CHAT_MESSAGE_MAX_CHARS]}
+                    for m in conversation["recent"]]
+        messages.append({"role": "user", "content": str(message)[:CHAT_MESSAGE_MAX_CHARS]})
+        return messages, render_summary(conversation["summary"])
+
+    def record(self, conversation, message, reply):
+        """Appends a user message and the assistant's reply, folding what leaves the window."""
+        at = _now()
+        rows = []
+        for role, content in (("user", message), ("assistant", reply)):
+            turn = {"role": role, "content": content, "seq": conversation["next_seq"], "at": at}
+            conversation["recent"].append(turn)
+            conversation["next_seq"] += 1
+            rows.append({"conversation_id": conversation["id"], "user_id": conversation["user_id"],
+                         "role": role, "content": content, "seq": turn["seq"], "created_at": at})
+        while len(conversation["recent"]) > self.window:
+            fold(conversation["summary"], conversation["recent"].pop(0))
+        self.cache.set(conversation["id"], conversation)
+        self.writer.add({"id": conversation["id"], "user_id": conversation["user_id"],
+                         "summary": conversation["summary"], "message_count": conversation["next_seq"],
+                         "updated_at": at}, rows)
+
+    def info(self):
+        return {"window": self.window, "cache": self.cache.info(), "writer": self.writer.info()}
+
+
+history_writer = HistoryWriter()
+conversations = ConversationStore(history_writer)
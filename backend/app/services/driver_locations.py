@@ -0,0 +1,400 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import datetime
+from array import array
+
+# Side of a cell of the position index. A radius query reads the cells its
+# circle touches, so about a typical pickup radius
+DRIVER_GRID_CELL_M = float(os.getenv("DRIVER_GRID_CELL_M", "500"))
+# A driver without a ping for this long isn't offered for pickups and is
+# dropped from the index
+DRIVER_STALE_SECONDS = float(os.getenv("DRIVER_STALE_SECONDS", "120"))
+# Stored track: a ping is kept when the driver has moved this far since the
+# last kept point, or this long has passed (so a parked car leaves a few
+# points, not one per ping)
+DRIVER_TRACK_MIN_METERS = float(os.getenv("DRIVER_TRACK_MIN_METERS", "50"))
+DRIVER_TRACK_MAX_INTERVAL = float(os.getenv("DRIVER_TRACK_MAX_INTERVAL", "60"))
+# Track points are written in batches: when this many are waiting, or every
+# DRIVER_TRACK_FLUSH_MS; past DRIVER_TRACK_MAX_PENDING (database down) the oldest are dropped
+DRIVER_TRACK_BATCH_SIZE = int(os.getenv("DRIVER_TRACK_BATCH_SIZE", "2000"))
+DRIVER_TRACK_FLUSH_MS = float(os.getenv("DRIVER_TRACK_FLUSH_MS", "1000"))
+DRIVER_TRACK_MAX_PENDING = int(os.getenv("DRIVER_TRACK_MAX_PENDING", "200000"))
+
+# Shared secret of the fleet gateway (X-Gateway-Key header), which posts
+# batches for many drivers; a driver's phone posts with its own access token.
+# Empty: phones only
+DRIVER_GATEWAY_KEY = os.getenv("DRIVER_GATEWAY_KEY", "")
+
+# Pings per request, and the widest radius a query may ask for
+DRIVER_PING_BATCH_MAX = 1000
+DRIVER_RADIUS_MAX_M = 20000
+# A fix this far in the future (a phone's clock) is taken as received now
+_CLOCK_SKEW = 30
+
+METERS_PER_DEGREE = 111_320.0
+
+
+def _iso(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).isoformat()
+
+
+class DriverIndex:
+    """
+    Current position of every active driver, for pickup matching.
+
+    Positions live in parallel arrays by slot (no object per driver for the
+    GC to walk) and in a grid of `cell_m` cells keyed by integer
+    (lat, lon) cell numbers: a radius query reads the cells its circle
+    touches; nearest() reads rings of cells outwards from the pickup until
+    no unread cell can hold anything closer. Distances are equirectangular,
+    which is exact enough at city scale; the grid doesn't wrap at the
+    antimeridian.
+
+    Each ping also goes through dead-band downsampling: update() returns
+    the point to store when the driver has moved `track_meters` since the
+    last stored one (or `track_interval` has passed, or the trip changed).
+    Call from one thread (the event loop).
+    """
+    def __init__(self, cell_m=DRIVER_GRID_CELL_M, stale_after=DRIVER_STALE_SECONDS,
+                 track_meters=DRIVER_TRACK_MIN_METERS, track_interval=DRIVER_TRACK_MAX_INTERVAL):
+        self.cell_m = cell_m
+        self.cell_deg = cell_m / METERS_PER_DEGREE
+        self._row = int(math.ceil(360 / self.cell_deg)) + 1   # cells per row of the key space
+        self.stale_after = stale_after
+        self.track_meters = track_meters
+        self.track_interval = track_interval
+        self.ids = []              # slot -> driver id, None when free
+        self.trips = []            # slot -> trip id or None
+        self.lat = array("d")
+        self.lon = array("d")
+        self.at = array("d")
+        self.speed = array("d")    # NaN when not reported
+        self.heading = array("d")
+        self.available = bytearray()
+        self.cell = array("q")
+        # The last stored track point, per slot
+        self.kept_lat = array("d")
+        self.kept_lon = array("d")
+        self.kept_at = array("d")
+        self.cells = {}            # cell key -> set of slots
+        self._slots = {}           # driver id -> slot
+        self._free = []
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _cell(self, lat, lon):
+        return int((lat + 90) / self.cell_deg) * self._row + int((lon + 180) / self.cell_deg)
+
+    def update(self, driver_id, lat, lon, at, available=True, trip_id=None, speed=None, heading=None):
+        """
+        Moves a driver. Returns None if the ping is older than the driver's
+        current position (ignored), else the track row to store or False.
+        """
+        slot = self._slots.get(driver_id)
+        cell = self._cell(lat, lon)
+        nan = math.nan
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self.ids[slot] = driver_id
+                self.trips[slot] = trip_id
+                self.lat[slot], self.lon[slot], self.at[slot] = lat, lon, at
+                self.speed[slot] = nan if speed is None else speed
+                self.heading[slot] = nan if heading is None else heading
+                self.available[slot] = bool(available)
+                self.cell[slot] = cell
+            else:
+                slot = len(self.ids)
+                self.ids.append(driver_id)
+                self.trips.append(trip_id)
+                self.lat.append(lat)
+                self.lon.append(lon)
+                self.at.append(at)
+                self.speed.append(nan if speed is None else speed)
+                self.heading.append(nan if heading is None else heading)
+                self.available.append(bool(available))
+                self.cell.append(cell)
+                self.kept_lat.append(0.0)
+                self.kept_lon.append(0.0)
+                self.kept_at.append(0.0)
+            self._slots[driver_id] = slot
+            members = self.cells.get(cell)
+            if members is None:
+                members = self.cells[cell] = set()
+            members.add(slot)
+            keep = True
+        else:
+            if at < self.at[slot]:
+                return None
+            old = self.cell[slot]
+            if old != cell:
+                members = self.cells[old]
+                members.discard(slot)
+                if not members:
+                    del self.cells[old]
+                members = self.cells.get(cell)
+                if members is None:
+                    members = self.cells[cell] = set()
+                members.add(slot)
+                self.cell[slot] = cell
+            keep = (trip_id != self.trips[slot] or at - self.kept_at[slot] >= self.track_interval
+                    or self.distance(lat, lon, self.kept_lat[slot], self.kept_lon[slot]) >= self.track_meters)
+            self.lat[slot], self.lon[slot], self.at[slot] = lat, lon, at
+            self.speed[slot] = nan if speed is None else speed
+            self.heading[slot] = nan if heading is None else heading
+            self.available[slot] = bool(available)
+            self.trips[slot] = trip_id
+        if not keep:
+            return False
+        self.kept_lat[slot], self.kept_lon[slot], self.kept_at[slot] = lat, lon, at
+        return {"driver_id": driver_id, "trip_id": trip_id, "recorded_at": _iso(at), "lat": lat, "lon": lon,
+                "speed": speed, "heading": heading}
+
+    @staticmethod
+    def distance(lat1, lon1, lat2, lon2):
+        """Meters between two nearby points (equirectangular)."""
+        x = (lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+        return math.hypot(x, lat2 - lat1) * METERS_PER_DEGREE
+
+    def remove(self, driver_id):
+        slot = self._slots.pop(driver_id, None)
+        if slot is None:
+            return
+        members = self.cells[self.cell[slot]]
+        members.discard(slot)
+        if not members:
+            del self.cells[self.cell[slot]]
+        self.ids[slot] = None
+        self.trips[slot] = None
+        self._free.append(slot)
+
+    def sweep(self, now):
+        """Drops drivers whose last ping is older than stale_after; returns how many."""
+        cutoff = now - self.stale_after
+        at = self.at
+        stale = [self.ids[slot] for slot in self._slots.values() if at[slot] < cutoff]
+        for driver_id in stale:
+            self.remove(driver_id)
+        return len(stale)
+
+    def position(self, slot, distance=None):
+        speed, heading = self.speed[slot], self.heading[slot]
+        return {"driver_id": self.ids[slot], "lat": self.lat[slot], "lon": self.lon[slot],
+                "at": _iso(self.at[slot]), "available": bool(self.available[slot]), "trip_id": self.trips[slot],
+                "speed": None if speed != speed else speed, "heading": None if heading != heading else heading,
+                **({"distance_m": round(distance, 1)} if distance is not None else {})}
+
+    def get(self, driver_id, now):
+        slot = self._slots.get(driver_id)
+        if slot is None or self.at[slot] < now - self.stale_after:
+            return None
+        return self.position(slot)
+
+    def _scan(self, key, lat, lon, kx, cutoff, available_only, visit):
+        members = self.cells.get(key)
+        if not members:
+            return
+        lats, lons, ats, avail = self.lat, self.lon, self.at, self.available
+        for slot in members:
+            if ats[slot] < cutoff or (available_only and not avail[slot]):
+                continue
+            visit(math.hypot((lons[slot] - lon) * kx, lats[slot] - lat) * METERS_PER_DEGREE, slot)
+
+    def within(self, lat, lon, radius_m, limit, now, available_only=True):
+        """Drivers within radius_m of (lat, lon), nearest first: [(meters, slot)]."""
+        kx = math.cos(math.radians(lat))
+        dlat = radius_m / METERS_PER_DEGREE
+        dlon = dlat / max(kx, 1e-6)
+        found = []
+        append = found.append
+
+        def visit(d, slot):
+            if d <= radius_m:
+                append((d, slot))
+
+        cutoff = now - self.stale_after
+        i0, i1 = int((lat - dlat + 90) / self.cell_deg), int((lat + dlat + 90) / self.cell_deg)
+        j0, j1 = int((lon - dlon + 180) / self.cell_deg), int((lon + dlon + 180) / self.cell_deg)
+        for i in range(i0, i1 + 1):
+            base = i * self._row
+            for j in range(j0, j1 + 1):
+                self._scan(base + j, lat, lon, kx, cutoff, available_only, visit)
+        return heapq.nsmallest(limit, found)
+
+    def nearest(self, lat, lon, k, max_radius_m, now, available_only=True):
+        """The k drivers nearest to (lat, lon) within max_radius_m, nearest first: [(meters, slot)]."""
+        kx = math.cos(math.radians(lat))
+        ci, cj = int((lat + 90) / self.cell_deg), int((lon + 180) / self.cell_deg)
+        # Smallest cell side in meters, and the distance from the point to its own cell's edges:
+        # nothing in ring r (cells r steps away) is closer than edge + (r - 1) * side
+        side = self.cell_m * min(1.0, kx)
+        fi = (lat + 90) / self.cell_deg - ci
+        fj = (lon + 180) / self.cell_deg - cj
+        edge = min(min(fi, 1 - fi) * self.cell_m, min(fj, 1 - fj) * self.cell_m * kx)
+        best = []  # max-heap of (-meters, slot)
+
+        def visit(d, slot):
+            if d > max_radius_m:
+                return
+            if len(best) < k:
+                heapq.heappush(best, (-d, slot))
+            elif d < -best[0][0]:
+                heapq.heapreplace(best, (-d, slot))
+
+        cutoff = now - self.stale_after
+        scan, row = self._scan, self._row
+        ring = 0
+        while True:
+            bound = edge + (ring - 1) * side if ring else 0.0
+            if bound > max_radius_m or (len(best) == k and bound > -best[0][0]):
+                break
+            if ring == 0:
+                scan(ci * row + cj, lat, lon, kx, cutoff, available_only, visit)
+            else:
+                for j in range(cj - ring, cj + ring + 1):
+                    scan((ci - ring) * row + j, lat, lon, kx, cutoff, available_only, visit)
+                    scan((ci + ring) * row + j, lat, lon, kx, cutoff, available_only, visit)
+                for i in range(ci - ring + 1, ci + ring):
+                    scan(i * row + cj - ring, lat, lon, kx, cutoff, available_only, visit)
+                    scan(i * row + cj + ring, lat, lon, kx, cutoff, available_only, visit)
+            ring += 1
+        return sorted((-d, slot) for d, slot in best)
+
+
+class DriverLocations:
+    """
+    Ingests driver pings into the DriverIndex and writes their downsampled
+    tracks to driver_tracks from a background task: one insert per
+    DRIVER_TRACK_BATCH_SIZE points, every DRIVER_TRACK_FLUSH_MS, like the
+    chat history writer. Failed writes are retried on the next flush. The
+    same loop drops drivers that went quiet. The index belongs to the worker
+    that receives the pings, so with several workers send a region's pings
+    and queries to the same one. Nothing is written until start() gives it
+    a client.
+    """
+    def __init__(self, index=None, batch_size=DRIVER_TRACK_BATCH_SIZE, flush_interval=DRIVER_TRACK_FLUSH_MS / 1000,
+                 max_pending=DRIVER_TRACK_MAX_PENDING, clock=time.time):
+        self.index = index if index is not None else DriverIndex()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.clock = clock
+        self.client = None
+        self._pending = []
+        self._wake = None
+        self._flushing = None
+        self._task = None
+        # Called with (driver_id, lat, lon, at) for every applied ping, in order
+        self.watchers = []
+        self.counters = {"pings": 0, "ignored": 0, "kept": 0, "written": 0, "batches": 0, "failures": 0,
+                         "dropped": 0, "expired": 0}
+
+    def start(self, client):
+        """Starts the flush loop on the running event loop."""
+        self.client = client
+        self._wake = asyncio.Event()
+        self._flushing = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the loop and writes whatever is still waiting."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.client:
+            await self.flush()
+
+    def ingest(self, pings):
+        """
+        pings: objects with driver_id, lat, lon, at (Unix seconds or None:
+        now), available, trip_id, speed, heading. Returns (applied, ignored):
+        pings older than the driver's position, or already stale, are ignored.
+        """
+        now = self.clock()
+        update = self.index.update
+        cutoff = now - self.index.stale_after
+        pending = self._pending
+        tracking = self.client is not None
+        watchers = self.watchers
+        applied = 0
+        for p in pings:
+            at = p.at
+            if at is None or at > now + _CLOCK_SKEW:
+                at = now
+            elif at < cutoff:
+                continue
+            row = update(p.driver_id, p.lat, p.lon, at, p.available, p.trip_id, p.speed, p.heading)
+            if row is None:
+                continue
+            applied += 1
+            if row and tracking:
+                pending.append(row)
+            for watch in watchers:
+                watch(p.driver_id, p.lat, p.lon, at)
+        ignored = len(pings) - applied
+        self.counters["pings"] += len(pings)
+        self.counters["ignored"] += ignored
+        if tracking:
+            overflow = len(pending) - self.max_pending
+            if overflow > 0:
+                del pending[:overflow]
+                self.counters["dropped"] += overflow
+            if len(pending) >= self.batch_size:
+                self._wake.set()
+        return applied, ignored
+
+    def nearby(self, lat, lon, radius_m, limit, available_only=True):
+        index = self.index
+        return [index.position(slot, d) for d, slot in index.within(lat, lon, radius_m, limit, self.clock(), available_only)]
+
+    def nearest(self, lat, lon, k, max_radius_m, available_only=True):
+        index = self.index
+        return [index.position(slot, d) for d, slot in index.nearest(lat, lon, k, max_radius_m, self.clock(), available_only)]
+
+    def position(self, driver_id):
+        return self.index.get(driver_id, self.clock())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            self.counters["expired"] += self.index.sweep(self.clock())
+            try:
+                # Shielded: stop() cancelling the loop mustn't lose the points being written
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                print(f"Driver track flush failed: {e}")
+
+    async def flush(self):
+        async with self._flushing:
+            rows, self._pending = self._pending, []
+            written = 0
+            try:
+                for i in range(0, len(rows), self.batch_size):
+                    batch = rows[i:i + self.batch_size]
+                    # A batch retried after a lost response can repeat points; readers don't mind
+                    response = await self.client.table("driver_tracks").insert(batch).execute()
+                    if response.status_code is None or response.status_code >= 400:
+                        raise RuntimeError(f"driver_tracks write failed with status {response.status_code}")
+                    written += len(batch)
+                    self.counters["written"] += len(batch)
+                    self.counters["batches"] += 1
+            except Exception as e:
+                self.counters["failures"] += 1
+                print(f"Driver track write failed, will retry: {e}")
+                self._pending[:0] = rows[written:]
+
+    def info(self):
+        return {"drivers": len(self.index), "cells": len(self.index.cells), "cell_m": self.index.cell_m,
+                "tracking": self.client is not None, "pending": len(self._pending), **self.counters}
+
+
+driver_locations = DriverLocations()
@@ -0,0 +1,410 @@
+import os
+import math
+import time
+import uuid
+import heapq
+import asyncio
+import datetime
+
+from app.services import ledger
+
+# How long a completed trip's fares stay held, so a passenger can still dispute
+ESCROW_DISPUTE_WINDOW = float(os.getenv("ESCROW_DISPUTE_WINDOW", str(24 * 3600)))
+# Holds settled per write (one settle_escrow_holds call, one database transaction)
+ESCROW_SETTLE_BATCH = int(os.getenv("ESCROW_SETTLE_BATCH", "500"))
+# Due times are rounded up to a multiple of this: everything due within one tick
+# settles together, in as few writes as the batch size allows
+ESCROW_TICK = float(os.getenv("ESCROW_TICK", "60"))
+# A failed settlement is tried again this much later
+ESCROW_RETRY = float(os.getenv("ESCROW_RETRY", "30"))
+# The scheduler looks at the database at least this often, for trips completed
+# through another API instance
+ESCROW_MAX_SLEEP = float(os.getenv("ESCROW_MAX_SLEEP", "300"))
+
+HOLD_COLUMNS = "id,booking_id,trip_id,payer_id,driver_id,amount_cents,funded_by,status,settle_as,release_at"
+OUTCOMES = {"release": "released", "refund": "refunded"}
+
+
+class EscrowError(Exception):
+    pass
+
+
+class HoldNotFound(EscrowError):
+    pass
+
+
+class HoldConflict(EscrowError):
+    """The hold isn't in a state that allows this (already settled, not disputed, ...)."""
+
+
+def _iso(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat(timespec="microseconds")
+
+
+def _epoch(value):
+    return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+def _check(response, what):
+    if response.status_code is None or response.status_code >= 400:
+        raise RuntimeError(f"{what} failed with status {response.status_code}: {response.error}")
+    return response.data
+
+
+def hold_id(booking_id):
+    """A booking's hold id (and its escrow_hold transaction id): a retried booking opens it once."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"escrow:{booking_id}"))
+
+
+def opening(booking, driver_id, now):
+    """The open_escrow_holds element for a booking row (book_seats), or None if it's free."""
+    amount = ledger.to_cents(booking.get("total_price") or 0)
+    if amount <= 0:
+        return None
+    id_ = hold_id(booking["id"])
+    posting = ledger.escrow_hold(booking["user_id"], driver_id, booking["trip_id"], amount, reference=booking["id"],
+                                 transaction_id=id_, created_at=_iso(now), status="pending")
+    return {
+        "hold": {"id": id_, "booking_id": booking["id"], "trip_id": booking["trip_id"],
+                 "payer_id": booking["user_id"], "driver_id": driver_id, "amount_cents": amount, "funded_by": "card"},
+        "transaction": posting.transaction, "entries": posting.entries, "month": posting.params()["p_month"],
+    }
+
+
+def settlement(hold, outcome, now):
+    """
+    The settle_escrow_holds element that releases a hold to the driver or
+    refunds it to the payer. Its transaction id comes from the hold, so a
+    retried batch posts each settlement once.
+    """
+    args = (hold["payer_id"], hold["driver_id"], hold["trip_id"], int(hold["amount_cents"]))
+    kwargs = {"transaction_id": str(uuid.uuid5(uuid.UUID(hold["id"]), outcome)), "created_at": _iso(now),
+              "reference": hold.get("booking_id")}
+    if outcome == "release":
+        posting = ledger.escrow_release(*args, **kwargs)
+    elif outcome == "refund":
+        posting = ledger.escrow_refund(*args, refund_to=hold.get("funded_by") or "card", **kwargs)
+    else:
+        raise ValueError(f"outcome must be one of {', '.join(OUTCOMES)}")
+    return {"hold_id": hold["id"], "from": hold["status"], "status": OUTCOMES[outcome],
+            "transaction": posting.transaction, "entries": posting.entries, "month": posting.params()["p_month"]}
+
+
+class EscrowStore:
+    """The escrow_holds table (add_escrow.sql): what is held, and what is due when."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def trip(self, trip_id):
+        """The trip's driver (user_id), status and status_updated_at, or None."""
+        response = await self.client.table("trips").select("user_id,status,status_updated_at") \
+            .eq("id", trip_id).execute()
+        rows = _check(response, "trip query") or []
+        return rows[0] if rows else None
+
+    async def bookings(self, booking_ids):
+        """The bookings' rows as opening() needs them, with their payment_status."""
+        response = await self.client.table("bookings").select("id,user_id,trip_id,total_price,payment_status") \
+            .in_("id", list(booking_ids)).execute()
+        return _check(response, "bookings query") or []
+
+    async def open(self, holds):
+        """Opens holds (see opening()) in one transaction; returns how many were new."""
+        response = await self.client.rpc("open_escrow_holds", {"p_holds": holds}).execute()
+        return _check(response, "opening escrow holds") or 0
+
+    async def schedule_trip(self, trip_id, release_at, settle_as):
+        """
+        Sets when, and how, a trip's held fares settle, for the holds not
+        scheduled yet: a repeated status update leaves the first one's due
+        time (and dispute window) alone. Returns how many holds that covers.
+        """
+        response = await self.client.table("escrow_holds") \
+            .update({"release_at": _iso(release_at), "settle_as": settle_as}) \
+            .eq("trip_id", trip_id).eq("status", "held").is_("settle_as", "null").execute()
+        return len(_check(response, "scheduling escrow holds") or [])
+
+    async def schedule_bookings(self, booking_ids, release_at, settle_as):
+        """Sets when, and how, the held fares of some bookings settle. Returns how many holds that covers."""
+        response = await self.client.table("escrow_holds") \
+            .update({"release_at": _iso(release_at), "settle_as": settle_as}) \
+            .in_("booking_id", list(booking_ids)).eq("status", "held").execute()
+        return len(_check(response, "scheduling escrow holds") or [])
+
+    async def due(self, now, limit):
+        """Held fares due by `now`, oldest first (escrow_holds_due_idx)."""
+        response = await self.client.table("escrow_holds").select(HOLD_COLUMNS).eq("status", "held") \
+            .lte("release_at", _iso(now)).order("release_at").order("id").limit(limit).execute()
+        return _check(response, "due escrow holds query") or []
+
+    async def next_release(self, after):
+        """When the next held fare after `after` is due (a timestamp), or None."""
+        response = await self.client.table("escrow_holds").select("release_at").eq("status", "held") \
+            .gt("release_at", _iso(after)).order("release_at").limit(1).execute()
+        rows = _check(response, "next escrow release query") or []
+        return _epoch(rows[0]["release_at"]) if rows else None
+
+    async def get(self, id_):
+        response = await self.client.table("escrow_holds").select(HOLD_COLUMNS).eq("id", id_).execute()
+        rows = _check(response, "escrow hold query") or []
+        return rows[0] if rows else None
+
+    async def dispute(self, id_, reason):
+        """Marks a held fare disputed; False if it was settled or disputed meanwhile."""
+        response = await self.client.table("escrow_holds").update({"status": "disputed", "dispute_reason": reason}) \
+            .eq("id", id_).eq("status", "held").execute()
+        return bool(_check(response, "disputing escrow hold"))
+
+    async def settle(self, settlements):
+        """Settles holds (see settlement()) in one transaction; returns the ids it settled."""
+        response = await self.client.rpc("settle_escrow_holds", {"p_settlements": settlements}).execute()
+        rows = _check(response, "settling escrow holds") or []
+        return [row if isinstance(row, str) else next(iter(row.values())) for row in rows]
+
+
+class EscrowScheduler:
+    """
+    Settles trip fares held in escrow when they are due, instead of a nightly
+    scan of every booking:
+
+    - a booking's fare is held once its card payment has gone through and
+      covers it (payments_settled, from the payment verification workers);
+      a payment that fails refunds whatever is still held for its bookings.
+      Fares paid after their trip finished are scheduled right away
+    - completing a trip makes its holds due dispute_window later, to be
+      released to the driver less the platform fee; cancelling it makes them
+      due now, to be refunded (trip_completed / trip_cancelled). The due time
+      and outcome are written to the holds, so they survive a restart
+    - a priority queue of due times, rounded up to the tick like the slots of
+      a timer wheel, wakes the scheduler; it then settles everything due,
+      batch_size holds per database write, so the trips of one tick share
+      their writes. After each run it asks the database for the next due
+      time, which picks up holds scheduled before a restart or by another
+      API instance
+    - a disputed hold is skipped until resolve() releases or refunds it
+
+    Settling checks each hold's status in the same transaction that posts
+    its ledger entries, so two instances racing for a batch settle every hold
+    once. `clock` returns epoch seconds; the bench drives it by hand.
+    """
+    def __init__(self, store=None, clock=time.time, dispute_window=ESCROW_DISPUTE_WINDOW,
+                 batch_size=ESCROW_SETTLE_BATCH, tick=ESCROW_TICK, retry=ESCROW_RETRY):
+        self.store = store
+        self.clock = clock
+        self.dispute_window = dispute_window
+        self.batch_size = batch_size
+        self.tick = tick
+        self.retry = retry
+        self._heap = []      # due times, each once
+        self._queued = set()
+        self._wake = None
+        self._task = None
+        self.counters = {"opened": 0, "scheduled_trips": 0, "released": 0, "refunded": 0, "disputed": 0,
+                         "runs": 0, "settle_writes": 0, "settle_failures": 0}
+
+    # --- the priority queue ---
+
+    def schedule(self, due):
+        """Wakes the scheduler at `due` (rounded up to the tick) to settle whatever is due by then."""
+        if self.tick:
+            due = math.ceil(due / self.tick) * self.tick
+        if due in self._queued:
+            return
+        self._queued.add(due)
+        heapq.heappush(self._heap, due)
+        if self._wake is not None and self._heap[0] == due:
+            self._wake.set()
+
+    def next_due(self):
+        """The earliest due time queued, or None."""
+        return self._heap[0] if self._heap else None
+
+    def _pop_due(self, now):
+        count = 0
+        while self._heap and self._heap[0] <= now:
+            self._queued.discard(heapq.heappop(self._heap))
+            count += 1
+        return count
+
+    # --- trip lifecycle (called by the endpoints) ---
+
+    async def open_holds(self, trip_id, bookings):
+        """
+        Holds the fares of paid bookings of a trip. Returns how many holds were
+        opened. A payment can come through after its trip has finished: the
+        trip's status is read again once the holds exist, and if it was
+        completed or cancelled they are scheduled as that would have (a trip
+        finishing in between schedules them itself).
+        """
+        trip = await self.store.trip(trip_id)
+        driver_id = trip and trip.get("user_id")
+        if not driver_id:
+            # Seeded trips have no driver account to pay out to
+            return 0
+        now = self.clock()
+        holds = [h for h in (opening(b, driver_id, now) for b in bookings) if h is not None]
+        if not holds:
+            return 0
+        opened = await self.store.open(holds)
+        self.counters["opened"] += opened
+        trip = await self.store.trip(trip_id) or {}
+        if trip.get("status") == "completed":
+            finished = trip.get("status_updated_at")
+            await self.trip_completed(trip_id, _epoch(finished) if finished else None)
+        elif trip.get("status") == "cancelled":
+            await self.trip_cancelled(trip_id)
+        return opened
+
+    async def payments_settled(self, succeeded=(), failed=()):
+        """
+        Called with the booking ids of payments that just got their result.
+        Bookings the payment made "paid" (add_payments.sql) have their fares
+        held; bookings of a failed payment that aren't paid have anything
+        held for them refunded. Idempotent, so a retried job can call it again.
+        """
+        if self.store is None:
+            raise RuntimeError("the escrow scheduler isn't running")
+        booking_ids = set(succeeded) | set(failed)
+        if not booking_ids:
+            return 0
+        rows = await self.store.bookings(booking_ids)
+        paid = {}
+        for row in rows:
+            if row["id"] in succeeded and row.get("payment_status") == "paid":
+                paid.setdefault(row["trip_id"], []).append(row)
+        opened = 0
+        for trip_id, bookings in paid.items():
+            opened += await self.open_holds(trip_id, bookings)
+        unpaid = [row["id"] for row in rows if row["id"] in failed and row.get("payment_status") != "paid"]
+        if unpaid:
+            now = self.clock()
+            if await self.store.schedule_bookings(unpaid, now, "refund"):
+                self.schedule(now)
+        return opened
+
+    async def trip_completed(self, trip_id, completed_at=None):
+        """
+        Releases the trip's held fares once the dispute window has passed.
+        Only holds not scheduled yet, so completing it again changes nothing.
+        """
+        release_at = (self.clock() if completed_at is None else completed_at) + self.dispute_window
+        if await self.store.schedule_trip(trip_id, release_at, "release"):
+            self.counters["scheduled_trips"] += 1
+            self.schedule(release_at)
+
+    async def trip_cancelled(self, trip_id):
+        """
+        Refunds the trip's held fares (on the scheduler's next run, which this
+        wakes). Fares already due to be released after completion stay so.
+        """
+        now = self.clock()
+        if await self.store.schedule_trip(trip_id, now, "refund"):
+            self.counters["scheduled_trips"] += 1
+            self.schedule(now)
+
+    async def dispute(self, id_, user_id=None, reason=None):
+        """Stops a hold from being released while it's looked into. Raises HoldNotFound / HoldConflict."""
+        hold = await self.store.get(id_)
+        if hold is None or (user_id is not None and user_id not in (hold["payer_id"], hold["driver_id"])):
+            raise HoldNotFound(f"escrow hold {id_} not found")
+        if hold["status"] != "held":
+            raise HoldConflict(f"escrow hold {id_} is already {hold['status']}")
+        if hold.get("settle_as") == "refund":
+            raise HoldConflict("the trip was cancelled; this fare is being refunded")
+        if hold.get("settle_as") == "release" and _epoch(hold["release_at"]) <= self.clock():
+            raise HoldConflict("the dispute window for this trip has closed")
+        if not await self.store.dispute(id_, reason):
+            raise HoldConflict(f"escrow hold {id_} was settled meanwhile")
+        self.counters["disputed"] += 1
+        return {**hold, "status": "disputed", "dispute_reason": reason}
+
+    async def resolve(self, id_, outcome):
+        """Settles a disputed hold now: outcome "release" or "refund"."""
+        if outcome not in OUTCOMES:
+            raise ValueError(f"outcome must be one of {', '.join(OUTCOMES)}")
+        hold = await self.store.get(id_)
+        if hold is None:
+            raise HoldNotFound(f"escrow hold {id_} not found")
+        if hold["status"] != "disputed":
+            raise HoldConflict(f"escrow hold {id_} is {hold['status']}, not disputed")
+        if not await self.store.settle([settlement(hold, outcome, self.clock())]):
+            raise HoldConflict(f"escrow hold {id_} was settled meanwhile")
+        self.counters[OUTCOMES[outcome]] += 1
+        return {**hold, "status": OUTCOMES[outcome]}
+
+    # --- settlement ---
+
+    async def run_due(self, now=None):
+        """
+        Settles every hold due by `now` (the clock by default) if anything
+        queued is due, batch_size holds per write, then queues the next due
+        time the database knows of. Returns how many holds were settled.
+        """
+        now = self.clock() if now is None else now
+        if not self._pop_due(now):
+            return 0
+        self.counters["runs"] += 1
+        settled = 0
+        try:
+            while True:
+                holds = await self.store.due(now, self.batch_size)
+                if not holds:
+                    break
+                outcomes = {h["id"]: OUTCOMES[h["settle_as"]] for h in holds}
+                ids = await self.store.settle([settlement(h, h["settle_as"], now) for h in holds])
+                self.counters["settle_writes"] += 1
+                for id_ in ids:
+                    self.counters[outcomes[id_]] += 1
+                settled += len(ids)
+                if len(holds) < self.batch_size or not ids:
+                    break
+            following = await self.store.next_release(now)
+            if following is not None:
+                self.schedule(following)
+        except Exception as e:
+            print(f"Escrow settlement failed, retrying in {self.retry:g}s: {e}")
+            self.counters["settle_failures"] += 1
+            self.schedule(now + self.retry)
+        return settled
+
+    def start(self, client):
+        """Starts settling on the running event loop; holds already due settle right away."""
+        self.store = EscrowStore(client)
+        self._wake = asyncio.Event()
+        self.schedule(self.clock())
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the scheduler. What was due stays due in the database for the next start."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Escrow scheduler error: {e}")
+            due = self.next_due()
+            wait = ESCROW_MAX_SLEEP + 1 if due is None else max(due - self.clock(), 0)
+            try:
+                await asyncio.wait_for(self._wake.wait(), min(wait, ESCROW_MAX_SLEEP))
+            except asyncio.TimeoutError:
+                if wait > ESCROW_MAX_SLEEP:
+                    # Nothing queued is due yet: look at the database anyway
+                    self.schedule(self.clock())
+            self._wake.clear()
+
+    def info(self):
+        due = self.next_due()
+        return {"running": self._task is not None, "dispute_window": self.dispute_window,
+                "batch_size": self.batch_size, "tick": self.tick, "queued": len(self._heap),
+                "next_due_in": None if due is None else round(max(due - self.clock(), 0), 3), **self.counters}
+
+
+escrow_scheduler = EscrowScheduler()
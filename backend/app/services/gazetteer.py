@@ -0,0 +1,286 @@
+import os
+import math
+import bisect
+import heapq
+import asyncio
+import threading
+from array import array
+from collections import Counter
+
+from app.services.trip_cache import normalize
+from app.services.pagination import keyset_filter
+
+GAZETTEER_REFRESH_SECONDS = float(os.getenv("GAZETTEER_REFRESH_SECONDS", "300"))
+GAZETTEER_PAGE_SIZE = 1000
+
+SUGGEST_LIMIT = 8
+# Prefix matches looked at (in key order) before ranking, so "a" stays cheap
+PREFIX_SCAN_LIMIT = 256
+# Typo matching: trigram Dice similarity threshold, candidates verified per query,
+# and how many postings (rarest trigrams first) are counted to find them
+FUZZY_MIN_SIMILARITY = 0.45
+FUZZY_CANDIDATES = 24
+FUZZY_POSTINGS_BUDGET = 2000
+
+# Local names and abbreviations people type -> the place(s) they mean
+ALIASES = {
+    "jozi": "johannesburg",
+    "joburg": "johannesburg",
+    "jhb": "johannesburg",
+    "jnb": "johannesburg",
+    "egoli": "johannesburg",
+    "cpt": "cape town",
+    "kaapstad": "cape town",
+    "mother city": "cape town",
+    "dbn": "durban",
+    "ethekwini": "durban",
+    "pta": "pretoria",
+    "tshwane": "pretoria",
+    "pmb": "pietermaritzburg",
+    "maritzburg": "pietermaritzburg",
+    "bloem": "bloemfontein",
+    "pe": ("gqeberha", "port elizabeth"),
+    "port elizabeth": "gqeberha",
+    "gqeberha": "port elizabeth",
+    "pietersburg": "polokwane",
+    "nelspruit": "mbombela",
+    "mbombela": "nelspruit",
+    "el": "east london",
+    "stellies": "stellenbosch",
+}
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _word_starts(key):
+    return [0] + [i + 1 for i, ch in enumerate(key) if ch == " "]
+
+
+class Gazetteer:
+    """
+    In-process index of place names for autocomplete:
+
+    - prefix index: sorted (suffix, id) pairs for every word start, so
+      "cape" and "town" both find "Cape Town" with one bisect (a trie
+      flattened into an array, far smaller than a node per character)
+    - trigram index: trigram -> ids, for typos ("johanesburg")
+    - alias table: "jozi", "jhb", ... -> canonical names
+
+    Names are ranked by how many trips use them. add_many() is incremental;
+    refresh() feeds it the trips created since the last refresh.
+    """
+    def __init__(self, aliases=None):
+        self._lock = threading.Lock()
+        self.names = []            # id -> display name
+        self.keys = []             # id -> normalized name
+        self.counts = array("I")   # id -> trips that start or end there
+        self._ids = {}             # normalized name -> id
+        # Prefix index as two parallel arrays (no per-entry tuples for the GC to walk):
+        self._suffixes = []        # sorted key[word_start:] for every word start
+        self._suffix_ids = array("I")
+        self._grams = {}           # trigram -> array of ids
+        self._short = {}           # results for 1-2 character queries, dropped on change
+        self.aliases = {}
+        for alias, targets in (ALIASES if aliases is None else aliases).items():
+            self.add_alias(alias, targets)
+        self.cursor = None         # (created_at, id) of the newest trip seen
+        self.ready = False
+
+    def add_alias(self, alias, targets):
+        if isinstance(targets, str):
+            targets = (targets,)
+        with self._lock:
+            self.aliases[normalize(alias)] = tuple(normalize(t) for t in targets)
+            self._short.clear()
+
+    def add_many(self, counts):
+        """counts: {place name: trips}. New names are indexed, known ones gain popularity."""
+        with self._lock:
+            added = []
+            for name, count in counts.items():
+                key = normalize(name)
+                if not key:
+                    continue
+                id_ = self._ids.get(key)
+                if id_ is not None:
+                    self.counts[id_] += count
+                    continue
+                id_ = len(self.keys)
+                self._ids[key] = id_
+                self.names.append(" ".join(str(name).split()))
+                self.keys.append(key)
+                self.counts.append(count)
+                added.extend((key[start:], id_) for start in _word_starts(key))
+                for gram in trigrams(key):
+                    postings = self._grams.get(gram)
+                    if postings is None:
+                        postings = self._grams[gram] = array("I")
+                    postings.append(id_)
+            if len(added) * 32 < len(self._suffixes):
+                for suffix, id_ in added:
+                    pos = bisect.bisect_right(self._suffixes, suffix)
+                    self._suffixes.insert(pos, suffix)
+                    self._suffix_ids.insert(pos, id_)
+            elif added:
+                # Bulk load: one sort beats many inserts
+                merged = list(zip(self._suffixes, self._suffix_ids))
+                merged.extend(added)
+                merged.sort()
+                self._suffixes = [s for s, _ in merged]
+                self._suffix_ids = array("I", (i for _, i in merged))
+            self._short.clear()
+
+    def add(self, name, count=1):
+        self.add_many({name: count})
+
+    def __len__(self):
+        return len(self.keys)
+
+    # --- lookups ---
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        """
+        Up to `limit` places for what the user typed so far:
+        [{"name": "Johannesburg", "match": "alias" | "prefix" | "fuzzy", "trips": 120}, ...]
+        """
+        q = normalize(query)
+        if not q:
+            return []
+        with self._lock:
+            short = len(q) <= 2
+            if short and (q, limit) in self._short:
+                return self._short[(q, limit)]
+
+            # Tiers: exact name/alias, name prefix, alias prefix, later-word prefix, typo
+            ranked = {}  # id -> (rank, match)
+
+            def offer(id_, rank, match):
+                if id_ not in ranked or rank < ranked[id_][0]:
+                    ranked[id_] = (rank, match)
+
+            for alias, targets in self.aliases.items():
+                if alias.startswith(q):
+                    for target in targets:
+                        id_ = self._ids.get(target)
+                        if id_ is not None:
+                            offer(id_, (0 if alias == q else 2, -self.counts[id_], target), "alias")
+
+            lo = bisect.bisect_left(self._suffixes, q)
+            hi = bisect.bisect_left(self._suffixes, q + "\U0010ffff", lo, min(len(self._suffixes), lo + PREFIX_SCAN_LIMIT))
+            keys, counts = self.keys, self.counts
+            # Rank cheaply first (name prefix before later word, then popularity), then
+            # build full ranks only for the few that can make the cut
+            ids = set(self._suffix_ids[lo:hi])
+            for id_ in heapq.nsmallest(limit, ids, key=lambda i: (not keys[i].startswith(q), -counts[i])):
+                key = keys[id_]
+                tier = 0 if key == q else (1 if key.startswith(q) else 3)
+                offer(id_, (tier, -counts[id_], key), "prefix")
+
+            # Typo matching is the fallback for input that matches nothing as typed
+            if not ranked and len(q) >= 3:
+                for id_, similarity in self._fuzzy(q, ranked):
+                    offer(id_, (4, -similarity, -self.counts[id_], self.keys[id_]), "fuzzy")
+
+            best = sorted(ranked.items(), key=lambda item: item[1][0])[:limit]
+            result = [{"name": self.names[id_], "match": match, "trips": self.counts[id_]}
+                      for id_, (_, match) in best]
+            if short:
+                self._short[(q, limit)] = result
+            return result
+
+    def resolve(self, phrase):
+        """Display name of the place `phrase` names exactly (or through an alias), else None."""
+        key = normalize(phrase)
+        with self._lock:
+            id_ = self._ids.get(key)
+            for target in self.aliases.get(key, ()) if id_ is None else ():
+                id_ = self._ids.get(target)
+                if id_ is not None:
+                    break
+            return self.names[id_] if id_ is not None else None
+
+    def _fuzzy(self, q, exclude):
+        grams = trigrams(q)
+        postings = sorted((self._grams[g] for g in grams if g in self._grams), key=len)
+        if not postings:
+            return []
+        # A name within the threshold shares at least `need` trigrams with the query,
+        # so it must appear in one of the m - need + 1 rarest lists (pigeonhole).
+        # Of those, only count the rarest ones up to the budget: common trigrams
+        # ("  s", "on ") say little and would dominate the cost.
+        need = max(1, math.ceil(FUZZY_MIN_SIMILARITY * len(grams) / 2))
+        hits, counted, lists = Counter(), 0, 0
+        for p in postings[:max(1, len(grams) - need + 1)]:
+            if counted and counted + len(p) > FUZZY_POSTINGS_BUDGET:
+                break
+            hits.update(p[:FUZZY_POSTINGS_BUDGET])
+            counted += len(p)
+            lists += 1
+        # Names sharing a single trigram are noise whenever several lists were counted
+        floor = 2 if lists > 1 else 1
+        pool = [(n, id_) for id_, n in hits.items() if n >= floor]
+        matches = []
+        for _, id_ in heapq.nlargest(FUZZY_CANDIDATES, pool):
+            if id_ in exclude:
+                continue
+            other = trigrams(self.keys[id_])
+            similarity = 2 * len(grams & other) / (len(grams) + len(other))
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                matches.append((id_, round(similarity, 3)))
+        return matches
+
+    def info(self):
+        with self._lock:
+            return {"names": len(self.keys), "aliases": len(self.aliases), "ready": self.ready,
+                    "synced_through": self.cursor[0] if self.cursor else None}
+
+    # --- loading from the trips table ---
+
+    async def refresh(self, client):
+        """
+        Indexes the origins/destinations of trips created since the last call
+        (all trips on the first one), paging by (created_at, id). Places that
+        disappear from the table stay suggestible until the next restart.
+        """
+        seen = 0
+        while True:
+            query = client.table("trips").select("id,origin,destination,created_at") \
+                .order("created_at").order("id").limit(GAZETTEER_PAGE_SIZE)
+            if self.cursor:
+                query = query.or_(keyset_filter(("created_at", "id"), self.cursor))
+            response = await query.execute()
+            if response.status_code is None or response.status_code >= 400:
+                raise RuntimeError(f"trips query failed with status {response.status_code}")
+            rows = response.data or []
+            counts = Counter()
+            for row in rows:
+                for column in ("origin", "destination"):
+                    if row.get(column):
+                        counts[row[column]] += 1
+            if counts:
+                self.add_many(counts)
+            seen += len(rows)
+            if rows and rows[-1].get("created_at") is not None:
+                self.cursor = (rows[-1]["created_at"], rows[-1]["id"])
+            if len(rows) < GAZETTEER_PAGE_SIZE:
+                break
+        self.ready = True
+        return seen
+
+
+gazetteer = Gazetteer()
+
+
+async def keep_fresh(client, interval=GAZETTEER_REFRESH_SECONDS):
+    """Background task: initial build, then an incremental refresh every `interval` seconds."""
+    while True:
+        try:
+            added = await gazetteer.refresh(client)
+            if added:
+                print(f"Gazetteer indexed {added} trips ({len(gazetteer)} places).")
+        except Exception as e:
+            print(f"Gazetteer refresh failed: {e}")
+        await asyncio.sleep(interval)
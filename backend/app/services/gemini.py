@@ -7,7 +7,46 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 
-def chat_completion(messages: list, model: str = "gemini-1.5-flash", temperature: float = 0.7):
+DEFAULT_MODEL = "gemini-1.5-flash"
+
+
+def _start_chat(messages: list, model: str, temperature: float):
+    """
+    Converts standard [{role: 'user', content: '...'}, {role: 'assistant', content: '...'}]
+    messages to Gemini's format and opens a chat session over all but the latest one.
+    Returns (chat_session, latest_message), or (None, None) if there is no message to send.
+    """
+    # Extract the system prompt if present; it becomes the model's system_instruction
+    system_instruction = None
+    gemini_history = []
+
+    for msg in messages:
+        role = msg.get("role")
+        content = msg.get("content", "")
+
+        if role == "system":
+            system_instruction = content
+        elif role == "user":
+            gemini_history.append({"role": "user", "parts": [content]})
+        elif role == "assistant" or role == "model":
+            gemini_history.append({"role": "model", "parts": [content]})
+
+    if not gemini_history:
+        return None, None
+
+    # Built once per request, with the system instruction (None if there isn't one)
+    gen_model = genai.GenerativeModel(
+        model_name=model,
+        system_instruction=system_instruction,
+        generation_config=genai.GenerationConfig(temperature=temperature)
+    )
+
+    # The latest user message is passed to .send_message(), the rest is history
+    chat_session = gen_model.start_chat(history=gemini_history[:-1])
+    return chat_session, gemini_history[-1]["parts"][0]
+
+
+def chat_completion(messages: list, model: str = DEFAULT_MODEL, temperature: float = 0.7):
     """
     Calls the Gemini API using the given message history.
     """
@@ -15,51 +54,10 @@ def chat_completion(messages: list, model: str = "gemini-1.5-flash", temperature
         return {"error": "GEMINI_API_KEY is not configured", "content": "I am currently offline. Please configure my API key."}
 
     try:
-        # Initialize the generative model
-        # We use gemini-1.5-flash as the default fast and capable model
-        gen_model = genai.GenerativeModel(
-            model_name=model,
-            generation_config=genai.GenerationConfig(
-                temperature=temperature,
-            )
-        )
-        
-        # Convert standard [{role: 'user', content: '...'}, {role: 'assistant', content: '...'}] array 
-        # to Gemini's expected format. Also extract the system prompt if present.
-        system_instruction = None
-        gemini_history = []
-        
-        for msg in messages:
-            role = msg.get("role")
-            content = msg.get("content", "")
-            
-            if role == "system":
-                system_instruction = content
-            elif role == "user":
-                gemini_history.append({"role": "user", "parts": [content]})
-            elif role == "assistant" or role == "model":
-                gemini_history.append({"role": "model", "parts": [content]})
-        
-        # If we have a system instruction, we apply it. Note: For basic genai SDK we pass it as a system_instruction kwarg
-        # but to keep it simple across API versions, we can just prepend it to the first user message if needed.
-        # Alternatively, genai.GenerativeModel supports system_instruction directly in recent versions:
-        if system_instruction:
-             gen_model = genai.GenerativeModel(
-                 model_name=model,
-                 system_instruction=system_instruction,
-                 generation_config=genai.GenerationConfig(temperature=temperature)
-             )
-
-        # Remove the latest user message from the history to pass it to .send_message()
-        if not gemini_history:
+        chat_session, latest_message = _start_chat(messages, model, temperature)
+        if chat_session is None:
              return {"error": "No messages provided"}
-             
-        latest_message = gemini_history[-1]["parts"][0]
-        history = gemini_history[:-1]
 
-        # Start a chat session with the formatted history
-        chat_session = gen_model.start_chat(history=history)
-        
         # Send the latest message
         response = chat_session.send_message(latest_message)
 
@@ -71,3 +69,43 @@ def chat_completion(messages: list, model: str = "gemini-1.5-flash", temperature
     except Exception as e:
         print(f"Gemini API Error: {str(e)}")
         return {"error": str(e), "content": "Sorry, I encountered an error connecting to my brain."}
+
+
+def is_configured():
+    return bool(GEMINI_API_KEY)
+
+
+def complete(messages: list, model: str = DEFAULT_MODEL, temperature: float = 0.7, timeout: float = None):
+    """
+    The reply text, raising on any failure (for the LLM gateway, which handles
+    fallbacks). `timeout` bounds the API call in seconds; the SDK has none by default.
+    """
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY is not configured")
+
+    chat_session, latest_message = _start_chat(messages, model, temperature)
+    if chat_session is None:
+        raise ValueError("No messages provided")
+
+    response = chat_session.send_message(latest_message, request_options={"timeout": timeout} if timeout else None)
+    return response.text
+
+
+def stream_chat(messages: list, model: str = DEFAULT_MODEL, temperature: float = 0.7, timeout: float = None):
+    """
+    Like chat_completion, but yields the reply in chunks as Gemini generates it.
+    Errors are raised rather than returned, since part of the reply may already be out.
+    `timeout` bounds the whole streamed call in seconds.
+    """
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY is not configured")
+
+    chat_session, latest_message = _start_chat(messages, model, temperature)
+    if chat_session is None:
+        raise ValueError("No messages provided")
+
+    options = {"timeout": timeout} if timeout else None
+    for chunk in chat_session.send_message(latest_message, stream=True, request_options=options):
+        # Chunks without text parts (e.g. only a finish reason) have nothing to forward
+        if chunk.parts:
+            yield chunk.text
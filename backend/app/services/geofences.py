@@ -0,0 +1,435 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import datetime
+
+from app.services.driver_locations import METERS_PER_DEGREE
+from app.services.metrics import parse_timestamp
+from app.services.pagination import keyset_filter
+
+# Cell side of the fence grid; a ping reads the one cell it falls in
+GEOFENCE_CELL_M = float(os.getenv("GEOFENCE_CELL_M", "250"))
+# Pickup zone radius for trips that don't set pickup_radius_m
+GEOFENCE_RADIUS_M = float(os.getenv("GEOFENCE_RADIUS_M", "150"))
+# A driver in the zone has left only once this far outside it, so GPS jitter
+# at the edge doesn't read as leaving and arriving again
+GEOFENCE_EXIT_MARGIN_M = float(os.getenv("GEOFENCE_EXIT_MARGIN_M", "30"))
+# "waited N minutes" every this many minutes in the zone
+GEOFENCE_WAIT_STEP_MINUTES = int(os.getenv("GEOFENCE_WAIT_STEP_MINUTES", "5"))
+# A trip's pickup zone is watched from this long before its departure until
+# this long after, or until the trip starts, completes or is cancelled
+GEOFENCE_OPEN_BEFORE = float(os.getenv("GEOFENCE_OPEN_BEFORE", "3600"))
+GEOFENCE_OPEN_AFTER = float(os.getenv("GEOFENCE_OPEN_AFTER", "3600"))
+# How often trips departing soon are loaded, and events written
+GEOFENCE_REFRESH = float(os.getenv("GEOFENCE_REFRESH", "60"))
+GEOFENCE_FLUSH_MS = float(os.getenv("GEOFENCE_FLUSH_MS", "1000"))
+GEOFENCE_MAX_PENDING = int(os.getenv("GEOFENCE_MAX_PENDING", "100000"))
+
+FENCE_COLUMNS = "id,user_id,status,departs_at,pickup_lat,pickup_lon,pickup_radius_m"
+# Trips whose pickup is over (no zone to watch)
+CLOSED_STATUSES = ("in_progress", "completed", "cancelled")
+EVENT_BATCH_SIZE = 1000
+_PAGE_SIZE = 1000
+
+
+def _iso(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).isoformat()
+
+
+def _epoch(value):
+    parsed = parse_timestamp(value)
+    return parsed.replace(tzinfo=datetime.timezone.utc).timestamp() if parsed else None
+
+
+class Fence:
+    """A trip's pickup zone, and whether its driver is in it."""
+    __slots__ = ("trip_id", "driver_id", "lat", "lon", "kx", "radius", "opens", "closes", "cells",
+                 "inside_since", "waited")
+
+    def __init__(self, trip_id, driver_id, lat, lon, radius, opens, closes):
+        self.trip_id = trip_id
+        self.driver_id = driver_id
+        self.lat = lat
+        self.lon = lon
+        self.kx = math.cos(math.radians(lat))  # degrees of longitude to degrees of latitude, here
+        self.radius = radius
+        self.opens = opens
+        self.closes = closes
+        self.cells = ()
+        self.inside_since = None  # time of the ping that arrived
+        self.waited = 0           # minutes of the last "waited" event
+
+
+class GeofenceEngine:
+    """
+    Evaluates driver pings against the pickup zones of their trips.
+
+    Only a trip's driver can arrive at its pickup, so fences are indexed by
+    driver, each driver's in a grid of `cell_m` cells: a fence is registered
+    in every cell its circle (plus the exit margin) touches, and a ping
+    reads its driver's one cell, i.e. only fences it could be in, however
+    crowded the pickup points; a driver with no trip due costs a lookup. Per
+    fence the driver is outside or inside: entering the radius emits
+    "arrived", each `wait_step` minutes inside emits "waited", and going
+    more than `margin` beyond the radius emits "left" (with the minutes
+    spent). Events are timed by the pings, so a replay of stored pings
+    gives the same timeline. Call from one thread (the event loop).
+    """
+    def __init__(self, cell_m=GEOFENCE_CELL_M, margin=GEOFENCE_EXIT_MARGIN_M, wait_step=GEOFENCE_WAIT_STEP_MINUTES):
+        self.cell_m = cell_m
+        self.cell_deg = cell_m / METERS_PER_DEGREE
+        self._row = int(math.ceil(360 / self.cell_deg)) + 1
+        self.margin = margin
+        self.wait_step = wait_step
+        self.fences = {}     # trip id -> Fence
+        self.cells = {}      # driver id -> {cell key -> list of Fences}
+        self._inside = {}    # driver id -> set of Fences the driver is in
+        self._closing = []   # heap of (closes, seq, Fence), for expire()
+        self._seq = 0
+        self.events = []     # (Fence, kind, at, lat, lon, distance, minutes), rows made by take()
+        self.counters = {"pings": 0, "checked": 0, "arrived": 0, "waited": 0, "left": 0}
+
+    def __len__(self):
+        return len(self.fences)
+
+    def add(self, trip_id, driver_id, lat, lon, radius, opens, closes):
+        """Watches a trip's pickup zone from `opens` to `closes` (Unix times). Re-adding keeps its state."""
+        fence = self.fences.get(trip_id)
+        if fence is not None and (fence.driver_id, fence.lat, fence.lon, fence.radius) == (driver_id, lat, lon, radius):
+            if fence.closes != closes:
+                self._schedule(fence, closes)
+            fence.opens = opens
+            return fence
+        if fence is not None:
+            self.remove(trip_id)
+        fence = Fence(trip_id, driver_id, lat, lon, radius, opens, closes)
+        reach = (radius + self.margin) / METERS_PER_DEGREE
+        reach_lon = reach / max(fence.kx, 1e-6)
+        i0, i1 = int((lat - reach + 90) / self.cell_deg), int((lat + reach + 90) / self.cell_deg)
+        j0, j1 = int((lon - reach_lon + 180) / self.cell_deg), int((lon + reach_lon + 180) / self.cell_deg)
+        fence.cells = tuple(i * self._row + j for i in range(i0, i1 + 1) for j in range(j0, j1 + 1))
+        grid = self.cells.setdefault(driver_id, {})
+        for key in fence.cells:
+            grid.setdefault(key, []).append(fence)
+        self.fences[trip_id] = fence
+        self._schedule(fence, closes)
+        return fence
+
+    def _schedule(self, fence, closes):
+        # The old heap entry goes stale: expire() skips entries that no longer match
+        fence.closes = closes
+        self._seq += 1
+        heapq.heappush(self._closing, (closes, self._seq, fence))
+
+    def remove(self, trip_id):
+        """Stops watching a trip's pickup zone (no event)."""
+        fence = self.fences.pop(trip_id, None)
+        if fence is None:
+            return
+        grid = self.cells[fence.driver_id]
+        for key in fence.cells:
+            members = grid[key]
+            members.remove(fence)
+            if not members:
+                del grid[key]
+        if not grid:
+            del self.cells[fence.driver_id]
+        if fence.inside_since is not None:
+            inside = self._inside.get(fence.driver_id)
+            if inside is not None:
+                inside.discard(fence)
+                if not inside:
+                    del self._inside[fence.driver_id]
+
+    def expire(self, now):
+        """Drops fences whose window has closed; returns how many."""
+        closing, expired = self._closing, 0
+        while closing and closing[0][0] < now:
+            closes, _, fence = heapq.heappop(closing)
+            if fence.closes == closes and self.fences.get(fence.trip_id) is fence:
+                self.remove(fence.trip_id)
+                expired += 1
+        return expired
+
+    def observe(self, driver_id, lat, lon, at):
+        """Evaluates one ping (in time order per driver); emitted events go to self.events."""
+        self.counters["pings"] += 1
+        grid = self.cells.get(driver_id)
+        if grid is None:
+            return
+        cell_deg = self.cell_deg
+        members = grid.get(int((lat + 90) / cell_deg) * self._row + int((lon + 180) / cell_deg))
+        inside = self._inside.get(driver_id)
+        evaluated = ()
+        if inside:
+            evaluated = tuple(inside)
+            for fence in evaluated:
+                self._evaluate(fence, lat, lon, at)
+        if members:
+            for fence in members:
+                # The fences the driver was in were evaluated above
+                if fence.inside_since is None and fence not in evaluated:
+                    self._evaluate(fence, lat, lon, at)
+
+    def _evaluate(self, fence, lat, lon, at):
+        if not fence.opens <= at <= fence.closes:
+            return
+        self.counters["checked"] += 1
+        distance = math.hypot((lon - fence.lon) * fence.kx, lat - fence.lat) * METERS_PER_DEGREE
+        if fence.inside_since is None:
+            if distance <= fence.radius:
+                fence.inside_since, fence.waited = at, 0
+                self._inside.setdefault(fence.driver_id, set()).add(fence)
+                self._emit(fence, "arrived", at, lat, lon, distance, 0)
+        elif distance > fence.radius + self.margin:
+            minutes = int((at - fence.inside_since) // 60)
+            fence.inside_since = None
+            inside = self._inside[fence.driver_id]
+            inside.discard(fence)
+            if not inside:
+                del self._inside[fence.driver_id]
+            self._emit(fence, "left", at, lat, lon, distance, minutes)
+        else:
+            minutes = int((at - fence.inside_since) // (self.wait_step * 60)) * self.wait_step
+            if minutes > fence.waited:
+                # Sparse pings can cross several steps at once; the latest one stands for them
+                fence.waited = minutes
+                self._emit(fence, "waited", at, lat, lon, distance, minutes)
+
+    def _emit(self, fence, kind, at, lat, lon, distance, minutes):
+        self.counters[kind] += 1
+        self.events.append((fence, kind, at, lat, lon, distance, minutes))
+
+    def take(self):
+        """The events emitted since the last call, as trip_events rows."""
+        events, self.events = self.events, []
+        return [{"trip_id": fence.trip_id, "driver_id": fence.driver_id, "kind": kind, "at": _iso(at),
+                 "minutes": minutes, "lat": lat, "lon": lon, "distance_m": round(distance, 1)}
+                for fence, kind, at, lat, lon, distance, minutes in events]
+
+    def info(self):
+        return {"fences": len(self.fences), "drivers": len(self.cells), "drivers_in_zones": len(self._inside),
+                "pending": len(self.events), **self.counters}
+
+
+def fence_window(departs_at, open_before=GEOFENCE_OPEN_BEFORE, open_after=GEOFENCE_OPEN_AFTER):
+    return departs_at - open_before, departs_at + open_after
+
+
+class PickupGeofences:
+    """
+    Keeps the engine's fences in step with the trips table and writes its
+    events to trip_events from a background task: every GEOFENCE_REFRESH
+    it loads the trips (with a pickup point and a driver) departing within
+    the watch window, and drops fences whose window has closed; events are
+    upserted every GEOFENCE_FLUSH_MS. The engine's observe() is one of
+    driver_locations' watchers.
+    """
+    def __init__(self, engine=None, refresh=GEOFENCE_REFRESH, flush_interval=GEOFENCE_FLUSH_MS / 1000,
+                 max_pending=GEOFENCE_MAX_PENDING, clock=time.time):
+        self.engine = engine if engine is not None else GeofenceEngine()
+        self.refresh = refresh
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.clock = clock
+        self.client = None
+        self._pending = []
+        self._task = None
+        self._loaded_at = 0.0
+        self.counters = {"loads": 0, "written": 0, "failures": 0, "dropped": 0, "expired": 0}
+
+    def start(self, client):
+        self.client = client
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.client:
+            await self.flush()
+
+    def watch_trip(self, trip):
+        """Adds (or updates) a trips row's pickup zone; False if it has none to watch."""
+        departs_at = _epoch(trip.get("departs_at"))
+        if (trip.get("pickup_lat") is None or trip.get("pickup_lon") is None or not trip.get("user_id")
+                or departs_at is None or trip.get("status") in CLOSED_STATUSES):
+            self.engine.remove(trip["id"])
+            return False
+        opens, closes = fence_window(departs_at)
+        self.engine.add(trip["id"], trip["user_id"], float(trip["pickup_lat"]), float(trip["pickup_lon"]),
+                        float(trip.get("pickup_radius_m") or GEOFENCE_RADIUS_M), opens, closes)
+        return True
+
+    def trip_status(self, trip_id, status):
+        """A trip that started, completed or was cancelled has no pickup left to watch."""
+        if status in CLOSED_STATUSES:
+            self.engine.remove(trip_id)
+
+    async def load(self, now):
+        """Watches every trip departing within the window (paged by departs_at, id); returns how many."""
+        # Departures up to one refresh past the window, so a fence is in place when it opens
+        since, until = _iso(now - GEOFENCE_OPEN_AFTER), _iso(now + GEOFENCE_OPEN_BEFORE + self.refresh)
+        watched, after = 0, None
+        while True:
+            query = self.client.table("trips").select(FENCE_COLUMNS).lte("departs_at", until) \
+                .gte("pickup_lat", -90)  # has a pickup point
+            if after is None:
+                query = query.gte("departs_at", since)
+            else:
+                query = query.or_(keyset_filter(("departs_at", "id"), after))
+            response = await query.order("departs_at").order("id").limit(_PAGE_SIZE).execute()
+            if response.status_code is None or response.status_code >= 400:
+                raise RuntimeError(f"trips query failed with status {response.status_code}")
+            rows = response.data or []
+            for trip in rows:
+                watched += self.watch_trip(trip)
+            if len(rows) < _PAGE_SIZE:
+                break
+            after = (rows[-1]["departs_at"], rows[-1]["id"])
+        self.counters["loads"] += 1
+        return watched
+
+    async def _run(self):
+        while True:
+            now = self.clock()
+            if now - self._loaded_at >= self.refresh:
+                self._loaded_at = now
+                try:
+                    self.counters["expired"] += self.engine.expire(now)
+                    await self.load(now)
+                except Exception as e:
+                    print(f"Pickup geofence refresh failed: {e}")
+            try:
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                print(f"Trip event flush failed: {e}")
+            await asyncio.sleep(self.flush_interval)
+
+    async def flush(self):
+        self._pending.extend(self.engine.take())
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.counters["dropped"] += overflow
+        rows, self._pending = self._pending, []
+        written = 0
+        try:
+            for i in range(0, len(rows), EVENT_BATCH_SIZE):
+                batch = rows[i:i + EVENT_BATCH_SIZE]
+                # Keyed by (trip, time, kind): a replayed or retried event isn't recorded twice
+                response = await self.client.table("trip_events").upsert(batch, on_conflict="trip_id,at,kind").execute()
+                if response.status_code is None or response.status_code >= 400:
+                    raise RuntimeError(f"trip_events write failed with status {response.status_code}")
+                written += len(batch)
+                self.counters["written"] += len(batch)
+        except Exception as e:
+            self.counters["failures"] += 1
+            print(f"Trip event write failed, will retry: {e}")
+            self._pending[:0] = rows[written:]
+
+    def info(self):
+        return {"enabled": self.client is not None, "pending": len(self._pending), **self.counters,
+                "engine": self.engine.info()}
+
+
+pickup_geofences = PickupGeofences()
+
+
+# Clock times in timelines are local to the trips
+TRIP_TIMEZONE = os.getenv("TRIP_TIMEZONE", "Africa/Johannesburg")
+
+TIMELINE_EVENT_LIMIT = 1000
+
+
+def trip_zone():
+    """The timezone trip dates and times are in (TRIP_TIMEZONE)."""
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+    try:
+        return ZoneInfo(TRIP_TIMEZONE)
+    except ZoneInfoNotFoundError:
+        # No tz database (Windows without tzdata): UTC rather than failing
+        return datetime.timezone.utc
+
+
+def _entry(at, kind, title, desc, icon, zone):
+    moment = datetime.datetime.fromtimestamp(at, datetime.timezone.utc)
+    return {"at": moment.isoformat(), "time": moment.astimezone(zone).strftime("%H:%M"), "kind": kind,
+            "title": title, "desc": desc, "icon": icon}
+
+
+def build_timeline(trip, bookings, events, now=None):
+    """
+    Merges a trip's bookings, its trip_events rows and its status into one
+    timeline, oldest first, plus a summary of the pickup: when the driver
+    arrived, how long they waited and when they left. A trip with a pickup
+    zone whose watch window closed (or that was cancelled) without an
+    arrival is a no-show.
+    """
+    now = time.time() if now is None else now
+    zone = trip_zone()
+    timeline = []
+    seats = {}
+    for booking in bookings:
+        key = (booking.get("created_at"), booking.get("user_id"))
+        seats[key] = seats.get(key, 0) + 1
+    route = f"{trip.get('origin')} to {trip.get('destination')}" if trip.get("origin") else "this trip"
+    for (created_at, _), count in sorted(seats.items(), key=lambda item: str(item[0][0])):
+        at = _epoch(created_at)
+        if at is not None:
+            timeline.append(_entry(at, "booked", "Booking Confirmed",
+                                   f"{count} seat{'s' if count > 1 else ''} booked from {route}.", "calendar_today", zone))
+
+    summary = {"arrived_at": None, "waited_minutes": 0, "left_at": None, "no_show": False}
+    for event in events:
+        at = _epoch(event["at"])
+        kind, minutes = event["kind"], event.get("minutes") or 0
+        if kind == "arrived":
+            summary["arrived_at"] = summary["arrived_at"] or event["at"]
+            timeline.append(_entry(at, kind, "Driver Arrived at Zone",
+                                   f"GPS position {event.get('distance_m', 0):.0f} m from the pickup point.", "near_me", zone))
+        elif kind == "waited":
+            summary["waited_minutes"] = max(summary["waited_minutes"], minutes)
+            timeline.append(_entry(at, kind, f"Driver Waited {minutes} Minutes",
+                                   "Still inside the pickup zone.", "hourglass_empty", zone))
+        elif kind == "left":
+            summary["waited_minutes"] = max(summary["waited_minutes"], minutes)
+            summary["left_at"] = event["at"]
+            timeline.append(_entry(at, kind, "Driver Left Zone",
+                                   f"After {minutes} minutes in the pickup zone.", "directions_car", zone))
+
+    status, changed_at = trip.get("status"), _epoch(trip.get("status_updated_at"))
+    titles = {"in_progress": ("Trip Started", "play_arrow"), "completed": ("Trip Completed", "check_circle"),
+              "cancelled": ("Trip Cancelled", "cancel")}
+    if status in titles and changed_at is not None:
+        title, icon = titles[status]
+        timeline.append(_entry(changed_at, status, title, f"Status set to {status.replace('_', ' ')}.", icon, zone))
+
+    departs_at = _epoch(trip.get("departs_at"))
+    if trip.get("pickup_lat") is not None and departs_at is not None and summary["arrived_at"] is None:
+        closed = status == "cancelled" or now > fence_window(departs_at)[1]
+        if closed and status not in ("in_progress", "completed"):
+            summary["no_show"] = True
+            timeline.append(_entry(departs_at, "no_show", "No Arrival Recorded",
+                                   "No GPS position inside the pickup zone around departure.", "location_off", zone))
+
+    timeline.sort(key=lambda entry: entry["at"])
+    return {"trip_id": trip["id"], "status": status, "summary": summary, "timeline": timeline}
+
+
+async def trip_timeline(client, trip_id, now=None):
+    """Loads and builds a trip's timeline; None if the trip doesn't exist."""
+    trip, bookings, events = await asyncio.gather(
+        client.table("trips").select("*").eq("id", trip_id).execute(),
+        client.table("bookings").select("id,user_id,status,created_at").eq("trip_id", trip_id).order("created_at").execute(),
+        client.table("trip_events").select("*").eq("trip_id", trip_id).order("at").limit(TIMELINE_EVENT_LIMIT).execute(),
+    )
+    for name, response in (("trips", trip), ("bookings", bookings), ("trip_events", events)):
+        if response.status_code is None or response.status_code >= 400:
+            raise RuntimeError(f"{name} query failed with status {response.status_code}")
+    if not trip.data:
+        return None
+    return build_timeline(trip.data[0], bookings.data or [], events.data or [], now)
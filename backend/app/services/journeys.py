@@ -0,0 +1,357 @@
+import os
+import time
+import heapq
+import asyncio
+import datetime
+from bisect import bisect_left, bisect_right
+
+from app.services.pagination import keyset_filter
+from app.services.geofences import trip_zone, CLOSED_STATUSES
+from app.services.pricing import route_key, departure_time, fetch_route_distances
+
+# Arrival is estimated: the trip's duration_minutes (add_journeys.sql) when the
+# driver gave one, else its route's distance (route_distances) at
+# JOURNEY_SPEED_KMH. Trips with neither aren't planned over
+JOURNEY_SPEED_KMH = float(os.getenv("JOURNEY_SPEED_KMH", "80"))
+# A connection leaves at least JOURNEY_MIN_TRANSFER_MINUTES and at most
+# JOURNEY_MAX_WAIT_HOURS after the previous leg arrives
+JOURNEY_MIN_TRANSFER_MINUTES = float(os.getenv("JOURNEY_MIN_TRANSFER_MINUTES", "30"))
+JOURNEY_MAX_WAIT_HOURS = float(os.getenv("JOURNEY_MAX_WAIT_HOURS", "12"))
+# The first leg departs within JOURNEY_HORIZON_HOURS of the requested time
+JOURNEY_HORIZON_HOURS = float(os.getenv("JOURNEY_HORIZON_HOURS", "48"))
+# Legs per itinerary (at most 3) and itineraries per query
+JOURNEY_MAX_LEGS = int(os.getenv("JOURNEY_MAX_LEGS", "3"))
+JOURNEY_MAX_RESULTS = int(os.getenv("JOURNEY_MAX_RESULTS", "20"))
+# New trips every JOURNEY_REFRESH seconds; seats, times and route distances
+# changed elsewhere every JOURNEY_RESYNC
+JOURNEY_REFRESH = float(os.getenv("JOURNEY_REFRESH", "30"))
+JOURNEY_RESYNC = float(os.getenv("JOURNEY_RESYNC", "600"))
+
+TRIP_COLUMNS = "id,origin,destination,date,time,departs_at,duration_minutes,price,seats_available,status,created_at"
+SORT_ORDERS = ("arrival", "price")
+_PAGE_SIZE = 1000
+# Itineraries never enter their origin or leave their destination, which with
+# up to three legs is enough for them never to visit a place twice
+_LEG_LIMIT = 3
+
+
+def _iso(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).isoformat()
+
+
+def earliest_departure(depart_after=None, date=None, now=None):
+    """
+    Unix time the first leg may leave: depart_after (ISO timestamp), else the
+    start of `date` (YYYY-MM-DD, trip-local), never before now. ValueError if
+    either doesn't parse.
+    """
+    now = time.time() if now is None else now
+    if depart_after:
+        return max(now, departure_time({"departs_at": depart_after}))
+    if date:
+        day = datetime.datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=trip_zone())
+        return max(now, day.timestamp())
+    return now
+
+
+class Leg:
+    """One trip in the graph: a connection from origin to destination."""
+    __slots__ = ("id", "origin", "destination", "departs", "arrives", "price", "seats", "row")
+
+    def __init__(self, trip_id, origin, destination, departs, arrives, price, seats, row):
+        self.id = trip_id
+        self.origin = origin
+        self.destination = destination
+        self.departs = departs
+        self.arrives = arrives
+        self.price = price
+        self.seats = seats
+        self.row = row  # (origin, destination, date, time) as the driver wrote them
+
+
+class JourneyPlanner:
+    """
+    Upcoming trips as a time-expanded graph for itineraries of up to three
+    legs: per route, the trips in departure order, so the connections out
+    of a place in a time window are a bisect per route. Trips are added,
+    moved and dropped one at a time (new trips by (created_at, id) like the
+    price table, seat and status changes from the API's writes), never by
+    rebuilding the graph. Call from one thread (the event loop).
+    """
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.legs = {}       # trip id -> Leg
+        self.routes = {}     # (origin, destination) -> ([departure times], [legs]), in departure order
+        self.outbound = {}   # place -> {destination: trips}
+        self.inbound = {}    # place -> {origin: trips}
+        self.distances = {}  # route -> km (both directions)
+        self.unestimated = set()  # ids of upcoming trips with no duration or route distance
+        self.cursor = None   # (created_at, id) of the newest trip loaded
+        self.client = None
+        self._task = None
+        self.counters = {"queries": 0, "labels": 0, "loaded": 0}
+
+    def __len__(self):
+        return len(self.legs)
+
+    # --- the graph ---
+
+    def duration(self, row, route):
+        """Seconds the trip takes, or None if it can't be estimated."""
+        minutes = row.get("duration_minutes")
+        if minutes:
+            return float(minutes) * 60
+        km = self.distances.get(route)
+        if km is None:
+            return None
+        return km / JOURNEY_SPEED_KMH * 3600
+
+    def _link(self, leg):
+        times, legs = self.routes.setdefault((leg.origin, leg.destination), ([], []))
+        i = bisect_right(times, leg.departs)
+        times.insert(i, leg.departs)
+        legs.insert(i, leg)
+        out = self.outbound.setdefault(leg.origin, {})
+        out[leg.destination] = out.get(leg.destination, 0) + 1
+        into = self.inbound.setdefault(leg.destination, {})
+        into[leg.origin] = into.get(leg.origin, 0) + 1
+
+    def _unlink(self, leg, index=None):
+        route = (leg.origin, leg.destination)
+        times, legs = self.routes[route]
+        if index is None:
+            index = bisect_left(times, leg.departs)
+            while legs[index] is not leg:
+                index += 1
+        del times[index]
+        del legs[index]
+        if not legs:
+            del self.routes[route]
+        for edges, place, other in ((self.outbound, leg.origin, leg.destination),
+                                    (self.inbound, leg.destination, leg.origin)):
+            counts = edges[place]
+            counts[other] -= 1
+            if not counts[other]:
+                del counts[other]
+                if not counts:
+                    del edges[place]
+
+    def upsert(self, row):
+        """Adds, updates or drops a trips row (full columns); returns whether it is in the graph."""
+        trip_id = row["id"]
+        route = route_key(row.get("origin"), row.get("destination"))
+        departs = departure_time(row)
+        duration = self.duration(row, route)
+        self.unestimated.discard(trip_id)
+        if (row.get("status") in CLOSED_STATUSES or departs is None or row.get("price") is None
+                or departs <= self.clock() or route[0] == route[1]):
+            self.remove(trip_id)
+            return False
+        if duration is None:
+            self.unestimated.add(trip_id)
+            self.remove(trip_id)
+            return False
+        leg = self.legs.get(trip_id)
+        if leg is not None and ((leg.origin, leg.destination) != route or leg.departs != departs):
+            self._unlink(leg)
+            leg = None
+        display = (row.get("origin"), row.get("destination"), row.get("date"), row.get("time"))
+        if leg is None:
+            leg = self.legs[trip_id] = Leg(trip_id, route[0], route[1], departs, departs + duration, 0.0, 0, display)
+            self._link(leg)
+        leg.arrives = departs + duration
+        leg.price = float(row["price"])
+        leg.seats = row.get("seats_available") or 0
+        leg.row = display
+        return True
+
+    def observe_trip(self, row):
+        """A partial row after a write (seats or status changed): updates the trip if it is in the graph."""
+        leg = self.legs.get(row.get("id"))
+        if leg is None:
+            return
+        if row.get("status") in CLOSED_STATUSES:
+            self.remove(leg.id)
+        elif "seats_available" in row:
+            leg.seats = row["seats_available"] or 0
+
+    def remove(self, trip_id):
+        leg = self.legs.pop(trip_id, None)
+        if leg is not None:
+            self._unlink(leg)
+
+    def expire(self, now=None):
+        """Drops trips that have departed (a prefix of each route); returns how many."""
+        now = self.clock() if now is None else now
+        dropped = 0
+        for route in list(self.routes):
+            times, legs = self.routes[route]
+            while route in self.routes and times and times[0] <= now:
+                del self.legs[legs[0].id]
+                self._unlink(legs[0], 0)
+                dropped += 1
+        return dropped
+
+    # --- planning ---
+
+    def plan(self, origin, destination, depart_after, sort="arrival", k=5, max_legs=JOURNEY_MAX_LEGS, seats=1,
+             prices=None):
+        """
+        The k best itineraries from origin to destination whose first leg
+        departs within JOURNEY_HORIZON_HOURS after depart_after (Unix time),
+        by arrival (then price) or by price (then arrival), fewest legs first
+        on ties. Every leg has `seats` free. prices: trip id -> current price
+        (the price table), else the listed price.
+
+        A best-first search over the graph's trips: a label is a route so far,
+        ending with a trip, and only the k best labels per (trip, legs used)
+        are extended, as the k best itineraries through a trip only need
+        the k best ways to reach it.
+        """
+        source, target = route_key(origin, destination)
+        max_legs = max(1, min(max_legs, _LEG_LIMIT))
+        self.counters["queries"] += 1
+        if source == target or source not in self.outbound or target not in self.inbound:
+            return []
+        prices = prices if prices is not None else {}
+        routes, outbound = self.routes, self.outbound
+        # reach[n]: places with at most n legs to go to the target
+        reach = [{target}]
+        for _ in range(max_legs - 1):
+            wider = set(reach[-1])
+            for place in reach[-1]:
+                wider.update(self.inbound.get(place, ()))
+            reach.append(wider)
+        transfer, wait = JOURNEY_MIN_TRANSFER_MINUTES * 60, JOURNEY_MAX_WAIT_HOURS * 3600
+        by_price = sort == "price"
+
+        # Labels: (key, key, legs, sequence, leg, price so far, previous label)
+        heap, sequence = [], 0
+        for place in outbound[source]:
+            if place not in reach[max_legs - 1]:
+                continue
+            times, legs = routes[(source, place)]
+            lo = bisect_left(times, depart_after)
+            hi = bisect_right(times, depart_after + JOURNEY_HORIZON_HOURS * 3600)
+            for leg in legs[lo:hi]:
+                if leg.seats >= seats:
+                    price = prices.get(leg.id, leg.price)
+                    sequence += 1
+                    heap.append((price, leg.arrives, 1, sequence, leg, price, None) if by_price
+                                else (leg.arrives, price, 1, sequence, leg, price, None))
+        heapq.heapify(heap)
+
+        extended, found = {}, []
+        while heap and len(found) < k:
+            label = heapq.heappop(heap)
+            _, _, used, _, leg, paid, _ = label
+            node = (leg.id, used)
+            count = extended.get(node, 0)
+            if count >= k:
+                continue
+            extended[node] = count + 1
+            here = leg.destination
+            if here == target:
+                found.append(label)
+                continue
+            ahead = reach[max_legs - used - 1]
+            earliest, latest = leg.arrives + transfer, leg.arrives + wait
+            for place in outbound.get(here, ()):
+                if place == source or place not in ahead:
+                    continue
+                times, legs = routes[(here, place)]
+                for nxt in legs[bisect_left(times, earliest):bisect_right(times, latest)]:
+                    if nxt.seats >= seats:
+                        price = paid + prices.get(nxt.id, nxt.price)
+                        sequence += 1
+                        heapq.heappush(heap, (price, nxt.arrives, used + 1, sequence, nxt, price, label) if by_price
+                                       else (nxt.arrives, price, used + 1, sequence, nxt, price, label))
+        self.counters["labels"] += sequence
+        return [self._itinerary(label) for label in found]
+
+    def _itinerary(self, label):
+        chain = []
+        while label is not None:
+            chain.append(label)
+            label = label[6]
+        chain.reverse()
+        legs, paid, waited = [], 0.0, 0.0
+        for i, (_, _, _, _, leg, total, _) in enumerate(chain):
+            if i:
+                waited += leg.departs - chain[i - 1][4].arrives
+            origin, destination, date, departs = leg.row
+            legs.append({"trip_id": leg.id, "origin": origin, "destination": destination, "date": date,
+                         "time": departs, "departs_at": _iso(leg.departs), "arrives_at": _iso(leg.arrives),
+                         "price": round(total - paid, 2), "seats_available": leg.seats})
+            paid = total
+        first, last = chain[0][4], chain[-1][4]
+        return {"departs_at": _iso(first.departs), "arrives_at": _iso(last.arrives),
+                "duration_minutes": round((last.arrives - first.departs) / 60), "price": round(paid, 2),
+                "transfers": len(chain) - 1, "wait_minutes": round(waited / 60), "legs": legs}
+
+    # --- loading from the database ---
+
+    async def load(self, client, resync=False):
+        """
+        Adds the upcoming trips created since the last call (all of them on
+        the first call, or with resync=True, which also picks up seats and
+        times changed elsewhere), paging by (created_at, id). Returns rows read.
+        """
+        today = datetime.datetime.now(trip_zone()).date().isoformat()
+        cursor = None if resync else self.cursor
+        if resync:
+            self.unestimated.clear()
+        seen = 0
+        while True:
+            query = client.table("trips").select(TRIP_COLUMNS).gte("date", today) \
+                .order("created_at").order("id").limit(_PAGE_SIZE)
+            if cursor:
+                query = query.or_(keyset_filter(("created_at", "id"), cursor))
+            response = await query.execute()
+            if response.status_code is None or response.status_code >= 400:
+                raise RuntimeError(f"trips query failed with status {response.status_code}")
+            rows = response.data or []
+            for row in rows:
+                self.upsert(row)
+            seen += len(rows)
+            if rows and rows[-1].get("created_at") is not None:
+                cursor = (rows[-1]["created_at"], rows[-1]["id"])
+            if len(rows) < _PAGE_SIZE:
+                break
+        if cursor and (self.cursor is None or cursor > self.cursor):
+            self.cursor = cursor
+        self.counters["loaded"] += seen
+        return seen
+
+    def start(self, client):
+        self.client = client
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        resync_at = 0.0
+        while True:
+            try:
+                now = self.clock()
+                if now - resync_at >= JOURNEY_RESYNC:
+                    resync_at = now
+                    self.distances = await fetch_route_distances(self.client)
+                    await self.load(self.client, resync=True)
+                else:
+                    await self.load(self.client)
+                self.expire(now)
+            except Exception as e:
+                print(f"Journey planner refresh failed: {e}")
+            await asyncio.sleep(JOURNEY_REFRESH)
+
+    def info(self):
+        return {"trips": len(self.legs), "routes": len(self.routes), "places": len(self.outbound.keys() | self.inbound),
+                "distances": len(self.distances), "unestimated": len(self.unestimated), **self.counters}
+
+
+journey_planner = JourneyPlanner()
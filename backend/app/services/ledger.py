@@ -0,0 +1,262 @@
+import os
+import uuid
+import asyncio
+import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+
+# The platform's cut of a trip fare when escrow is released to the driver, in basis points
+PLATFORM_FEE_BPS = int(os.getenv("PLATFORM_FEE_BPS", "1000"))
+
+# Accounts outside any user's wallet. Every transaction moves money between
+# accounts and its entries sum to zero, so these go negative as money comes in
+PLATFORM_REVENUE = "platform:revenue"
+EXTERNAL_PAYMENTS = "external:payments"  # card payments into the platform
+EXTERNAL_PAYOUTS = "external:payouts"    # bank transfers out of it
+
+# How each kind of transaction shows up in the wallet: type, icon, icon colour.
+# A transaction is listed for its user_id (the payer of a hold or refund, the
+# driver of a release); counterparty_id is the other side.
+TRANSACTION_TYPES = {
+    "deposit": ("Deposit", "add_card", "teal"),
+    "withdrawal": ("Withdrawal", "account_balance", "slate"),
+    "escrow_hold": ("Spending", "shopping_cart", "slate"),
+    "escrow_release": ("Earnings", "local_taxi", "blue"),
+    "escrow_refund": ("Refund", "undo", "orange"),
+}
+KINDS_BY_TYPE = {display: kind for kind, (display, _, _) in TRANSACTION_TYPES.items()}
+STATUSES = ("completed", "pending", "failed")
+
+COUNTER_FIELDS = ("earned_cents", "spent_cents", "trips_completed", "open_holds")
+
+
+class LedgerError(Exception):
+    pass
+
+
+class UnbalancedTransaction(LedgerError):
+    """The entries of a transaction don't sum to zero."""
+
+
+class InsufficientFunds(LedgerError):
+    """The transaction would take a wallet below zero."""
+
+
+def wallet_account(user_id):
+    return f"wallet:{user_id}"
+
+
+def escrow_account(user_id):
+    """Fares held for a driver until the trip is completed."""
+    return f"escrow:{user_id}"
+
+
+def to_cents(amount):
+    """A rand amount (float, str or Decimal) as integer cents, rounded half up."""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Cents as a rand float, for clients that expect amounts in rand."""
+    return cents / 100
+
+
+def format_cents(cents, signed=False):
+    """12345 -> "R 123.45"; signed: "+ R 123.45" / "- R 123.45"."""
+    text = f"R {abs(cents) // 100:,}.{abs(cents) % 100:02d}"
+    if not signed:
+        return f"- {text}" if cents < 0 else text
+    return f"{'-' if cents < 0 else '+'} {text}"
+
+
+def platform_fee(amount_cents, bps=PLATFORM_FEE_BPS):
+    """The platform's fee on a fare, in whole cents (half up)."""
+    return (amount_cents * bps + 5000) // 10000
+
+
+def _month(created_at):
+    return created_at[:7] + "-01"
+
+
+class Posting:
+    """
+    One ledger transaction ready to post: the header, its entries (account,
+    signed amount in cents; they must sum to zero) and what it adds to the
+    users' wallet counters. Ids are generated here, so posting the same
+    Posting twice (a retry) records it once.
+    """
+    __slots__ = ("transaction", "entries")
+
+    def __init__(self, kind, user_id, amount_cents, entries, counters=(), counterparty_id=None, trip_id=None,
+                 description="", reference=None, created_at=None, transaction_id=None, status="completed"):
+        if sum(amount for _, amount in entries) != 0:
+            raise UnbalancedTransaction(f"{kind} entries sum to {sum(a for _, a in entries)}, not 0")
+        if status not in STATUSES:
+            raise ValueError(f"unknown status {status!r}")
+        if len(entries) < 2 or any(not isinstance(amount, int) or isinstance(amount, bool) or amount == 0
+                                   for _, amount in entries):
+            raise UnbalancedTransaction(f"{kind} needs two or more non-zero integer-cent entries")
+        created_at = created_at or datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.transaction = {
+            "id": transaction_id or str(uuid.uuid4()),
+            "kind": kind,
+            "user_id": user_id,
+            "counterparty_id": counterparty_id,
+            "trip_id": trip_id,
+            "amount_cents": amount_cents,  # signed, as the user sees it
+            "description": description,
+            "reference": reference,
+            "counters": [c for c in counters if any(c[f] for f in COUNTER_FIELDS)],
+            "status": status,
+            "created_at": created_at,
+        }
+        self.entries = [{"account": account, "amount_cents": amount} for account, amount in entries]
+
+    @property
+    def counters(self):
+        return self.transaction["counters"]
+
+    def params(self):
+        """Arguments of the post_ledger_transaction RPC (add_wallet_ledger.sql)."""
+        return {"p_transaction": self.transaction, "p_entries": self.entries,
+                "p_month": _month(self.transaction["created_at"])}
+
+
+def _positive(amount_cents):
+    if not isinstance(amount_cents, int) or isinstance(amount_cents, bool) or amount_cents <= 0:
+        raise ValueError(f"amount must be a positive number of cents, got {amount_cents!r}")
+    return amount_cents
+
+
+def _counter(user_id, earned_cents=0, spent_cents=0, trips_completed=0, open_holds=0):
+    return {"user_id": user_id, "earned_cents": earned_cents, "spent_cents": spent_cents,
+            "trips_completed": trips_completed, "open_holds": open_holds}
+
+
+def deposit(user_id, amount_cents, reference=None, **kwargs):
+    """A wallet top-up paid by card."""
+    amount = _positive(amount_cents)
+    return Posting("deposit", user_id, amount,
+                   [(EXTERNAL_PAYMENTS, -amount), (wallet_account(user_id), amount)],
+                   reference=reference, description=kwargs.pop("description", "Wallet Top-Up"), **kwargs)
+
+
+def withdrawal(user_id, amount_cents, reference=None, **kwargs):
+    """A transfer from the wallet to the user's bank account."""
+    amount = _positive(amount_cents)
+    return Posting("withdrawal", user_id, -amount,
+                   [(wallet_account(user_id), -amount), (EXTERNAL_PAYOUTS, amount)],
+                   reference=reference, description=kwargs.pop("description", "Bank Withdrawal"), **kwargs)
+
+
+def escrow_hold(payer_id, driver_id, trip_id, amount_cents, funded_by="card", reference=None, **kwargs):
+    """A fare paid by card (or from the payer's wallet) and held for the driver until the trip is completed."""
+    amount = _positive(amount_cents)
+    source = EXTERNAL_PAYMENTS if funded_by == "card" else wallet_account(payer_id)
+    return Posting("escrow_hold", payer_id, -amount,
+                   [(source, -amount), (escrow_account(driver_id), amount)],
+                   [_counter(payer_id, spent_cents=amount, open_holds=1)],
+                   counterparty_id=driver_id, trip_id=trip_id, reference=reference,
+                   description=kwargs.pop("description", "Trip Payment"), **kwargs)
+
+
+def escrow_release(payer_id, driver_id, trip_id, amount_cents, fee_cents=None, **kwargs):
+    """A completed trip: the held fare goes to the driver's wallet, less the platform fee."""
+    amount = _positive(amount_cents)
+    fee = platform_fee(amount) if fee_cents is None else fee_cents
+    entries = [(escrow_account(driver_id), -amount), (wallet_account(driver_id), amount - fee)]
+    if fee:
+        entries.append((PLATFORM_REVENUE, fee))
+    return Posting("escrow_release", driver_id, amount - fee, entries,
+                   [_counter(driver_id, earned_cents=amount - fee, trips_completed=1),
+                    _counter(payer_id, trips_completed=1, open_holds=-1)],
+                   counterparty_id=payer_id, trip_id=trip_id,
+                   description=kwargs.pop("description", "Trip Earnings"), **kwargs)
+
+
+def escrow_refund(payer_id, driver_id, trip_id, amount_cents, refund_to="card", reference=None, **kwargs):
+    """A cancelled trip: the held fare goes back to the payer (card or wallet)."""
+    amount = _positive(amount_cents)
+    target = EXTERNAL_PAYMENTS if refund_to == "card" else wallet_account(payer_id)
+    return Posting("escrow_refund", payer_id, amount,
+                   [(escrow_account(driver_id), -amount), (target, amount)],
+                   [_counter(payer_id, spent_cents=-amount, open_holds=-1)],
+                   counterparty_id=driver_id, trip_id=trip_id, reference=reference,
+                   description=kwargs.pop("description", "Trip Refund"), **kwargs)
+
+
+def _raise_for(response, what):
+    if response.status_code is not None and response.status_code < 400:
+        return
+    error = response.error or {}
+    hint = error.get("hint")
+    if hint == "insufficient_funds":
+        raise InsufficientFunds(error.get("message") or "insufficient funds")
+    if hint == "unbalanced":
+        raise UnbalancedTransaction(error.get("message") or "unbalanced transaction")
+    raise RuntimeError(f"{what} failed with status {response.status_code}: {error.get('message') or error}")
+
+
+async def post(client, posting):
+    """
+    Records a Posting through the post_ledger_transaction RPC, which appends
+    the entries and updates the balance snapshots and wallet counters in one
+    database transaction. Raises InsufficientFunds / UnbalancedTransaction.
+    """
+    response = await client.rpc("post_ledger_transaction", posting.params()).execute()
+    _raise_for(response, "ledger posting")
+    # A retry of an id already posted returns the transaction as first recorded
+    return response.data if isinstance(response.data, dict) else posting.transaction
+
+
+def _change(current, previous):
+    """Month-on-month change in percent, or None without last month's figure."""
+    if not previous:
+        return None
+    return round((current - previous) * 100 / previous, 1)
+
+
+async def wallet_summary(client, user_id, today=None):
+    """
+    The wallet card: balances from the per-account snapshots, totals from the
+    user's counters and the change against last month from the monthly
+    counters. A fixed number of single-row reads, however long the history.
+    """
+    today = today or datetime.date.today()
+    this_month = today.replace(day=1)
+    last_month = (this_month - datetime.timedelta(days=1)).replace(day=1)
+    accounts = [wallet_account(user_id), escrow_account(user_id)]
+    balances, counters, monthly = await asyncio.gather(
+        client.table("ledger_balances").select("account,balance_cents").in_("account", accounts).execute(),
+        client.table("wallet_counters").select("*").eq("user_id", user_id).limit(1).execute(),
+        client.table("wallet_monthly").select("month,earned_cents,spent_cents").eq("user_id", user_id)
+            .in_("month", [this_month.isoformat(), last_month.isoformat()]).execute(),
+    )
+    for response, what in ((balances, "balances"), (counters, "counters"), (monthly, "monthly counters")):
+        _raise_for(response, f"wallet {what} query")
+
+    balance = {row["account"]: row["balance_cents"] for row in balances.data or []}
+    counter = (counters.data or [{}])[0]
+    months = {str(row["month"])[:10]: row for row in monthly.data or []}
+    now, before = months.get(this_month.isoformat(), {}), months.get(last_month.isoformat(), {})
+    return {
+        "available_cents": balance.get(wallet_account(user_id), 0),
+        "escrowed_cents": balance.get(escrow_account(user_id), 0),
+        "total_earned_cents": counter.get("total_earned_cents", 0),
+        "total_spent_cents": counter.get("total_spent_cents", 0),
+        "earned_change": _change(now.get("earned_cents", 0), before.get("earned_cents", 0)),
+        "spent_change": _change(now.get("spent_cents", 0), before.get("spent_cents", 0)),
+        "trips_completed": counter.get("trips_completed", 0),
+        "upcoming_trips": counter.get("open_holds", 0),
+    }
+
+
+async def check(client, limit=100):
+    """
+    Runs the ledger_check function (add_wallet_ledger.sql): every entry and
+    counter delta replayed against the snapshots, in one statement over one
+    snapshot. Reads the whole ledger: an admin / nightly job.
+    """
+    response = await client.rpc("ledger_check", {"p_limit": limit}).execute()
+    _raise_for(response, "ledger check")
+    return response.data
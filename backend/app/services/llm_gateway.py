@@ -0,0 +1,332 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from app.services import gemini, minimax
+from app.services.chat_stream import stream_reply
+
+# Per-attempt limit, passed down to the provider's HTTP call as well. Streams:
+# the limit for the first chunk, and then between chunks
+LLM_PROVIDER_TIMEOUT = float(os.getenv("LLM_PROVIDER_TIMEOUT", "15"))
+# A streamed reply as a whole, passed down to the provider's HTTP call
+LLM_STREAM_TIMEOUT = float(os.getenv("LLM_STREAM_TIMEOUT", "120"))
+# Whole request: past this, the smart mock answers
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "20"))
+# A hedged attempt starts when the first one has taken longer than the provider's
+# p95, never sooner than LLM_HEDGE_MIN_MS; LLM_HEDGE_DEFAULT_MS until there is a p95
+LLM_HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", "100"))
+LLM_HEDGE_DEFAULT_MS = float(os.getenv("LLM_HEDGE_DEFAULT_MS", "3000"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "64"))
+LATENCY_WINDOW = 200  # recent successful calls per provider
+LATENCY_MIN_SAMPLES = 20  # before this many, p95 isn't trusted for hedging
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive failures; open -> half-open
+    after `cooldown` seconds, letting one probe call through; the probe's
+    success closes the breaker, its failure opens it again.
+    """
+    def __init__(self, failures=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN, clock=time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._streak = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0  # times it tripped
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == "open" and self.clock() - self._opened_at >= self.cooldown:
+                return "half_open"
+            return self._state
+
+    def available(self):
+        """Whether allow() would let a call through right now (doesn't take the probe)."""
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._probing)
+
+    def allow(self):
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self.clock() - self._opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                # A late success from a call started before the breaker opened doesn't close it
+                if self._state == "closed" or self._probing:
+                    self._state, self._streak, self._probing = "closed", 0, False
+                return
+            self._streak += 1
+            if self._probing or (self._state == "closed" and self._streak >= self.failures):
+                if self._state == "closed":
+                    self.opened += 1
+                self._state, self._opened_at, self._probing = "open", self.clock(), False
+
+
+class Provider:
+    """
+    A registered LLM: complete(messages, model=..., temperature=..., timeout=...)
+    returns the reply text or raises; stream(...) with the same arguments, if
+    given, is a blocking generator of reply chunks that raises on failure.
+    `configured` says whether it can be used at all (e.g. has an API key).
+    """
+    def __init__(self, name, complete, configured=lambda: True, timeout=LLM_PROVIDER_TIMEOUT, breaker=None,
+                 stream=None):
+        self.name = name
+        self.complete = complete
+        self.stream = stream
+        self.configured = configured
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)  # ms, successful calls only
+        self.calls = 0
+        self.failures = 0
+        self.hedges = 0  # hedged attempts sent to this provider
+        self.wins = 0    # requests this provider answered
+
+    def record(self, ok, ms=None):
+        """ms: the call's latency, for hedging; None for streams, which take as long as the reply."""
+        with self._lock:
+            self.calls += 1
+            if ok and ms is not None:
+                self._latencies.append(ms)
+            elif not ok:
+                self.failures += 1
+        self.breaker.record(ok)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def info(self):
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        with self._lock:
+            return {"state": self.breaker.state, "configured": bool(self.configured()), "calls": self.calls,
+                    "failures": self.failures, "hedges": self.hedges, "wins": self.wins,
+                    "p50_ms": round(p50, 1) if p50 is not None else None,
+                    "p95_ms": round(p95, 1) if p95 is not None else None,
+                    "breaker_trips": self.breaker.opened}
+
+
+class LLMGateway:
+    """
+    One entry point for chat completions across providers:
+
+    - routing: the requested provider first, then the others by recent median
+      latency (untried ones first so they get measured); providers that aren't
+      configured or whose breaker is open are skipped
+    - hedging: if an attempt hasn't answered after that provider's p95, a
+      second attempt goes to the next provider, and the first good answer
+      wins; a provider already working on the request isn't asked twice
+    - fallback: a failed attempt moves on to the next provider at once; when
+      none are left or the deadline passes, `fallback(messages)` answers
+      (the smart mock)
+    - streams (stream()): the same routing, breakers and fallback for the
+      reply's first chunk, without hedging
+
+    Provider calls block, so they run on a dedicated thread pool; abandoned
+    attempts finish in the background within the provider timeout.
+    """
+    def __init__(self, providers=(), fallback=None, deadline=LLM_DEADLINE,
+                 hedge_min_ms=LLM_HEDGE_MIN_MS, hedge_default_ms=LLM_HEDGE_DEFAULT_MS, max_workers=LLM_MAX_WORKERS):
+        self.providers = {}
+        for provider in providers:
+            self.register(provider)
+        self.fallback = fallback
+        self.deadline = deadline
+        self.hedge_min_ms = hedge_min_ms
+        self.hedge_default_ms = hedge_default_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.fallbacks = 0
+
+    def register(self, provider):
+        self.providers[provider.name] = provider
+
+    def route(self, preferred=None):
+        """Providers to try, in order."""
+        usable = [p for p in self.providers.values() if p.configured() and p.breaker.available()]
+        order = sorted(usable, key=lambda p: p.percentile(0.5) or 0.0)  # stable: registration order breaks ties
+        first = [p for p in order if p.name == preferred]
+        return first + [p for p in order if p.name != preferred]
+
+    def hedge_delay(self, provider):
+        p95 = provider.percentile(0.95)
+        return max(self.hedge_min_ms, p95 if p95 is not None else self.hedge_default_ms) / 1000
+
+    async def _attempt(self, provider, messages, kwargs):
+        """(ok, reply text or error message). Never raises, so abandoned attempts stay quiet."""
+        if not provider.breaker.allow():
+            return False, "circuit open"
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            call = partial(provider.complete, messages, timeout=provider.timeout, **kwargs)
+            text = await asyncio.wait_for(loop.run_in_executor(self._executor, call), provider.timeout)
+            ok = bool(text)
+            result = text if ok else "empty reply"
+        except asyncio.TimeoutError:
+            ok, result = False, f"timed out after {provider.timeout:.0f}s"
+        except Exception as e:
+            ok, result = False, str(e)
+        provider.record(ok, (time.perf_counter() - start) * 1000)
+        if not ok:
+            print(f"LLM provider {provider.name} failed: {result}")
+        return ok, result
+
+    async def complete(self, messages, provider=None, model=None, temperature=0.7):
+        """
+        {"content", "role": "assistant", "provider"}; "fallback": True when the
+        smart mock answered. `model` only applies to `provider`; the others use
+        their default model.
+        """
+        with self._lock:
+            self.requests += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        order = self.route(provider)
+        pending = {}
+        next_up = 0
+        hedge_at = None
+
+        def launch(target, hedge=False):
+            kwargs = {"temperature": temperature}
+            if model and target.name == provider:
+                kwargs["model"] = model
+            if hedge:
+                target.hedges += 1
+            pending[asyncio.ensure_future(self._attempt(target, messages, kwargs))] = target
+
+        while True:
+            if not pending:
+                if next_up >= len(order):
+                    break
+                launch(order[next_up])
+                hedge_at = loop.time() + self.hedge_delay(order[next_up])
+                next_up += 1
+            wake = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, _ = await asyncio.wait(pending, timeout=max(0.0, wake - loop.time()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                target = pending.pop(task)
+                ok, result = task.result()
+                if ok:
+                    target.wins += 1
+                    return {"content": result, "role": "assistant", "provider": target.name}
+            if done:
+                continue
+            if loop.time() >= deadline:
+                break
+            # Slow, not failed: hedge once, on the next provider. With none left
+            # the running attempt is waited for; resending to the provider already
+            # working on it only doubles its load when it is struggling
+            hedge_at = None
+            if next_up < len(order):
+                target = order[next_up]
+                next_up += 1
+                if target.breaker.available():
+                    with self._lock:
+                        self.hedged += 1
+                    launch(target, hedge=True)
+
+        with self._lock:
+            self.fallbacks += 1
+        content = self.fallback(messages) if self.fallback else "Sorry, I can't answer right now."
+        return {"content": content, "role": "assistant", "provider": "mock", "fallback": True}
+
+    async def stream(self, messages, provider=None, model=None, temperature=0.7):
+        """
+        The reply in chunks, from the first provider (route() order, skipping
+        those without a stream) whose first chunk comes within its timeout
+        and the request deadline; failing that, `fallback(messages)` as one
+        chunk. Once a chunk is out the reply can't move to another provider:
+        an error, or no chunk for the provider's timeout, is raised.
+        """
+        with self._lock:
+            self.requests += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        for target in self.route(provider):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if target.stream is None or not target.breaker.allow():
+                continue
+            kwargs = {"temperature": temperature, "timeout": LLM_STREAM_TIMEOUT}
+            if model and target.name == provider:
+                kwargs["model"] = model
+            chunks = stream_reply(target.stream, messages, **kwargs)
+            try:
+                first = await asyncio.wait_for(anext(chunks), min(target.timeout, remaining))
+            except Exception as e:
+                await chunks.aclose()
+                target.record(False)
+                reason = "no reply" if isinstance(e, StopAsyncIteration) else (
+                    f"no first chunk after {min(target.timeout, remaining):.0f}s"
+                    if isinstance(e, asyncio.TimeoutError) else str(e))
+                print(f"LLM provider {target.name} failed to stream: {reason}")
+                continue
+            target.record(True)
+            target.wins += 1
+            try:
+                yield first
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(anext(chunks), target.timeout)
+                    except StopAsyncIteration:
+                        return
+                    yield chunk
+            except asyncio.TimeoutError:
+                target.record(False)
+                raise TimeoutError(f"{target.name} stalled: no reply chunk for {target.timeout:.0f}s")
+            except Exception:
+                target.record(False)
+                raise
+            finally:
+                await chunks.aclose()
+
+        with self._lock:
+            self.fallbacks += 1
+        yield self.fallback(messages) if self.fallback else "Sorry, I can't answer right now."
+
+    def info(self):
+        with self._lock:
+            totals = {"requests": self.requests, "hedged": self.hedged, "fallbacks": self.fallbacks}
+        return {**totals, "providers": {name: p.info() for name, p in self.providers.items()}}
+
+
+def _smart_mock(messages):
+    return minimax.get_smart_mock_response(messages)["reply"]
+
+
+gateway = LLMGateway(
+    [
+        Provider("gemini", gemini.complete, configured=gemini.is_configured, stream=gemini.stream_chat),
+        # mock=False: the gateway falls back itself, after trying the other providers
+        Provider("minimax", minimax.complete, configured=minimax.is_configured,
+                 stream=partial(minimax.stream_chat, mock=False)),
+    ],
+    fallback=_smart_mock,
+)
@@ -0,0 +1,250 @@
+import os
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+# How long per-day and per-hour buckets are kept in memory
+METRICS_DAILY_RETENTION_DAYS = int(os.getenv("METRICS_DAILY_RETENTION_DAYS", "90"))
+METRICS_HOURLY_RETENTION_DAYS = int(os.getenv("METRICS_HOURLY_RETENTION_DAYS", "14"))
+
+BACKFILL_PAGE_SIZE = 1000
+
+
+def parse_timestamp(value):
+    """Parses PostgREST timestamps ("2026-02-15T08:00:00.123+00:00" / "...Z") into naive UTC."""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+def _day(at):
+    return at.strftime("%Y-%m-%d")
+
+
+def _hour(at):
+    return at.strftime("%Y-%m-%dT%H")
+
+
+def _bucket():
+    return {"bookings": 0, "revenue": 0.0, "trips": Counter()}
+
+
+def _departed(bucket):
+    # Trips that got moving in this bucket (still running or already finished)
+    return bucket["trips"]["in_progress"] + bucket["trips"]["completed"]
+
+
+def trend(current, previous):
+    """Percentage change, rounded like the dashboard shows it."""
+    if not previous:
+        return 100 if current else 0
+    return round((current - previous) / previous * 100)
+
+
+class DashboardRollups:
+    """
+    Per-day and per-hour rollups of booking counts, revenue and trips by the
+    status they were moved to, plus the current number of trips in each status.
+
+    Writers call record_booking / record_trip_status as they commit, so reads
+    never scan the bookings or trips tables. rebuild() recomputes everything
+    from raw rows (startup backfill, /admin/metrics/rebuild) and must produce
+    exactly what the incremental path produces.
+
+    The rollups live in this process and only see the writes it handles: run
+    the API as a single worker, or each worker's dashboard shows its own
+    share of today's bookings and trip moves until the next rebuild.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffers = []  # one per rebuild in flight: writes made while it fetches rows
+        self._reset()
+
+    def _reset(self):
+        self.daily = defaultdict(_bucket)
+        self.hourly = defaultdict(_bucket)
+        self.trip_status = {}
+        self.status_counts = Counter()
+        self.ready = False
+        self.built_at = None
+
+    # --- writes ---
+
+    def _add_booking(self, amount, at):
+        for bucket in (self.daily[_day(at)], self.hourly[_hour(at)]):
+            bucket["bookings"] += 1
+            bucket["revenue"] += float(amount or 0)
+
+    def _set_trip_status(self, trip_id, status, at):
+        # Each trip is counted once, under its current status, in the bucket
+        # where that status was set -- which is what a recompute can see.
+        previous = self.trip_status.get(trip_id)
+        if previous is not None:
+            old_status, old_at = previous
+            if old_status == status:
+                return
+            self.status_counts[old_status] -= 1
+            if old_at is not None:
+                self.daily[_day(old_at)]["trips"][old_status] -= 1
+                self.hourly[_hour(old_at)]["trips"][old_status] -= 1
+        self.status_counts[status] += 1
+        self.trip_status[trip_id] = (status, at)
+        if at is not None:
+            self.daily[_day(at)]["trips"][status] += 1
+            self.hourly[_hour(at)]["trips"][status] += 1
+
+    def record_booking(self, amount, at=None, booking_id=None):
+        with self._lock:
+            at = at or datetime.utcnow()
+            self._add_booking(amount, at)
+            for buffer in self._buffers:
+                buffer.append(("booking", booking_id, amount, at))
+
+    def record_trip_status(self, trip_id, status, at=None):
+        with self._lock:
+            at = at or datetime.utcnow()
+            self._set_trip_status(trip_id, status, at)
+            for buffer in self._buffers:
+                buffer.append(("status", trip_id, status, at))
+
+    def begin_rebuild(self):
+        """
+        Call before fetching the rows for rebuild() and pass the result to it:
+        writes recorded in between are replayed on top of the rebuilt state
+        instead of being lost when it replaces the old one.
+        """
+        buffer = []
+        with self._lock:
+            self._buffers.append(buffer)
+        return buffer
+
+    def rebuild(self, trips, bookings, during=None):
+        """
+        Full recompute from raw rows. Trips are bucketed by status_updated_at
+        (falling back to created_at), bookings by created_at. `during` is what
+        begin_rebuild() returned: its writes are replayed, except bookings
+        whose id is already among the rows.
+        """
+        with self._lock:
+            if during is not None:
+                self._buffers = [b for b in self._buffers if b is not during]
+            self._reset()
+            for trip in trips:
+                at = parse_timestamp(trip.get("status_updated_at") or trip.get("created_at"))
+                self._set_trip_status(trip["id"], trip.get("status") or "scheduled", at)
+            for booking in bookings:
+                at = parse_timestamp(booking.get("created_at")) or datetime.utcnow()
+                self._add_booking(booking.get("total_price"), at)
+            fetched = {booking.get("id") for booking in bookings}
+            for kind, key, value, at in during or ():
+                if kind == "status":
+                    self._set_trip_status(key, value, at)
+                elif key is None or key not in fetched:
+                    self._add_booking(value, at)
+            self._prune(datetime.utcnow())
+            self.ready = True
+            self.built_at = datetime.utcnow()
+
+    def rebuild_cancelled(self, during):
+        """The rebuild that began with `during` won't happen: stop buffering for it."""
+        with self._lock:
+            self._buffers = [b for b in self._buffers if b is not during]
+
+    def _prune(self, now):
+        daily_cutoff = _day(now - timedelta(days=METRICS_DAILY_RETENTION_DAYS))
+        hourly_cutoff = _hour(now - timedelta(days=METRICS_HOURLY_RETENTION_DAYS))
+        for key in [k for k in self.daily if k < daily_cutoff]:
+            del self.daily[key]
+        for key in [k for k in self.hourly if k < hourly_cutoff]:
+            del self.hourly[key]
+
+    # --- reads ---
+
+    def _day_through_hour(self, day, hour):
+        """Totals for `day` from midnight up to and including `hour` (bounded: at most 24 buckets)."""
+        total = _bucket()
+        for h in range(hour + 1):
+            bucket = self.hourly.get(f"{day}T{h:02d}")
+            if bucket:
+                total["bookings"] += bucket["bookings"]
+                total["revenue"] += bucket["revenue"]
+                total["trips"].update(bucket["trips"])
+        return total
+
+    def dashboard(self, now=None):
+        """
+        Today's figures and trends versus yesterday up to the same hour,
+        read from the rollups only.
+        """
+        now = now or datetime.utcnow()
+        today, yesterday = _day(now), _day(now - timedelta(days=1))
+        with self._lock:
+            today_bucket = self.daily.get(today) or _bucket()
+            so_far_yesterday = self._day_through_hour(yesterday, now.hour)
+            return {
+                "activeTrips": self.status_counts["in_progress"],
+                "activeTripsTrend": trend(_departed(today_bucket), _departed(so_far_yesterday)),
+                "todaysBookings": today_bucket["bookings"],
+                "todaysBookingsTrend": trend(today_bucket["bookings"], so_far_yesterday["bookings"]),
+                "revenueEst": round(today_bucket["revenue"], 2),
+                "revenueTrend": trend(today_bucket["revenue"], so_far_yesterday["revenue"]),
+            }
+
+    def snapshot(self):
+        """Plain-dict copy of all rollups, used to compare incremental vs rebuilt state."""
+        def plain(buckets):
+            result = {}
+            for key, b in buckets.items():
+                trips = {s: n for s, n in b["trips"].items() if n}
+                if b["bookings"] or trips:
+                    result[key] = {"bookings": b["bookings"], "revenue": round(b["revenue"], 2), "trips": trips}
+            return result
+        with self._lock:
+            return {
+                "daily": plain(self.daily),
+                "hourly": plain(self.hourly),
+                "status_counts": {s: n for s, n in self.status_counts.items() if n},
+            }
+
+
+rollups = DashboardRollups()
+
+
+async def _fetch_all(client, table, columns):
+    """
+    Every row, in pages seeked by id (keyset) rather than by offset: a row
+    inserted during the rebuild can't shift a later page, so none is skipped
+    or read twice (rows inserted meanwhile are counted through begin_rebuild).
+    """
+    rows, last = [], None
+    while True:
+        query = client.table(table).select(columns).order("id").limit(BACKFILL_PAGE_SIZE)
+        if last is not None:
+            query = query.gt("id", last)
+        response = await query.execute()
+        if response.status_code is None or response.status_code >= 400:
+            raise RuntimeError(f"{table} query failed with status {response.status_code}")
+        page = response.data or []
+        rows.extend(page)
+        if len(page) < BACKFILL_PAGE_SIZE:
+            return rows
+        last = page[-1]["id"]
+
+
+async def backfill(client):
+    """Rebuilds the rollups from the trips and bookings tables, keeping writes made while it reads them."""
+    during = rollups.begin_rebuild()
+    try:
+        trips = await _fetch_all(client, "trips", "id,status,status_updated_at,created_at")
+        bookings = await _fetch_all(client, "bookings", "id,total_price,created_at")
+    except BaseException:
+        rollups.rebuild_cancelled(during)
+        raise
+    rollups.rebuild(trips, bookings, during)
+    print(f"Dashboard metrics rebuilt from {len(trips)} trips and {len(bookings)} bookings.")
+    return {"trips": len(trips), "bookings": len(bookings)}
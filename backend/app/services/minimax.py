@@ -1,4 +1,6 @@
 import os
+import re
+import json
 import requests
 import logging
 from dotenv import load_dotenv
@@ -67,16 +69,12 @@ def get_smart_mock_response(messages):
         "choices": [{"message": {"content": reply}}]
     }
 
-def chat_completion(messages, model="abab6.5-chat", temperature=0.7, tokens_to_generate=None):
-    """
-    Sends a chat completion request to the Minimax API.
-    FALLBACK to smart mock if API fails.
-    """
-    # 1. Check Credentials
-    if not MINIMAX_API_KEY or not MINIMAX_GROUP_ID or "your_minimax" in MINIMAX_API_KEY:
-        logger.warning("Minimax API Key missing/invalid. Using Smart Mock.")
-        return get_smart_mock_response(messages)
+def is_configured():
+    """True if real Minimax credentials are set (otherwise the smart mock answers)."""
+    return bool(MINIMAX_API_KEY and MINIMAX_GROUP_ID and "your_minimax" not in MINIMAX_API_KEY)
 
+def _api_request(messages, model, temperature, tokens_to_generate=None, stream=False):
+    """(url, headers, payload) for a chatcompletion_v2 call."""
     url = f"{MINIMAX_API_URL}/text/chatcompletion_v2"
     
     headers = {
@@ -93,20 +91,113 @@ def chat_completion(messages, model="abab6.5-chat", temperature=0.7, tokens_to_g
     
     if tokens_to_generate:
         payload["tokens_to_generate"] = tokens_to_generate
+    if stream:
+        payload["stream"] = True
+
+    return url, headers, payload
+
+class MinimaxAPIError(Exception):
+    """An error reported in base_resp (returned with a success HTTP code)."""
+
+def _post(url, headers, payload, timeout):
+    response = requests.post(url, headers=headers, json=payload, timeout=timeout)
+    response.raise_for_status()
+    response_json = response.json()
+    
+    # Check for API-level errors (e.g., invalid key returned as success HTTP code but error body)
+    if "base_resp" in response_json and response_json["base_resp"].get("status_code", 0) != 0:
+        raise MinimaxAPIError(response_json["base_resp"].get("status_msg", "Unknown API Error"))
+    
+    return response_json
+
+def chat_completion(messages, model="abab6.5-chat", temperature=0.7, tokens_to_generate=None, timeout=30):
+    """
+    Sends a chat completion request to the Minimax API.
+    FALLBACK to smart mock if API fails.
+    """
+    # 1. Check Credentials
+    if not is_configured():
+        logger.warning("Minimax API Key missing/invalid. Using Smart Mock.")
+        return get_smart_mock_response(messages)
+
+    url, headers, payload = _api_request(messages, model, temperature, tokens_to_generate)
 
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()
-        response_json = response.json()
-        
-        # 2. Check for API-level errors (e.g., invalid key returned as success HTTP code but error body)
-        if "base_resp" in response_json and response_json["base_resp"].get("status_code", 0) != 0:
-             error_msg = response_json["base_resp"].get("status_msg", "Unknown API Error")
-             logger.error(f"Minimax API Error: {error_msg}. Falling back to Smart Mock.")
-             return get_smart_mock_response(messages)
-        
-        return response_json
-        
+        return _post(url, headers, payload, timeout)
+    except MinimaxAPIError as e:
+        logger.error(f"Minimax API Error: {e}. Falling back to Smart Mock.")
+        return get_smart_mock_response(messages)
     except Exception as e:
         logger.error(f"Minimax Connection Error: {e}. Falling back to Smart Mock.")
         return get_smart_mock_response(messages)
+
+def complete(messages, model="abab6.5-chat", temperature=0.7, timeout=30):
+    """
+    The reply text, raising on any failure instead of falling back to the smart
+    mock (the LLM gateway decides what to fall back to).
+    """
+    if not is_configured():
+        raise RuntimeError("Minimax API Key missing/invalid")
+    url, headers, payload = _api_request(messages, model, temperature)
+    response_json = _post(url, headers, payload, timeout)
+    choices = response_json.get("choices") or []
+    content = (choices[0].get("message") or {}).get("content") if choices else None
+    content = content or response_json.get("reply")
+    if not content:
+        raise RuntimeError("Minimax returned an empty reply")
+    return content
+
+def _mock_stream(messages):
+    """The smart mock reply, word by word, so offline streaming looks like the real thing."""
+    reply = get_smart_mock_response(messages)["reply"]
+    yield from re.findall(r"\S+\s*", reply)
+
+def stream_chat(messages, model="abab6.5-chat", temperature=0.7, tokens_to_generate=None, timeout=30, mock=True):
+    """
+    Like chat_completion, but yields the reply in chunks as Minimax generates it
+    (stream mode: server-sent events with choices[].delta.content).
+    Falls back to the smart mock the same way, as long as nothing has been yielded yet;
+    a failure after that is raised. mock=False raises instead of falling back.
+    `timeout` bounds connecting and each read of the stream.
+    """
+    if not is_configured():
+        if not mock:
+            raise RuntimeError("MINIMAX_API_KEY is not configured")
+        logger.warning("Minimax API Key missing/invalid. Using Smart Mock.")
+        yield from _mock_stream(messages)
+        return
+
+    url, headers, payload = _api_request(messages, model, temperature, tokens_to_generate, stream=True)
+    started = False
+
+    try:
+        with requests.post(url, headers=headers, json=payload, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+
+            # API-level errors come back as a single JSON body instead of an event stream
+            if "json" in response.headers.get("Content-Type", ""):
+                response_json = response.json()
+                error_msg = response_json.get("base_resp", {}).get("status_msg", "Unknown API Error")
+                raise RuntimeError(error_msg)
+
+            # chunk_size=None: hand over each event as it arrives instead of filling 512-byte reads
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if event.get("base_resp", {}).get("status_code", 0) != 0:
+                    raise RuntimeError(event["base_resp"].get("status_msg", "Unknown API Error"))
+                for choice in event.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        started = True
+                        yield delta
+
+    except Exception as e:
+        if started or not mock:
+            raise
+        logger.error(f"Minimax Connection Error: {e}. Falling back to Smart Mock.")
+        yield from _mock_stream(messages)
@@ -0,0 +1,102 @@
+import os
+import json
+import base64
+
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "50"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "200"))
+
+# Header carrying the token for the next page; list bodies stay plain JSON arrays
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Characters PostgREST treats as syntax inside or=(...) / and(...)
+_RESERVED = set(',.:()"')
+
+
+def page_size(limit=None):
+    """Requested page size clamped to 1..PAGE_SIZE_MAX."""
+    return max(1, min(limit or PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX))
+
+
+def encode_cursor(row, columns):
+    """Opaque token for the position just after `row` in the (columns) sort order."""
+    values = [row.get(c) for c in columns]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, columns):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if (not isinstance(values, list) or len(values) != len(columns)
+            or not all(v is None or isinstance(v, (str, int, float)) and not isinstance(v, bool) for v in values)):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _literal(value):
+    text = str(value)
+    if any(ch in _RESERVED for ch in text):
+        return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return text
+
+
+def _equal(column, value):
+    return f"{column}.is.null" if value is None else f"{column}.eq.{_literal(value)}"
+
+
+def keyset_filter(columns, values, desc=False):
+    """
+    Rows strictly after `values` in the (columns) order, as a PostgREST or-tree:
+    (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z).
+    Nulls sort the way Postgres sorts them by default, last ascending and
+    first descending: ascending, a null comes after any x (a > x OR a IS NULL)
+    and nothing comes after a null; descending, everything non-null comes
+    after a null. The last column is never null (it's the unique id).
+    """
+    op = "lt" if desc else "gt"
+    clauses = []
+    for i, column in enumerate(columns):
+        prefix = [_equal(c, v) for c, v in zip(columns[:i], values[:i])]
+        value = values[i]
+        if value is None:
+            after = [f"{column}.not.is.null"] if desc else []
+        else:
+            after = [f"{column}.{op}.{_literal(value)}"]
+            if not desc and i < len(columns) - 1:
+                after.append(f"{column}.is.null")
+        for part in after:
+            parts = prefix + [part]
+            clauses.append(parts[0] if len(parts) == 1 else f"and({','.join(parts)})")
+    return ",".join(clauses)
+
+
+def paginate(query, columns, cursor=None, limit=None, desc=False):
+    """
+    Orders `query` by `columns` (the last one must be unique and not null, e.g. id), seeks
+    past `cursor` and asks for one row more than the page so split_page can
+    tell whether another page exists. Returns (query, size).
+    Raises ValueError for a cursor that wasn't produced by encode_cursor.
+    """
+    size = page_size(limit)
+    for column in columns:
+        query = query.order(column, desc=desc)
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        query = query.or_(keyset_filter(columns, values, desc))
+        # Redundant with the or-tree, but gives the planner an index range to seek to.
+        # Ascending, the nulls after the cursor are still to come
+        first, value = columns[0], values[0]
+        if value is not None and first not in query.params and "and" not in query.params:
+            query = query.lte(first, value) if desc \
+                else query.and_(f"or({first}.gte.{_literal(value)},{first}.is.null)")
+    return query.limit(size + 1), size
+
+
+def split_page(rows, columns, size):
+    """Returns (rows of this page, cursor for the next page or None)."""
+    if len(rows) > size:
+        return rows[:size], encode_cursor(rows[size - 1], columns)
+    return rows, None
@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import threading
+
+import requests
+
+from app.services.cache import create_cache, MISSING
+from app.services.singleflight import SingleFlight
+from app.services.supabase_rest import PoolStats, build_session
+
+PAYMENT_SWITCH_URL = os.getenv("PAYMENT_SWITCH_URL", "https://payment-switch.urbansmart34.com")
+PAYMENT_SWITCH_STORE_ID = os.getenv("PAYMENT_SWITCH_STORE_ID", "811298f2-31aa-4e90-9071-41999bfe47a0")
+PAYMENT_SWITCH_POOL_MAXSIZE = int(os.getenv("PAYMENT_SWITCH_POOL_MAXSIZE", "20"))
+PAYMENT_SWITCH_CONNECT_TIMEOUT = float(os.getenv("PAYMENT_SWITCH_CONNECT_TIMEOUT", "3.05"))
+PAYMENT_SWITCH_READ_TIMEOUT = float(os.getenv("PAYMENT_SWITCH_READ_TIMEOUT", "10"))
+# Retries of a checkout on 502/503/504 or a refused connection. Read timeouts are
+# not retried: the switch may have created the checkout and just be slow to say so
+PAYMENT_SWITCH_RETRIES = int(os.getenv("PAYMENT_SWITCH_RETRIES", "2"))
+PAYMENT_SWITCH_RETRY_BACKOFF = float(os.getenv("PAYMENT_SWITCH_RETRY_BACKOFF", "0.2"))
+# How long a repeated submission gets the checkout that was already created
+# (about a checkout session's lifetime)
+PAYMENT_IDEMPOTENCY_TTL = float(os.getenv("PAYMENT_IDEMPOTENCY_TTL", "1800"))
+PAYMENT_IDEMPOTENCY_MAXSIZE = int(os.getenv("PAYMENT_IDEMPOTENCY_MAXSIZE", "10000"))
+
+# Metadata that identifies what is being paid for, when there is no booking id yet
+BOOKING_FIELDS = ("booking_ids", "booking_id", "trip_id", "user_id", "seats")
+
+
+class PaymentSwitchError(Exception):
+    """The switch answered with an error. status is its HTTP status."""
+    def __init__(self, status, detail):
+        super().__init__(f"Payment Switch Error: {detail}")
+        self.status = status
+        self.detail = detail
+
+
+class PaymentSwitchUnavailable(Exception):
+    """The switch couldn't be reached or didn't answer within the timeouts."""
+
+
+def idempotency_key(store_id, amount_cents, currency, metadata, client_key=None):
+    """
+    Same booking, amount and currency -> same key, so a double-clicked "Pay" or
+    a client retry maps to one checkout. A client's own key is hashed in with
+    the booking fields (booking ids, user), not instead of them, so the same
+    key from another user, for other bookings or another amount gets a new
+    checkout rather than someone else's. None if nothing says what is being
+    paid for.
+    """
+    booking = {}
+    for k in BOOKING_FIELDS:
+        value = metadata.get(k)
+        if isinstance(value, (list, tuple)):
+            value = sorted(str(v) for v in value)
+        if value is not None:
+            booking[k] = value
+    if client_key:
+        booking["client_key"] = client_key
+    if not booking:
+        return None
+    raw = json.dumps([store_id, amount_cents, currency.upper(), booking], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+class PaymentSwitchStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0  # created at the switch
+        self.replays = 0    # repeat submissions answered from the idempotency store
+        self.coalesced = 0  # concurrent repeats that waited for the first one
+        self.errors = 0     # switch errors (4xx/5xx after retries)
+        self.unavailable = 0  # timeouts / connection failures
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {"checkouts": self.checkouts, "replays": self.replays, "coalesced": self.coalesced,
+                    "errors": self.errors, "unavailable": self.unavailable}
+
+
+class PaymentSwitchClient:
+    """
+    Client for the Payment Switch:
+
+    - one keep-alive session with a bounded pool (PAYMENT_SWITCH_POOL_MAXSIZE)
+    - connect/read timeouts on every call, so a slow switch can't hold a
+      worker thread for longer than (retries + 1) x (connect + read) timeout
+    - a checkout is only retried on 502/503/504 when it carries an
+      Idempotency-Key; without one a retry could create a second checkout
+    - an Idempotency-Key per booking and amount, sent to the switch and used
+      locally: a repeat submission within PAYMENT_IDEMPOTENCY_TTL gets the
+      checkout already created, and concurrent repeats share one call
+    """
+    def __init__(self, base_url=PAYMENT_SWITCH_URL, store_id=PAYMENT_SWITCH_STORE_ID,
+                 pool_maxsize=PAYMENT_SWITCH_POOL_MAXSIZE,
+                 timeout=(PAYMENT_SWITCH_CONNECT_TIMEOUT, PAYMENT_SWITCH_READ_TIMEOUT),
+                 retries=PAYMENT_SWITCH_RETRIES, backoff=PAYMENT_SWITCH_RETRY_BACKOFF,
+                 idempotency_ttl=PAYMENT_IDEMPOTENCY_TTL):
+        self.base_url = base_url.rstrip("/")
+        self.store_id = store_id
+        self.timeout = timeout
+        self.pool_stats = PoolStats()
+        # A keyed checkout carries its Idempotency-Key, so the switch dedupes a retried POST
+        self.session = build_session(self.pool_stats, pool_connections=1, pool_maxsize=pool_maxsize,
+                                     retries=retries, backoff=backoff, retry_methods=("POST",), read_retries=0)
+        # Without a key (the default retry_methods leave POST out) only a connection
+        # that was never established is retried
+        self.unkeyed_session = build_session(self.pool_stats, pool_connections=1, pool_maxsize=pool_maxsize,
+                                             retries=retries, backoff=backoff, read_retries=0)
+        self.store = create_cache("payments:checkouts", maxsize=PAYMENT_IDEMPOTENCY_MAXSIZE, ttl=idempotency_ttl)
+        self.flight = SingleFlight()
+        self.stats = PaymentSwitchStats()
+
+    def create_checkout(self, amount_cents, currency="ZAR", metadata=None, origin=None, key=None):
+        """
+        {"checkoutUrl", "transactionId"}. `key` (a client's Idempotency-Key) replaces
+        the booking fields in the derived key; the amount and currency still count.
+        Raises PaymentSwitchError / PaymentSwitchUnavailable.
+        """
+        metadata = metadata or {}
+        key = idempotency_key(self.store_id, amount_cents, currency, metadata, client_key=key)
+        if key is None:
+            return self._post(amount_cents, currency, metadata, origin, None)
+
+        checkout = self.store.get(key)
+        if checkout is not MISSING:
+            self.stats.incr("replays")
+            return checkout
+        led = False
+
+        def create():
+            nonlocal led
+            led = True
+            checkout = self._post(amount_cents, currency, metadata, origin, key)
+            self.store.set(key, checkout)
+            return checkout
+
+        checkout = self.flight.do(key, create)
+        if not led:
+            self.stats.incr("coalesced")
+        return checkout
+
+    def _post(self, amount_cents, currency, metadata, origin, key):
+        headers = {"Content-Type": "application/json"}
+        if origin:
+            headers["origin"] = origin
+        if key:
+            headers["Idempotency-Key"] = key
+        payload = {"amount": amount_cents, "currency": currency, "storeId": self.store_id, "metadata": metadata}
+        self.pool_stats.incr("requests")
+        session = self.session if key else self.unkeyed_session
+        try:
+            response = session.post(f"{self.base_url}/api/process-payment", json=payload,
+                                         headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self.pool_stats.incr("errors")
+            self.stats.incr("unavailable")
+            raise PaymentSwitchUnavailable(str(e)) from e
+
+        if not response.ok:
+            detail = response.text
+            try:
+                detail = response.json()
+            except ValueError:
+                pass
+            self.stats.incr("errors")
+            raise PaymentSwitchError(response.status_code, detail)
+        data = response.json()
+        self.stats.incr("checkouts")
+        return {"checkoutUrl": data.get("checkoutUrl"), "transactionId": data.get("transactionId")}
+
+    def info(self):
+        return {**self.stats.snapshot(), "pool": self.pool_stats.snapshot(), "idempotency_store": self.store.info()}
+
+
+payment_switch = PaymentSwitchClient()
@@ -0,0 +1,431 @@
+import os
+import hmac
+import time
+import base64
+import asyncio
+import hashlib
+import datetime
+import threading
+
+import requests
+
+from app.services.escrow import escrow_scheduler
+from app.services.supabase_rest import PoolStats, build_session
+from app.services.work_queue import WorkQueue
+
+# The queue is a local SQLite file: accepted events survive a restart of the API
+PAYMENT_QUEUE_PATH = os.getenv("PAYMENT_QUEUE_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "payment_queue.sqlite3"))
+PAYMENT_VERIFY_WORKERS = int(os.getenv("PAYMENT_VERIFY_WORKERS", "4"))
+# Jobs a worker takes at a time: one read and one write to the database per batch
+PAYMENT_VERIFY_BATCH = int(os.getenv("PAYMENT_VERIFY_BATCH", "50"))
+# A worker that dies mid-batch gives its jobs back after this long
+PAYMENT_VERIFY_LEASE = float(os.getenv("PAYMENT_VERIFY_LEASE", "60"))
+PAYMENT_VERIFY_IDLE_MS = float(os.getenv("PAYMENT_VERIFY_IDLE_MS", "250"))
+# A verification that still finds the checkout in progress looks again this much later
+PAYMENT_VERIFY_RETRY = float(os.getenv("PAYMENT_VERIFY_RETRY", "5"))
+# Payments still pending PAYMENT_POLL_AFTER seconds after the checkout are looked
+# up at the provider every PAYMENT_POLL_INTERVAL, for up to PAYMENT_POLL_MAX_AGE
+# (a missed webhook or a user who never came back to the site)
+PAYMENT_POLL_AFTER = float(os.getenv("PAYMENT_POLL_AFTER", "300"))
+PAYMENT_POLL_INTERVAL = float(os.getenv("PAYMENT_POLL_INTERVAL", "60"))
+PAYMENT_POLL_MAX_AGE = float(os.getenv("PAYMENT_POLL_MAX_AGE", str(24 * 3600)))
+PAYMENT_POLL_LIMIT = int(os.getenv("PAYMENT_POLL_LIMIT", "500"))
+
+YOCO_API_URL = os.getenv("YOCO_API_URL", "https://payments.yoco.com/api")
+YOCO_SECRET_KEY = os.getenv("YOCO_SECRET_KEY", "")
+# Local development without YOCO_SECRET_KEY: "1" marks a checkout paid when the user
+# comes back from it. Otherwise those payments stay pending until a webhook says more
+PAYMENT_TRUST_REDIRECT = os.getenv("PAYMENT_TRUST_REDIRECT", "0") == "1"
+# "whsec_..." from the webhook subscription; without it /payments/webhook refuses every event
+YOCO_WEBHOOK_SECRET = os.getenv("YOCO_WEBHOOK_SECRET", "")
+YOCO_WEBHOOK_TOLERANCE = float(os.getenv("YOCO_WEBHOOK_TOLERANCE", "300"))
+YOCO_CONNECT_TIMEOUT = float(os.getenv("YOCO_CONNECT_TIMEOUT", "3.05"))
+YOCO_READ_TIMEOUT = float(os.getenv("YOCO_READ_TIMEOUT", "10"))
+
+# Provider statuses -> payments.status (pending | succeeded | failed)
+STATUSES = {
+    "succeeded": "succeeded", "completed": "succeeded", "successful": "succeeded", "paid": "succeeded",
+    "failed": "failed", "expired": "failed", "cancelled": "failed", "canceled": "failed",
+}
+# The payments columns the workers write (every row of a batch has all of them)
+PAYMENT_FIELDS = ("checkout_id", "status", "user_id", "trip_id", "booking_ids", "seats", "amount_cents", "currency",
+                  "transaction_id", "provider_status", "verified_at", "updated_at")
+DETAIL_FIELDS = ("user_id", "trip_id", "booking_ids", "seats", "amount_cents", "currency", "transaction_id")
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def normalize_status(status):
+    return STATUSES.get(str(status or "").lower(), "pending")
+
+
+def sign_webhook(secret, message_id, timestamp, body):
+    """The v1 signature of a webhook (HMAC-SHA256 of "id.timestamp.body", base64)."""
+    key = base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret)
+    signed = f"{message_id}.{timestamp}.".encode() + body
+    return base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode()
+
+
+def verify_webhook(secret, headers, body, now=None, tolerance=YOCO_WEBHOOK_TOLERANCE):
+    """
+    True if the webhook-id / webhook-timestamp / webhook-signature headers
+    sign `body` (bytes) with `secret` and the timestamp is recent, so a
+    captured event can't be replayed later.
+    """
+    message_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature")
+    if not (message_id and timestamp and signatures):
+        return False
+    try:
+        if abs((now or time.time()) - int(timestamp)) > tolerance:
+            return False
+        expected = sign_webhook(secret, message_id, timestamp, body)
+    except ValueError:
+        return False
+    # Space-separated "v1,<signature>" entries (several while the secret is rotated)
+    return any(hmac.compare_digest(expected, entry.partition(",")[2]) for entry in signatures.split())
+
+
+def parse_event(event):
+    """
+    The payment update a provider event carries ({"checkout_id", "status", ...}),
+    or None if it isn't about a checkout (e.g. a refund of something else).
+    """
+    payload = event.get("payload") or {}
+    metadata = payload.get("metadata") or {}
+    checkout_id = metadata.get("checkoutId") or payload.get("checkoutId") or metadata.get("transactionId")
+    if not checkout_id:
+        return None
+    kind = str(event.get("type") or "")
+    reported = kind.rpartition(".")[2] if kind.startswith("payment.") else payload.get("status")
+    update = {"checkout_id": str(checkout_id), "status": normalize_status(reported),
+              "provider_status": payload.get("status") or kind, "transaction_id": payload.get("id"),
+              "amount_cents": payload.get("amount"), "currency": payload.get("currency")}
+    for field in ("user_id", "trip_id", "seats"):
+        update[field] = metadata.get(field)
+    # The metadata the checkout was created with; a provider may hand lists back joined
+    booking_ids = metadata.get("booking_ids")
+    if isinstance(booking_ids, str):
+        booking_ids = [i for i in booking_ids.split(",") if i]
+    update["booking_ids"] = booking_ids or None
+    return update
+
+
+def merge(current, update, now):
+    """
+    The payments row after applying `update` to `current` (None: no row yet),
+    or None if nothing changes. "succeeded" is final; "pending" never
+    overwrites a result; details only fill in what is missing.
+    """
+    row = dict(current) if current else {"checkout_id": update["checkout_id"], "status": "pending"}
+    changed = current is None
+    for field in DETAIL_FIELDS:
+        if update.get(field) is not None and row.get(field) is None:
+            row[field] = update[field]
+            changed = True
+    status = update.get("status") or "pending"
+    if status != "pending" and row["status"] not in ("succeeded", status):
+        row["status"] = status
+        row["provider_status"] = update.get("provider_status")
+        row["verified_at"] = now
+        changed = True
+    if not changed:
+        return None
+    row["updated_at"] = now
+    return {field: row.get(field) for field in PAYMENT_FIELDS}
+
+
+class RetryLater(Exception):
+    """The checkout is still in progress at the provider; look again in `delay` seconds."""
+    def __init__(self, delay):
+        super().__init__(f"checkout still in progress, retrying in {delay:.0f}s")
+        self.delay = delay
+
+
+class CheckoutLookup:
+    """Asks the provider for a checkout's status, on a pooled, timeout-bound session."""
+    def __init__(self, base_url=YOCO_API_URL, secret_key=YOCO_SECRET_KEY, pool_maxsize=PAYMENT_VERIFY_WORKERS * 4,
+                 timeout=(YOCO_CONNECT_TIMEOUT, YOCO_READ_TIMEOUT)):
+        self.base_url = base_url.rstrip("/")
+        self.secret_key = secret_key
+        self.timeout = timeout
+        self.pool_stats = PoolStats()
+        self.session = build_session(self.pool_stats, pool_connections=1, pool_maxsize=pool_maxsize)
+
+    @property
+    def configured(self):
+        return bool(self.secret_key)
+
+    def status(self, checkout_id):
+        """(status, provider details). Raises on errors, so the job is retried."""
+        self.pool_stats.incr("requests")
+        try:
+            response = self.session.get(f"{self.base_url}/checkouts/{checkout_id}", timeout=self.timeout,
+                                        headers={"Authorization": f"Bearer {self.secret_key}"})
+        except requests.exceptions.RequestException:
+            self.pool_stats.incr("errors")
+            raise
+        if response.status_code == 404:
+            return "failed", {"provider_status": "not_found"}
+        if not response.ok:
+            raise RuntimeError(f"checkout lookup failed with status {response.status_code}")
+        data = response.json()
+        return normalize_status(data.get("status")), {"provider_status": data.get("status"),
+                                                      "transaction_id": data.get("paymentId")}
+
+
+class PaymentVerifier:
+    """
+    Payment verification off the request path. Endpoints only put work on a
+    durable local queue (webhook events, "verify this checkout", "a checkout
+    was created") and return; a pool of workers drains it:
+
+    - jobs of one checkout run one at a time, in arrival order (the queue's
+      order key), so a worker can read the payment, merge and write it back
+    - per batch, one query loads the batch's payments and one upsert writes
+      the ones that changed; a trigger gives the payment's bookings the
+      result, and the escrow scheduler holds the fares of those now paid
+    - "verify" jobs look the checkout up at the provider; if it's still in
+      progress the job is retried later, and a poller re-checks payments left
+      pending by a missed webhook
+
+    Handlers are idempotent: a redelivered webhook is dropped by its event id,
+    and a job that runs twice (a worker died mid-batch) merges to the same row.
+    Nothing is processed until start() gives it a database client.
+    """
+    def __init__(self, queue_path=PAYMENT_QUEUE_PATH, workers=PAYMENT_VERIFY_WORKERS,
+                 batch_size=PAYMENT_VERIFY_BATCH, lease=PAYMENT_VERIFY_LEASE, lookup=None, escrow=None):
+        self.queue_path = queue_path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.lease = lease
+        self.lookup = lookup or CheckoutLookup()
+        self.escrow = escrow or escrow_scheduler
+        self.client = None
+        self._queue = None
+        self._queue_lock = threading.Lock()
+        self._loop = None
+        self._wake = None
+        self._tasks = []
+        self._counter_lock = threading.Lock()
+        self.counters = {"processed": 0, "retried": 0, "dead": 0, "batches": 0, "lookups": 0,
+                         "unverified": 0, "payments_written": 0, "ignored_events": 0}
+
+    @property
+    def queue(self):
+        # Opened on first use, not at import
+        if self._queue is None:
+            with self._queue_lock:
+                if self._queue is None:
+                    self._queue = WorkQueue(self.queue_path)
+        return self._queue
+
+    def _count(self, name, amount=1):
+        with self._counter_lock:
+            self.counters[name] += amount
+
+    # --- ingestion (called by the endpoints) ---
+
+    def ingest_event(self, event_id, event):
+        """Queues a provider event. "queued", "duplicate" (already seen) or "ignored"."""
+        update = parse_event(event)
+        if update is None:
+            self._count("ignored_events")
+            return "ignored"
+        queued = self.queue.enqueue("update", update, dedupe_key=f"event:{event_id}", order_key=update["checkout_id"])
+        self._notify()
+        return "queued" if queued else "duplicate"
+
+    def request_verification(self, checkout_id, details=None):
+        """Queues a lookup of the checkout at the provider (once per checkout). False if already queued."""
+        payload = {**(details or {}), "checkout_id": str(checkout_id), "retry_pending": True}
+        queued = self.queue.enqueue("verify", payload, dedupe_key=f"verify:{checkout_id}", order_key=str(checkout_id))
+        self._notify()
+        return queued
+
+    def record_checkout(self, checkout_id, details):
+        """Queues the pending payment row for a checkout that was just created."""
+        payload = {**details, "checkout_id": str(checkout_id), "status": "pending"}
+        queued = self.queue.enqueue("update", payload, dedupe_key=f"checkout:{checkout_id}", order_key=str(checkout_id))
+        self._notify()
+        return queued
+
+    def _notify(self):
+        # Endpoints run on the event loop or in the threadpool. From another thread
+        # the loop has to be woken through its self-pipe, a syscall per call
+        if self._loop is None or self._wake.is_set():
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # --- workers ---
+
+    def start(self, client):
+        """Starts the workers and the poller on the running event loop."""
+        self.client = client
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poll()))
+
+    async def stop(self):
+        """Stops the workers. Jobs they were holding run again after their lease."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    async def _work(self):
+        while True:
+            try:
+                jobs = await asyncio.to_thread(self.queue.claim, self.batch_size, self.lease)
+                if jobs:
+                    await self.process(jobs)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Payment verification worker error: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), PAYMENT_VERIFY_IDLE_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def process(self, jobs):
+        """Runs one claimed batch (distinct checkouts) and completes / retries its jobs."""
+        # Only "verify" jobs wait on the provider; their lookups run concurrently
+        verify = [job for job in jobs if job.kind == "verify"]
+        results = await asyncio.gather(*(self._lookup(job) for job in verify), return_exceptions=True)
+        updates = {job.id: job.payload for job in jobs if job.kind != "verify"}
+        failed = []
+        for job, result in zip(verify, results):
+            if isinstance(result, BaseException):
+                failed.append((job, result))
+            else:
+                updates[job.id] = result
+
+        try:
+            await self._apply(list(updates.values()))
+        except Exception as e:
+            print(f"Payment verification write failed, will retry: {e}")
+            failed += [(job, e) for job in jobs if job.id in updates]
+            updates = {}
+
+        await asyncio.to_thread(self.queue.complete, list(updates))
+        for job, error in failed:
+            state = await asyncio.to_thread(self.queue.fail, job, error, getattr(error, "delay", None))
+            self._count("dead" if state == "dead" else "retried")
+            if state == "dead":
+                print(f"Payment verification job {job.id} ({job.kind} {job.order_key}) gave up: {error}")
+        self._count("processed", len(updates))
+        self._count("batches")
+
+    async def _lookup(self, job):
+        """The payment update for a "verify" job: the checkout's status at the provider."""
+        update = dict(job.payload)
+        if not self.lookup.configured:
+            # No provider key: nothing to check the checkout against
+            self._count("unverified")
+            update.pop("retry_pending", None)
+            if PAYMENT_TRUST_REDIRECT:
+                update.update(status="succeeded", provider_status="unverified")
+            else:
+                update.update(status="pending")
+            return update
+        self._count("lookups")
+        status, details = await asyncio.to_thread(self.lookup.status, update["checkout_id"])
+        if status == "pending" and update.pop("retry_pending", False) and job.attempts < self.queue.max_attempts:
+            raise RetryLater(PAYMENT_VERIFY_RETRY * job.attempts)
+        update.update(details, status=status)
+        return update
+
+    async def _apply(self, updates):
+        if not updates:
+            return
+        checkout_ids = [u["checkout_id"] for u in updates]
+        response = await self.client.table("payments").select(",".join(PAYMENT_FIELDS)) \
+            .in_("checkout_id", checkout_ids).execute()
+        if response.status_code is None or response.status_code >= 400:
+            raise RuntimeError(f"payments query failed with status {response.status_code}")
+        current = {row["checkout_id"]: row for row in response.data or []}
+
+        now = _now()
+        merged = {}
+        for u in updates:
+            row = merge(current.get(u["checkout_id"]), u, now)
+            if row is not None:
+                merged[u["checkout_id"]] = row
+        rows = list(merged.values())
+        if rows:
+            # The payments_settle_bookings trigger (add_payments.sql) marks the bookings in the same transaction
+            response = await self.client.table("payments").upsert(rows, on_conflict="checkout_id").execute()
+            if response.status_code is None or response.status_code >= 400:
+                raise RuntimeError(f"payments write failed with status {response.status_code}")
+            self._count("payments_written", len(rows))
+
+        # Every payment of the batch that has its result, written now or by an earlier
+        # try of the job: holding the fares is idempotent, and a failure retries the job
+        results = [merged.get(c) or current.get(c) for c in checkout_ids]
+        succeeded = [b for row in results if row and row["status"] == "succeeded" for b in row.get("booking_ids") or ()]
+        failed = [b for row in results if row and row["status"] == "failed" for b in row.get("booking_ids") or ()]
+        if succeeded or failed:
+            await self.escrow.payments_settled(succeeded, failed)
+
+    # --- poller ---
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(PAYMENT_POLL_INTERVAL)
+            try:
+                await self.poll_pending()
+                await asyncio.to_thread(self.queue.purge)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Payment verification poll failed: {e}")
+
+    async def poll_pending(self):
+        """Queues a lookup of payments pending for too long. Returns how many were queued."""
+        if not self.lookup.configured:
+            return 0
+        now = datetime.datetime.now(datetime.timezone.utc)
+        response = await self.client.table("payments").select("checkout_id").eq("status", "pending") \
+            .lt("created_at", (now - datetime.timedelta(seconds=PAYMENT_POLL_AFTER)).isoformat()) \
+            .gt("created_at", (now - datetime.timedelta(seconds=PAYMENT_POLL_MAX_AGE)).isoformat()) \
+            .order("created_at").limit(PAYMENT_POLL_LIMIT).execute()
+        if response.status_code is None or response.status_code >= 400:
+            raise RuntimeError(f"pending payments query failed with status {response.status_code}")
+        # One lookup per checkout per interval, however often this runs
+        bucket = int(now.timestamp() // PAYMENT_POLL_INTERVAL)
+        items = [("verify", {"checkout_id": row["checkout_id"]}, f"poll:{row['checkout_id']}:{bucket}",
+                  row["checkout_id"]) for row in response.data or []]
+        queued = await asyncio.to_thread(self.queue.enqueue_many, items) if items else 0
+        if queued:
+            self._notify()
+        return queued
+
+    def info(self):
+        with self._counter_lock:
+            counters = dict(self.counters)
+        return {"running": bool(self._tasks), "workers": self.workers, "verified_with_provider": self.lookup.configured,
+                "trust_redirect": PAYMENT_TRUST_REDIRECT and not self.lookup.configured,
+                "queue": {**self.queue.counts(), "enqueued": self.queue.enqueued, "duplicates": self.queue.duplicates},
+                **counters, "lookup_pool": self.lookup.pool_stats.snapshot()}
+
+    def dead_jobs(self, limit=50):
+        return self.queue.dead_jobs(limit)
+
+
+payment_verifier = PaymentVerifier()
@@ -0,0 +1,462 @@
+import os
+import time
+import asyncio
+import datetime
+from collections import deque
+
+from app.services.trip_cache import normalize
+from app.services.pagination import keyset_filter
+from app.services.metrics import parse_timestamp
+from app.services.geofences import trip_zone, CLOSED_STATUSES
+
+# Fare for a route with a known distance (route_distances), before multipliers;
+# routes without one start from the trip's listed price
+PRICING_RATE_PER_KM = float(os.getenv("PRICING_RATE_PER_KM", "1.50"))
+PRICING_MIN_FARE = float(os.getenv("PRICING_MIN_FARE", "30"))
+# Seats: the last of PRICING_SEAT_CAPACITY seats costs up to PRICING_SCARCITY more
+PRICING_SEAT_CAPACITY = int(os.getenv("PRICING_SEAT_CAPACITY", "4"))
+PRICING_SCARCITY = float(os.getenv("PRICING_SCARCITY", "0.3"))
+# Time to departure: up to PRICING_LATE_PREMIUM more in the last PRICING_LATE_HOURS,
+# PRICING_EARLY_DISCOUNT less more than PRICING_EARLY_DAYS ahead
+PRICING_LATE_HOURS = float(os.getenv("PRICING_LATE_HOURS", "24"))
+PRICING_LATE_PREMIUM = float(os.getenv("PRICING_LATE_PREMIUM", "0.15"))
+PRICING_EARLY_DAYS = float(os.getenv("PRICING_EARLY_DAYS", "7"))
+PRICING_EARLY_DISCOUNT = float(os.getenv("PRICING_EARLY_DISCOUNT", "0.1"))
+# Demand: a route's searches and booked seats over the last PRICING_DEMAND_WINDOW
+# seconds against its rate over PRICING_DEMAND_BASELINE. PRICING_DEMAND_PRIOR
+# events per hour are added to both so a quiet route doesn't swing on one search
+PRICING_DEMAND_WINDOW = float(os.getenv("PRICING_DEMAND_WINDOW", "3600"))
+PRICING_DEMAND_BASELINE = float(os.getenv("PRICING_DEMAND_BASELINE", "86400"))
+PRICING_DEMAND_PRIOR = float(os.getenv("PRICING_DEMAND_PRIOR", "5"))
+PRICING_DEMAND_ELASTICITY = float(os.getenv("PRICING_DEMAND_ELASTICITY", "0.25"))
+PRICING_DEMAND_MIN = float(os.getenv("PRICING_DEMAND_MIN", "0.9"))
+PRICING_DEMAND_MAX = float(os.getenv("PRICING_DEMAND_MAX", "1.3"))
+# A booked seat counts as this many searches
+PRICING_BOOKING_WEIGHT = float(os.getenv("PRICING_BOOKING_WEIGHT", "5"))
+# All multipliers together stay within these bounds of the base fare
+PRICING_MIN_MULTIPLIER = float(os.getenv("PRICING_MIN_MULTIPLIER", "0.8"))
+PRICING_MAX_MULTIPLIER = float(os.getenv("PRICING_MAX_MULTIPLIER", "1.6"))
+PRICING_ROUND_TO = float(os.getenv("PRICING_ROUND_TO", "0.5"))
+# Demand is counted per worker, so workers' prices drift apart a little: a
+# booking quoted (by whichever worker) within this fraction of the booking
+# worker's price is charged the higher of the two, else refused
+PRICING_QUOTE_TOLERANCE = float(os.getenv("PRICING_QUOTE_TOLERANCE", "0.1"))
+# Background work: new trips and demand changes every PRICING_REFRESH seconds,
+# every price (time to departure moves) every PRICING_FULL_REPRICE, and seats
+# booked through other workers every PRICING_RESYNC
+PRICING_REFRESH = float(os.getenv("PRICING_REFRESH", "5"))
+PRICING_FULL_REPRICE = float(os.getenv("PRICING_FULL_REPRICE", "300"))
+PRICING_RESYNC = float(os.getenv("PRICING_RESYNC", "600"))
+
+TRIP_COLUMNS = "id,origin,destination,date,time,departs_at,price,seats_available,status,created_at"
+_PAGE_SIZE = 1000
+# Slices per demand window: the window slides one slice at a time
+_WINDOW_SLICES = 60
+
+
+def route_key(origin, destination):
+    return (normalize(origin), normalize(destination))
+
+
+def departure_time(trip):
+    """Unix time a trips row departs: departs_at, else its local date and time; None if unparseable."""
+    departs_at = parse_timestamp(trip.get("departs_at"))
+    if departs_at is not None:
+        return departs_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+    try:
+        local = datetime.datetime.strptime(f"{trip.get('date')} {str(trip.get('time'))[:5]}", "%Y-%m-%d %H:%M")
+    except ValueError:
+        return None
+    return local.replace(tzinfo=trip_zone()).timestamp()
+
+
+async def fetch_route_distances(client):
+    """route -> km from route_distances, both directions (a reverse row, if any, wins for its direction)."""
+    response = await client.table("route_distances").select("origin,destination,distance_km").execute()
+    if response.status_code is None or response.status_code >= 400:
+        raise RuntimeError(f"route_distances query failed with status {response.status_code}")
+    distances = {}
+    for row in response.data or []:
+        km = float(row["distance_km"])
+        distances[route_key(row["origin"], row["destination"])] = km
+        distances.setdefault(route_key(row["destination"], row["origin"]), km)
+    return distances
+
+
+class WindowCounter:
+    """
+    Events per key over the last `window` seconds, kept as counts per slice
+    of window / slices seconds (only slices that saw events are stored), so
+    the window slides a slice at a time and a total is a running sum.
+    """
+    def __init__(self, window, slices=_WINDOW_SLICES):
+        self.width = window / slices
+        self.slices = slices
+        self._keys = {}  # key -> [deque of [slice, count], total]
+
+    def _expire(self, entry, current):
+        counts = entry[0]
+        while counts and counts[0][0] <= current - self.slices:
+            entry[1] -= counts.popleft()[1]
+
+    def add(self, key, amount, now):
+        current = int(now // self.width)
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = self._keys[key] = [deque(), 0]
+        counts = entry[0]
+        if counts and counts[-1][0] == current:
+            counts[-1][1] += amount
+        else:
+            counts.append([current, amount])
+            self._expire(entry, current)
+        entry[1] += amount
+
+    def total(self, key, now):
+        entry = self._keys.get(key)
+        if entry is None:
+            return 0
+        self._expire(entry, int(now // self.width))
+        return entry[1]
+
+    def prune(self, now):
+        """Drops keys with nothing left in the window."""
+        current = int(now // self.width)
+        for key in list(self._keys):
+            entry = self._keys[key]
+            self._expire(entry, current)
+            if not entry[0]:
+                del self._keys[key]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class RouteDemand:
+    """Searches and booked seats per route, recent against baseline, as a price multiplier."""
+    def __init__(self, window=PRICING_DEMAND_WINDOW, baseline=PRICING_DEMAND_BASELINE):
+        self.window = window
+        self.baseline = baseline
+        self.recent = WindowCounter(window)
+        self.history = WindowCounter(baseline)
+        self.touched = set()  # routes with events since the last reprice
+
+    def record(self, route, weight, now):
+        self.recent.add(route, weight, now)
+        self.history.add(route, weight, now)
+        self.touched.add(route)
+
+    def multiplier(self, route, now):
+        recent = self.recent.total(route, now) * 3600 / self.window
+        usual = self.history.total(route, now) * 3600 / self.baseline
+        ratio = (recent + PRICING_DEMAND_PRIOR) / (usual + PRICING_DEMAND_PRIOR)
+        # Two decimals: small drifts in demand don't reprice a route
+        return round(min(max(ratio ** PRICING_DEMAND_ELASTICITY, PRICING_DEMAND_MIN), PRICING_DEMAND_MAX), 2)
+
+    def prune(self, now):
+        """Forgets routes with no events left in the baseline."""
+        self.recent.prune(now)
+        self.history.prune(now)
+
+
+class PricedTrip:
+    __slots__ = ("route", "base", "listed", "seats", "departs", "price")
+
+    def __init__(self, route, base, listed, seats, departs):
+        self.route = route
+        self.base = base
+        self.listed = listed
+        self.seats = seats
+        self.departs = departs
+        self.price = None
+
+
+class PriceChanged(Exception):
+    """The quoted price is too far from the trip's current one; .price is the current price."""
+    def __init__(self, trip_id, price):
+        super().__init__(f"the price of trip {trip_id} is now {price:.2f}")
+        self.price = price
+
+
+class PriceTable:
+    """
+    Current price of every upcoming trip, precomputed so reads are a dict
+    lookup: search_trips, get_trip and the AI trip context overlay the
+    table's price on the rows they return, and bookings are charged it, or
+    the quote the traveller saw if that was a little higher (charge()).
+
+    price = base fare (route km x PRICING_RATE_PER_KM, or the listed price)
+            x seats left x time to departure x route demand
+    clamped to PRICING_MIN/MAX_MULTIPLIER of the base and rounded to
+    PRICING_ROUND_TO. Repricing is incremental: a booking reprices its trip,
+    a route whose demand multiplier moved reprices its trips, and only the
+    periodic full pass (time to departure) touches every trip. New trips
+    are loaded by (created_at, id) like the gazetteer. Call from one thread
+    (the event loop).
+    """
+    def __init__(self, demand=None, clock=time.time):
+        self.demand = demand if demand is not None else RouteDemand()
+        self.clock = clock
+        self.trips = {}       # trip id -> PricedTrip
+        self.routes = {}      # route -> set of trip ids
+        self.prices = {}      # trip id -> price: the read path
+        self.distances = {}   # route -> km (both directions)
+        self._demand = {}     # route -> demand multiplier its prices were computed with
+        self.cursor = None    # (created_at, id) of the newest trip loaded
+        self.client = None
+        self._task = None
+        self.counters = {"repriced": 0, "changed": 0, "full_passes": 0, "searches": 0, "bookings": 0,
+                         "loaded": 0}
+
+    def __len__(self):
+        return len(self.trips)
+
+    # --- the read path ---
+
+    def price(self, trip_id):
+        """The trip's current price, or None if it isn't priced (the listed price stands)."""
+        return self.prices.get(trip_id)
+
+    def charge(self, trip_id, quoted=None, tolerance=PRICING_QUOTE_TOLERANCE):
+        """
+        The unit price to charge for a booking on the trip: the current price,
+        or the `quoted` one if that is higher and within `tolerance` (another
+        worker may have quoted it; the client sends it, so it never lowers the
+        price). None if the trip isn't priced (the listed price stands).
+        Raises PriceChanged when the quote is further off either way.
+        """
+        current = self.prices.get(trip_id)
+        if quoted is None or current is None:
+            return current
+        if abs(quoted - current) > current * tolerance:
+            raise PriceChanged(trip_id, current)
+        return max(quoted, current)
+
+    def apply(self, trips):
+        """The rows with their current price; changed rows are copies (the originals may be cached)."""
+        prices = self.prices
+        priced = []
+        for trip in trips:
+            price = prices.get(trip.get("id"))
+            priced.append(trip if price is None or price == trip.get("price") else {**trip, "price": price})
+        return priced
+
+    # --- demand ---
+
+    def record_search(self, origin, destination):
+        self.counters["searches"] += 1
+        self.demand.record(route_key(origin, destination), 1, self.clock())
+
+    def record_booking(self, trip_id, seats):
+        trip = self.trips.get(trip_id)
+        if trip is not None:
+            self.counters["bookings"] += seats
+            self.demand.record(trip.route, seats * PRICING_BOOKING_WEIGHT, self.clock())
+
+    # --- trips ---
+
+    def base_fare(self, route, listed):
+        km = self.distances.get(route)
+        if km is None:
+            return listed
+        return max(PRICING_MIN_FARE, km * PRICING_RATE_PER_KM)
+
+    def upsert(self, row):
+        """Adds or updates a trips row (full columns); returns its price, or None if it isn't priced."""
+        trip_id = row["id"]
+        departs = departure_time(row)
+        listed = row.get("price")
+        if row.get("status") in CLOSED_STATUSES or departs is None or listed is None or departs <= self.clock():
+            self.remove(trip_id)
+            return None
+        route = route_key(row.get("origin"), row.get("destination"))
+        trip = self.trips.get(trip_id)
+        if trip is not None and trip.route != route:
+            self.remove(trip_id)
+            trip = None
+        if trip is None:
+            trip = self.trips[trip_id] = PricedTrip(route, 0.0, 0.0, 0, departs)
+            self.routes.setdefault(route, set()).add(trip_id)
+        trip.listed = float(listed)
+        trip.base = self.base_fare(route, trip.listed)
+        trip.seats = row.get("seats_available") or 0
+        trip.departs = departs
+        return self._reprice(trip_id, trip, self.clock(), self._route_demand(route))
+
+    def observe_trip(self, row):
+        """A partial row after a write (seats or status changed): reprices the trip if it is in the table."""
+        trip_id = row.get("id")
+        trip = self.trips.get(trip_id)
+        if trip is None:
+            return
+        if row.get("status") in CLOSED_STATUSES:
+            self.remove(trip_id)
+            return
+        if "seats_available" in row:
+            trip.seats = row["seats_available"] or 0
+        self._reprice(trip_id, trip, self.clock(), self._route_demand(trip.route))
+
+    def remove(self, trip_id):
+        trip = self.trips.pop(trip_id, None)
+        self.prices.pop(trip_id, None)
+        if trip is not None:
+            ids = self.routes[trip.route]
+            ids.discard(trip_id)
+            if not ids:
+                del self.routes[trip.route]
+                self._demand.pop(trip.route, None)
+
+    # --- pricing ---
+
+    def _route_demand(self, route):
+        multiplier = self._demand.get(route)
+        if multiplier is None:
+            multiplier = self._demand[route] = self.demand.multiplier(route, self.clock())
+        return multiplier
+
+    def multipliers(self, trip, now, demand):
+        """(seats, time to departure, demand) multipliers for a trip."""
+        capacity = max(PRICING_SEAT_CAPACITY, trip.seats)
+        seats = 1 + PRICING_SCARCITY * (capacity - max(trip.seats, 1)) / max(capacity - 1, 1)
+        # Whole hours, so the full pass changes a price at most once an hour
+        hours = int((trip.departs - now) // 3600)
+        if hours < PRICING_LATE_HOURS:
+            timing = 1 + PRICING_LATE_PREMIUM * (1 - max(hours, 0) / PRICING_LATE_HOURS)
+        elif hours >= PRICING_EARLY_DAYS * 24:
+            timing = 1 - PRICING_EARLY_DISCOUNT
+        else:
+            timing = 1.0
+        return seats, timing, demand
+
+    def quote(self, trip, now, demand):
+        seats, timing, demand = self.multipliers(trip, now, demand)
+        factor = min(max(seats * timing * demand, PRICING_MIN_MULTIPLIER), PRICING_MAX_MULTIPLIER)
+        return round(trip.base * factor / PRICING_ROUND_TO) * PRICING_ROUND_TO
+
+    def _reprice(self, trip_id, trip, now, demand):
+        price = self.quote(trip, now, demand)
+        self.counters["repriced"] += 1
+        if price != trip.price:
+            trip.price = price
+            self.prices[trip_id] = price
+            self.counters["changed"] += 1
+        return price
+
+    def reprice_route(self, route, now=None):
+        """Reprices a route's trips with its current demand; returns how many prices changed."""
+        now = self.clock() if now is None else now
+        demand = self._demand[route] = self.demand.multiplier(route, now)
+        changed, trips = 0, self.trips
+        for trip_id in self.routes.get(route, ()):
+            trip = trips[trip_id]
+            before = trip.price
+            changed += self._reprice(trip_id, trip, now, demand) != before
+        return changed
+
+    def reprice_demand(self, now=None):
+        """Reprices the routes searched or booked since the last call whose demand multiplier moved."""
+        now = self.clock() if now is None else now
+        touched, self.demand.touched = self.demand.touched, set()
+        changed = 0
+        for route in touched:
+            if route in self.routes and self.demand.multiplier(route, now) != self._demand.get(route):
+                changed += self.reprice_route(route, now)
+        return changed
+
+    def reprice_all(self, now=None):
+        """Every trip (time to departure moved, demand aged out); drops departed trips. Returns prices changed."""
+        now = self.clock() if now is None else now
+        for trip_id in [i for i, t in self.trips.items() if t.departs <= now]:
+            self.remove(trip_id)
+        self.demand.prune(now)
+        self.demand.touched.clear()
+        changed = sum(self.reprice_route(route, now) for route in list(self.routes))
+        self.counters["full_passes"] += 1
+        return changed
+
+    def explain(self, trip_id):
+        """The parts of a trip's price, or None if it isn't priced."""
+        trip = self.trips.get(trip_id)
+        if trip is None:
+            return None
+        now = self.clock()
+        seats, timing, demand = self.multipliers(trip, now, self._route_demand(trip.route))
+        return {"trip_id": trip_id, "price": trip.price, "listed_price": trip.listed, "base_fare": round(trip.base, 2),
+                "distance_km": self.distances.get(trip.route), "seats_available": trip.seats,
+                "hours_to_departure": round((trip.departs - now) / 3600, 1),
+                "multipliers": {"seats": round(seats, 3), "time": round(timing, 3), "demand": demand}}
+
+    # --- loading from the database ---
+
+    async def load_distances(self, client):
+        self.distances = await fetch_route_distances(client)
+        for trip in self.trips.values():
+            trip.base = self.base_fare(trip.route, trip.listed)
+
+    async def load(self, client, resync=False):
+        """
+        Prices the upcoming trips created since the last call (all of them on
+        the first call, or with resync=True, which also picks up seats booked
+        through other workers), paging by (created_at, id). Returns rows read.
+        """
+        today = datetime.datetime.now(trip_zone()).date().isoformat()
+        cursor = None if resync else self.cursor
+        seen = 0
+        while True:
+            query = client.table("trips").select(TRIP_COLUMNS).gte("date", today) \
+                .order("created_at").order("id").limit(_PAGE_SIZE)
+            if cursor:
+                query = query.or_(keyset_filter(("created_at", "id"), cursor))
+            response = await query.execute()
+            if response.status_code is None or response.status_code >= 400:
+                raise RuntimeError(f"trips query failed with status {response.status_code}")
+            rows = response.data or []
+            for row in rows:
+                self.upsert(row)
+            seen += len(rows)
+            if rows and rows[-1].get("created_at") is not None:
+                cursor = (rows[-1]["created_at"], rows[-1]["id"])
+            if len(rows) < _PAGE_SIZE:
+                break
+        if cursor and (self.cursor is None or cursor > self.cursor):
+            self.cursor = cursor
+        self.counters["loaded"] += seen
+        return seen
+
+    def start(self, client):
+        self.client = client
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        full_at = resync_at = 0.0
+        while True:
+            try:
+                now = self.clock()
+                if now - resync_at >= PRICING_RESYNC:
+                    resync_at = full_at = now
+                    await self.load_distances(self.client)
+                    await self.load(self.client, resync=True)
+                    self.reprice_all(now)
+                else:
+                    await self.load(self.client)
+                    if now - full_at >= PRICING_FULL_REPRICE:
+                        full_at = now
+                        self.reprice_all(now)
+                    else:
+                        self.reprice_demand(now)
+            except Exception as e:
+                print(f"Price table refresh failed: {e}")
+            await asyncio.sleep(PRICING_REFRESH)
+
+    def info(self):
+        return {"trips": len(self.trips), "routes": len(self.routes), "distances": len(self.distances),
+                "demand_routes": len(self.demand.history), **self.counters}
+
+
+price_table = PriceTable()
@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import tempfile
+from collections import OrderedDict, deque
+
+from app.services.trip_cache import normalize
+
+# Events one connection may have waiting. A newer event for the same trip
+# replaces the waiting one, and waiting events are shared by every connection,
+# so this can cover a busy route's trips through a pause of the event loop;
+# a connection that still falls this far behind is sent "resync" (fetch the
+# state again) instead of being buffered without bound
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", "256"))
+# Publishes to one topic within this window go out once, with the latest data
+PUSH_COALESCE_MS = float(os.getenv("PUSH_COALESCE_MS", "50"))
+# Idle connections get a comment this often, so proxies don't close them
+PUSH_HEARTBEAT = float(os.getenv("PUSH_HEARTBEAT", "15"))
+PUSH_MAX_TOPICS = int(os.getenv("PUSH_MAX_TOPICS", "20"))
+# Connections are ended after this long and the client reconnects (EventSource
+# does so by itself). Spreads clients over workers again and lets a graceful
+# shutdown finish: the server waits for open responses to end
+PUSH_MAX_AGE = float(os.getenv("PUSH_MAX_AGE", "600"))
+# memory: subscribers of this process only. unix: every API worker on this
+# host, over datagram sockets in PUSH_BROKER_DIR (one per worker)
+PUSH_BROKER = os.getenv("PUSH_BROKER", "memory")
+PUSH_BROKER_DIR = os.getenv("PUSH_BROKER_DIR", os.path.join(tempfile.gettempdir(), "urbansmart-push"))
+# How often the unix broker lists PUSH_BROKER_DIR for workers started since
+PUSH_BROKER_REFRESH = float(os.getenv("PUSH_BROKER_REFRESH", "1"))
+
+# Fields of a trip row that live subscribers get
+TRIP_FIELDS = ("id", "status", "status_updated_at", "seats_available", "origin", "destination", "date", "time")
+
+# Messages per datagram, well under the socket's size limit
+_DATAGRAM_MESSAGES = 100
+# Datagrams kept for a worker whose socket queue is full (Linux queues only
+# net.unix.max_dgram_qlen, often 10); older ones are dropped beyond this
+_PEER_BACKLOG = 256
+# How soon datagrams that didn't fit are sent again
+_BACKLOG_RETRY = 0.005
+
+
+def trip_topic(trip_id):
+    return f"trip:{trip_id}"
+
+
+def route_topic(origin, destination):
+    return f"route:{normalize(origin)}>{normalize(destination)}"
+
+
+def trip_event(trip):
+    """The "trip" event for a trips row, published to the trip's topic and its route's."""
+    data = {k: trip.get(k) for k in TRIP_FIELDS if k in trip}
+    topics = [trip_topic(trip["id"])]
+    if trip.get("origin") and trip.get("destination"):
+        topics.append(route_topic(trip["origin"], trip["destination"]))
+    return topics, data
+
+
+class Message:
+    """
+    One event, encoded once for every connection it goes to. Events with the
+    same key (topic, event, and what it is about, e.g. the trip on a route
+    topic) replace each other while waiting.
+    """
+    __slots__ = ("key", "json", "sse")
+
+    def __init__(self, topic, event, data, key=None):
+        self.key = (topic, event, key)
+        self.json = json.dumps({"topic": topic, "event": event, "data": data}, separators=(",", ":"), default=str)
+        self.sse = f"event: {event}\ndata: {self.json}\n\n".encode()
+
+
+RESYNC = Message("", "resync", None)
+
+
+class Subscription:
+    """One connection: its topics and its bounded queue of waiting events."""
+    __slots__ = ("topics", "limit", "_waiting", "_waiter", "resyncs", "coalesced")
+
+    def __init__(self, topics, limit=PUSH_QUEUE_SIZE):
+        self.topics = topics
+        self.limit = limit
+        self._waiting = OrderedDict()  # Message.key -> Message, oldest first
+        self._waiter = None  # a bare future rather than an Event: thousands of these sit idle
+        self.resyncs = 0
+        self.coalesced = 0
+
+    def offer(self, message):
+        waiting = self._waiting
+        if message.key in waiting:
+            # Keeps its place in line with the newer data
+            waiting[message.key] = message
+            self.coalesced += 1
+        else:
+            if len(waiting) >= self.limit:
+                waiting.clear()
+                waiting[RESYNC.key] = RESYNC
+                self.resyncs += 1
+            waiting[message.key] = message
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def next(self, timeout=PUSH_HEARTBEAT):
+        """The waiting events, oldest first; [] if none came within `timeout`."""
+        if not self._waiting:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                return []
+            finally:
+                self._waiter = None
+        messages = list(self._waiting.values())
+        self._waiting.clear()
+        return messages
+
+
+class UnixBroker:
+    """
+    Shares published events between the API workers of one host without a
+    broker process: each worker binds a datagram socket in `directory` and
+    sends every batch to all the others. Datagrams for a worker that is busy
+    (its socket queue is full) wait, in order, and are sent again shortly;
+    one that stays behind loses the oldest (counted as dropped) rather than
+    slowing the publisher down. Linux / macOS only.
+    """
+    def __init__(self, directory=PUSH_BROKER_DIR):
+        self.directory = directory
+        self.path = None
+        self._sock = None
+        self._loop = None
+        self._peers = []
+        self._listed = 0.0
+        self._backlog = {}     # peer -> deque of datagrams not sent yet
+        self._retry_handle = None
+        self.counters = {"sent": 0, "received": 0, "dropped": 0, "peers": 0}
+
+    def start(self, deliver):
+        """Binds this worker's socket and calls deliver(messages) for batches from the others."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self._sock.setblocking(False)
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._sock.fileno(), self._read, deliver)
+
+    def stop(self):
+        if self._sock is None:
+            return
+        if self._retry_handle is not None:
+            self._retry_handle.cancel()
+            self._retry_handle = None
+        self._backlog.clear()
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _list_peers(self):
+        now = time.monotonic()
+        if now - self._listed >= PUSH_BROKER_REFRESH:
+            self._listed = now
+            self._peers = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                           if name.endswith(".sock") and os.path.join(self.directory, name) != self.path]
+            self.counters["peers"] = len(self._peers)
+        return self._peers
+
+    def send(self, messages):
+        """messages: [(topic, event, data, key)], already coalesced."""
+        if self._sock is None:
+            return
+        peers = self._list_peers()
+        if not peers:
+            return
+        for i in range(0, len(messages), _DATAGRAM_MESSAGES):
+            datagram = json.dumps(messages[i:i + _DATAGRAM_MESSAGES], separators=(",", ":"), default=str).encode()
+            for peer in peers:
+                self._backlog.setdefault(peer, deque()).append(datagram)
+        self._send_backlog()
+
+    def _send_backlog(self):
+        self._retry_handle = None
+        for peer, queue in list(self._backlog.items()):
+            while queue:
+                try:
+                    self._sock.sendto(queue[0], peer)
+                except BlockingIOError:
+                    break
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # A worker that exited without cleaning up
+                    self._forget(peer)
+                    break
+                queue.popleft()
+                self.counters["sent"] += 1
+            while len(queue) > _PEER_BACKLOG:
+                queue.popleft()
+                self.counters["dropped"] += 1
+            if not queue:
+                self._backlog.pop(peer, None)
+        if self._backlog and self._retry_handle is None:
+            self._retry_handle = self._loop.call_later(_BACKLOG_RETRY, self._send_backlog)
+
+    def _forget(self, peer):
+        if peer in self._peers:
+            self._peers.remove(peer)
+        self._backlog.pop(peer, None)
+        try:
+            os.unlink(peer)
+        except OSError:
+            pass
+
+    def _read(self, deliver):
+        while True:
+            try:
+                datagram = self._sock.recv(1 << 20)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.counters["received"] += 1
+            try:
+                deliver([tuple(m) for m in json.loads(datagram)])
+            except Exception as e:
+                print(f"Live update broker got a bad batch: {e}")
+
+
+class Hub:
+    """
+    Topic fan-out for live updates ("trip:<id>", "route:<from>><to>").
+    publish() collects events for PUSH_COALESCE_MS, so a burst on one topic
+    (seats selling out, say) goes out once with the latest data; each event is
+    encoded once and offered to the subscribers of its topic, whose queues
+    coalesce and stay bounded (Subscription). With a broker the batch also
+    goes to the other workers, whose hubs deliver it to their subscribers.
+    Call from the event loop.
+    """
+    def __init__(self, broker=None, coalesce=PUSH_COALESCE_MS / 1000, queue_size=PUSH_QUEUE_SIZE):
+        self.broker = broker
+        self.coalesce = coalesce
+        self.queue_size = queue_size
+        self.topics = {}       # topic -> set of Subscriptions
+        self._pending = {}     # (topic, event, key) -> data, waiting for the window to close
+        self._flush_handle = None
+        self.counters = {"subscribers": 0, "published": 0, "coalesced": 0, "batches": 0, "delivered": 0, "resyncs": 0}
+
+    def start(self):
+        if self.broker is not None:
+            self.broker.start(self.deliver)
+
+    def stop(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush()
+        if self.broker is not None:
+            self.broker.stop()
+
+    def subscribe(self, topics):
+        sub = Subscription(tuple(dict.fromkeys(topics)), self.queue_size)
+        for topic in sub.topics:
+            self.topics.setdefault(topic, set()).add(sub)
+        self.counters["subscribers"] += 1
+        return sub
+
+    def unsubscribe(self, sub):
+        for topic in sub.topics:
+            subs = self.topics.get(topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self.topics[topic]
+        self.counters["subscribers"] -= 1
+        self.counters["resyncs"] += sub.resyncs
+
+    def publish(self, topic, event, data, key=None):
+        """Sends `data` to the topic's subscribers; replaces a waiting event with the same topic, event and key."""
+        pending_key = (topic, event, key)
+        if pending_key in self._pending:
+            self.counters["coalesced"] += 1
+        self._pending[pending_key] = data
+        self.counters["published"] += 1
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.coalesce, self._flush)
+
+    def publish_trip(self, trip):
+        """Publishes a trips row's live fields to its trip and route topics."""
+        topics, data = trip_event(trip)
+        for topic in topics:
+            self.publish(topic, "trip", data, key=trip["id"])
+
+    def _flush(self):
+        self._flush_handle = None
+        messages = [(topic, event, data, key) for (topic, event, key), data in self._pending.items()]
+        self._pending = {}
+        if not messages:
+            return
+        self.counters["batches"] += 1
+        self.deliver(messages)
+        if self.broker is not None:
+            self.broker.send(messages)
+
+    def deliver(self, messages):
+        """Offers [(topic, event, data, key)] to this process's subscribers."""
+        delivered = 0
+        for topic, event, data, key in messages:
+            subs = self.topics.get(topic)
+            if not subs:
+                continue
+            message = Message(topic, event, data, key)
+            for sub in subs:
+                sub.offer(message)
+            delivered += len(subs)
+        self.counters["delivered"] += delivered
+
+    def info(self):
+        return {"broker": PUSH_BROKER if self.broker is not None else "memory", "topics": len(self.topics),
+                "coalesce_ms": self.coalesce * 1000, "queue_size": self.queue_size, **self.counters,
+                **({"broker_" + k: v for k, v in self.broker.counters.items()} if self.broker is not None else {})}
+
+
+hub = Hub(broker=UnixBroker() if PUSH_BROKER == "unix" else None)
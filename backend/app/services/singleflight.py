@@ -0,0 +1,95 @@
+import asyncio
+import threading
+
+
+class FlightStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.leaders = 0     # calls that actually went upstream
+        self.shared = 0      # calls that waited on someone else's in-flight call
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {"upstream_calls": self.leaders, "coalesced_calls": self.shared}
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Thread version: concurrent do(key, fn) calls with the same key run fn
+    once; everyone else blocks until it finishes and gets the same result
+    (or the same exception). Results are shared, so treat them as read-only.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = FlightStats()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self.stats.incr("shared")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self.stats.incr("leaders")
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """
+    asyncio version of SingleFlight. The upstream call runs as its own task,
+    so a caller that is cancelled (client disconnect) does not cancel it for
+    the others still waiting.
+    """
+    def __init__(self):
+        self._calls = {}
+        self.stats = FlightStats()
+
+    async def do(self, key, coro_fn):
+        task = self._calls.get(key)
+        if task is None:
+            self.stats.incr("leaders")
+            task = asyncio.ensure_future(coro_fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.stats.incr("shared")
+        return await asyncio.shield(task)
+
+
+def request_key(method, url, params, headers):
+    """Identity of a read: same table, filters and credentials means same answer."""
+    return (
+        method,
+        url,
+        tuple(sorted((params or {}).items())),
+        headers.get("Authorization"),
+        headers.get("Prefer"),
+    )
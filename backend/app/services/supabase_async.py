@@ -0,0 +1,130 @@
+import os
+import json
+import asyncio
+import aiohttp
+
+from app.services.supabase_rest import (
+    SupabaseTable,
+    Response,
+    PoolStats,
+    parse_count,
+    parse_error,
+    SUPABASE_CONNECT_TIMEOUT,
+    SUPABASE_READ_TIMEOUT,
+    SUPABASE_GET_RETRIES,
+    SUPABASE_RETRY_BACKOFF,
+    SUPABASE_COALESCE_READS,
+)
+from app.services.singleflight import AsyncSingleFlight, request_key
+
+# Async routes can keep far more requests in flight than the threadpool, so the pool is larger
+SUPABASE_ASYNC_MAX_CONNECTIONS = int(os.getenv("SUPABASE_ASYNC_MAX_CONNECTIONS", "100"))
+SUPABASE_KEEPALIVE_TIMEOUT = float(os.getenv("SUPABASE_KEEPALIVE_TIMEOUT", "30"))
+
+RETRYABLE_STATUS = (502, 503, 504)
+
+
+class AsyncSupabaseTable(SupabaseTable):
+    """
+    Same fluent builder as SupabaseTable (select/eq/ilike/insert/update/...),
+    but `await query.execute()` runs on the client's shared aiohttp session.
+    """
+    def __init__(self, url, key, table_name, client=None, stats=None):
+        super().__init__(url, key, table_name, stats=stats)
+        self.client = client
+        self.flight = client.flight if client is not None else None
+
+    async def execute(self):
+        method, kwargs = self._request()
+        if self.flight is not None and method in ("GET", "HEAD"):
+            # Concurrent identical reads share one request and one (read-only) Response
+            key = request_key(method, self.url, self.params, self.headers)
+            return await self.flight.do(key, lambda: self._send(method, kwargs))
+        return await self._send(method, kwargs)
+
+    async def _send(self, method, kwargs):
+        if self.stats:
+            self.stats.incr("requests")
+
+        session = self.client.session()
+        attempts = self.client.retries + 1 if method in ("GET", "HEAD") else 1
+        for attempt in range(attempts):
+            if attempt:
+                # Exponential backoff between retries of idempotent reads
+                await asyncio.sleep(self.client.backoff * (2 ** (attempt - 1)))
+            try:
+                async with session.request(method, self.url, headers=self.headers, **kwargs) as response:
+                    if response.status in RETRYABLE_STATUS and attempt + 1 < attempts:
+                        continue
+                    body = await response.text()
+                    status = response.status
+                    count = parse_count(response.headers.get("Content-Range"))
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt + 1 < attempts:
+                    continue
+                if self.stats:
+                    self.stats.incr("errors")
+                print(f"Supabase REST Error: {e}")
+                return Response([])
+
+        try:
+            if status >= 400:
+                raise RuntimeError(f"{status} Error for url: {self.url}")
+            return Response(json.loads(body) if body else [], status, count)
+        except Exception as e:
+            if self.stats:
+                self.stats.incr("errors")
+            print(f"Supabase REST Error: {e} | Content: {body}")
+            return Response([], status, error=parse_error(body))
+
+
+class AsyncSupabaseClient:
+    """
+    Async counterpart of SupabaseClient. The aiohttp session (and its bounded,
+    keep-alive connection pool) is created lazily inside the running event loop.
+    """
+    def __init__(self, url, key, max_connections=SUPABASE_ASYNC_MAX_CONNECTIONS,
+                 connect_timeout=SUPABASE_CONNECT_TIMEOUT, read_timeout=SUPABASE_READ_TIMEOUT,
+                 retries=SUPABASE_GET_RETRIES, backoff=SUPABASE_RETRY_BACKOFF, coalesce=SUPABASE_COALESCE_READS):
+        self.url = url
+        self.key = key
+        self.max_connections = max_connections
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = PoolStats()
+        self.flight = AsyncSingleFlight() if coalesce else None
+        self._session = None
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections,
+                keepalive_timeout=SUPABASE_KEEPALIVE_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def table(self, table_name):
+        return AsyncSupabaseTable(self.url, self.key, table_name, client=self, stats=self.stats)
+
+    def rpc(self, function_name, params=None):
+        """Calls a Postgres function exposed by PostgREST at /rest/v1/rpc/<function_name>."""
+        return self.table(f"rpc/{function_name}").insert(params or {})
+
+    def pool_stats(self):
+        stats = self.stats.snapshot()
+        if self.flight is not None:
+            stats.update(self.flight.stats.snapshot())
+        return stats
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+def create_async_client(url, key, **kwargs):
+    return AsyncSupabaseClient(url, key, **kwargs)
+
+AsyncClient = AsyncSupabaseClient # Type alias
@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 
 # Use our custom REST wrapper to avoid dependency hell
 from app.services.supabase_rest import create_client, Client
+from app.services.supabase_async import create_async_client, AsyncClient
 
 # Load environment variables (if not already loaded)
 # load_dotenv() 
@@ -14,12 +15,24 @@ service_role_key: str = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 supabase = None
 supabase_admin = None
 
+# Async variants used by the `async def` routes so they never block the event loop
+async_supabase = None
+async_supabase_admin = None
+
 if url and key:
     supabase = create_client(url, key)
+    async_supabase = create_async_client(url, key)
     print("Supabase REST Client initialized.")
 
 if url and service_role_key:
     supabase_admin = create_client(url, service_role_key)
+    async_supabase_admin = create_async_client(url, service_role_key)
     print("Supabase Admin Client initialized (Service Role).")
 else:
     print("Warning: Service Role Key missing. Admin features (bookings) may fail.")
+
+
+async def close_async_clients():
+    for client in (async_supabase, async_supabase_admin):
+        if client:
+            await client.close()
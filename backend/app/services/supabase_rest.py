@@ -1,9 +1,145 @@
 import os
+import time
+import threading
 import requests
 import json
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from app.services.singleflight import SingleFlight, request_key
+
+# Transport tuning (all overridable from the environment)
+SUPABASE_POOL_CONNECTIONS = int(os.getenv("SUPABASE_POOL_CONNECTIONS", "4"))   # distinct hosts kept pooled
+SUPABASE_POOL_MAXSIZE = int(os.getenv("SUPABASE_POOL_MAXSIZE", "20"))          # max keep-alive connections per host
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "3.05"))
+SUPABASE_READ_TIMEOUT = float(os.getenv("SUPABASE_READ_TIMEOUT", "10"))
+SUPABASE_GET_RETRIES = int(os.getenv("SUPABASE_GET_RETRIES", "3"))
+SUPABASE_RETRY_BACKOFF = float(os.getenv("SUPABASE_RETRY_BACKOFF", "0.2"))
+# Identical concurrent reads share one upstream request (see singleflight.py)
+SUPABASE_COALESCE_READS = os.getenv("SUPABASE_COALESCE_READS", "1") == "1"
+
+
+class PoolStats:
+    """
+    Counters for the pooled transport.
+    hits       - request reused an open keep-alive connection
+    new        - request had to open a brand new connection
+    reconnects - a pooled connection had been dropped and was re-opened
+    waits      - request blocked because the per-host limit was reached
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.new = 0
+        self.reconnects = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hits": self.hits,
+                "new": self.new,
+                "reconnects": self.reconnects,
+                "waits": self.waits,
+                "wait_time_ms": round(self.wait_time * 1000, 2),
+                "errors": self.errors,
+            }
+
+
+def _tracked_pool(base, stats):
+    """Builds a urllib3 pool class that reports connection reuse into `stats`."""
+    class TrackedPool(base):
+        def _get_conn(self, timeout=None):
+            must_wait = self.pool is not None and self.pool.empty()
+            start = time.monotonic()
+            conn = super()._get_conn(timeout=timeout)
+            if must_wait:
+                stats.incr("waits")
+                stats.incr("wait_time", time.monotonic() - start)
+
+            if getattr(conn, "sock", None) is not None:
+                stats.incr("hits")
+            elif getattr(conn, "_pool_used", False):
+                stats.incr("reconnects")
+            else:
+                stats.incr("new")
+            conn._pool_used = True
+            return conn
+
+    return TrackedPool
+
+
+class _PooledAdapter(HTTPAdapter):
+    def __init__(self, stats, **kwargs):
+        self._stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _tracked_pool(HTTPConnectionPool, self._stats),
+            "https": _tracked_pool(HTTPSConnectionPool, self._stats),
+        }
+
+
+def build_session(stats, pool_connections=SUPABASE_POOL_CONNECTIONS, pool_maxsize=SUPABASE_POOL_MAXSIZE,
+                  retries=SUPABASE_GET_RETRIES, backoff=SUPABASE_RETRY_BACKOFF,
+                  retry_methods=("GET", "HEAD"), read_retries=None):
+    """
+    Creates a keep-alive requests.Session with a bounded per-host pool.
+    Only `retry_methods` (by default the idempotent reads) are retried on
+    502/503/504 and read errors (read_retries, default `retries`); other
+    requests are only retried when the connection could not be established at all.
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries if read_retries is None else read_retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(retry_methods),
+        raise_on_status=False,
+    )
+    adapter = _PooledAdapter(
+        stats,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=True,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Shared transport for tables created without a client (e.g. SupabaseTable(url, key, name))
+_shared_lock = threading.Lock()
+_shared_stats = PoolStats()
+_shared_session = None
+_shared_flight = SingleFlight() if SUPABASE_COALESCE_READS else None
+
+
+def _get_shared_session():
+    global _shared_session
+    with _shared_lock:
+        if _shared_session is None:
+            _shared_session = build_session(_shared_stats)
+        return _shared_session
+
 
 class SupabaseTable:
-    def __init__(self, url, key, table_name):
+    def __init__(self, url, key, table_name, session=None, timeout=None, stats=None, flight=None):
         self.url = f"{url}/rest/v1/{table_name}"
         self.headers = {
             "apikey": key,
@@ -12,51 +148,222 @@ class SupabaseTable:
             "Prefer": "return=representation"  # Get back inserted data
         }
         self.params = {}
+        self.session = session
+        self.timeout = timeout or (SUPABASE_CONNECT_TIMEOUT, SUPABASE_READ_TIMEOUT)
+        self.stats = stats
+        self.flight = flight if session is not None else _shared_flight
 
-    def select(self, columns="*"):
+    def select(self, columns="*", count=None, head=False):
+        """
+        count: "exact" | "planned" | "estimated" asks PostgREST for the row total
+        (returned as Response.count). head=True sends a HEAD request so only the
+        count comes back, not the rows.
+        """
         self.params["select"] = columns
+        if count:
+            self.headers["Prefer"] = f"count={count}"
+        self._head = head
         return self
 
     def eq(self, column, value):
         self.params[f"{column}"] = f"eq.{value}"
         return self
 
+    def neq(self, column, value):
+        self.params[f"{column}"] = f"neq.{value}"
+        return self
+
+    def gt(self, column, value):
+        self.params[f"{column}"] = f"gt.{value}"
+        return self
+
+    def gte(self, column, value):
+        self.params[f"{column}"] = f"gte.{value}"
+        return self
+
+    def lt(self, column, value):
+        self.params[f"{column}"] = f"lt.{value}"
+        return self
+
+    def lte(self, column, value):
+        self.params[f"{column}"] = f"lte.{value}"
+        return self
+
+    def like(self, column, value):
+        self.params[f"{column}"] = f"like.{value}"
+        return self
+
     def ilike(self, column, value):
         self.params[f"{column}"] = f"ilike.{value}"
         return self
-    
+
+    def is_(self, column, value):
+        """column IS null / true / false (value "null", True or False); eq can't match null."""
+        self.params[f"{column}"] = f"is.{str(value).lower()}"
+        return self
+
+    def in_(self, column, values):
+        """column is one of values (quoted, so values may contain commas)."""
+        quoted = ",".join('"{}"'.format(str(v).replace('"', '\\"')) for v in values)
+        self.params[f"{column}"] = f"in.({quoted})"
+        return self
+
+    def or_(self, filters):
+        """filters: PostgREST logic tree body, e.g. "date.gt.2026-02-01,and(date.eq.2026-02-01,id.gt.42)"."""
+        self.params["or"] = f"({filters})"
+        return self
+
+    def and_(self, filters):
+        """Like or_(), all must hold: e.g. two bounds on one column, "date.gte.2026-02-01,date.lt.2026-03-01"."""
+        self.params["and"] = f"({filters})"
+        return self
+
+    def order(self, column, desc=False):
+        """Adds a sort key; call again for tie-breakers (order("date").order("id"))."""
+        key = f"{column}.{'desc' if desc else 'asc'}"
+        self.params["order"] = f"{self.params['order']},{key}" if "order" in self.params else key
+        return self
+
+    def limit(self, count):
+        self.params["limit"] = str(int(count))
+        return self
+
+    def offset(self, count):
+        self.params["offset"] = str(int(count))
+        return self
+
+    def range(self, start, end):
+        """Rows start..end inclusive, like supabase-py's range()."""
+        return self.offset(start).limit(end - start + 1)
+
     def insert(self, data):
+        """data: one row (dict) or a list of rows, sent as a single bulk insert."""
+        if isinstance(data, (list, tuple)):
+            data = list(data)
+            columns = sorted({k for row in data for k in row})
+            if any(len(row) != len(columns) for row in data):
+                # Rows with different keys: name the union so PostgREST accepts the batch
+                self.params["columns"] = ",".join(columns)
         self._insert_data = data
         return self
 
-    def execute(self):
-        # Determine if GET or POST based on state
+    def upsert(self, data, on_conflict=None):
+        """Like insert(), but rows whose key already exists are updated (merged) instead."""
+        self.headers = {**self.headers, "Prefer": "return=representation,resolution=merge-duplicates"}
+        if on_conflict:
+            self.params["on_conflict"] = on_conflict
+        return self.insert(data)
+
+    def update(self, data):
+        self._update_data = data
+        return self
+
+    def _request(self):
+        """Returns (method, kwargs) for the request this builder describes."""
         if hasattr(self, '_insert_data'):
-            response = requests.post(self.url, headers=self.headers, json=self._insert_data)
-        else:
-            response = requests.get(self.url, headers=self.headers, params=self.params)
-        
-        # Mimic postgrest response object
-        class Response:
-            def __init__(self, data):
-                self.data = data
-        
+            return "POST", {"json": self._insert_data, "params": self.params}
+        if hasattr(self, '_update_data'):
+            return "PATCH", {"json": self._update_data, "params": self.params}
+        if getattr(self, '_head', False):
+            return "HEAD", {"params": self.params}
+        return "GET", {"params": self.params}
+
+    def execute(self):
+        # Determine if GET, POST or PATCH based on state
+        method, kwargs = self._request()
+        if self.flight is not None and method in ("GET", "HEAD"):
+            # Reads are coalesced: concurrent identical queries wait on one request.
+            # The Response is shared between them, so callers must not mutate it in place.
+            key = request_key(method, self.url, self.params, self.headers)
+            return self.flight.do(key, lambda: self._send(method, kwargs))
+        return self._send(method, kwargs)
+
+    def _send(self, method, kwargs):
+        session = self.session or _get_shared_session()
+        stats = self.stats if self.stats is not None else (_shared_stats if self.session is None else None)
+        if stats:
+            stats.incr("requests")
+
+        try:
+            response = session.request(method, self.url, headers=self.headers, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            if stats:
+                stats.incr("errors")
+            print(f"Supabase REST Error: {e}")
+            return Response([])
+
         try:
             response.raise_for_status()
-            return Response(response.json())
+            data = response.json() if method != "HEAD" else []
+            return Response(data, response.status_code, parse_count(response.headers.get("Content-Range")))
         except Exception as e:
+            if stats:
+                stats.incr("errors")
             print(f"Supabase REST Error: {e} | Content: {response.text}")
-            return Response([])
+            return Response([], response.status_code, error=parse_error(response.text))
+
+
+def parse_count(content_range):
+    """Extracts the total from a PostgREST Content-Range header ("0-24/3573" or "*/3573")."""
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[1]
+    return int(total) if total.isdigit() else None
+
+
+def parse_error(body):
+    """PostgREST error payload ({"code", "message", "details", "hint"}), or the raw text wrapped in one."""
+    try:
+        error = json.loads(body) if body else None
+    except ValueError:
+        error = None
+    return error if isinstance(error, dict) else {"message": body}
+
+
+# Mimic postgrest response object
+class Response:
+    def __init__(self, data, status_code=None, count=None, error=None):
+        self.data = data
+        self.status_code = status_code
+        self.count = count
+        self.error = error
+
 
 class SupabaseClient:
-    def __init__(self, url, key):
+    def __init__(self, url, key, pool_connections=SUPABASE_POOL_CONNECTIONS, pool_maxsize=SUPABASE_POOL_MAXSIZE,
+                 connect_timeout=SUPABASE_CONNECT_TIMEOUT, read_timeout=SUPABASE_READ_TIMEOUT,
+                 retries=SUPABASE_GET_RETRIES, backoff=SUPABASE_RETRY_BACKOFF, coalesce=SUPABASE_COALESCE_READS):
         self.url = url
         self.key = key
+        self.timeout = (connect_timeout, read_timeout)
+        self.stats = PoolStats()
+        self.session = build_session(self.stats, pool_connections, pool_maxsize, retries, backoff)
+        self.flight = SingleFlight() if coalesce else None
 
     def table(self, table_name):
-        return SupabaseTable(self.url, self.key, table_name)
+        return SupabaseTable(self.url, self.key, table_name, session=self.session, timeout=self.timeout,
+                             stats=self.stats, flight=self.flight)
+
+    def rpc(self, function_name, params=None):
+        """Calls a Postgres function exposed by PostgREST at /rest/v1/rpc/<function_name>."""
+        return self.table(f"rpc/{function_name}").insert(params or {})
+
+    def pool_stats(self):
+        stats = self.stats.snapshot()
+        if self.flight is not None:
+            stats.update(self.flight.stats.snapshot())
+        return stats
+
+    def close(self):
+        self.session.close()
+
+def create_client(url, key, **kwargs):
+    return SupabaseClient(url, key, **kwargs)
 
-def create_client(url, key):
-    return SupabaseClient(url, key)
+def shared_pool_stats():
+    stats = _shared_stats.snapshot()
+    if _shared_flight is not None:
+        stats.update(_shared_flight.stats.snapshot())
+    return stats
 
 Client = SupabaseClient # Type alias
@@ -0,0 +1,66 @@
+import os
+from app.services.cache import create_cache, MISSING
+
+TRIP_CACHE_MAXSIZE = int(os.getenv("TRIP_CACHE_MAXSIZE", "2048"))
+TRIP_CACHE_TTL = float(os.getenv("TRIP_CACHE_TTL", "30"))
+AI_CONTEXT_TTL = float(os.getenv("AI_CONTEXT_TTL", "60"))
+
+# Search results are tagged with the ids of the trips they contain, so a write
+# to one trip drops exactly the searches that showed it.
+search_cache = create_cache("trips:search", maxsize=TRIP_CACHE_MAXSIZE, ttl=TRIP_CACHE_TTL)
+detail_cache = create_cache("trips:detail", maxsize=TRIP_CACHE_MAXSIZE, ttl=TRIP_CACHE_TTL)
+# Rendered AI prompt context per (origin, destination, date), tagged like searches
+context_cache = create_cache("trips:ai_context", maxsize=TRIP_CACHE_MAXSIZE, ttl=AI_CONTEXT_TTL)
+
+# Caches elsewhere whose entries are tagged with trip ids (e.g. AI replies);
+# invalidate_trip drops their entries for the trip too
+dependent_caches = []
+
+
+def normalize(value):
+    """Case- and whitespace-insensitive form of a search term ("  Cape  town" -> "cape town")."""
+    return " ".join(str(value).lower().split()) if value else ""
+
+
+def search_key(from_loc=None, to_loc=None, date=None, driver_id=None, cursor=None, limit=None):
+    # The cursor is an opaque token, so it is kept verbatim
+    return "|".join([normalize(v) for v in (from_loc, to_loc, date, driver_id)] + [cursor or "", str(limit or "")])
+
+
+def get_search(key):
+    """Returns {"trips": [...], "next_cursor": str | None} or MISSING."""
+    return search_cache.get(key)
+
+
+def set_search(key, trips, next_cursor=None):
+    search_cache.set(key, {"trips": trips, "next_cursor": next_cursor}, tags=[str(t.get("id")) for t in trips])
+
+
+def get_trip(trip_id):
+    return detail_cache.get(str(trip_id))
+
+
+def set_trip(trip):
+    detail_cache.set(str(trip["id"]), trip)
+
+
+def get_context(key):
+    return context_cache.get(key)
+
+
+def set_context(key, context):
+    """context: {"text": rendered prompt section, "trip_ids": [...]}"""
+    context_cache.set(key, context, tags=[str(t) for t in context["trip_ids"]])
+
+
+def invalidate_trip(trip_id):
+    """Called after any write that touches a trip (status change, booking)."""
+    detail_cache.delete(str(trip_id))
+    search_cache.invalidate_tag(str(trip_id))
+    context_cache.invalidate_tag(str(trip_id))
+    for cache in dependent_caches:
+        cache.invalidate_tag(str(trip_id))
+
+
+def stats():
+    return {"search": search_cache.info(), "detail": detail_cache.info(), "ai_context": context_cache.info()}
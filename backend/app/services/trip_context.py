@@ -0,0 +1,206 @@
+import os
+import re
+import datetime
+
+from app.services import trip_cache
+from app.services.gazetteer import gazetteer
+from app.services.trip_search import filter_location
+from app.services.pricing import price_table
+
+# Trips listed in the assistant's prompt (the top-k for what the user asked)
+AI_CONTEXT_TRIP_LIMIT = int(os.getenv("AI_CONTEXT_TRIP_LIMIT", "10"))
+# User messages (newest first) searched for a route/date the latest one leaves out,
+# so "what about tomorrow?" keeps the route from the question before
+AI_CONTEXT_LOOKBACK = 3
+# Longest place name, in words, looked up in the gazetteer
+MAX_PLACE_WORDS = 4
+
+CONTEXT_COLUMNS = "id,origin,destination,date,time,price,seats_available,vehicle,driver_name"
+
+ORIGIN_CUES = {"from", "leaving", "departing", "ex"}
+DESTINATION_CUES = {"to", "into", "towards", "for", "till", "until"}
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = ["january", "february", "march", "april", "may", "june", "july",
+          "august", "september", "october", "november", "december"]
+
+_WORD = re.compile(r"[\w'-]+")
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_NUMERIC_DATE = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{4}))?\b")  # day/month, as written here
+_MONTH = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*"
+_DAY_MONTH = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?" + _MONTH + r"\b")
+_MONTH_DAY = re.compile(r"\b" + _MONTH + r"\s+(\d{1,2})(?:st|nd|rd|th)?\b")
+
+
+def _month(name):
+    return next(i for i, month in enumerate(MONTHS, 1) if month.startswith(name[:3]))
+
+
+def _day(year, month, day):
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _upcoming(today, month, day):
+    # A day/month without a year means the next one from today
+    date = _day(today.year, month, day)
+    if date and date < today:
+        date = _day(today.year + 1, month, day)
+    return date
+
+
+def extract_date(text, today):
+    """The travel date `text` mentions, as a datetime.date, or None."""
+    text = text.lower()
+    match = _ISO_DATE.search(text)
+    if match:
+        return _day(*map(int, match.groups()))
+    if "day after tomorrow" in text:
+        return today + datetime.timedelta(days=2)
+    if "tomorrow" in text:
+        return today + datetime.timedelta(days=1)
+    if "today" in text or "tonight" in text:
+        return today
+    match = _DAY_MONTH.search(text)
+    if match:
+        return _upcoming(today, _month(match.group(2)), int(match.group(1)))
+    match = _MONTH_DAY.search(text)
+    if match:
+        return _upcoming(today, _month(match.group(1)), int(match.group(2)))
+    match = _NUMERIC_DATE.search(text)
+    if match:
+        day, month, year = match.groups()
+        if year:
+            return _day(int(year), int(month), int(day))
+        return _upcoming(today, int(month), int(day))
+    for word in set(_WORD.findall(text)):
+        for i, weekday in enumerate(WEEKDAYS):
+            if word == weekday or (len(word) >= 3 and word in (weekday[:3], weekday[:4])):
+                # The next such day, today included
+                return today + datetime.timedelta(days=(i - today.weekday()) % 7)
+    return None
+
+
+def extract_places(text, places=gazetteer):
+    """
+    (origin, destination) named in `text`, each a gazetteer display name or None.
+    A place after "from" is the origin, after "to" the destination; otherwise
+    "A ... B" reads as A to B and a lone place as the destination.
+    """
+    words = _WORD.findall(text.lower())
+    found = []  # (place, cue)
+    i = 0
+    while i < len(words):
+        # Longest name first, so "port elizabeth" wins over a place called "port"
+        for n in range(min(MAX_PLACE_WORDS, len(words) - i), 0, -1):
+            place = places.resolve(" ".join(words[i:i + n]))
+            if place:
+                cue = words[i - 1] if i else None
+                found.append((place, "origin" if cue in ORIGIN_CUES else
+                              "destination" if cue in DESTINATION_CUES else None))
+                i += n
+                break
+        else:
+            i += 1
+
+    origin = next((p for p, cue in found if cue == "origin"), None)
+    destination = next((p for p, cue in found if cue == "destination" and p != origin), None)
+    unlabelled = [p for p, cue in found if cue is None and p not in (origin, destination)]
+    for n, place in enumerate(unlabelled):
+        if origin is None and (destination is not None or n + 1 < len(unlabelled)):
+            origin = place
+        elif destination is None:
+            destination = place
+    return origin, destination
+
+
+def extract_intent(messages, today, places=gazetteer):
+    """{"origin", "destination", "date"} the user is asking about, each possibly None."""
+    intent = {"origin": None, "destination": None, "date": None}
+    user_messages = [m.get("content") or "" for m in messages if m.get("role") == "user"]
+    for text in reversed(user_messages[-AI_CONTEXT_LOOKBACK:]):
+        text = str(text)
+        origin, destination = extract_places(text, places)
+        date = extract_date(text, today)
+        if not any(intent.values()):
+            intent.update(origin=origin, destination=destination, date=date)
+        else:
+            # Only fill in what the newer messages left open
+            if intent["origin"] is None and intent["destination"] is None:
+                intent.update(origin=origin, destination=destination)
+            if intent["date"] is None:
+                intent["date"] = date
+        if all(intent.values()):
+            break
+    if intent["date"]:
+        intent["date"] = intent["date"].isoformat()
+    return intent
+
+
+async def _top_trips(client, intent, today, exact_date=True):
+    # Indexed: the *_norm route columns and (date, time, id); see add_trip_search_indexes.sql
+    query = client.table("trips").select(CONTEXT_COLUMNS).gt("seats_available", 0)
+    if intent["origin"]:
+        query = filter_location(query, "origin", intent["origin"])
+    if intent["destination"]:
+        query = filter_location(query, "destination", intent["destination"])
+    if intent["date"] and exact_date:
+        query = query.eq("date", intent["date"])
+    else:
+        query = query.gte("date", today.isoformat())
+    query = query.order("date").order("time").order("id").limit(AI_CONTEXT_TRIP_LIMIT)
+    response = await query.execute()
+    if response.status_code is None or response.status_code >= 400:
+        raise RuntimeError(f"trips query failed with status {response.status_code}")
+    # The prices travellers are quoted, not the listed ones
+    return price_table.apply(response.data or [])
+
+
+def _describe(intent):
+    route = ""
+    if intent["origin"]:
+        route += f" from {intent['origin']}"
+    if intent["destination"]:
+        route += f" to {intent['destination']}"
+    return route + (f" on {intent['date']}" if intent["date"] else "")
+
+
+def render_trip(t):
+    return (f"- {t.get('origin')} to {t.get('destination')}, {t.get('date')} at {t.get('time')}, "
+            f"R{t.get('price')}, {t.get('seats_available')} seats, {t.get('vehicle')}, driver {t.get('driver_name')}")
+
+
+async def build_trip_context(client, messages, today=None):
+    """
+    The 'Available Trips' section of the assistant's prompt as
+    {"text", "trip_ids", "places" (the origin/destination it is about)}:
+    at most AI_CONTEXT_TRIP_LIMIT upcoming trips matching the route and date the
+    user asked about (the next upcoming trips if they named neither). Cached per
+    (origin, destination, date) for AI_CONTEXT_TTL seconds; bookings drop the
+    entries that list the trip.
+    """
+    today = today or datetime.date.today()
+    intent = extract_intent(messages, today)
+    key = "|".join(trip_cache.normalize(v) for v in (intent["origin"], intent["destination"],
+                                                     intent["date"] or f"from {today.isoformat()}"))
+    cached = trip_cache.get_context(key)
+    if cached is not trip_cache.MISSING:
+        return cached
+
+    trips = await _top_trips(client, intent, today)
+    heading = f"Available Trips{_describe(intent)}:"
+    if not trips and intent["date"] and (intent["origin"] or intent["destination"]):
+        # Nothing that day: offer the route's other dates rather than nothing
+        trips = await _top_trips(client, intent, today, exact_date=False)
+        heading = (f"No trips{_describe(intent)}. "
+                   f"Available Trips{_describe({**intent, 'date': None})} on other dates:")
+    if trips:
+        text = heading + "\n" + "\n".join(render_trip(t) for t in trips)
+    else:
+        text = f"No trips currently available{_describe(intent)}."
+    context = {"text": text, "trip_ids": [t.get("id") for t in trips],
+               "places": [p for p in (intent["origin"], intent["destination"]) if p]}
+    trip_cache.set_context(key, context)
+    return context
@@ -0,0 +1,28 @@
+import os
+from app.services.trip_cache import normalize
+
+# "contains": "town" matches "Cape Town", as searches always have (pg_trgm GIN indexes)
+# "prefix": only "cape" matches "Cape Town" (btree on the *_norm columns); opt in
+# See add_trip_search_indexes.sql for both.
+TRIP_SEARCH_MATCH = os.getenv("TRIP_SEARCH_MATCH", "contains")
+
+
+def escape_like(value):
+    """Makes user input literal inside a LIKE pattern."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def location_pattern(value, match=None):
+    term = escape_like(normalize(value))
+    if (match or TRIP_SEARCH_MATCH) == "prefix":
+        return f"{term}%"
+    return f"%{term}%"
+
+
+def filter_location(query, column, value):
+    """
+    Matches `column` ("origin" / "destination") through its generated
+    *_norm column, so the search is case/whitespace-insensitive without
+    wrapping the column in lower() and losing the index.
+    """
+    return query.like(f"{column}_norm", location_pattern(value))
@@ -0,0 +1,160 @@
+import os
+import io
+import csv
+import json
+import asyncio
+import datetime
+
+from app.services import ledger
+from app.services.pagination import keyset_filter
+
+# Rows per database read while exporting. The export holds at most two pages:
+# the one being written out and the next one, requested meanwhile
+WALLET_EXPORT_PAGE_SIZE = int(os.getenv("WALLET_EXPORT_PAGE_SIZE", "1000"))
+
+# Newest first; (created_at, id) is the cursor and the tail of every history index
+HISTORY_SORT = ("created_at", "id")
+HISTORY_COLUMNS = "id,kind,status,user_id,counterparty_id,trip_id,amount_cents,description,reference,created_at"
+
+EXPORT_COLUMNS = ("id", "created_at", "type", "status", "description", "reference", "trip_id",
+                  "amount", "amount_cents", "currency")
+EXPORT_FORMATS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def _timestamp(value, end=False):
+    """
+    A date or ISO datetime as a timestamp bound. A bare date as the end of a
+    range means the whole of that day. Returns (operator, ISO timestamp).
+    """
+    try:
+        if len(value) == 10:
+            day = datetime.date.fromisoformat(value)
+            if end:
+                day += datetime.timedelta(days=1)
+            moment = datetime.datetime.combine(day, datetime.time(), datetime.timezone.utc)
+            return ("lt" if end else "gte"), moment.isoformat()
+        moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD or an ISO datetime")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return ("lte" if end else "gte"), moment.isoformat()
+
+
+def filter_history(query, user_id, type=None, status=None, date_from=None, date_to=None):
+    """
+    One user's ledger transactions, optionally of one type (Earnings,
+    Spending, ...), one status and within a date range, all applied by the
+    database. Raises ValueError for an unknown type or status or a bad date.
+    """
+    query = query.eq("user_id", user_id)
+    if type and type != "All":
+        kind = ledger.KINDS_BY_TYPE.get(type)
+        if not kind:
+            raise ValueError(f"Unknown transaction type {type!r}")
+        query = query.eq("kind", kind)
+    if status and status != "All":
+        if status.lower() not in ledger.STATUSES:
+            raise ValueError(f"Unknown status {status!r}")
+        query = query.eq("status", status.lower())
+    bounds = [_timestamp(value, end) for value, end in ((date_from, False), (date_to, True)) if value]
+    if len(bounds) == 1:
+        op, moment = bounds[0]
+        query = getattr(query, op)("created_at", moment)
+    elif bounds:
+        # Two bounds on one column don't fit the builder's one-filter-per-column params
+        query = query.and_(",".join(f'created_at.{op}."{moment}"' for op, moment in bounds))
+    return query
+
+
+def transaction_view(row):
+    """A ledger_transactions row as the wallet's transaction list shows it."""
+    display, icon, icon_color = ledger.TRANSACTION_TYPES.get(row["kind"], (row["kind"], "receipt", "slate"))
+    created = datetime.datetime.fromisoformat(str(row["created_at"]).replace("Z", "+00:00"))
+    trip_id = row.get("trip_id")
+    return {
+        "id": row["id"],
+        "date": created.strftime("%b %d, %Y"),
+        "time": created.strftime("%I:%M %p"),
+        "description": row.get("description") or display,
+        "sub_description": f"Trip #{str(trip_id)[:8]}" if trip_id else (row.get("reference") or ""),
+        "type": display,
+        "status": (row.get("status") or "completed").capitalize(),
+        "amount": ledger.format_cents(row["amount_cents"], signed=True),
+        "amount_cents": row["amount_cents"],
+        "icon": icon,
+        "icon_color": icon_color,
+        "created_at": row["created_at"],
+    }
+
+
+def _export_row(row):
+    cents = row["amount_cents"]
+    return {
+        "id": row["id"],
+        "created_at": row["created_at"],
+        "type": ledger.TRANSACTION_TYPES.get(row["kind"], (row["kind"],))[0],
+        "status": row.get("status") or "completed",
+        "description": row.get("description") or "",
+        "reference": row.get("reference") or "",
+        "trip_id": row.get("trip_id") or "",
+        "amount": f"{'-' if cents < 0 else ''}{abs(cents) // 100}.{abs(cents) % 100:02d}",
+        "amount_cents": cents,
+        "currency": "ZAR",
+    }
+
+
+async def _pages(make_query, page_size):
+    """
+    Keyset pages of the history, newest first. The next page is requested as
+    soon as the current one arrives, so the database read overlaps with the
+    caller writing the current page out.
+    """
+    async def fetch(last):
+        query = make_query()
+        for column in HISTORY_SORT:
+            query = query.order(column, desc=True)
+        if last is not None:
+            query = query.or_(keyset_filter(HISTORY_SORT, last, desc=True))
+        response = await query.limit(page_size).execute()
+        if response.status_code is None or response.status_code >= 400:
+            raise RuntimeError(f"ledger_transactions query failed with status {response.status_code}")
+        return response.data or []
+
+    pending = asyncio.ensure_future(fetch(None))
+    try:
+        while pending is not None:
+            rows = await pending
+            pending = None
+            if len(rows) == page_size:
+                pending = asyncio.ensure_future(fetch([rows[-1][c] for c in HISTORY_SORT]))
+            if rows:
+                yield rows
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+def _encode(rows, fmt):
+    if fmt == "ndjson":
+        return "".join(json.dumps(_export_row(row), separators=(",", ":")) + "\n" for row in rows).encode()
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(
+        [values[c] for c in EXPORT_COLUMNS] for values in map(_export_row, rows))
+    return buffer.getvalue().encode()
+
+
+async def export(make_query, fmt="csv", page_size=WALLET_EXPORT_PAGE_SIZE):
+    """
+    The whole filtered history as CSV or NDJSON chunks, one per page, for a
+    StreamingResponse: memory stays at two pages whatever the statement's
+    size. make_query() returns a fresh filtered query (see filter_history).
+    The first chunk (with the CSV header) carries the first page, so awaiting
+    it surfaces database errors before any response is sent.
+    """
+    header = (",".join(EXPORT_COLUMNS) + "\n").encode() if fmt == "csv" else b""
+    async for rows in _pages(make_query, page_size):
+        yield header + _encode(rows, fmt)
+        header = b""
+    if header:
+        yield header
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "8"))
+WORK_QUEUE_RETRY_BASE = float(os.getenv("WORK_QUEUE_RETRY_BASE", "2"))      # seconds, doubled per attempt
+WORK_QUEUE_RETRY_MAX = float(os.getenv("WORK_QUEUE_RETRY_MAX", "300"))
+# Finished jobs are kept this long (for dedupe of late redeliveries), then purged
+WORK_QUEUE_KEEP_DONE = float(os.getenv("WORK_QUEUE_KEEP_DONE", str(7 * 24 * 3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    dedupe_key TEXT UNIQUE,      -- a second enqueue with the same key is ignored
+    order_key TEXT,              -- jobs with the same order key run one at a time, oldest first
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'ready',   -- ready | leased | done | dead
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    leased_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready_idx ON jobs (state, run_at);
+CREATE INDEX IF NOT EXISTS jobs_order_key_idx ON jobs (order_key, state);
+"""
+
+
+class Job:
+    __slots__ = ("id", "kind", "payload", "attempts", "order_key")
+
+    def __init__(self, id, kind, payload, attempts, order_key):
+        self.id = id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.order_key = order_key
+
+
+class WorkQueue:
+    """
+    Durable local work queue in a SQLite file (WAL mode), so accepted work
+    survives a restart of the API without an external broker.
+
+    claim() leases ready jobs for `lease` seconds; a worker that dies without
+    calling complete()/fail() loses the lease and the job runs again, so
+    handlers must be idempotent. fail() retries with exponential backoff and
+    marks the job dead after max_attempts. Jobs sharing an order_key are
+    handed out one at a time in enqueue order (e.g. all events of one payment).
+
+    synchronous=NORMAL: a commit survives the process dying, not the machine
+    losing power mid-write.
+    """
+    def __init__(self, path, max_attempts=WORK_QUEUE_MAX_ATTEMPTS, clock=time.time):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.clock = clock
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self.enqueued = 0
+        self.duplicates = 0
+
+    def enqueue(self, kind, payload, dedupe_key=None, order_key=None, delay=0.0):
+        """True if queued, False if a job with this dedupe_key already exists."""
+        return self.enqueue_many([(kind, payload, dedupe_key, order_key)], delay) == 1
+
+    def enqueue_many(self, items, delay=0.0):
+        """items: (kind, payload, dedupe_key, order_key) tuples, in one transaction. Returns how many were new."""
+        now = self.clock()
+        rows = [(kind, json.dumps(payload), dedupe_key, order_key, now + delay, now)
+                for kind, payload, dedupe_key, order_key in items]
+        with self._lock:
+            before = self._db.total_changes
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO jobs (kind, payload, dedupe_key, order_key, run_at, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            added = self._db.total_changes - before
+        self.enqueued += added
+        self.duplicates += len(rows) - added
+        return added
+
+    def claim(self, limit=32, lease=30.0):
+        """Leases up to `limit` runnable jobs; expired leases count as runnable."""
+        now = self.clock()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Expired leases go back to ready (their worker is gone), so the claim
+                # below only walks ready jobs in (state, run_at) index order and stops at
+                # `limit` instead of sorting the whole backlog
+                self._db.execute("UPDATE jobs SET state = 'ready', leased_until = NULL "
+                                 "WHERE state = 'leased' AND leased_until < ?", (now,))
+                # The oldest runnable job per order key, skipping keys that already have one leased
+                rows = self._db.execute(
+                    """
+                    UPDATE jobs SET state = 'leased', leased_until = ?, attempts = attempts + 1
+                    WHERE id IN (
+                        SELECT j.id FROM jobs j
+                        WHERE j.state = 'ready' AND j.run_at <= ?
+                          AND NOT EXISTS (
+                            SELECT 1 FROM jobs o
+                            WHERE o.order_key = j.order_key AND o.id < j.id AND o.state IN ('ready', 'leased')
+                        )
+                        ORDER BY j.run_at, j.id
+                        LIMIT ?
+                    )
+                    RETURNING id, kind, payload, attempts, order_key
+                    """, (now + lease, now, limit)).fetchall()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return [Job(id_, kind, json.loads(payload), attempts, order_key)
+                for id_, kind, payload, attempts, order_key in sorted(rows)]
+
+    def complete(self, job_ids):
+        if not job_ids:
+            return
+        now = self.clock()
+        job_ids = list(job_ids)
+        with self._lock:
+            for i in range(0, len(job_ids), 500):
+                chunk = job_ids[i:i + 500]
+                self._db.execute(f"UPDATE jobs SET state = 'done', finished_at = ?, leased_until = NULL "
+                                 f"WHERE id IN ({','.join('?' * len(chunk))})", (now, *chunk))
+
+    def fail(self, job, error, retry_in=None):
+        """Schedules a retry (backoff, or `retry_in` seconds), or marks the job dead after max_attempts."""
+        now = self.clock()
+        if job.attempts >= self.max_attempts:
+            state, run_at = "dead", now
+        else:
+            state = "ready"
+            backoff = WORK_QUEUE_RETRY_BASE * 2 ** (job.attempts - 1)
+            run_at = now + (retry_in if retry_in is not None else min(WORK_QUEUE_RETRY_MAX, backoff))
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = ?, run_at = ?, leased_until = NULL, last_error = ?, "
+                "finished_at = CASE WHEN ? = 'dead' THEN ? END WHERE id = ?",
+                (state, run_at, str(error)[:500], state, now, job.id))
+        return state
+
+    def purge(self, older_than=WORK_QUEUE_KEEP_DONE):
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM jobs WHERE state = 'done' AND finished_at < ?",
+                                      (self.clock() - older_than,))
+            return cursor.rowcount
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = {"ready": 0, "leased": 0, "done": 0, "dead": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def dead_jobs(self, limit=50):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, kind, payload, attempts, last_error FROM jobs WHERE state = 'dead' "
+                "ORDER BY finished_at DESC LIMIT ?", (limit,)).fetchall()
+        return [{"id": id_, "kind": kind, "payload": json.loads(payload), "attempts": attempts, "error": error}
+                for id_, kind, payload, attempts, error in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
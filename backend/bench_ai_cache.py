@@ -0,0 +1,128 @@
+"""
+Benchmark: AI response cache hit ratio and correctness on chat-like traffic.
+
+Generates --requests questions from a handful of intents per destination
+(availability, price, departure time, seats for N people), each written in
+several ways ("Any trips to Durban?", "are there trips to durban??", ...),
+with popular destinations asked far more often (Zipf). Questions arrive in
+bursts of --concurrency; every --change-every requests a trip on a random
+route changes (trip_cache.invalidate_trip plus a new context, like a
+booking). The stub LLM answers with the intent it was asked, so a cached
+reply for a different intent counts as wrong.
+
+Fails if any reply is wrong, if the hit ratio is under --min-hit-ratio, or if
+a cache lookup's p99 exceeds --target-ms.
+
+    python bench_ai_cache.py --requests 20000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import trip_cache
+from app.services.ai_cache import ResponseCache
+
+DESTINATIONS = ["Durban", "Cape Town", "Polokwane", "Bloemfontein", "Stellenbosch", "Pietermaritzburg",
+                "Gqeberha", "East London", "Nelspruit", "Kimberley", "George", "Upington"]
+PHRASINGS = {
+    "available": ["Any trips to {d}?", "are there any trips to {d}??", "any trip to {d} please",
+                  "Trips to {d}?", "hi, do you have trips to {d}", "Is there a trip to {d}?"],
+    "price": ["How much is a trip to {d}?", "how much to {d}", "What's the price to {d}?",
+              "how much does a trip to {d} cost"],
+    "time": ["What time do trips to {d} leave?", "when do trips to {d} leave", "What time does the {d} trip leave?"],
+    "seats": ["Any trips to {d} for {n} people?", "trip to {d} for {n} people", "Do you have {n} seats to {d}?"],
+}
+
+
+def workload(count, rng):
+    weights = [1 / (rank + 1) for rank in range(len(DESTINATIONS))]
+    for _ in range(count):
+        destination = rng.choices(DESTINATIONS, weights)[0]
+        kind = rng.choice(list(PHRASINGS))
+        people = rng.randint(2, 4)
+        text = rng.choice(PHRASINGS[kind]).format(d=destination, n=people)
+        yield destination, f"{destination}:{kind}:{people if kind == 'seats' else ''}", text
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    cache = ResponseCache(maxsize=args.maxsize)
+    versions = {d: 0 for d in DESTINATIONS}
+    calls, wrong, lookups = 0, 0, []
+
+    async def ask(destination, intent, text):
+        nonlocal calls, wrong
+        # What the retrieval stage would produce: the route's trips, which change on bookings
+        trip_ids = [f"{destination}-trip-{versions[destination]}"]
+        context = {"text": f"Available Trips to {destination}: {trip_ids[0]}", "trip_ids": trip_ids,
+                   "places": [destination]}
+        bucket, key = cache.key("gemini", "gemini-1.5-flash", [{"role": "user", "content": text}], context)
+
+        async def llm():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(args.llm_ms / 1000)
+            return {"content": intent, "role": "assistant"}
+
+        reply = await cache.answer(bucket, key, llm, trip_ids)
+        if reply["content"] != intent:
+            wrong += 1
+            if wrong <= 5:
+                print(f"wrong: {text!r} ({intent}) got {reply['content']}")
+        return bucket, key
+
+    requests = list(workload(args.requests, rng))
+    asked = []
+    start = time.perf_counter()
+    for i in range(0, len(requests), args.concurrency):
+        asked += await asyncio.gather(*(ask(*r) for r in requests[i:i + args.concurrency]))
+        if (i // args.concurrency) % max(1, args.change_every // args.concurrency) == 0 and i:
+            destination = rng.choice(DESTINATIONS)
+            trip_cache.invalidate_trip(f"{destination}-trip-{versions[destination]}")
+            versions[destination] += 1
+    elapsed = time.perf_counter() - start
+
+    info = cache.info()
+    for bucket, key in rng.sample(asked, min(len(asked), 5000)):
+        start = time.perf_counter()
+        cache.lookup(bucket, key)
+        lookups.append((time.perf_counter() - start) * 1000)
+    lookups.sort()
+    print(f"{args.requests} questions in {elapsed:.1f} s ({args.requests / elapsed:.0f}/s), "
+          f"{sum(versions.values())} trip changes\n")
+    print(f"LLM calls:        {calls} ({info['llm_calls_saved']} saved)")
+    print(f"hit ratio:        {info['hit_ratio']:.1%}  (exact {info['hits']}, near {info['near_hits']}, "
+          f"coalesced {info['coalesced']})")
+    print(f"wrong replies:    {wrong}")
+    print(f"invalidations:    {info['store']['invalidations']}")
+    print(f"lookup p50 / p99: {lookups[len(lookups) // 2]:.3f} / {lookups[int(len(lookups) * 0.99)]:.3f} ms")
+    return (wrong == 0 and info["hit_ratio"] >= args.min_hit_ratio
+            and lookups[int(len(lookups) * 0.99)] <= args.target_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--change-every", type=int, default=200, help="requests between trip changes")
+    parser.add_argument("--maxsize", type=int, default=2048)
+    parser.add_argument("--llm-ms", type=float, default=1.0)
+    parser.add_argument("--min-hit-ratio", type=float, default=0.8)
+    parser.add_argument("--target-ms", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args))
+    print()
+    print("[PASS] no wrong replies, hit ratio and lookup cost on target" if ok
+          else "[FAIL] wrong replies, low hit ratio or slow lookups")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Benchmark: AI assistant prompt size and latency as the trips table grows.
+
+For each size a fake PostgREST process is seeded with N trips (index on
+date, time, id) and the same chat questions are answered three ways, with a
+stub LLM that charges --llm-base-ms plus --llm-ms-per-1k tokens of prompt and
+refuses prompts over --context-window tokens:
+
+  whole table - select("*") of every trip into the prompt (the original /ai/chat)
+  first 50    - the first 50 trips by date, whatever was asked
+  retrieval   - trip_context.build_trip_context: route/date intent, top-k
+                indexed query; "cold" clears the context cache first
+
+"relevant" is the share of route questions whose context lists a trip on
+that route (and date, if one was asked).
+
+    python bench_ai_context.py --sizes 1000 10000 100000
+"""
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest, seed_trips
+from app.services import trip_cache
+from app.services.gazetteer import gazetteer
+from app.services.supabase_async import create_async_client
+from app.services.trip_context import build_trip_context, extract_intent
+
+TODAY = datetime.date(2026, 2, 1)  # seed_trips dates are in February 2026
+QUESTIONS = [
+    "Any trips from Johannesburg to Durban on 2026-02-14?",
+    "I need a ride to Polokwane tomorrow",
+    "Cape Town to Stellenbosch on friday please",
+    "jozi to bloem on the 20th of february?",
+    "Durban to Pietermaritzburg, how much?",
+    "hi! what trips do you have?",
+]
+
+
+def serve(port, trips, ready):
+    server = FakePostgrest(port=port)
+    seed_trips(server, trips)
+    server.create_index("trips", ("date", "time", "id"))
+    ready.set()
+    server._server.serve_forever()
+
+
+def tokens(text):
+    return len(text) // 4  # rough English average
+
+
+async def stub_llm(prompt, args):
+    n = tokens(prompt)
+    if n > args.context_window:
+        raise ValueError(f"prompt of {n} tokens exceeds the {args.context_window}-token context window")
+    await asyncio.sleep((args.llm_base_ms + args.llm_ms_per_1k * n / 1000) / 1000)
+
+
+def old_format(trips):
+    return "Available Trips:\n" + "\n".join(
+        f"- From {t.get('origin')} to {t.get('destination')} on {t.get('date')} at {t.get('time')}. "
+        f"Price: R{t.get('price')}. Vehicle: {t.get('vehicle')}. Driver: {t.get('driver_name')}." for t in trips)
+
+
+async def context(client, mode, messages):
+    if mode == "whole table":
+        return old_format((await client.table("trips").select("*").execute()).data)
+    if mode == "first 50":
+        query = client.table("trips").select("origin,destination,date,time,price,vehicle,driver_name")
+        return old_format((await query.order("date").order("time").order("id").limit(50).execute()).data)
+    if mode == "retrieval (cold)":
+        trip_cache.context_cache.clear()
+    return (await build_trip_context(client, messages, today=TODAY))["text"]
+
+
+def relevant(text, intent):
+    if not (intent["origin"] or intent["destination"]):
+        return None
+    for line in text.splitlines():
+        line = line.replace("From ", "")
+        if ((not intent["origin"] or line.startswith(f"- {intent['origin']} to")) and
+                (not intent["destination"] or f"to {intent['destination']}" in line) and
+                (not intent["date"] or intent["date"] in line) and "No trips" not in text):
+            return True
+    return False
+
+
+async def run_mode(url, mode, args):
+    client = create_async_client(url, "bench-key")
+    timings, sizes, hits, asked, failures = [], [], 0, 0, 0
+    if mode == "retrieval":
+        for question in QUESTIONS:  # warm the context cache
+            await context(client, mode, [{"role": "user", "content": question}])
+    for _ in range(args.rounds):
+        for question in QUESTIONS:
+            messages = [{"role": "user", "content": question}]
+            start = time.perf_counter()
+            text = await context(client, mode, messages)
+            try:
+                await stub_llm(text, args)
+            except ValueError:
+                failures += 1
+            timings.append((time.perf_counter() - start) * 1000)
+            sizes.append(tokens(text))
+            ok = relevant(text, extract_intent(messages, TODAY))
+            if ok is not None:
+                asked += 1
+                hits += ok
+    await client.close()
+    timings.sort()
+    return (max(sizes), statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+            hits / asked, failures)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 10000, 100000])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--whole-table-max", type=int, default=100000, help="skip the whole-table read above this size")
+    parser.add_argument("--context-window", type=int, default=1000000, help="tokens (gemini-1.5-flash: 1M)")
+    parser.add_argument("--llm-base-ms", type=float, default=50.0)
+    parser.add_argument("--llm-ms-per-1k", type=float, default=1.0)
+    parser.add_argument("--token-budget", type=int, default=1000, help="max retrieval context tokens")
+    parser.add_argument("--port", type=int, default=54328)
+    args = parser.parse_args()
+
+    gazetteer.add_many({name: 1 for name in ["Johannesburg", "Durban", "Cape Town", "Stellenbosch", "Pretoria",
+                                              "Polokwane", "Pietermaritzburg", "Bloemfontein"]})
+    print(f"{'trips':>7} {'mode':<17} {'ctx tokens':>11} {'p50 ms':>9} {'p95 ms':>9} {'relevant':>9} {'too big':>8}")
+    ok = True
+    for i, size in enumerate(args.sizes):
+        port = args.port + i
+        ready = multiprocessing.Event()
+        stub = multiprocessing.Process(target=serve, args=(port, size, ready), daemon=True)
+        stub.start()
+        ready.wait()
+        try:
+            for mode in ("whole table", "first 50", "retrieval (cold)", "retrieval"):
+                if mode == "whole table" and size > args.whole_table_max:
+                    continue
+                size_tokens, p50, p95, share, failures = asyncio.run(run_mode(f"http://127.0.0.1:{port}", mode, args))
+                print(f"{size:>7} {mode:<17} {size_tokens:>11} {p50:>9.1f} {p95:>9.1f} {share:>9.0%} {failures:>8}")
+                if mode.startswith("retrieval"):
+                    ok = ok and size_tokens <= args.token_budget and share == 1.0 and failures == 0
+        finally:
+            stub.terminate()
+            stub.join()
+
+    print()
+    print("[PASS] retrieval context stays within the token budget and answers every route question" if ok
+          else "[FAIL] retrieval context over budget or missing the asked-for trips")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
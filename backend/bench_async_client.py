@@ -0,0 +1,99 @@
+"""
+Load benchmark: sync SupabaseClient on a FastAPI-sized threadpool vs AsyncSupabaseClient.
+
+Sync routes run on anyio's default worker pool (40 threads), so that is what the
+sync path gets here. The async path runs every client as a coroutine on one
+event loop, the way the ported `async def` routes do.
+
+    python bench_async_client.py --latency-ms 20 --per-client 5
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest, seed_trips
+from app.services.supabase_rest import create_client
+from app.services.supabase_async import create_async_client
+
+FASTAPI_THREADPOOL = 40
+
+
+def search(client):
+    return client.table("trips").select("*").ilike("origin", "%Durban%").eq("date", "2026-02-04").execute().data
+
+
+async def search_async(client):
+    response = await client.table("trips").select("*").ilike("origin", "%Durban%").eq("date", "2026-02-04").execute()
+    return response.data
+
+
+def bench_sync(url, clients, per_client):
+    client = create_client(url, "bench-key", pool_maxsize=FASTAPI_THREADPOOL)
+    total = clients * per_client
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=FASTAPI_THREADPOOL) as pool:
+        results = list(pool.map(lambda _: search(client), range(total)))
+    elapsed = time.perf_counter() - start
+    client.close()
+    return total / elapsed, sum(1 for r in results if r)
+
+
+async def bench_async(url, clients, per_client):
+    client = create_async_client(url, "bench-key")
+
+    async def one_client():
+        ok = 0
+        for _ in range(per_client):
+            if await search_async(client):
+                ok += 1
+        return ok
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one_client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    await client.close()
+    return clients * per_client / elapsed, sum(results)
+
+
+def serve(port, latency, ready):
+    # The stub runs in its own process so it does not compete with the client for the GIL
+    server = FakePostgrest(port=port, latency=latency)
+    seed_trips(server, 50)  # keep the stub cheap so upstream latency dominates
+    ready.set()
+    server._server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=54322)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--per-client", type=int, default=5)
+    parser.add_argument("--clients", type=int, nargs="*", default=[50, 200, 1000])
+    args = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    stub = multiprocessing.Process(target=serve, args=(args.port, args.latency_ms / 1000, ready), daemon=True)
+    stub.start()
+    ready.wait()
+    url = f"http://127.0.0.1:{args.port}"
+    print(f"Fake PostgREST at {url} (latency {args.latency_ms} ms), {args.per_client} searches per client\n")
+    print(f"{'clients':>8} {'sync req/s':>12} {'async req/s':>12} {'speedup':>8}")
+
+    for clients in args.clients:
+        sync_rps, sync_ok = bench_sync(url, clients, args.per_client)
+        async_rps, async_ok = asyncio.run(bench_async(url, clients, args.per_client))
+        expected = clients * args.per_client
+        note = "" if sync_ok == async_ok == expected else f"  (ok: sync {sync_ok}, async {async_ok} of {expected})"
+        print(f"{clients:>8} {sync_rps:>12.0f} {async_rps:>12.0f} {async_rps / sync_rps:>7.1f}x{note}")
+
+    stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Contention benchmark for seat booking.
+
+Runs the real /travel/bookings/batch handler against a fake PostgREST (in a
+separate process) whose book_seats RPC locks per trip like the SQL
+function's SELECT ... FOR UPDATE:
+
+  hot trip   - --buyers concurrent buyers, one seat each, for one 4-seat trip:
+               exactly 4 must be confirmed, the rest get 409
+  groups     - the same, but buyers want 1-3 seats: never more than 4 seats sold
+  many trips - --buyers buyers spread over --trips trips, so per-trip locks
+               don't serialize unrelated buyers
+
+    python bench_booking_contention.py --buyers 1000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+PORT = 54325
+os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ["SUPABASE_KEY"] = "bench-key"
+os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "bench-service-key"
+
+from fastapi import HTTPException
+from fake_postgrest import FakePostgrest, seed_trips, book_seats
+from app.routers.travel import create_bookings_batch, BatchBookingRequest
+from app.services.supabase_client import async_supabase_admin, close_async_clients
+
+SEATS = 4
+
+
+def serve(trips, ready):
+    server = FakePostgrest(port=PORT)
+    seed_trips(server, trips)
+    server.register_rpc("book_seats", book_seats)
+    ready.set()
+    server._server.serve_forever()
+
+
+async def buyer(trip_id, user, seats):
+    try:
+        result = await create_bookings_batch(BatchBookingRequest(trip_id=trip_id, user_id=user, seats=seats))
+        return 200, result["seats"]
+    except HTTPException as e:
+        return e.status_code, 0
+
+
+async def scenario(name, orders):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # the handler prints every 409
+        results = await asyncio.gather(*(buyer(trip, f"user-{i}", seats) for i, (trip, seats) in enumerate(orders)))
+    elapsed = time.perf_counter() - start
+
+    trips = sorted({trip for trip, _ in orders})
+    sold = {}
+    for trip in trips:
+        rows = (await async_supabase_admin.table("trips").select("seats_available").eq("id", trip).execute()).data
+        sold[trip] = SEATS - rows[0]["seats_available"]
+    confirmed = sum(1 for status, _ in results if status == 200)
+    seats_booked = sum(seats for _, seats in results)
+    rejected = sum(1 for status, _ in results if status == 409)
+    other = len(results) - confirmed - rejected
+
+    ok = other == 0 and seats_booked == sum(sold.values()) and all(0 <= n <= SEATS for n in sold.values())
+    print(f"{name:<11} {len(orders):>7} {len(trips):>6} {confirmed:>10} {seats_booked:>6} {rejected:>9} "
+          f"{len(orders) / elapsed:>9.0f}")
+    return ok, confirmed, seats_booked
+
+
+async def run(buyers, trips, seed):
+    rng = random.Random(seed)
+    hot = "trip-00000000"
+    print(f"{'scenario':<11} {'buyers':>7} {'trips':>6} {'confirmed':>10} {'seats':>6} {'409s':>9} {'req/s':>9}")
+    ok1, confirmed, _ = await scenario("hot trip", [(hot, 1) for _ in range(buyers)])
+    ok1 = ok1 and confirmed == SEATS
+    ok2, _, seats = await scenario("groups", [("trip-00000001", rng.randint(1, 3)) for _ in range(buyers)])
+    ok2 = ok2 and seats <= SEATS
+    spread = [(f"trip-{rng.randrange(2, trips + 2):08d}", 1) for _ in range(buyers)]
+    ok3, _, _ = await scenario("many trips", spread)
+    await close_async_clients()
+    return ok1 and ok2 and ok3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--buyers", type=int, default=1000)
+    parser.add_argument("--trips", type=int, default=250)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    stub = multiprocessing.Process(target=serve, args=(args.trips + 2, ready), daemon=True)
+    stub.start()
+    ready.wait()
+    try:
+        ok = asyncio.run(run(args.buyers, args.trips, args.seed))
+    finally:
+        stub.terminate()
+        stub.join()
+
+    print()
+    print("[PASS] no trip oversold; exactly 4 of the hot-trip buyers confirmed" if ok
+          else "[FAIL] oversold, undersold or unexpected errors")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Benchmark: /ai/chat request size, prompt size and latency as a conversation grows.
+
+Runs the app in-process against fake_postgrest, with the LLM gateway's
+providers replaced by a fake model whose latency grows with the prompt
+(--llm-ms plus --us-per-token per prompt token, like prefill). The response
+cache is off so every turn reaches the model.
+
+  stateless     the client sends the whole conversation every turn (the old
+                API); measured at each checkpoint turn
+  conversation  the client sends the new message and a conversation id; the
+                server rebuilds the prompt from the last CHAT_HISTORY_TURNS
+                messages plus a rolling summary, and stores turns in batches
+
+Fails if, in conversation mode, request bytes or prompt tokens at the last
+checkpoint exceed --growth times those at the second one, or if any stored
+message is missing after the final flush, or if writes aren't batched.
+
+    python bench_chat_history.py --turns 5 50 500
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest, seed_trips
+
+QUESTIONS = ["Any trips from Cape Town to Durban on Friday?", "How much is it per seat?",
+             "What time does it leave?", "Is there one on Saturday instead?",
+             "Can I take a big suitcase?", "What about to Polokwane next week?"]
+REPLY = ("There are two trips from Cape Town to Durban that day: 07:00 in a Toyota Quantum with "
+         "driver Sipho (R450, 6 seats left) and 13:30 in a VW Crafter with driver Anele (R420, 3 seats "
+         "left). Would you like me to tell you more about either of them, or look at another day?")
+
+
+def run(args):
+    server = FakePostgrest(latency=args.db_ms / 1000).start()
+    seed_trips(server, 2000)
+    os.environ.update(SUPABASE_URL=server.url, SUPABASE_KEY="bench", SUPABASE_SERVICE_ROLE_KEY="bench",
+                      AI_CACHE_ENABLED="0")
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services.conversations import conversations, history_writer, CHAT_HISTORY_TURNS
+    from app.services.llm_gateway import gateway, Provider
+
+    prompts = []
+
+    def fake_model(messages, model=None, temperature=0.7, timeout=None):
+        tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+        prompts.append(tokens)
+        time.sleep((args.llm_ms + tokens * args.us_per_token / 1000) / 1000)
+        return REPLY
+
+    gateway.providers.clear()
+    gateway.register(Provider("gemini", fake_model))  # the default provider
+
+    def post(client, body):
+        data = json.dumps(body)
+        start = time.perf_counter()
+        response = client.post("/ai/chat", content=data, headers={"Content-Type": "application/json"})
+        elapsed = (time.perf_counter() - start) * 1000
+        assert response.status_code == 200, response.text
+        return len(data), elapsed, prompts[-1], response.json()
+
+    checkpoints = sorted(args.turns)
+    results = {}
+    with TestClient(app) as client:
+        # --- stateless: the whole history in every request ---
+        for turn in checkpoints:
+            history = []
+            for i in range(turn - 1):
+                history += [{"role": "user", "content": QUESTIONS[i % len(QUESTIONS)]},
+                            {"role": "assistant", "content": REPLY}]
+            body = {"messages": history + [{"role": "user", "content": QUESTIONS[(turn - 1) % len(QUESTIONS)]}]}
+            runs = [post(client, body) for _ in range(args.repeat)]
+            results[("stateless", turn)] = (runs[0][0], statistics.median(r[1] for r in runs), runs[0][2])
+
+        # --- conversation: id + new message, history on the server ---
+        conversation_id, latencies = None, []
+        for turn in range(1, checkpoints[-1] + 1):
+            body = {"message": QUESTIONS[(turn - 1) % len(QUESTIONS)]}
+            if conversation_id:
+                body["conversation_id"] = conversation_id
+            size, elapsed, tokens, reply = post(client, body)
+            conversation_id = reply["conversation_id"]
+            latencies.append(elapsed)
+            if turn in checkpoints:
+                window = latencies[max(0, turn - args.repeat):turn]
+                results[("conversation", turn)] = (size, statistics.median(window), tokens)
+
+        # A conversation that fell out of the cache is read back from the database
+        conversations.cache.clear()
+        _, cold_ms, cold_tokens, _ = post(client, {"message": "And on Sunday?", "conversation_id": conversation_id})
+    # Shutdown flushed the writer
+    stored = [m for m in server.tables.get("messages", []) if m["conversation_id"] == conversation_id]
+    writer = history_writer.info()
+    server.stop()
+
+    print(f"fake model: {args.llm_ms:.0f} ms + {args.us_per_token:.0f} us/prompt token; "
+          f"window {CHAT_HISTORY_TURNS} messages\n")
+    print(f"{'mode':<14}{'turn':>6}{'request bytes':>15}{'prompt tokens':>15}{'latency ms':>12}")
+    for (mode, turn), (size, latency, tokens) in sorted(results.items()):
+        print(f"{mode:<14}{turn:>6}{size:>15,}{tokens:>15,}{latency:>12.1f}")
+    print(f"\ncold conversation (reloaded from the database): {cold_ms:.1f} ms, {cold_tokens:,} prompt tokens")
+    expected = 2 * (checkpoints[-1] + 1)
+    print(f"stored messages: {len(stored)}/{expected} in {writer['batches']} write requests "
+          f"({writer['messages_written'] / max(1, writer['batches']):.0f} rows per request), "
+          f"failures {writer['failures']}, dropped {writer['dropped']}")
+
+    second, last = results[("conversation", checkpoints[1])], results[("conversation", checkpoints[-1])]
+    bounded = last[0] <= second[0] * args.growth and last[2] <= second[2] * args.growth
+    batched = writer["batches"] * 5 <= len(stored)
+    return bounded and len(stored) == expected and batched
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--repeat", type=int, default=5, help="requests per stateless checkpoint")
+    parser.add_argument("--llm-ms", type=float, default=10)
+    parser.add_argument("--us-per-token", type=float, default=5)
+    parser.add_argument("--db-ms", type=float, default=1)
+    parser.add_argument("--growth", type=float, default=1.5)
+    args = parser.parse_args()
+
+    ok = run(args)
+    print()
+    print("[PASS] request and prompt size stay flat, history stored in batches" if ok
+          else "[FAIL] request or prompt size grows, or history writes missing / unbatched")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Benchmark: time to first token for AI chat, blocking vs streaming.
+
+Starts a fake model server speaking Minimax's chatcompletion_v2 protocol that
+emits --tokens tokens, one every --token-delay-ms (as server-sent events when
+asked to stream, otherwise as one JSON body at the end), and the API under
+uvicorn pointed at it. Then, with --clients concurrent users:
+
+  blocking   - minimax.chat_completion, as /ai/chat calls its provider: the
+               first token arrives with the last one
+  sse        - POST /ai/chat/stream, time to the first delta event
+  websocket  - /ai/chat/ws, the same (needs the websockets package)
+
+and checks that a client disconnecting after a few tokens makes the server
+drop the upstream stream, and that a slow reader holds the model reader back
+to CHAT_STREAM_QUEUE_SIZE chunks (backpressure).
+
+    python bench_chat_stream.py --clients 50 --tokens 100 --token-delay-ms 20
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+MODEL_PORT = 54326
+APP_PORT = 54327
+os.environ["MINIMAX_API_URL"] = f"http://127.0.0.1:{MODEL_PORT}"
+os.environ["MINIMAX_API_KEY"] = "bench-key"
+os.environ["MINIMAX_GROUP_ID"] = "bench-group"
+os.environ.pop("SUPABASE_URL", None)  # the prompt gets no trip context; both modes pay the same
+
+import aiohttp
+
+from app.services import minimax
+from app.services.chat_stream import CHAT_STREAM_QUEUE_SIZE, stream_reply
+
+BODY = {"messages": [{"role": "user", "content": "Any trips to Durban?"}], "provider": "minimax"}
+
+
+class FakeModel(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # like a real token stream: each event goes out at once
+    tokens = 100
+    delay = 0.02
+    sent = {}  # request number -> tokens written before the stream ended or broke
+    requests = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with FakeModel.lock:
+            FakeModel.requests += 1
+            number = FakeModel.requests
+        words = [f"tok{i} " for i in range(self.tokens)]
+
+        if not payload.get("stream"):
+            time.sleep(self.delay * self.tokens)
+            body = json.dumps({"choices": [{"message": {"content": "".join(words)}}],
+                               "base_resp": {"status_code": 0}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        FakeModel.sent[number] = 0
+        try:
+            for word in words:
+                time.sleep(self.delay)
+                event = f"data: {json.dumps({'choices': [{'delta': {'content': word}}]})}\n\n".encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+                self.wfile.flush()
+                FakeModel.sent[number] += 1
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def serve_app(ready):
+    import uvicorn
+    config = uvicorn.Config("app.main:app", host="127.0.0.1", port=APP_PORT, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=lambda: (time.sleep(0.5), ready.set()), daemon=True).start()
+    server.run()
+
+
+def percentiles(values):
+    values = sorted(values)
+    return statistics.median(values), values[min(len(values) - 1, int(len(values) * 0.95))]
+
+
+def blocking_ttft(clients):
+    def one(_):
+        start = time.perf_counter()
+        minimax.chat_completion(BODY["messages"])
+        return (time.perf_counter() - start) * 1000
+    with ThreadPoolExecutor(clients) as pool:
+        return list(pool.map(one, range(clients)))
+
+
+async def sse_ttft(session):
+    start = time.perf_counter()
+    first = None
+    async with session.post(f"http://127.0.0.1:{APP_PORT}/ai/chat/stream", json=BODY) as response:
+        async for line in response.content:
+            if first is None and line.startswith(b"data:"):
+                first = (time.perf_counter() - start) * 1000
+            if line.startswith(b"event: done"):
+                break
+    return first, (time.perf_counter() - start) * 1000
+
+
+async def ws_ttft(session):
+    start = time.perf_counter()
+    first = None
+    async with session.ws_connect(f"ws://127.0.0.1:{APP_PORT}/ai/chat/ws") as ws:
+        await ws.send_json(BODY)
+        while True:
+            message = await ws.receive_json()
+            if first is None and message["type"] == "delta":
+                first = (time.perf_counter() - start) * 1000
+            if message["type"] != "delta":
+                break
+    return first, (time.perf_counter() - start) * 1000
+
+
+async def disconnect_after(session, deltas):
+    """Reads `deltas` tokens, hangs up, and returns how many tokens the model went on to send."""
+    async with session.post(f"http://127.0.0.1:{APP_PORT}/ai/chat/stream", json=BODY) as response:
+        seen, number = 0, None
+        async for line in response.content:
+            if line.startswith(b"data:"):
+                seen += 1
+                number = number or FakeModel.requests
+                if seen == deltas:
+                    break
+        response.close()
+    await asyncio.sleep(FakeModel.delay * 10 + 0.5)
+    return FakeModel.sent.get(number, 0)
+
+
+async def backpressure(chunks=500):
+    """Largest number of chunks the reader ran ahead of a slow consumer."""
+    produced = 0
+
+    def fast_model():
+        nonlocal produced
+        for i in range(chunks):
+            produced += 1
+            yield f"tok{i} "
+
+    consumed, ahead = 0, 0
+    async for _ in stream_reply(fast_model):
+        consumed += 1
+        ahead = max(ahead, produced - consumed)
+        await asyncio.sleep(0.001)
+    return ahead
+
+
+async def run(args):
+    results = {}
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+        await sse_ttft(session)  # warm up
+        results["sse"] = await asyncio.gather(*(sse_ttft(session) for _ in range(args.clients)))
+        try:
+            import websockets  # noqa: F401  (uvicorn needs it to serve WebSockets)
+            results["websocket"] = await asyncio.gather(*(ws_ttft(session) for _ in range(args.clients)))
+        except ImportError:
+            print("websocket: skipped, the websockets package is not installed")
+        sent_after_hangup = await disconnect_after(session, 3)
+    ahead = await backpressure()
+    return results, sent_after_hangup, ahead
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-delay-ms", type=float, default=20.0)
+    parser.add_argument("--target-ms", type=float, default=250.0, help="streaming p95 time-to-first-token")
+    args = parser.parse_args()
+
+    FakeModel.tokens = args.tokens
+    FakeModel.delay = args.token_delay_ms / 1000
+    ThreadingHTTPServer.request_queue_size = 256  # every client connects at once
+    model = ThreadingHTTPServer(("127.0.0.1", MODEL_PORT), FakeModel)
+    model.daemon_threads = True
+    threading.Thread(target=model.serve_forever, daemon=True).start()
+
+    ready = multiprocessing.Event()
+    api = multiprocessing.Process(target=serve_app, args=(ready,), daemon=True)
+    api.start()
+    ready.wait()
+    try:
+        blocking = blocking_ttft(args.clients)
+        results, sent_after_hangup, ahead = asyncio.run(run(args))
+    finally:
+        api.terminate()
+        api.join()
+
+    print(f"\n{args.clients} clients, {args.tokens} tokens at {args.token_delay_ms:.0f} ms each\n")
+    print(f"{'mode':<10} {'TTFT p50':>9} {'TTFT p95':>9} {'total p50':>10}")
+    p50, p95 = percentiles(blocking)
+    print(f"{'blocking':<10} {p50:>9.0f} {p95:>9.0f} {p50:>10.0f}")
+    ok = True
+    for mode, timings in results.items():
+        p50, p95 = percentiles([first for first, _ in timings])
+        total, _ = percentiles([total for _, total in timings])
+        ok = ok and p95 <= args.target_ms
+        print(f"{mode:<10} {p50:>9.0f} {p95:>9.0f} {total:>10.0f}")
+
+    stopped = sent_after_hangup < args.tokens // 2
+    print(f"\nclient hung up after 3 tokens: model sent {sent_after_hangup} of {args.tokens}")
+    print(f"slow reader: model reader ran at most {ahead} chunks ahead (queue {CHAT_STREAM_QUEUE_SIZE})")
+    ok = ok and stopped and ahead <= CHAT_STREAM_QUEUE_SIZE + 1
+    print()
+    print("[PASS] streaming TTFT within target, disconnect cancels upstream, backpressure holds" if ok
+          else "[FAIL] TTFT over target, upstream not cancelled, or reader ran ahead of the queue")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: admin dashboard stats latency as the bookings table grows.
+
+For each size a fresh fake PostgREST process is seeded with N bookings (10% of
+them created today), an index on bookings.created_at and a `dashboard_revenue`
+RPC. Two strategies are timed:
+
+  legacy  - three sequential queries that download the matching rows and
+            len()/sum() them in Python (the old get_dashboard_stats)
+  current - admin.fetch_dashboard_stats: concurrent HEAD count requests plus
+            the revenue RPC
+
+    python bench_dashboard_stats.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest
+from app.services.supabase_async import create_async_client
+from app.routers.admin import fetch_dashboard_stats
+
+
+def dashboard_revenue(server, params):
+    keys, rows, lo, hi = server.index_range("bookings", "created_at", "gte", params["since"])
+    return sum(r["total_price"] for r in rows[lo:hi])
+
+
+def serve(port, bookings, ready):
+    server = FakePostgrest(port=port)
+    today = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
+    old = today - timedelta(days=30)
+    rows = []
+    for i in range(bookings):
+        created = today if i % 10 == 0 else old
+        rows.append({"id": i, "created_at": created.strftime("%Y-%m-%dT%H:%M:%SZ"), "total_price": 150.0})
+    server.add_rows("bookings", rows)
+    server.add_rows("trips", [{"id": i, "status": "in_progress" if i % 20 == 0 else "scheduled"} for i in range(1000)])
+    server.add_rows("support_tickets", [{"id": i, "status": "Closed" if i % 4 else "New"} for i in range(200)])
+    server.create_index("bookings", "created_at")
+    server.create_index("trips", "status")
+    server.register_rpc("dashboard_revenue", dashboard_revenue)
+    ready.set()
+    server._server.serve_forever()
+
+
+async def legacy_stats(client):
+    since = f"{datetime.utcnow().strftime('%Y-%m-%d')}T00:00:00Z"
+    trips = await client.table("trips").select("id").eq("status", "in_progress").execute()
+    bookings = await client.table("bookings").select("id, total_price").gte("created_at", since).execute()
+    tickets = await client.table("support_tickets").select("id").neq("status", "Closed").execute()
+    return {
+        "activeTrips": len(trips.data),
+        "todaysBookings": len(bookings.data),
+        "revenueEst": sum(float(b.get("total_price", 0)) for b in bookings.data),
+        "pendingIssues": len(tickets.data),
+    }
+
+
+async def timed(fn, client, rounds):
+    timings, result = [], None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = await fn(client)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+async def measure(url, bookings, rounds, legacy_limit):
+    client = create_async_client(url, "bench-key")
+    current_ms, current = await timed(fetch_dashboard_stats, client, rounds)
+    if bookings <= legacy_limit:
+        legacy_ms, legacy = await timed(legacy_stats, client, max(1, rounds // 5))
+        match = "yes" if legacy == current else f"NO: {legacy} vs {current}"
+        legacy_col = f"{legacy_ms:>10.1f}"
+    else:
+        legacy_col, match = f"{'skipped':>10}", "-"
+    await client.close()
+    print(f"{bookings:>10} {legacy_col} {current_ms:>10.1f}   {current['todaysBookings']:>8} {match}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--legacy-limit", type=int, default=1000000, help="skip the legacy path above this size")
+    parser.add_argument("--port", type=int, default=54323)
+    args = parser.parse_args()
+
+    print(f"{'bookings':>10} {'legacy ms':>10} {'current ms':>10}   {'today':>8} same result")
+    for size in args.sizes:
+        ready = multiprocessing.Event()
+        stub = multiprocessing.Process(target=serve, args=(args.port, size, ready), daemon=True)
+        stub.start()
+        ready.wait()
+        asyncio.run(measure(f"http://127.0.0.1:{args.port}", size, args.rounds, args.legacy_limit))
+        stub.terminate()
+        stub.join()
+
+
+if __name__ == "__main__":
+    main()
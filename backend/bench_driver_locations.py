@@ -0,0 +1,296 @@
+"""
+Benchmark: driver location ingestion and nearest-driver queries with --drivers active drivers.
+
+Simulates a city's drivers (clustered around a few hubs, some parked, some
+busy) and:
+
+  index   - in process: k-nearest and radius queries on the DriverIndex with
+            every driver in it, checked against a brute-force scan; p50 / p99
+            latency per query
+  ingest  - the API under uvicorn in a subprocess (so its CPU is its own)
+            with fake_postgrest behind it. --connections keep-alive clients
+            POST /drivers/locations in batches of --batch pings, bodies built
+            before the clock starts, as the fleet gateway (X-Gateway-Key):
+            pings/s, and the API's CPU. Then the
+            stored tracks: points per ping, and every stored point must be
+            --track-m away from (or DRIVER_TRACK_MAX_INTERVAL after) the
+            driver's previous one
+  query   - GET /drivers/nearest against the API's index, with every driver
+            in it (HTTP included)
+
+Pings without a token or the gateway key, with a wrong key, or for another
+driver than the token's must be refused.
+
+    python bench_driver_locations.py --drivers 100000 --min-rate 50000
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import jwt
+import requests
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest
+from app.services.driver_locations import DriverIndex, METERS_PER_DEGREE
+
+HOST = "127.0.0.1"
+# Johannesburg, Pretoria, Sandton, Soweto, OR Tambo
+HUBS = [(-26.2041, 28.0473), (-25.7479, 28.2293), (-26.1076, 28.0567), (-26.2485, 27.8540), (-26.1367, 28.2411)]
+GATEWAY_KEY = "bench-gateway-key"
+JWT_SECRET = "bench-jwt-secret"
+
+
+def auth(user_id):
+    """Headers with an access token for user_id, as Supabase issues them."""
+    claims = {"sub": user_id, "aud": "authenticated", "exp": int(time.time()) + 3600}
+    return {"Authorization": f"Bearer {jwt.encode(claims, JWT_SECRET, algorithm='HS256')}"}
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class Fleet:
+    """Drivers around the hubs: 30% parked, the rest driving at 5-20 m/s in a straight line."""
+
+    def __init__(self, count, rng):
+        self.ids = [f"00000000-0000-4000-8000-{i:012d}" for i in range(count)]
+        self.lat, self.lon, self.vlat, self.vlon, self.available = [], [], [], [], []
+        for _ in range(count):
+            hub = HUBS[rng.randrange(len(HUBS))]
+            self.lat.append(hub[0] + rng.gauss(0, 0.05))
+            self.lon.append(hub[1] + rng.gauss(0, 0.05))
+            speed = 0.0 if rng.random() < 0.3 else rng.uniform(5, 20)
+            angle = rng.uniform(0, 2 * math.pi)
+            self.vlat.append(speed * math.cos(angle) / METERS_PER_DEGREE)
+            self.vlon.append(speed * math.sin(angle) / METERS_PER_DEGREE / math.cos(math.radians(hub[0])))
+            self.available.append(rng.random() < 0.8)
+
+    def move(self, seconds):
+        for i in range(len(self.ids)):
+            self.lat[i] += self.vlat[i] * seconds
+            self.lon[i] += self.vlon[i] * seconds
+
+    def pings(self, start, stop):
+        return [{"driver_id": self.ids[i], "lat": round(self.lat[i], 7), "lon": round(self.lon[i], 7),
+                 "available": self.available[i]} for i in range(start, stop)]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def bench_index(fleet, queries, k, radius, rng):
+    index = DriverIndex()
+    now = time.time()
+    for i, driver_id in enumerate(fleet.ids):
+        index.update(driver_id, fleet.lat[i], fleet.lon[i], now, fleet.available[i])
+    points = [(hub[0] + rng.gauss(0, 0.06), hub[1] + rng.gauss(0, 0.06))
+              for hub in (HUBS[rng.randrange(len(HUBS))] for _ in range(queries))]
+    knn, within = [], []
+    for lat, lon in points:
+        started = time.perf_counter()
+        index.nearest(lat, lon, k, 10000, now)
+        knn.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        index.within(lat, lon, radius, 20, now)
+        within.append(time.perf_counter() - started)
+
+    # Against a scan of every driver
+    wrong = 0
+    for lat, lon in points[:200]:
+        kx = math.cos(math.radians(lat))
+        every = sorted((math.hypot((index.lon[s] - lon) * kx, index.lat[s] - lat) * METERS_PER_DEGREE, s)
+                       for s in range(len(index.ids)) if index.available[s])
+        expect_knn = [round(d, 6) for d, _ in every if d <= 10000][:k]
+        expect_within = [round(d, 6) for d, _ in every if d <= radius][:20]
+        wrong += [round(d, 6) for d, _ in index.nearest(lat, lon, k, 10000, now)] != expect_knn
+        wrong += [round(d, 6) for d, _ in index.within(lat, lon, radius, 20, now)] != expect_within
+    return {"knn_p50": percentile(knn, 0.5) * 1000, "knn_p99": percentile(knn, 0.99) * 1000,
+            "within_p50": percentile(within, 0.5) * 1000, "within_p99": percentile(within, 0.99) * 1000,
+            "wrong": wrong}
+
+
+async def post_all(port, bodies, connections):
+    """Sends every body over `connections` keep-alive connections; returns the responses' JSON."""
+    queue = list(reversed(bodies))
+    results = []
+
+    async def client():
+        reader, writer = await asyncio.open_connection(HOST, port)
+        while queue:
+            body = queue.pop()
+            writer.write(b"POST /drivers/locations HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                         b"X-Gateway-Key: %s\r\nContent-Length: %d\r\n\r\n%s"
+                         % (GATEWAY_KEY.encode(), len(body), body))
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+            payload = await reader.readexactly(length)
+            if not head.startswith(b"HTTP/1.1 200"):
+                raise RuntimeError(f"/drivers/locations answered {head.split(b' ', 2)[1].decode()}: {payload[:200]}")
+            results.append(json.loads(payload))
+        writer.close()
+
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return results
+
+
+def check_tracks(rows, track_m, interval):
+    """Points that came too soon after the driver's previous stored point."""
+    by_driver = {}
+    for row in rows:
+        by_driver.setdefault(row["driver_id"], []).append(row)
+    close = 0
+    for points in by_driver.values():
+        points.sort(key=lambda r: r["recorded_at"])
+        for a, b in zip(points, points[1:]):
+            moved = DriverIndex.distance(a["lat"], a["lon"], b["lat"], b["lon"])
+            waited = (datetime.datetime.fromisoformat(b["recorded_at"])
+                      - datetime.datetime.fromisoformat(a["recorded_at"])).total_seconds()
+            close += moved < track_m - 1e-6 and waited < interval and a["trip_id"] == b["trip_id"]
+    return close, len(by_driver)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--drivers", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=6, help="pings per driver (each after --step seconds of driving)")
+    parser.add_argument("--step", type=float, default=2, help="simulated seconds between a driver's pings")
+    parser.add_argument("--batch", type=int, default=500, help="pings per request")
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--radius", type=float, default=1000)
+    parser.add_argument("--track-m", type=float, default=50)
+    parser.add_argument("--min-rate", type=float, default=50_000, help="pings/s the API must ingest")
+    parser.add_argument("--max-knn-ms", type=float, default=2, help="p99 of an in-process k-nearest query")
+    parser.add_argument("--port", type=int, default=8768)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fleet = Fleet(args.drivers, rng)
+
+    index = bench_index(fleet, args.queries, args.k, args.radius, rng)
+    print(f"index     {args.drivers:,} drivers: {args.k}-nearest p50 {index['knn_p50']:.3f} ms, "
+          f"p99 {index['knn_p99']:.3f} ms; within {args.radius:g} m (20 nearest) p50 {index['within_p50']:.3f} ms, "
+          f"p99 {index['within_p99']:.3f} ms; {index['wrong']} of 400 answers differ from a full scan")
+
+    # Request bodies for every round, built before the clock starts
+    rounds = []
+    for r in range(args.rounds):
+        if r:
+            fleet.move(args.step)
+        rounds.append([json.dumps({"pings": fleet.pings(i, min(i + args.batch, args.drivers))}).encode()
+                       for i in range(0, args.drivers, args.batch)])
+    pings = args.drivers * args.rounds
+
+    db = FakePostgrest().start()
+    env = {**os.environ, "SUPABASE_URL": db.url, "SUPABASE_KEY": "bench", "SUPABASE_SERVICE_ROLE_KEY": "bench",
+           "PAYMENT_QUEUE_PATH": os.path.join(tempfile.mkdtemp(), "payment_queue.sqlite3"),
+           "DRIVER_TRACK_MIN_METERS": str(args.track_m), "DRIVER_TRACK_FLUSH_MS": "500",
+           "DRIVER_GATEWAY_KEY": GATEWAY_KEY, "SUPABASE_JWT_SECRET": JWT_SECRET}
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port),
+                            "--log-level", "warning", "--no-access-log"],
+                           cwd=os.path.dirname(os.path.abspath(__file__)), env=env, stdout=subprocess.DEVNULL)
+    base = f"http://{HOST}:{args.port}"
+    try:
+        for _ in range(300):
+            try:
+                if requests.get(f"{base}/health").status_code == 200:
+                    break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("API did not start")
+
+        cpu = cpu_seconds(api.pid)
+        started = time.perf_counter()
+        accepted = ignored = 0
+        for bodies in rounds:
+            # A round's pings all come after the previous round's
+            for result in asyncio.run(post_all(args.port, bodies, args.connections)):
+                accepted += result["accepted"]
+                ignored += result["ignored"]
+        elapsed = time.perf_counter() - started
+        rate = pings / elapsed
+        api_cpu = (cpu_seconds(api.pid) - cpu) / elapsed
+        print(f"ingest    {pings:,} pings in {elapsed:.1f} s ({rate:,.0f}/s over {args.connections} connections, "
+              f"{args.batch} per request); API CPU {api_cpu * 100:.0f}%; {accepted:,} accepted, {ignored:,} ignored")
+
+        # Tracks: wait for the writer to catch up
+        for _ in range(100):
+            stats = requests.get(f"{base}/drivers/locations/stats").json()
+            if not stats["pending"]:
+                break
+            time.sleep(0.2)
+        with db._lock:
+            tracks = list(db.tables.get("driver_tracks", []))
+        close, tracked = check_tracks(tracks, args.track_m, 60)
+        print(f"tracks    {len(tracks):,} points stored for {tracked:,} drivers ({len(tracks) / pings:.2f} per ping, "
+              f"{stats['batches']} inserts); {close} closer than {args.track_m:g} m to the previous point")
+
+        # Queries over HTTP against the API's index
+        session = requests.Session()
+        latencies, empty = [], 0
+        for _ in range(1000):
+            hub = HUBS[rng.randrange(len(HUBS))]
+            params = {"lat": hub[0] + rng.gauss(0, 0.06), "lon": hub[1] + rng.gauss(0, 0.06), "k": args.k}
+            started = time.perf_counter()
+            response = session.get(f"{base}/drivers/nearest", params=params)
+            latencies.append(time.perf_counter() - started)
+            empty += response.status_code != 200 or not response.json()
+        last = fleet.ids[-1]
+        where = session.get(f"{base}/drivers/{last}/location").json()
+        moved_to = (round(fleet.lat[-1], 7), round(fleet.lon[-1], 7))
+        print(f"query     GET /drivers/nearest (k={args.k}) p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms with {stats['drivers']:,} drivers in the index")
+
+        # Senders: a driver's phone posts only its own pings
+        ping = lambda driver: {"pings": [{"driver_id": driver, "lat": HUBS[0][0], "lon": HUBS[0][1]}]}
+        refused = [session.post(f"{base}/drivers/locations", json=ping(last), headers=headers).status_code
+                   for headers in ({}, {"X-Gateway-Key": "wrong"}, auth(fleet.ids[0]))]
+        own = session.post(f"{base}/drivers/locations", json=ping(fleet.ids[0]), headers=auth(fleet.ids[0]))
+        print(f"senders   no credentials / wrong key / another driver's pings: {refused}; own pings: {own.status_code}")
+    finally:
+        api.terminate()
+        api.wait()
+        db.stop()
+
+    checks = {
+        f"ingest at least {args.min_rate:,.0f} pings/s": rate >= args.min_rate,
+        "every ping applied": accepted == pings and not ignored,
+        "every driver in the API's index, at its last position":
+            stats["drivers"] == args.drivers and (where.get("lat"), where.get("lon")) == moved_to,
+        "stored tracks are downsampled (fewer points than pings, none too close)": len(tracks) < pings and not close,
+        "every driver has a stored track": tracked == args.drivers,
+        "index answers match a full scan": not index["wrong"],
+        f"{args.k}-nearest p99 within {args.max_knn_ms:g} ms at {args.drivers:,} drivers":
+            index["knn_p99"] <= args.max_knn_ms,
+        "nearest-driver queries answer over HTTP": not empty,
+        "only the gateway or the driver's own token may post pings": refused == [401, 401, 403] and own.ok,
+    }
+    print()
+    for name, passed in checks.items():
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+    ok = all(checks.values())
+    print()
+    print("[PASS] drivers are indexed and tracked at the target rate" if ok else "[FAIL] see above")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
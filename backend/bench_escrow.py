@@ -0,0 +1,355 @@
+"""
+Benchmark: the escrow scheduler over --holds concurrent holds, on a simulated clock.
+
+Books --holds seats (1 to --max-seats per trip), so every fare is held at
+once, then plays --days of trip lifecycle as a discrete-event simulation:
+each trip is completed (released --window later) or, at --cancel-rate,
+cancelled (refunded at once); --dispute-rate of the completed fares are
+disputed inside the window and resolved later; --repeat-rate of the trips
+are completed a second time inside the window; the payment of --late-rate
+of the trips only comes through after they finished, so their holds are
+opened then; halfway through the API
+"restarts" (a new scheduler with an empty queue), and --failures settlement
+writes fail. The clock jumps straight to the next event or the next time the
+scheduler asked to be woken, so days run in seconds and any lateness is the
+scheduler's, not the bench's.
+
+The store is the API's EscrowStore on fake_postgrest (which stands in for
+the escrow and ledger SQL functions), so the scheduler runs the queries it
+runs in production; a subclass counts writes and the hold rows the scheduler
+reads, and the database answers the failing settlement writes with a 503.
+Checks:
+
+  - every hold settles exactly once, released or refunded as its trip went,
+    and disputed holds only when the dispute is resolved
+  - completing a trip again doesn't move its fares' release time, and fares
+    paid after their trip finished are scheduled as the trip went
+  - no fare is released before its trip's dispute window has passed, and
+    none later than one tick after (one tick plus the retry delay when a
+    write failed)
+  - every escrow account ends at zero; drivers got the fares less the fee
+  - settlement writes are batched: the trips due within a tick share their
+    writes (one per --batch holds), and the scheduler reads each hold about
+    once, not the whole table every night
+  - the scheduler's queue holds due times, not holds: it stays small
+
+    python bench_escrow.py --holds 50000
+"""
+import argparse
+import asyncio
+import heapq
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import ledger
+from app.services.escrow import EscrowScheduler, EscrowStore, HoldConflict, _epoch, _iso
+from app.services.supabase_async import create_async_client
+from fake_postgrest import FakePostgrest, open_escrow_holds, post_ledger_transaction, settle_escrow_holds
+
+START = 1_790_000_000.0  # a Tuesday in 2026
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class BenchStore(EscrowStore):
+    """The API's EscrowStore, counting its writes and the hold rows the scheduler reads."""
+
+    def __init__(self, client, db, clock):
+        super().__init__(client)
+        self.db = db
+        self.clock = clock
+        self.settled = []       # (hold id, settled at, from status)
+        self.writes = {"open": 0, "schedule": 0, "settle": 0, "dispute": 0}
+        self.rows_read = 0
+        self.fail_next = 0
+
+    async def open(self, holds):
+        self.writes["open"] += 1
+        return await super().open(holds)
+
+    async def schedule_trip(self, trip_id, release_at, settle_as):
+        self.writes["schedule"] += 1
+        return await super().schedule_trip(trip_id, release_at, settle_as)
+
+    async def due(self, now, limit):
+        rows = await super().due(now, limit)
+        self.rows_read += len(rows)
+        return rows
+
+    async def dispute(self, id_, reason):
+        self.writes["dispute"] += 1
+        return await super().dispute(id_, reason)
+
+    async def settle(self, settlements):
+        self.writes["settle"] += 1
+        if self.fail_next and settlements[0]["from"] == "held":
+            # The scheduler's batches only (a failed resolve is the endpoint's 500): the database answers 503
+            self.fail_next -= 1
+            self.db.fail_next += 1
+        ids = await super().settle(settlements)
+        sources = {s["hold_id"]: s["from"] for s in settlements}
+        self.settled.extend((id_, self.clock(), sources[id_]) for id_ in ids)
+        return ids
+
+    def holds(self):
+        return {row["id"]: {**row, "release_at": None if row["release_at"] is None else _epoch(row["release_at"])}
+                for row in self.db.tables.get("escrow_holds", [])}
+
+    def balances(self):
+        return defaultdict(int, {row["account"]: row["balance_cents"] for row in self.db.tables.get("ledger_balances", [])})
+
+
+def new_id(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    clock = Clock(START)
+    db = FakePostgrest().start()
+    for name, fn in (("open_escrow_holds", open_escrow_holds), ("settle_escrow_holds", settle_escrow_holds),
+                     ("post_ledger_transaction", post_ledger_transaction)):
+        db.register_rpc(name, fn)
+    # The queries' indexes (add_escrow.sql)
+    for table, column in (("trips", "id"), ("escrow_holds", "id"), ("escrow_holds", "trip_id"),
+                          ("escrow_holds", "release_at")):
+        db.create_index(table, column)
+    client = create_async_client(db.url, "bench")
+    store = BenchStore(client, db, clock)
+    make = lambda: EscrowScheduler(store, clock=clock, dispute_window=args.window, batch_size=args.batch,
+                                   tick=args.tick, retry=args.retry)
+    scheduler = make()
+    drivers = [new_id(rng) for _ in range(args.drivers)]
+    payers = [new_id(rng) for _ in range(args.payers)]
+
+    # Booking: every fare held at once, but those paid late
+    trips, unpaid = [], {}
+    started = time.perf_counter()
+    booked = 0
+    while booked < args.holds:
+        trip_id, seats = new_id(rng), min(rng.randint(1, args.max_seats), args.holds - booked)
+        price = rng.randrange(80, 900) + rng.choice((0, 0.5, 0.99))
+        db.add_rows("trips", [{"id": trip_id, "user_id": rng.choice(drivers), "status": "scheduled"}])
+        payer = rng.choice(payers)
+        bookings = [{"id": new_id(rng), "trip_id": trip_id, "user_id": payer, "total_price": price}
+                    for _ in range(seats)]
+        if rng.random() < args.late_rate:
+            unpaid[trip_id] = bookings
+        else:
+            await scheduler.open_holds(trip_id, bookings)
+        trips.append(trip_id)
+        booked += seats
+    open_seconds = time.perf_counter() - started
+    held = sum(1 for h in db.tables.get("escrow_holds", []) if h["status"] == "held")
+    escrowed = sum(v for k, v in store.balances().items() if k.startswith("escrow:"))
+    by_trip = defaultdict(list)
+    for h in db.tables.get("escrow_holds", []):
+        by_trip[h["trip_id"]].append(h["id"])
+    print(f"booked    {held:,} holds on {len(trips):,} trips in {open_seconds:.1f} s "
+          f"({held / open_seconds:,.0f} holds/s), {ledger.format_cents(escrowed)} in escrow")
+
+    # The lifecycle, as events on the simulated clock
+    horizon = args.days * 86400
+    events, seq = [], 0
+
+    def add(at, kind, payload):
+        nonlocal seq
+        heapq.heappush(events, (at, seq, kind, payload))
+        seq += 1
+
+    outcome, completed_at = {}, {}
+    for trip_id in trips:
+        at = START + rng.random() * horizon
+        if trip_id in unpaid:
+            add(at + rng.random() * args.window * 0.5, "pay", trip_id)
+        if rng.random() < args.cancel_rate:
+            outcome[trip_id] = "refund"
+            add(at, "cancel", trip_id)
+            continue
+        outcome[trip_id], completed_at[trip_id] = "release", at
+        add(at, "complete", trip_id)
+        if trip_id in unpaid:
+            # (a repeated PATCH moves status_updated_at, which a late payment goes by)
+            continue
+        if rng.random() < args.repeat_rate:
+            add(at + rng.random() * args.window * 0.9, "complete", trip_id)
+        for id_ in by_trip[trip_id]:
+            if rng.random() < args.dispute_rate:
+                disputed = at + rng.random() * args.window * 0.9
+                add(disputed, "dispute", id_)
+                add(disputed + rng.uniform(3600, 2 * 86400), "resolve", (id_, rng.choice(("release", "refund"))))
+    add(START + horizon / 2, "restart", None)
+    for i in range(args.failures):
+        add(START + horizon * (i + 1) / (args.failures + 2) + 1, "fail", None)
+
+    def finish(trip_id, status):
+        # What PATCH /travel/trips/{id}/status writes
+        db.lookup("trips", "id", trip_id)[0].update(status=status, status_updated_at=_iso(clock.now))
+
+    disputed, resolved, failed_at = set(), {}, []
+    run_seconds, runs_with_work, max_queue = 0.0, 0, 0
+    started, sim_cpu = time.perf_counter(), time.process_time()
+    while True:
+        due = scheduler.next_due()
+        if events and (due is None or events[0][0] < due):
+            at, _, kind, payload = heapq.heappop(events)
+            clock.now = max(clock.now, at)
+            if kind == "complete":
+                finish(payload, "completed")
+                await scheduler.trip_completed(payload)
+            elif kind == "cancel":
+                finish(payload, "cancelled")
+                await scheduler.trip_cancelled(payload)
+            elif kind == "pay":
+                await scheduler.open_holds(payload, unpaid[payload])
+            elif kind == "dispute":
+                try:
+                    await scheduler.dispute(payload, reason="bench")
+                    disputed.add(payload)
+                except HoldConflict:
+                    pass
+            elif kind == "resolve":
+                if payload[0] in disputed:
+                    await scheduler.resolve(*payload)
+                    resolved[payload[0]] = payload[1]
+            elif kind == "restart":
+                scheduler = make()
+                scheduler.schedule(clock.now)
+            elif kind == "fail":
+                store.fail_next += 1
+                failed_at.append(clock.now)
+        elif due is not None:
+            clock.now = max(clock.now, due)
+            began = time.perf_counter()
+            if await scheduler.run_due():
+                runs_with_work += 1
+            run_seconds += time.perf_counter() - began
+        else:
+            break
+        max_queue = max(max_queue, len(scheduler._heap))
+    sim_seconds = time.perf_counter() - started
+    sim_cpu = time.process_time() - sim_cpu
+
+    # What happened to every hold
+    await client.close()
+    db.stop()
+    holds, balances = store.holds(), store.balances()
+    problems = []
+    settle_count = defaultdict(int)
+    for id_, _, _ in store.settled:
+        settle_count[id_] += 1
+    if any(n != 1 for n in settle_count.values()) or len(settle_count) != len(holds):
+        problems.append(f"{len(holds) - len(settle_count):,} holds unsettled, "
+                        f"{sum(1 for n in settle_count.values() if n > 1):,} settled twice")
+    wrong = 0
+    early, lateness = 0, []
+    for id_, at, source in store.settled:
+        row = holds[id_]
+        expected = resolved.get(id_) if id_ in disputed else outcome[row["trip_id"]]
+        if row["status"] != {"release": "released", "refund": "refunded"}[expected]:
+            wrong += 1
+        if source == "disputed":
+            continue
+        if id_ in disputed:
+            wrong += 1
+        if at < row["release_at"]:
+            early += 1
+        lateness.append(at - row["release_at"])
+    if wrong:
+        problems.append(f"{wrong:,} holds settled the wrong way")
+    moved = sum(1 for h in holds.values() if h["settle_as"] == "release"
+                and abs(h["release_at"] - completed_at[h["trip_id"]] - args.window) > 1e-3)
+    postings = len(db.tables.get("ledger_transactions", []))
+    if postings != len(holds) + len(store.settled):
+        problems.append(f"{postings:,} ledger postings for {len(holds):,} holds opened and "
+                        f"{len(store.settled):,} settled")
+
+    lateness.sort()
+    p99 = lateness[int(len(lateness) * 0.99)] if lateness else 0
+    late_bound = args.tick + (args.retry + args.tick if failed_at else 0)
+    escrow_left = {k: v for k, v in balances.items() if k.startswith("escrow:") and v}
+    released_holds = [h for h in holds.values() if h["status"] == "released"]
+    net = sum(h["amount_cents"] - ledger.platform_fee(h["amount_cents"]) for h in released_holds)
+    fees = sum(ledger.platform_fee(h["amount_cents"]) for h in released_holds)
+    wallets = sum(v for k, v in balances.items() if k.startswith("wallet:"))
+    settled = len(store.settled)
+    scheduled = settled - len(resolved)
+    writes = store.writes["settle"] - len(resolved)  # resolving a dispute is a write of its own
+    nightly = len(holds) * args.days
+
+    print(f"simulated {args.days:g} days: {settled:,} holds settled "
+          f"({sum(1 for h in holds.values() if h['status'] == 'released'):,} released, "
+          f"{sum(1 for h in holds.values() if h['status'] == 'refunded'):,} refunded, "
+          f"{len(disputed):,} disputed) in {sim_seconds:.1f} s wall, {sim_cpu:.1f} s CPU")
+    print(f"timeliness  early {early}, lateness p50 {lateness[len(lateness) // 2] if lateness else 0:.1f} s, "
+          f"p99 {p99:.1f} s, max {lateness[-1] if lateness else 0:.1f} s (tick {args.tick:g} s, "
+          f"{len(failed_at)} failed writes retried after {args.retry:g} s); {moved} release times moved")
+    print(f"writes      {writes:,} settlement writes for {scheduled:,} holds on {len(trips):,} trips "
+          f"({scheduled / max(writes, 1):.0f} holds/write, batch {args.batch}) in {runs_with_work:,} "
+          f"scheduler runs; {store.writes['schedule']:,} trip updates")
+    print(f"reads       {store.rows_read:,} hold rows read by the scheduler; a nightly scan would read "
+          f"~{nightly:,} over {args.days:g} nights")
+    print(f"scheduler   {run_seconds / max(settled, 1) * 1e6:.1f} us per settled hold (settlement postings "
+          f"included); queue peaked at {max_queue:,} due times for {len(holds):,} holds")
+
+    checks = {
+        "every hold settled exactly once, the right way": not problems,
+        "no fare released before its dispute window passed": early == 0,
+        "repeated completions leave the release time alone": moved == 0,
+        f"settled within {late_bound:g} s of being due": not lateness or lateness[-1] <= late_bound,
+        "escrow accounts back to zero": not escrow_left,
+        "drivers got the fares less the fee": wallets == net and balances[ledger.PLATFORM_REVENUE] == fees,
+        "settlement writes batched: one per tick with work, plus one per batch":
+            writes <= runs_with_work + math.ceil(scheduled / args.batch) + len(failed_at),
+        "each hold read about once (not a full scan)": store.rows_read <= 1.05 * settled + args.batch * len(failed_at),
+        "queue bounded by ticks, not holds": max_queue <= math.ceil((horizon + 2 * args.window) / args.tick) + 10,
+    }
+    for problem in problems:
+        print(f"  ! {problem}")
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--holds", type=int, default=10_000, help="seats booked, all held at once")
+    parser.add_argument("--max-seats", type=int, default=6)
+    parser.add_argument("--drivers", type=int, default=500)
+    parser.add_argument("--payers", type=int, default=5_000)
+    parser.add_argument("--days", type=float, default=3, help="over which the trips complete or are cancelled")
+    parser.add_argument("--window", type=float, default=86400, help="dispute window, seconds")
+    parser.add_argument("--tick", type=float, default=60)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--retry", type=float, default=30)
+    parser.add_argument("--cancel-rate", type=float, default=0.1)
+    parser.add_argument("--dispute-rate", type=float, default=0.005)
+    parser.add_argument("--repeat-rate", type=float, default=0.05)
+    parser.add_argument("--late-rate", type=float, default=0.05)
+    parser.add_argument("--failures", type=int, default=3, help="settlement writes that fail")
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    checks = asyncio.run(run(args))
+    print()
+    for name, passed in checks.items():
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+    ok = all(checks.values())
+    print()
+    print("[PASS] escrow settles on time, once, in batches" if ok else "[FAIL] see above")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark: location autocomplete over a large gazetteer.
+
+Builds the Gazetteer from --names synthetic place names (multi-word, with
+popularity counts) and measures index memory (tracemalloc), build time,
+incremental add time and suggest() latency for the kinds of input users
+type: one or two letters, a prefix, a later word, an alias, a typo and a
+miss. Fails if memory exceeds --memory-budget-mb, if a prefix/alias
+workload's p99 exceeds --target-ms, or if the typo-fallback workloads'
+median does. Typo recall is the share of misspellings whose intended place
+is among the first three suggestions.
+
+    python bench_gazetteer.py --names 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.gazetteer import Gazetteer
+
+# Syllables shaped like Southern African place names (Mbombela, Stellenbosch, Kwa Thema...)
+ONSETS = ["b", "d", "f", "g", "h", "k", "l", "m", "n", "p", "r", "s", "t", "v", "w", "z",
+          "th", "sh", "kw", "ng", "mb", "nd", "st", "tsh", "dl", "hl", "bl", "gr"]
+VOWELS = ["a", "e", "i", "o", "u", "aa", "oe", "ie"]
+CODAS = ["", "", "", "n", "r", "l", "s", "m", "nk", "rg"]
+SUFFIXES = ["", "", "", " North", " South", " Central", " Heights", " Park", " Extension", " Village"]
+
+
+def place_names(count, rng):
+    names, seen = [], set()
+    while len(names) < count:
+        word = "".join(rng.choice(ONSETS) + rng.choice(VOWELS) + rng.choice(CODAS)
+                       for _ in range(rng.randint(2, 4))).capitalize()
+        name = word + rng.choice(SUFFIXES)
+        if name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
+
+def typo(name, rng):
+    chars = list(name)
+    i = rng.randrange(1, len(chars))
+    if rng.random() < 0.5:
+        del chars[i]
+    else:
+        chars[i - 1], chars[i] = chars[i], chars[i - 1]
+    return "".join(chars)
+
+
+def timed(gazetteer, queries):
+    timings = []
+    for q in queries:
+        start = time.perf_counter()
+        gazetteer.suggest(q)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--names", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--memory-budget-mb", type=float, default=64.0)
+    parser.add_argument("--target-ms", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = place_names(args.names + 1000, rng)
+    names, later = names[:args.names], names[args.names:]
+    real = ["Johannesburg", "Cape Town", "Durban", "Pretoria", "Stellenbosch", "Bloemfontein", "Polokwane"]
+    counts = {name: rng.randint(1, 50) for name in names}
+    counts.update({name: 5000 for name in real})
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    gazetteer = Gazetteer()
+    gazetteer.add_many(counts)
+    build_s = time.perf_counter() - start
+    index_mb = (tracemalloc.get_traced_memory()[0] - before) / 1024 / 1024
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for name in later:
+        gazetteer.add(name, 1)
+    add_ms = (time.perf_counter() - start) * 1000 / len(later)
+
+    sample = [rng.choice(names) for _ in range(args.queries)]
+    workloads = {
+        "1-2 letters": [s[:rng.randint(1, 2)] for s in sample],
+        "prefix": [s[:rng.randint(3, 6)] for s in sample],
+        "later word": [s.split()[-1][:4] if " " in s else s[:4] for s in sample],
+        "alias": [rng.choice(["jozi", "jhb", "cpt", "dbn", "pta", "stellies"]) for _ in sample],
+        "typo": [typo(s, rng) for s in sample],
+        "miss": ["qxz" + s[:3] for s in sample],
+    }
+
+    fallback = ("typo", "miss")
+
+    ok = index_mb <= args.memory_budget_mb
+    print(f"{len(gazetteer)} places: build {build_s:.2f} s, index {index_mb:.1f} MB "
+          f"(budget {args.memory_budget_mb:.0f} MB), incremental add {add_ms:.3f} ms/name\n")
+    print(f"{'query':<12} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, queries in workloads.items():
+        gazetteer.suggest(queries[0])
+        p50, p99 = timed(gazetteer, queries)
+        ok = ok and (p50 if label in fallback else p99) <= args.target_ms
+        print(f"{label:<12} {p50:>8.3f} {p99:>8.3f}")
+
+    found = sum(any(s["name"] == name for s in gazetteer.suggest(q)[:3])
+                for name, q in zip(sample, workloads["typo"]))
+    print(f"\ntypo recall@3: {found / len(sample):.1%}")
+    print(f"jozi -> {gazetteer.suggest('jozi')[:1]}")
+    print(f"johanesburg -> {gazetteer.suggest('johanesburg')[:1]}")
+    print()
+    print("[PASS] within memory budget and latency target" if ok else "[FAIL] over memory budget or latency target")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Benchmark: pickup-zone geofence evaluation over a synthetic day of --trips trips and about --pings driver pings.
+
+Scripts a day of trips around a few hubs, each driver with several trips
+in turn. For each trip the driver either drives up to the pickup zone,
+waits in it a few minutes (some pings wobbling just past its edge, inside
+the exit margin) and leaves, or never turns up (a no-show). Drivers also
+cruise around between trips. Then:
+
+  replay  - in process: every ping, in time order, through the
+            GeofenceEngine, with fences loaded and expired the way the
+            service does (every GEOFENCE_REFRESH of simulated time):
+            pings/s, and fences evaluated per ping against the number of
+            active fences a scan without the grid would check. The events
+            must equal those of a brute-force evaluator (every fence of the
+            ping's driver, haversine distances), and match the script:
+            one arrival at the first ping in the zone, one departure at the
+            first ping past the margin (wobbles are not departures), the
+            longest wait, and no arrival for no-shows; the timelines built
+            from them flag exactly the no-shows
+  ingest  - the same pings through DriverLocations.ingest with and without
+            the engine watching: what the evaluation adds per ping
+  api     - the app on fake_postgrest: pings posted to /drivers/locations
+            for a trip departing now, then its timeline
+            (/travel/trips/{id}/timeline), a no-show's, and the dispute
+            detail of a ticket about the trip
+
+    python bench_geofences.py --trips 100000 --pings 1000000
+"""
+import argparse
+import datetime
+import gc
+import math
+import os
+import random
+import sys
+import time
+import uuid
+
+import jwt
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.driver_locations import DriverLocations, DriverIndex, METERS_PER_DEGREE
+from app.services.geofences import (GeofenceEngine, PickupGeofences, build_timeline, fence_window, _iso,
+                                    GEOFENCE_OPEN_BEFORE, GEOFENCE_OPEN_AFTER)
+
+# Johannesburg, Pretoria, Sandton, Soweto, OR Tambo
+HUBS = [(-26.2041, 28.0473), (-25.7479, 28.2293), (-26.1076, 28.0567), (-26.2485, 27.8540), (-26.1367, 28.2411)]
+DAY = datetime.datetime(2026, 2, 16, tzinfo=datetime.timezone.utc).timestamp()
+# Seconds between a waiting driver's pings
+WAIT_PING_EVERY = 180
+
+
+class Ping:
+    __slots__ = ("driver_id", "lat", "lon", "at", "available", "trip_id", "speed", "heading")
+
+    def __init__(self, at, driver_id, lat, lon):
+        self.at, self.driver_id, self.lat, self.lon = at, driver_id, lat, lon
+        self.available, self.trip_id, self.speed, self.heading = True, None, None, None
+
+
+def offset(lat, lon, meters, rng):
+    angle = rng.uniform(0, 2 * math.pi)
+    return (lat + meters * math.sin(angle) / METERS_PER_DEGREE,
+            lon + meters * math.cos(angle) / (METERS_PER_DEGREE * math.cos(math.radians(lat))))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * 6371008.8 * math.asin(math.sqrt(a))
+
+
+def script_day(args, rng):
+    """Trips rows, pings (time order) and what the script says each trip's events are."""
+    drivers = max(1, args.trips // args.trips_per_driver)
+    slot = 86400 / args.trips_per_driver
+    margin = args.margin
+    trips, pings, truth, roamers = [], [], {}, []
+    for n in range(args.trips):
+        d, j = n % drivers, n // drivers
+        driver_id = f"00000000-0000-4000-8000-{d:012d}"
+        trip_id = f"00000000-0000-4000-9000-{n:012d}"
+        hub = HUBS[rng.randrange(len(HUBS))]
+        plat, plon = hub[0] + rng.gauss(0, 0.05), hub[1] + rng.gauss(0, 0.05)
+        radius = rng.choice((100, 150, 200))
+        start = DAY + j * slot
+        # The whole watch window inside the driver's slot, so trips don't overlap
+        departs = start + GEOFENCE_OPEN_BEFORE + rng.uniform(0, slot - GEOFENCE_OPEN_BEFORE - GEOFENCE_OPEN_AFTER)
+        trips.append({"id": trip_id, "user_id": driver_id, "status": "scheduled", "departs_at": _iso(departs),
+                      "pickup_lat": plat, "pickup_lon": plon, "pickup_radius_m": radius,
+                      "origin": "Hub", "destination": "Elsewhere"})
+        roamers.append((driver_id, hub, start, max(start, departs - GEOFENCE_OPEN_BEFORE - 60)))
+        if rng.random() < args.no_show:
+            for k in range(6):
+                at = departs - 3000 + k * 1000 + rng.uniform(0, 60)
+                pings.append(Ping(at, driver_id, *offset(plat, plon, rng.uniform(1000, 3000), rng)))
+            truth[trip_id] = None
+            continue
+        arrive = departs - rng.uniform(0, 900)
+        pings.append(Ping(arrive - 360, driver_id, *offset(plat, plon, 2000, rng)))
+        pings.append(Ping(arrive - 180, driver_id, *offset(plat, plon, 800, rng)))
+        pings.append(Ping(arrive, driver_id, *offset(plat, plon, rng.uniform(0, 0.8 * radius), rng)))
+        wait_until, at, last_inside = arrive + rng.uniform(60, 1500), arrive + WAIT_PING_EVERY, arrive
+        while at < wait_until:
+            wobble = rng.random() < 0.2
+            meters = rng.uniform(radius + 1, radius + 0.9 * margin) if wobble else rng.uniform(0, radius)
+            pings.append(Ping(at, driver_id, *offset(plat, plon, meters, rng)))
+            last_inside = at
+            at += WAIT_PING_EVERY + rng.uniform(-20, 20)
+        pings.append(Ping(at, driver_id, *offset(plat, plon, radius + margin + rng.uniform(50, 300), rng)))
+        pings.append(Ping(at + 180, driver_id, *offset(plat, plon, 1500, rng)))
+        truth[trip_id] = {"arrived": _iso(arrive), "left": _iso(at), "left_minutes": int((at - arrive) // 60),
+                          "waited": int((last_inside - arrive) // (args.step * 60)) * args.step}
+
+    # Cruising between trips, before the next trip's zone is watched
+    while len(pings) < args.pings:
+        driver_id, hub, start, until = roamers[rng.randrange(len(roamers))]
+        pings.append(Ping(rng.uniform(start, until), driver_id, hub[0] + rng.gauss(0, 0.05), hub[1] + rng.gauss(0, 0.05)))
+    pings.sort(key=lambda p: p.at)
+    # A driver's pings at distinct times, so the position index keeps every one
+    for i in range(1, len(pings)):
+        if pings[i].at <= pings[i - 1].at:
+            pings[i].at = pings[i - 1].at + 1e-6
+    return trips, pings, truth
+
+
+def replay(trips, pings, args, watch=True, ingest=False):
+    """Runs the day; returns (events, seconds, active fences per refresh, engine)."""
+    engine = GeofenceEngine(margin=args.margin, wait_step=args.step)
+    service = PickupGeofences(engine, refresh=args.refresh)
+    locations = DriverLocations(DriverIndex(), clock=lambda: now) if ingest else None
+    if ingest and watch:
+        locations.watchers.append(engine.observe)
+    order = sorted(trips, key=lambda t: t["departs_at"])
+    departures = [datetime.datetime.fromisoformat(t["departs_at"]).timestamp() for t in order]
+    # Batches of time-ordered pings, each ending at a refresh so fences are loaded and expired on time
+    batches, refreshes, start, next_refresh = [], [], 0, pings[0].at
+    while start < len(pings):
+        due = []
+        while next_refresh <= pings[start].at:
+            due.append(next_refresh)
+            next_refresh += args.refresh
+        end = min(start + args.batch, len(pings))
+        while pings[end - 1].at >= next_refresh:
+            end -= 1
+        batches.append(pings[start:end])
+        refreshes.append(due)
+        start = end
+    loaded, active, events = 0, [], []
+    observe = engine.observe
+    now = pings[0].at
+    started = time.perf_counter()
+    for batch, due in zip(batches, refreshes):
+        for at in due if watch else ():
+            engine.expire(at)
+            horizon = at + GEOFENCE_OPEN_BEFORE + args.refresh
+            while loaded < len(order) and departures[loaded] <= horizon:
+                service.watch_trip(order[loaded])
+                loaded += 1
+            active.append(len(engine))
+        now = batch[-1].at
+        if ingest:
+            locations.ingest(batch)
+        elif watch:
+            for p in batch:
+                observe(p.driver_id, p.lat, p.lon, p.at)
+        events.extend(engine.take())
+    return events, time.perf_counter() - started, active, engine
+
+
+def oracle(trips, pings, margin, step):
+    """Every fence of the ping's driver, no grid, haversine: the events the engine must emit."""
+    fences = {}
+    for trip in trips:
+        opens, closes = fence_window(datetime.datetime.fromisoformat(trip["departs_at"]).timestamp())
+        fences.setdefault(trip["user_id"], []).append([trip, opens, closes, None, 0])
+    events = set()
+    for p in pings:
+        for fence in fences.get(p.driver_id, ()):
+            trip, opens, closes, since, waited = fence
+            if not opens <= p.at <= closes:
+                continue
+            d = haversine(p.lat, p.lon, trip["pickup_lat"], trip["pickup_lon"])
+            if since is None:
+                if d <= trip["pickup_radius_m"]:
+                    fence[3], fence[4] = p.at, 0
+                    events.add((trip["id"], "arrived", _iso(p.at), 0))
+            elif d > trip["pickup_radius_m"] + margin:
+                events.add((trip["id"], "left", _iso(p.at), int((p.at - since) // 60)))
+                fence[3] = None
+            else:
+                minutes = int((p.at - since) // (step * 60)) * step
+                if minutes > waited:
+                    fence[4] = minutes
+                    events.add((trip["id"], "waited", _iso(p.at), minutes))
+    return events
+
+
+def check_script(trips, events, truth, args):
+    """Mismatches between the events and the scripted arrivals, waits, departures and no-shows."""
+    by_trip = {}
+    for e in events:
+        by_trip.setdefault(e["trip_id"], []).append(e)
+    wrong = 0
+    end = DAY + 86400 + GEOFENCE_OPEN_AFTER + 1
+    for trip in trips:
+        mine, expected = by_trip.get(trip["id"], []), truth[trip["id"]]
+        arrived = [e["at"] for e in mine if e["kind"] == "arrived"]
+        left = [(e["at"], e["minutes"]) for e in mine if e["kind"] == "left"]
+        waited = max([e["minutes"] for e in mine if e["kind"] == "waited"], default=0)
+        if expected is None:
+            ok = not mine
+        else:
+            ok = (arrived == [expected["arrived"]] and left == [(expected["left"], expected["left_minutes"])]
+                  and waited == expected["waited"])
+        summary = build_timeline(trip, [], mine, now=end)["summary"]
+        ok = ok and summary["no_show"] == (expected is None)
+        wrong += not ok
+    return wrong
+
+
+def check_api(args):
+    """Pings for a trip departing now through the app, then its timeline, a no-show's and a dispute's."""
+    from fake_postgrest import FakePostgrest
+    server = FakePostgrest().start()
+    os.environ.update(SUPABASE_URL=server.url, SUPABASE_KEY="bench", SUPABASE_SERVICE_ROLE_KEY="bench",
+                      AI_CACHE_ENABLED="0", SUPABASE_JWT_SECRET="bench-jwt-secret")
+    now = time.time()
+    driver = str(uuid.uuid4())
+    trip, missed, ticket = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+    plat, plon = HUBS[0]
+    base = {"user_id": driver, "origin": "Johannesburg", "destination": "Pretoria", "date": "2026-02-16",
+            "time": "08:00", "price": 100.0, "seats_available": 3, "vehicle": "Sedan", "driver_name": "Bench",
+            "driver_rating": 4.8, "pickup_lat": plat, "pickup_lon": plon, "pickup_radius_m": 150,
+            "status_updated_at": None}
+    server.add_rows("trips", [
+        {**base, "id": trip, "status": "scheduled", "departs_at": _iso(now + 300)},
+        {**base, "id": missed, "status": "cancelled", "departs_at": _iso(now - 2 * GEOFENCE_OPEN_AFTER),
+         "status_updated_at": _iso(now - 3600)},
+    ])
+    server.add_rows("bookings", [{"id": str(uuid.uuid4()), "trip_id": trip, "user_id": str(uuid.uuid4()),
+                                  "status": "confirmed", "created_at": _iso(now - 86400)}])
+    server.add_rows("support_tickets", [{"id": ticket, "user_id": str(uuid.uuid4()), "type": "Dispute",
+                                         "status": "New", "description": "Driver never came",
+                                         "trip_id": trip, "created_at": _iso(now)}])
+    server.add_rows("trip_events", [])
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services.geofences import pickup_geofences
+
+    # Minute steps, so a wait fits in the position index's freshness window
+    pickup_geofences.engine.wait_step = 1
+    with TestClient(app) as client:
+        deadline = time.time() + 5
+        while trip not in pickup_geofences.engine.fences and time.time() < deadline:
+            time.sleep(0.05)
+        at = time.time()
+        rng = random.Random(args.seed)
+        pings = [(at - 110, 1000), (at - 100, 40), (at - 35, 120), (at - 5, 400)]
+        body = {"pings": [{"driver_id": driver, "lat": lat, "lon": lon, "at": t}
+                          for t, meters in pings for lat, lon in [offset(plat, plon, meters, rng)]]}
+        # The driver's phone, with their access token
+        token = jwt.encode({"sub": driver, "aud": "authenticated", "exp": int(time.time()) + 3600},
+                           "bench-jwt-secret", algorithm="HS256")
+        accepted = client.post("/drivers/locations", json=body,
+                               headers={"Authorization": f"Bearer {token}"}).json()["accepted"]
+        time.sleep(pickup_geofences.flush_interval * 2)
+        timeline = client.get(f"/travel/trips/{trip}/timeline").json()
+        no_show = client.get(f"/travel/trips/{missed}/timeline").json()
+        dispute = client.get(f"/admin/disputes/{ticket}").json()
+    server.stop()
+    kinds = [entry["kind"] for entry in timeline["timeline"]]
+    return [
+        ("pings accepted", accepted == len(pings)),
+        (f"timeline {kinds}", kinds == ["booked", "arrived", "waited", "left"]),
+        ("wait and departure in the summary", timeline["summary"]["waited_minutes"] == 1
+         and timeline["summary"]["left_at"] is not None),
+        ("cancelled trip with no arrival is a no-show", no_show["summary"]["no_show"]),
+        ("dispute timeline from data", [e["kind"] for e in dispute.get("timeline", [])] == kinds),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", type=int, default=100_000)
+    parser.add_argument("--pings", type=int, default=1_000_000, help="total, topped up with drivers cruising")
+    parser.add_argument("--trips-per-driver", type=int, default=5)
+    parser.add_argument("--no-show", type=float, default=0.1, help="share of trips whose driver never arrives")
+    parser.add_argument("--margin", type=float, default=30, help="exit margin (m)")
+    parser.add_argument("--step", type=int, default=5, help="minutes between wait events")
+    parser.add_argument("--refresh", type=float, default=60, help="simulated seconds between fence loads")
+    parser.add_argument("--batch", type=int, default=500, help="pings per ingest call")
+    parser.add_argument("--min-rate", type=float, default=100_000,
+                        help="pings/s the engine must evaluate (fence loads and event rows included)")
+    parser.add_argument("--max-checked", type=float, default=1.0, help="fences evaluated per ping")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    trips, pings, truth = script_day(args, rng)
+    # As the API runs (tune_garbage_collection in app/main.py): the scripted day is never garbage
+    gc.set_threshold(50000, 20, 10)
+    gc.freeze()
+    no_shows = sum(1 for t in truth.values() if t is None)
+    print(f"day: {len(trips)} trips ({no_shows} no-shows), {len(pings)} pings, "
+          f"scripted in {time.perf_counter() - started:.1f}s")
+
+    events, seconds, active, engine = replay(trips, pings, args)
+    info = engine.info()
+    rate = len(pings) / seconds
+    checked = info["checked"] / len(pings)
+    print(f"replay: {rate:,.0f} pings/s; {checked:.2f} fences evaluated per ping, "
+          f"{sum(active) / len(active):,.0f} active on average ({max(active):,} at most); "
+          f"{info['arrived']} arrived, {info['waited']} waited, {info['left']} left")
+
+    expected = oracle(trips, pings, args.margin, args.step)
+    got = {(e["trip_id"], e["kind"], e["at"], e["minutes"]) for e in events}
+    wrong = check_script(trips, events, truth, args)
+    print(f"oracle: {len(expected)} events, {len(got ^ expected)} differ; script: {wrong} trips differ")
+
+    _, bare, _, _ = replay(trips, pings, args, watch=False, ingest=True)
+    _, watched, _, _ = replay(trips, pings, args, ingest=True)
+    overhead = (watched - bare) / len(pings) * 1e6
+    print(f"ingest: {len(pings) / bare:,.0f} pings/s without the engine, {len(pings) / watched:,.0f} with it "
+          f"(+{overhead:.2f} us per ping)")
+
+    checks = [
+        (f"engine evaluates >= {args.min_rate:,.0f} pings/s", rate >= args.min_rate),
+        (f"<= {args.max_checked} fences evaluated per ping", checked <= args.max_checked),
+        ("events equal the brute-force evaluation", got == expected and len(got) == len(events)),
+        ("arrivals, waits, departures and no-shows match the script", wrong == 0),
+    ]
+    if not args.skip_api:
+        checks += check_api(args)
+    ok = True
+    for name, passed in checks:
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+        ok = ok and passed
+    print("[PASS] pickup zones are evaluated at the target rate and the timelines are right" if ok else "[FAIL] see above")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Benchmark: the journey planner over --trips upcoming trips.
+
+  build   - in process: --trips trips over a month on a hub-and-spoke network
+            (towns linked to one or two hubs, hubs to each other, a few town
+            to town routes), most trips timed from the route's distance, some
+            with a duration_minutes. Time to build the graph, then queries
+            between random places, by arrival and by price: p50 / p99 / max
+            latency against --max-ms
+  exact   - on a --oracle-trips graph with current prices that differ from
+            the listed ones: every query's k best itineraries against a
+            brute-force enumeration of every itinerary of up to three legs
+  update  - new, sold-out, cancelled and rescheduled trips applied one at a
+            time, and the departed dropped as the clock moves: the answers
+            must equal those of a graph built from scratch, and each change
+            must cost far less than a rebuild
+  http    - over HTTP on fake_postgrest: Johannesburg to Pietermaritzburg
+            with no direct trip comes back through Durban, with the price
+            table's prices and a change of at least the minimum transfer,
+            and a leg that sells out disappears from the answers
+
+    python bench_journeys.py --trips 200000
+"""
+import argparse
+import datetime
+import gc
+import math
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import journeys
+from app.services.journeys import JourneyPlanner, _iso
+from app.services.pricing import route_key, departure_time
+
+NOW = datetime.datetime(2026, 3, 2, 6, 0, tzinfo=datetime.timezone.utc).timestamp()
+HUBS = ["Johannesburg", "Durban", "Cape Town", "Bloemfontein", "Gqeberha", "Polokwane"]
+
+
+def make_network(rng, towns):
+    """places -> (x, y) km, and directed routes -> km by road."""
+    places = {hub: (rng.uniform(0, 1200), rng.uniform(0, 1200)) for hub in HUBS}
+    places.update({f"Town {i}": (rng.uniform(0, 1200), rng.uniform(0, 1200)) for i in range(towns)})
+    road = lambda a, b: round(math.dist(places[a], places[b]) * 1.25 + 5, 1)
+    links = {(a, b) for a in HUBS for b in HUBS if a != b}
+    spokes = [p for p in places if p not in HUBS]
+    for town in spokes:
+        for hub in sorted(HUBS, key=lambda h: math.dist(places[h], places[town]))[:rng.choice((1, 2))]:
+            links.update({(town, hub), (hub, town)})
+    for _ in range(towns // 3):
+        a, b = rng.sample(spokes, 2)
+        links.update({(a, b), (b, a)})
+    return places, {link: road(*link) for link in links}
+
+
+def make_trips(count, rng, routes, now, days=30):
+    weighted = [route for route in routes for _ in range(4 if route[0] in HUBS and route[1] in HUBS else 1)]
+    rows = []
+    for i in range(count):
+        origin, destination = rng.choice(weighted)
+        departs = now + rng.uniform(60, days * 86400)
+        local = datetime.datetime.fromtimestamp(departs, journeys.trip_zone())
+        row = {"id": str(uuid.UUID(int=rng.getrandbits(128), version=4)), "origin": origin, "destination": destination,
+               "date": local.strftime("%Y-%m-%d"), "time": local.strftime("%H:%M"),
+               "price": float(rng.randrange(60, 900, 10)), "seats_available": rng.choice((0, 1, 2, 3, 4, 4)),
+               "status": "scheduled", "created_at": f"2026-03-01T00:00:00.{i:06d}Z"}
+        if i % 2:
+            row["departs_at"] = _iso(departs)
+        if i % 10 == 0:
+            row["duration_minutes"] = rng.randrange(30, 900)
+        rows.append(row)
+    return rows
+
+
+def build(rows, distances, clock):
+    planner = JourneyPlanner(clock=lambda: clock[0])
+    planner.distances = distances
+    for row in rows:
+        planner.upsert(row)
+    return planner
+
+
+def distance_table(routes):
+    return {route_key(*route): km for route, km in routes.items()}
+
+
+def keys(itineraries, sort):
+    """What the answer is ranked by; ties may be broken by different itineraries."""
+    ranked = []
+    for it in itineraries:
+        arrival, price, legs = it["arrives_at"], it["price"], len(it["legs"])
+        ranked.append((price, arrival, legs) if sort == "price" else (arrival, price, legs))
+    return ranked
+
+
+def brute_force(rows, distances, source, target, after, sort, k, seats, prices, now):
+    """Every itinerary of up to three legs, from the rows, with no index."""
+    legs = []
+    for row in rows:
+        route = route_key(row["origin"], row["destination"])
+        departs = departure_time(row)
+        duration = row["duration_minutes"] * 60 if row.get("duration_minutes") else (
+            distances[route] / journeys.JOURNEY_SPEED_KMH * 3600 if route in distances else None)
+        if departs is None or departs <= now or duration is None or row.get("status") in journeys.CLOSED_STATUSES \
+                or row["seats_available"] < seats:
+            continue
+        legs.append((route[0], route[1], departs, departs + duration, prices.get(row["id"], row["price"])))
+    source, target = route_key(source, target)
+    transfer, wait = journeys.JOURNEY_MIN_TRANSFER_MINUTES * 60, journeys.JOURNEY_MAX_WAIT_HOURS * 3600
+    found = []
+
+    def extend(path, paid):
+        last = path[-1]
+        if last[1] == target:
+            found.append((last[3], round(paid, 2), len(path)))
+            return
+        if len(path) == 3:
+            return
+        for leg in legs:
+            if leg[0] == last[1] and leg[1] != source and last[3] + transfer <= leg[2] <= last[3] + wait:
+                extend(path + [leg], paid + leg[4])
+
+    for leg in legs:
+        if leg[0] == source and after <= leg[2] <= after + journeys.JOURNEY_HORIZON_HOURS * 3600:
+            extend([leg], leg[4])
+    ranked = sorted(((p, _iso(a), n) if sort == "price" else (_iso(a), p, n)) for a, p, n in found)
+    return ranked[:k]
+
+
+def bench_build(args, rng):
+    places, routes = make_network(rng, args.towns)
+    distances = distance_table(routes)
+    rows = make_trips(args.trips, rng, routes, NOW)
+    clock = [NOW]
+    started = time.perf_counter()
+    planner = build(rows, distances, clock)
+    build_s = time.perf_counter() - started
+    gc.freeze()
+
+    names = list(places)
+    samples, connected, labels = {"arrival": [], "price": []}, 0, planner.counters["labels"]
+    for i in range(args.queries):
+        source, target = rng.sample(names, 2)
+        after = NOW + rng.uniform(0, 25 * 86400)
+        for sort in ("arrival", "price"):
+            started = time.perf_counter()
+            found = planner.plan(source, target, after, sort=sort, k=args.k)
+            samples[sort].append((time.perf_counter() - started) * 1000)
+            connected += sort == "arrival" and any(len(it["legs"]) > 1 for it in found)
+    labels = (planner.counters["labels"] - labels) / (2 * args.queries)
+
+    info = planner.info()
+    print(f"build: {info['trips']:,} trips on {info['routes']} routes between {info['places']} places in "
+          f"{build_s:.2f} s; {args.queries} queries each way, {labels:.0f} labels per query, "
+          f"{connected} answered with changes")
+    worst = 0.0
+    for sort, ms in samples.items():
+        p50, p99 = statistics.median(ms), statistics.quantiles(ms, n=100)[98]
+        worst = max(worst, p99)
+        print(f"  by {sort}: p50 {p50:.2f} ms, p99 {p99:.2f} ms, max {max(ms):.2f} ms")
+    return [(f"p99 query within {args.max_ms:.0f} ms on {info['trips']:,} trips", worst <= args.max_ms),
+            ("itineraries with changes found", connected > 0)]
+
+
+def bench_exact(args, rng):
+    places, routes = make_network(rng, args.towns // 3)
+    distances = distance_table(routes)
+    rows = make_trips(args.oracle_trips, rng, routes, NOW, days=6)
+    prices = {row["id"]: round(row["price"] * rng.uniform(0.8, 1.6) * 2) / 2 for row in rows if rng.random() < 0.7}
+    planner = build(rows, distances, [NOW])
+    names, wrong, checked, multi = list(places), 0, 0, 0
+    for _ in range(args.oracle_queries):
+        source, target = rng.sample(names, 2)
+        after, seats = NOW + rng.uniform(0, 3 * 86400), rng.choice((1, 1, 2))
+        for sort in ("arrival", "price"):
+            got = keys(planner.plan(source, target, after, sort=sort, k=args.k, seats=seats, prices=prices), sort)
+            want = brute_force(rows, distances, source, target, after, sort, args.k, seats, prices, NOW)
+            wrong += got != want
+            checked += 1
+            multi += any(n > 1 for *_, n in want)
+    print(f"exact: {checked} answers against brute force ({multi} with changes), {wrong} different")
+    return [("k best itineraries equal a brute-force enumeration", wrong == 0 and multi > 0)]
+
+
+def bench_update(args, rng):
+    places, routes = make_network(rng, args.towns)
+    distances = distance_table(routes)
+    rows = make_trips(args.trips, rng, routes, NOW)
+    clock = [NOW]
+    planner = build(rows, distances, clock)
+
+    started = time.perf_counter()
+    changes = 0
+    added = make_trips(args.changes, rng, routes, NOW)
+    for row in added:
+        planner.upsert(row)
+    rows.extend(added)
+    for row in rng.sample(rows, args.changes):
+        row["seats_available"] = 0
+        planner.observe_trip({"id": row["id"], "seats_available": 0})
+    for row in rng.sample(rows, args.changes):
+        row["status"] = "cancelled"
+        planner.observe_trip({"id": row["id"], "status": "cancelled"})
+    moved = rng.sample([r for r in rows if r["status"] == "scheduled"], args.changes)
+    for row in moved:
+        row["departs_at"] = _iso(departure_time(row) + 3600)
+        planner.upsert(row)
+    changes = 4 * args.changes
+    per_change_us = (time.perf_counter() - started) / changes * 1e6
+
+    clock[0] = NOW + 6 * 3600
+    started = time.perf_counter()
+    dropped = planner.expire()
+    expire_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    fresh = build(rows, distances, clock)
+    rebuild_s = time.perf_counter() - started
+
+    names, wrong = list(places), 0
+    for _ in range(args.update_queries):
+        source, target = rng.sample(names, 2)
+        after = clock[0] + rng.uniform(0, 5 * 86400)
+        for sort in ("arrival", "price"):
+            wrong += keys(planner.plan(source, target, after, sort=sort), sort) != \
+                keys(fresh.plan(source, target, after, sort=sort), sort)
+    same = len(planner) == len(fresh) and wrong == 0
+    print(f"update: {changes:,} changes at {per_change_us:.1f} us each; {dropped:,} departed dropped in "
+          f"{expire_ms:.1f} ms; rebuild from scratch {rebuild_s:.2f} s; "
+          f"{2 * args.update_queries} answers, {wrong} different from the rebuilt graph")
+    return [("incrementally updated graph answers like a rebuilt one", same),
+            ("a change costs under a thousandth of a rebuild", per_change_us / 1e6 < rebuild_s / 1000)]
+
+
+def bench_http(args, rng):
+    from fake_postgrest import FakePostgrest, book_seats
+    server = FakePostgrest().start()
+    server.register_rpc("book_seats", book_seats)
+    now = time.time()
+    rows = []
+    for day in range(3):
+        for hour in (6, 9, 12, 15):
+            base = now + 3600 + day * 86400 + (hour - 6) * 3600
+            rows.append(("Johannesburg", "Durban", base, 650.0))
+            for offset in (0.25, 1, 2.5, 5, 8):
+                rows.append(("Durban", "Pietermaritzburg", base + 568 / journeys.JOURNEY_SPEED_KMH * 3600
+                             + offset * 3600, 120.0))
+            rows.append(("Johannesburg", "Pretoria", base, 90.0))
+    trips = []
+    for i, (origin, destination, departs, price) in enumerate(rows):
+        local = datetime.datetime.fromtimestamp(departs, journeys.trip_zone())
+        trips.append({"id": str(uuid.uuid4()), "origin": origin, "destination": destination,
+                      "origin_norm": origin.lower(), "destination_norm": destination.lower(),
+                      "date": local.strftime("%Y-%m-%d"), "time": local.strftime("%H:%M"), "price": price,
+                      "seats_available": 3, "status": "scheduled", "created_at": f"2026-03-01T00:00:00.{i:06d}Z",
+                      "vehicle": "Sedan", "driver_name": "Bench", "driver_rating": 4.8, "driver_image": ""})
+    server.add_rows("trips", trips)
+    server.add_rows("route_distances", [{"origin": "Johannesburg", "destination": "Durban", "distance_km": 568},
+                                        {"origin": "Durban", "destination": "Pietermaritzburg", "distance_km": 80},
+                                        {"origin": "Johannesburg", "destination": "Pretoria", "distance_km": 58}])
+    os.environ.update(SUPABASE_URL=server.url, SUPABASE_KEY="bench", SUPABASE_SERVICE_ROLE_KEY="bench",
+                      AI_CACHE_ENABLED="0")
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services.journeys import journey_planner
+    from app.services.pricing import price_table
+
+    url = "/travel/journeys?from_loc=Johannesburg&to_loc=Pietermaritzburg"
+    with TestClient(app) as client:
+        deadline = time.time() + 30
+        while (len(journey_planner) < len(trips) or len(price_table) < len(trips)) and time.time() < deadline:
+            time.sleep(0.05)
+        by_arrival = client.get(url).json()
+        by_price = client.get(url + "&sort=price&k=10").json()
+        bad_sort = client.get(url + "&sort=distance").status_code
+
+        via_durban = bool(by_arrival) and all([leg["destination"] for leg in it["legs"]] == ["Durban", "Pietermaritzburg"]
+                                              for it in by_arrival)
+        minimum = journeys.JOURNEY_MIN_TRANSFER_MINUTES
+        transfers_ok = all(it["wait_minutes"] >= minimum for it in by_arrival + by_price)
+        arrivals = [it["arrives_at"] for it in by_arrival]
+        totals = [it["price"] for it in by_price]
+        quoted = all(leg["price"] == price_table.price(leg["trip_id"]) for it in by_price for leg in it["legs"])
+
+        sold = by_arrival[0]["legs"][0]["trip_id"]
+        booking = client.post("/travel/bookings/batch", json={"trip_id": sold, "user_id": str(uuid.uuid4()), "seats": 3})
+        deadline = time.time() + 5
+        while sold in journey_planner.legs and journey_planner.legs[sold].seats and time.time() < deadline:
+            time.sleep(0.02)
+        after = client.get(url).json()
+        gone = booking.status_code == 200 and all(leg["trip_id"] != sold for it in after for leg in it["legs"])
+        stats = client.get("/travel/journeys/stats").json()
+    server.stop()
+
+    first = by_arrival[0] if by_arrival else {}
+    print(f"http: {len(by_arrival)} by arrival, {len(by_price)} by price; best {first.get('departs_at', '')[:16]} -> "
+          f"{first.get('arrives_at', '')[:16]}, {first.get('wait_minutes')} min in Durban, R{first.get('price')}; "
+          f"graph {stats['trips']} trips")
+    return [("no direct trip: itineraries through Durban", via_durban),
+            ("changes respect the minimum transfer", transfers_ok),
+            ("sorted by arrival and by price", arrivals == sorted(arrivals) and totals == sorted(totals)),
+            ("legs carry the price table's prices", quoted and len(by_price) > 0),
+            ("a sold-out leg disappears; unknown sort is a 400", gone and bad_sort == 400)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", type=int, default=200_000)
+    parser.add_argument("--towns", type=int, default=54, help="places besides the six hubs")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--oracle-trips", type=int, default=6000)
+    parser.add_argument("--oracle-queries", type=int, default=60)
+    parser.add_argument("--changes", type=int, default=1000, help="of each kind")
+    parser.add_argument("--update-queries", type=int, default=100)
+    parser.add_argument("--max-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    # As the API runs (tune_garbage_collection in app/main.py)
+    gc.set_threshold(50000, 20, 10)
+    rng = random.Random(args.seed)
+    checks = bench_build(args, rng) + bench_exact(args, rng) + bench_update(args, rng) + bench_http(args, rng)
+    ok = True
+    for name, passed in checks:
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+        ok = ok and passed
+    print("[PASS] journeys are exact, fast and kept up to date" if ok else "[FAIL] see above")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+Benchmark: the live trip push channel (/live/trips) with --subscribers idle
+connections and --rate trip updates a second on one node.
+
+Starts fake_postgrest with --trips trips and the API under uvicorn in a
+subprocess (so its memory and CPU are its own) with PUSH_BROKER=unix and
+GC_THRESHOLD=--gc-threshold (the tuning for live-update nodes), then
+opens the subscribers from this process: each follows one trip, and one in
+--route-every follows a whole route instead. Updates are published the way a
+second API worker would publish them, through a Hub whose UnixBroker shares
+the API's broker directory.
+
+  idle    - the API's RSS per 1,000 subscribers and its CPU while they only
+            get heartbeats
+  load    - --rate updates/s for --seconds, one in ten on a few hot trips (a
+            burst that coalesces): publish-to-receive latency, events/s, the
+            API's CPU and RSS growth. Every subscriber must end up with the
+            last state of each trip it follows
+  slow    - --slow connections on a busy route that stop reading: they must
+            be sent "resync" and the API's memory must stay bounded
+  workers - a second API process on the same broker: a subscriber there gets
+            a PATCH /travel/trips/{id}/status made on the first
+
+    python bench_live.py --subscribers 10000 --rate 1000
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest, seed_trips
+from app.services.pubsub import Hub, UnixBroker, route_topic, trip_event
+
+HOST = "127.0.0.1"
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class Subscriber:
+    def __init__(self, trips=(), route=None):
+        self.trips, self.route = list(trips), route
+        self.last = {}          # trip id -> status_updated_at last received
+        self.events = 0
+        self.resyncs = 0
+        self.writer = None
+
+
+def request(sub):
+    params = [("trip_id", t) for t in sub.trips]
+    if sub.route:
+        params += [("from_loc", sub.route[0]), ("to_loc", sub.route[1])]
+    return (f"GET /live/trips?{urlencode(params)} HTTP/1.1\r\nHost: bench\r\n"
+            f"Accept: text/event-stream\r\n\r\n").encode()
+
+
+async def connect(port, sub):
+    """Opens /live/trips for sub; returns its reader once the response has started."""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(request(sub))
+    head = await reader.readuntil(b"\r\n\r\n")
+    if not head.startswith(b"HTTP/1.1 200"):
+        raise RuntimeError(head.split(b"\r\n", 1)[0].decode())
+    sub.writer = writer
+    return reader
+
+
+async def follow(reader, sub, latencies):
+    """Reads sub's chunked event stream until it ends, recording each trip event."""
+    try:
+        while True:
+            size = int(await reader.readuntil(b"\r\n"), 16)
+            if size == 0:
+                return
+            payload = await reader.readexactly(size + 2)
+            now = time.time()
+            for block in payload[:-2].split(b"\n\n"):
+                if block.startswith(b"event: trip\n"):
+                    data = json.loads(block[block.index(b"data: ") + 6:])["data"]
+                    sub.last[data["id"]] = data["status_updated_at"]
+                    sub.events += 1
+                    latencies.append(now - datetime.datetime.fromisoformat(data["status_updated_at"]).timestamp())
+                elif block.startswith(b"event: resync"):
+                    sub.resyncs += 1
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return
+
+
+async def open_all(port, subs, concurrency=200):
+    readers = []
+    for i in range(0, len(subs), concurrency):
+        readers += await asyncio.gather(*(connect(port, sub) for sub in subs[i:i + concurrency]))
+    return readers
+
+
+async def publish_load(hub, trips, rate, seconds, rng, published):
+    """rate updates/s for `seconds` in 10 ms steps; 10% on the first 10 trips (hot). Returns updates sent."""
+    step, sent = 0.01, 0
+    started = time.monotonic()
+    while (elapsed := time.monotonic() - started) < seconds:
+        for _ in range(int(rate * elapsed) - sent):
+            trip = trips[rng.randrange(10)] if rng.random() < 0.1 else trips[rng.randrange(len(trips))]
+            stamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            trip = {**trip, "status_updated_at": stamp, "seats_available": rng.randrange(5)}
+            published[trip["id"]] = stamp
+            hub.publish_trip(trip)
+            sent += 1
+        await asyncio.sleep(step)
+    return sent
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+async def bench(args, api, second_api, broker_dir, trips, rng):
+    port, second_port = args.port, args.port + 1
+    routes = sorted({(t["origin"], t["destination"]) for t in trips})
+    subs = [Subscriber(route=routes[i % len(routes)]) if i % args.route_every == 0
+            else Subscriber(trips=[trips[i % len(trips)]["id"]]) for i in range(args.subscribers)]
+    latencies, results, problems = [], {}, []
+
+    resting = rss_kb(api.pid)
+    started = time.perf_counter()
+    readers = await open_all(port, subs)
+    tasks = [asyncio.create_task(follow(reader, sub, latencies)) for reader, sub in zip(readers, subs)]
+    print(f"connected {len(subs):,} subscribers in {time.perf_counter() - started:.1f} s")
+
+    # Idle: heartbeats only
+    await asyncio.sleep(2)
+    cpu, rss = cpu_seconds(api.pid), rss_kb(api.pid)
+    await asyncio.sleep(args.idle)
+    results["idle_cpu"] = (cpu_seconds(api.pid) - cpu) / args.idle
+    results["per_1k_mb"] = (rss - resting) / 1024 / len(subs) * 1000
+    print(f"idle      API RSS {resting / 1024:.0f} MiB at rest, {rss / 1024:.0f} MiB with {len(subs):,} subscribers "
+          f"({results['per_1k_mb']:.1f} MiB per 1,000); CPU {results['idle_cpu'] * 100:.1f}% over {args.idle:g} s")
+
+    # Slow consumers on a busy route: bare sockets with tiny receive buffers
+    # that aren't read (a StreamReader would keep reading into its buffer)
+    loop = asyncio.get_running_loop()
+    hot_route = (trips[0]["origin"], trips[0]["destination"])
+    slow = []
+    for _ in range(args.slow):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        await loop.sock_connect(sock, (HOST, port))
+        await loop.sock_sendall(sock, request(Subscriber(route=hot_route)))
+        slow.append(sock)
+
+    # Load, published as another worker would
+    hub = Hub(broker=UnixBroker(broker_dir))
+    hub.start()
+    published = {}
+    before = {"cpu": cpu_seconds(api.pid), "bench_cpu": cpu_seconds(os.getpid()),
+              "events": sum(s.events for s in subs)}
+    peak = rss
+    sampler_stop = asyncio.Event()
+
+    async def sample():
+        nonlocal peak
+        while not sampler_stop.is_set():
+            peak = max(peak, rss_kb(api.pid))
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.create_task(sample())
+    latencies.clear()
+    started = time.perf_counter()
+    sent = await publish_load(hub, trips, args.rate, args.seconds, rng, published)
+    elapsed = time.perf_counter() - started
+    # Until the last window has arrived everywhere (this process reads all the connections)
+    received, quiet = sum(s.events for s in subs), 0
+    while quiet < 10:
+        await asyncio.sleep(0.1)
+        now = sum(s.events for s in subs)
+        quiet, received = (quiet + 1 if now == received else 0), now
+    drained = time.perf_counter() - started - elapsed
+    cpu = cpu_seconds(api.pid) - before["cpu"]
+    received -= before["events"]
+    bench_cpu = (cpu_seconds(os.getpid()) - before["bench_cpu"]) / (elapsed + drained)
+    stats = requests.get(f"http://{HOST}:{port}/live/stats").json()
+    results.update(rate=sent / elapsed, p50=percentile(latencies, 0.5) * 1000, p95=percentile(latencies, 0.95) * 1000,
+                   p99=percentile(latencies, 0.99) * 1000, max=max(latencies, default=float("nan")) * 1000,
+                   load_cpu=cpu / (elapsed + drained))
+    print(f"load      {sent:,} updates in {elapsed:.1f} s ({results['rate']:,.0f}/s; "
+          f"{hub.counters['coalesced']:,} coalesced before sending); {received:,} events received "
+          f"({received / elapsed:,.0f}/s), latency p50 {results['p50']:.0f} ms, p95 {results['p95']:.0f} ms, "
+          f"p99 {results['p99']:.0f} ms, max {results['max']:.0f} ms; "
+          f"all arrived {drained - 1:.1f} s after the last publish; CPU {results['load_cpu'] * 100:.0f}% API, "
+          f"{bench_cpu * 100:.0f}% this process; broker datagrams {stats.get('broker_received', 0):,} received, "
+          f"{stats.get('broker_dropped', 0)} dropped by the API")
+
+    # Everyone converged on the last state of what they follow
+    by_route = {}
+    for trip in trips:
+        if trip["id"] in published:
+            by_route.setdefault((trip["origin"], trip["destination"]), []).append(trip["id"])
+    # (one sent "resync" fetches the trips again, so it may have missed some)
+    stale = resynced = 0
+    for sub in subs:
+        following = by_route.get(sub.route, []) if sub.route else [t for t in sub.trips if t in published]
+        if sub.resyncs:
+            resynced += 1
+        else:
+            stale += any(sub.last.get(t) != published[t] for t in following)
+    results.update(stale=stale, resynced=resynced)
+    print(f"          {resynced:,} subscribers were sent resync")
+    if stale:
+        problems.append(f"{stale:,} subscribers missed the last state of a trip they follow")
+
+    # The load above fits in the stalled connections' socket buffers; flood
+    # their route (every trip on it, each window) until the buffers are full
+    # and events wait in the hub
+    topic = route_topic(*hot_route)
+    flooding = [trip_event({**t, "status_updated_at": None})[1] for t in trips if (t["origin"], t["destination"]) == hot_route]
+    flooded = 0
+    started = time.monotonic()
+    while time.monotonic() - started < args.flood:
+        for data in flooding:
+            hub.publish(topic, "trip", data, key=data["id"])
+        flooded += len(flooding)
+        await asyncio.sleep(hub.coalesce)
+    await asyncio.sleep(1)
+    sampler_stop.set()
+    await sampler
+    hub.stop()
+    results["growth_mb"] = (peak - rss) / 1024
+    print(f"slow      {len(slow)} connections stalled during the load and a flood of {flooded:,} events on their "
+          f"route; API RSS {peak / 1024:.0f} MiB peak ({results['growth_mb']:+.1f} MiB)")
+
+    # The slow connections start reading: a resync must be among what waited
+    async def drain(sock):
+        deadline = time.monotonic() + 10
+        seen = b""
+        while b"event: resync" not in seen and time.monotonic() < deadline:
+            try:
+                seen = seen[-64:] + await asyncio.wait_for(loop.sock_recv(sock, 1 << 16), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+        sock.close()
+        return b"event: resync" in seen
+
+    results["slow_resynced"] = sum(await asyncio.gather(*(drain(sock) for sock in slow)))
+    print(f"          {results['slow_resynced']}/{len(slow)} were sent resync when they read again")
+
+    # A second worker's subscriber sees a status change made through the first
+    watcher = Subscriber(trips=[trips[1]["id"]])
+    watcher_latencies = []
+    watching = asyncio.create_task(follow(await connect(second_port, watcher), watcher, watcher_latencies))
+    await asyncio.sleep(args.broker_refresh + 0.5)  # the first worker lists the broker directory again
+    response = await asyncio.to_thread(requests.patch, f"http://{HOST}:{port}/travel/trips/{trips[1]['id']}/status",
+                                       json={"status": "in_progress"})
+    for _ in range(40):
+        if watcher.events:
+            break
+        await asyncio.sleep(0.05)
+    results["across_workers"] = response.status_code == 200 and watcher.events > 0
+    print(f"workers   PATCH on :{port} answered {response.status_code}; subscriber on :{second_port} got "
+          f"{watcher.events} event(s)")
+
+    for sub in subs + [watcher]:
+        sub.writer.close()
+    for task in tasks + [watching]:
+        task.cancel()
+    await asyncio.gather(*tasks, watching, return_exceptions=True)
+    return results, problems
+
+
+def start_api(port, env):
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                            "--log-level", "warning", "--no-access-log", "--backlog", "16384",
+                            "--timeout-graceful-shutdown", "2"],
+                           cwd=os.path.dirname(os.path.abspath(__file__)), env=env, stdout=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            if requests.get(f"http://{HOST}:{port}/health").status_code == 200:
+                return api
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    api.terminate()
+    raise RuntimeError("API did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=10_000)
+    parser.add_argument("--trips", type=int, default=2_000, help="trips the subscribers follow")
+    parser.add_argument("--route-every", type=int, default=100, help="one subscriber in this many follows a route")
+    parser.add_argument("--rate", type=int, default=1_000, help="trip updates per second")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--idle", type=float, default=16, help="seconds to measure idle CPU (covers a heartbeat)")
+    parser.add_argument("--slow", type=int, default=20, help="connections that stop reading")
+    parser.add_argument("--flood", type=float, default=3, help="seconds of every trip on their route, each window")
+    parser.add_argument("--max-p99-ms", type=float, default=500)
+    parser.add_argument("--max-idle-cpu", type=float, default=10, help="percent")
+    parser.add_argument("--max-per-1k-mb", type=float, default=64, help="API RSS per 1,000 subscribers")
+    parser.add_argument("--max-growth-mb", type=float, default=64, help="API RSS growth under load")
+    parser.add_argument("--broker-refresh", type=float, default=1)
+    parser.add_argument("--gc-threshold", default="50000,20,10", help="the API's GC_THRESHOLD; \"\" for Python's default")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    db = FakePostgrest().start()
+    seed_trips(db, args.trips)
+    trips = requests.get(f"{db.url}/rest/v1/trips", params={"select": "id,origin,destination,date,time,status"}).json()
+    trips.sort(key=lambda t: t["id"])
+
+    broker_dir = tempfile.mkdtemp()
+    env = {**os.environ, "SUPABASE_URL": db.url, "SUPABASE_KEY": "bench", "SUPABASE_SERVICE_ROLE_KEY": "bench",
+           "PUSH_BROKER": "unix", "PUSH_BROKER_DIR": broker_dir, "PUSH_BROKER_REFRESH": str(args.broker_refresh),
+           "PUSH_MAX_TOPICS": "20", "GC_THRESHOLD": args.gc_threshold}
+    apis = []
+    try:
+        for port in (args.port, args.port + 1):
+            apis.append(start_api(port, {**env, "PAYMENT_QUEUE_PATH": os.path.join(tempfile.mkdtemp(), "q.sqlite3")}))
+        results, problems = asyncio.run(bench(args, apis[0], apis[1], broker_dir, trips, rng))
+    finally:
+        for api in apis:
+            api.terminate()
+        for api in apis:
+            api.wait()
+        db.stop()
+
+    checks = {
+        f"{args.rate:,} updates/s published": results["rate"] >= 0.95 * args.rate,
+        "every subscriber has the last state of what it follows (or was sent resync)": not results["stale"],
+        "under 1% of subscribers sent resync": results["resynced"] < args.subscribers / 100,
+        f"latency p99 within {args.max_p99_ms:g} ms": results["p99"] <= args.max_p99_ms,
+        f"idle CPU with {args.subscribers:,} subscribers within {args.max_idle_cpu:g}%":
+            results["idle_cpu"] * 100 <= args.max_idle_cpu,
+        f"API memory per 1,000 subscribers within {args.max_per_1k_mb:g} MiB":
+            results["per_1k_mb"] <= args.max_per_1k_mb,
+        f"API memory growth under load (with stalled readers) within {args.max_growth_mb:g} MiB":
+            results["growth_mb"] <= args.max_growth_mb,
+        "stalled connections were sent resync": results["slow_resynced"] == args.slow,
+        "an update on one worker reaches subscribers of another": results["across_workers"],
+    }
+    for problem in problems[:10]:
+        print(f"  ! {problem}")
+    print()
+    for name, passed in checks.items():
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+    ok = all(checks.values())
+    print()
+    print("[PASS] live updates fan out within budget and stay bounded" if ok else "[FAIL] see above")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Benchmark: LLM gateway latency and availability against flaky providers.
+
+Two local fake providers stand in for Gemini and Minimax. Each answers in
+about --base-ms, but a --tail share of calls takes --tail-ms (a slow model
+replica), so a single provider's p99 is the tail. Four phases:
+
+  tail      both providers healthy; one provider called directly (as /chat
+            did before the gateway) vs the gateway with hedging
+  outage    the preferred provider errors on every call; the breaker should
+            open and send traffic to the other one, never twice for one
+            request (no hedging onto the provider already working on it),
+            with no more fallbacks than its tail explains
+  blackout  both providers hang; the smart-mock fallback should answer
+            within the gateway deadline
+  streams   streamed replies: an erroring provider is skipped before the
+            first chunk, hanging ones give way to the fallback by the
+            deadline, and a reply that stalls after starting ends with an
+            error within the provider timeout; replies that stream fine
+            don't count as failures or trip the breaker
+
+Fails if the gateway's p99 in the tail phase isn't well under the direct
+p99, if the outage shows through, or if blackout replies miss the deadline.
+
+    python bench_llm_gateway.py --requests 400
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.llm_gateway import CircuitBreaker, LLMGateway, Provider
+
+MESSAGES = [{"role": "user", "content": "Any trips to Durban?"}]
+
+
+class FakeProvider:
+    """complete(messages, ...) that sleeps like a model and can be made to fail or hang."""
+    def __init__(self, name, base_ms, tail, tail_ms, seed):
+        self.name = name
+        self.base_ms = base_ms
+        self.tail = tail
+        self.tail_ms = tail_ms
+        self.mode = "ok"  # "ok" | "error" | "hang"
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def complete(self, messages, model=None, temperature=0.7, timeout=None):
+        with self._lock:
+            self.calls += 1
+            slow = self._rng.random() < self.tail
+            jitter = self._rng.uniform(0.8, 1.2)
+        if self.mode == "error":
+            time.sleep(0.005)
+            raise RuntimeError(f"{self.name}: 503 Service Unavailable")
+        if self.mode == "hang":
+            time.sleep(timeout or 60)
+            raise TimeoutError(f"{self.name}: read timed out")
+        time.sleep((self.tail_ms if slow else self.base_ms * jitter) / 1000)
+        return f"{self.name} says hi"
+
+    def stream(self, messages, model=None, temperature=0.7, timeout=None):
+        """Five chunks over about base_ms; mode "stall" hangs after the first."""
+        with self._lock:
+            self.calls += 1
+        if self.mode == "error":
+            time.sleep(0.005)
+            raise RuntimeError(f"{self.name}: 503 Service Unavailable")
+        if self.mode == "hang":
+            time.sleep(timeout or 60)
+            raise TimeoutError(f"{self.name}: read timed out")
+        for i in range(5):
+            time.sleep(self.base_ms / 5000)
+            yield f"{self.name}{i} "
+            if self.mode == "stall":
+                time.sleep(timeout or 60)
+                raise TimeoutError(f"{self.name}: read timed out")
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))]
+    return pick(0.5), pick(0.95), pick(0.99)
+
+
+async def drive(count, concurrency, call):
+    """Latencies (ms) and results of `count` calls, `concurrency` at a time."""
+    latencies, results = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            results.append(await call())
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(count)))
+    return latencies, results
+
+
+def report(label, latencies):
+    p50, p95, p99 = percentiles(latencies)
+    print(f"{label:<28} p50 {p50:7.1f}  p95 {p95:7.1f}  p99 {p99:7.1f} ms")
+    return p99
+
+
+async def run(args):
+    ok = True
+    a = FakeProvider("alpha", args.base_ms, args.tail, args.tail_ms, args.seed)
+    b = FakeProvider("beta", args.base_ms * 1.3, args.tail, args.tail_ms, args.seed + 1)
+    timeout = args.tail_ms * 2 / 1000
+    gateway = LLMGateway(
+        [Provider(p.name, p.complete, timeout=timeout, stream=p.stream,
+                  breaker=CircuitBreaker(failures=args.breaker_failures, cooldown=args.cooldown))
+         for p in (a, b)],
+        fallback=lambda messages: "mock reply",
+        deadline=args.deadline_ms / 1000,
+        hedge_default_ms=args.base_ms * 4,
+    )
+
+    # --- tail: direct vs gateway ---
+    print(f"tail: {args.tail:.0%} of calls take {args.tail_ms:.0f} ms, {args.requests} requests, "
+          f"{args.concurrency} concurrent\n")
+    pool = ThreadPoolExecutor(max_workers=args.concurrency)
+    loop = asyncio.get_running_loop()
+    direct, _ = await drive(args.requests, args.concurrency,
+                            lambda: loop.run_in_executor(pool, a.complete, MESSAGES))
+    direct_p99 = report("single provider, direct", direct)
+    await drive(50, args.concurrency, lambda: gateway.complete(MESSAGES, provider="alpha"))  # learn p95s
+    hedged, results = await drive(args.requests, args.concurrency,
+                                  lambda: gateway.complete(MESSAGES, provider="alpha"))
+    gateway_p99 = report("gateway, hedged", hedged)
+    info = gateway.info()
+    print(f"{'':<28} hedged {info['hedged']} requests, answered by alpha "
+          f"{info['providers']['alpha']['wins']} / beta {info['providers']['beta']['wins']}")
+    if gateway_p99 * 3 > direct_p99 or any(r.get("fallback") for r in results):
+        print("  tail latency not cut (or fallbacks while healthy)")
+        ok = False
+
+    # --- outage: alpha errors, the breaker routes around it ---
+    a.mode = "error"
+    calls_before, beta_before = a.calls, b.calls
+    latencies, results = await drive(args.requests, args.concurrency,
+                                     lambda: gateway.complete(MESSAGES, provider="alpha"))
+    print()
+    report("outage (alpha erroring)", latencies)
+    mocked = sum(1 for r in results if r.get("fallback"))
+    # beta alone: a call landing in its tail runs out the deadline
+    expected = max(2, int(args.requests * args.tail * 2))
+    alpha = gateway.providers["alpha"]
+    print(f"{'':<28} alpha breaker {alpha.breaker.state} (tripped {alpha.breaker.opened}x), "
+          f"alpha calls {a.calls - calls_before}, beta calls {b.calls - beta_before}, "
+          f"fallbacks {mocked} (tail, <= {expected})")
+    if (any(r["provider"] == "alpha" for r in results) or mocked > expected
+            or alpha.breaker.state == "closed" or a.calls - calls_before > args.requests // 4
+            or b.calls - beta_before > args.requests):
+        print("  outage leaked into replies or the breaker didn't open")
+        ok = False
+
+    # --- blackout: both hang, the mock answers by the deadline ---
+    a.mode = b.mode = "hang"
+    for provider in gateway.providers.values():
+        provider.breaker = CircuitBreaker(failures=args.breaker_failures, cooldown=args.cooldown)
+    fallbacks_before = gateway.fallbacks
+    latencies, results = await drive(args.concurrency, args.concurrency,
+                                     lambda: gateway.complete(MESSAGES, provider="alpha"))
+    print()
+    blackout_p99 = report("blackout (both hanging)", latencies)
+    mocked = sum(1 for r in results if r.get("fallback"))
+    print(f"{'':<28} {mocked}/{len(results)} answered by the fallback "
+          f"(deadline {args.deadline_ms:.0f} ms), {gateway.fallbacks - fallbacks_before} counted")
+    if mocked != len(results) or blackout_p99 > args.deadline_ms * 1.2:
+        print("  blackout replies missing or late")
+        ok = False
+
+    # --- streams: failover until the first chunk, then stalls end the reply ---
+    for provider in gateway.providers.values():
+        provider.breaker = CircuitBreaker(failures=args.breaker_failures, cooldown=args.cooldown)
+
+    async def collect():
+        start, chunks, error = time.perf_counter(), [], None
+        try:
+            async for chunk in gateway.stream(MESSAGES, provider="alpha"):
+                chunks.append(chunk)
+        except Exception as e:
+            error = e
+        return "".join(chunks), error, (time.perf_counter() - start) * 1000
+
+    a.mode, b.mode = "error", "ok"
+    failover = await collect()
+    a.mode = b.mode = "hang"
+    hung = await collect()
+    a.mode, b.mode = "stall", "ok"
+    stalled = await collect()
+    a.mode, b.mode = "ok", "ok"
+    alpha = gateway.providers["alpha"]
+    alpha.breaker = CircuitBreaker(failures=args.breaker_failures, cooldown=args.cooldown)
+    failures_before = alpha.failures
+    healthy = [await collect() for _ in range(args.breaker_failures + 1)]
+    print()
+    for label, (text, error, ms) in (("stream, alpha erroring", failover), ("stream, both hanging", hung),
+                                     ("stream, alpha stalling", stalled)):
+        print(f"{label:<28} {ms:7.1f} ms  {text.strip()!r}" + (f"  error: {error}" if error else ""))
+    if (not failover[0].startswith("beta0") or failover[1] is not None
+            or hung[0] != "mock reply" or hung[2] > args.deadline_ms * 1.2
+            or stalled[0] != "alpha0 " or not isinstance(stalled[1], TimeoutError)
+            or stalled[2] > timeout * 1000 * 1.2 + args.base_ms):
+        print("  streams didn't fail over, fall back or end on a stall")
+        ok = False
+    if (any(error or not text.startswith("alpha") for text, error, _ in healthy)
+            or alpha.failures != failures_before or alpha.breaker.state != "closed"):
+        print(f"  healthy streams counted as failures ({alpha.failures - failures_before}), "
+              f"breaker {alpha.breaker.state}")
+        ok = False
+    pool.shutdown(wait=False)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--base-ms", type=float, default=40)
+    parser.add_argument("--tail", type=float, default=0.03, help="share of slow calls")
+    parser.add_argument("--tail-ms", type=float, default=1500)
+    parser.add_argument("--deadline-ms", type=float, default=1000)
+    parser.add_argument("--breaker-failures", type=int, default=5)
+    parser.add_argument("--cooldown", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args))
+    print()
+    print("[PASS] hedging cut the tail, outages and blackouts never reached users, streams included" if ok
+          else "[FAIL] see above")
+    # Hung fake calls are still sleeping in worker threads; don't wait for them
+    os._exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
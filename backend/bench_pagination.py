@@ -0,0 +1,106 @@
+"""
+Benchmark: trip listing latency and API-process memory as the trips table grows.
+
+For each size a fake PostgREST process is seeded with N trips and a composite
+index on (date, time, id), the sort key search_trips pages on. Each read
+pattern then runs in its own fresh process so its peak RSS is its own:
+
+  unbounded  - select("*") with no limit (the old search_trips / ai chat query)
+  first      - first page of search_trips
+  deep       - a page starting at a random cursor anywhere in the table
+  filtered   - origin ilike "%durban%" from a random cursor
+
+    python bench_pagination.py --sizes 10000 100000 1000000 --requests 200
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest, seed_trips
+from app.services.supabase_async import create_async_client
+from app.services.pagination import paginate, split_page, encode_cursor, PAGE_SIZE_DEFAULT
+
+TRIP_SORT = ("date", "time", "id")
+
+
+def serve(port, trips, ready):
+    server = FakePostgrest(port=port)
+    seed_trips(server, trips)
+    server.create_index("trips", TRIP_SORT)
+    ready.set()
+    server._server.serve_forever()
+
+
+def seeded_row(i):
+    # Same values seed_trips gives trip i
+    return {"date": f"2026-02-{(i % 28) + 1:02d}", "time": f"{(i % 24):02d}:00", "id": f"trip-{i:08d}"}
+
+
+async def run_pattern(url, size, pattern, requests, seed):
+    rng = random.Random(seed)
+    client = create_async_client(url, "bench-key")
+    timings, rows = [], 0
+    for _ in range(requests):
+        query = client.table("trips").select("*")
+        if pattern == "filtered":
+            query = query.ilike("origin", "%durban%")
+        if pattern != "unbounded":
+            cursor = None if pattern == "first" else encode_cursor(seeded_row(rng.randrange(size)), TRIP_SORT)
+            query, page = paginate(query, TRIP_SORT, cursor, PAGE_SIZE_DEFAULT)
+        start = time.perf_counter()
+        response = await query.execute()
+        data = response.data if pattern == "unbounded" else split_page(response.data, TRIP_SORT, page)[0]
+        timings.append((time.perf_counter() - start) * 1000)
+        rows = len(data)
+    await client.close()
+    return timings, rows
+
+
+def measure(url, size, pattern, requests, results):
+    timings, rows = asyncio.run(run_pattern(url, size, pattern, requests, seed=34))
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put((statistics.median(timings), p99, peak_mb, rows))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10000, 100000, 1000000])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--unbounded-limit", type=int, default=100000, help="skip the unbounded read above this size")
+    parser.add_argument("--port", type=int, default=54324)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    print(f"{'trips':>9} {'pattern':>10} {'p50 ms':>9} {'p99 ms':>9} {'peak RSS MB':>12} {'rows':>8}")
+    for size in args.sizes:
+        ready = multiprocessing.Event()
+        stub = multiprocessing.Process(target=serve, args=(args.port, size, ready), daemon=True)
+        stub.start()
+        ready.wait()
+        for pattern in ("unbounded", "first", "deep", "filtered"):
+            if pattern == "unbounded" and size > args.unbounded_limit:
+                print(f"{size:>9} {pattern:>10} {'skipped':>9}")
+                continue
+            requests = max(3, args.requests // 20) if pattern == "unbounded" else args.requests
+            results = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=measure, args=(url, size, pattern, requests, results))
+            worker.start()
+            p50, p99, peak_mb, rows = results.get()
+            worker.join()
+            print(f"{size:>9} {pattern:>10} {p50:>9.1f} {p99:>9.1f} {peak_mb:>12.1f} {rows:>8}")
+        stub.terminate()
+        stub.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Benchmark: checkout bursts against a slow, flaky Payment Switch.
+
+Starts a local fake switch (POST /api/process-payment) that answers in about
+--latency-ms, returns 503 for --fail-rate of requests and stalls for
+--stall-s on --stall-rate of them. Like the real switch, it creates one
+checkout per Idempotency-Key. It counts TCP connections and how many
+checkouts each booking ended up with.
+
+The burst is --bookings checkouts from --threads concurrent users, with
+--repeat-rate of them submitted again (a double click or a client retry),
+sometimes while the first submission is still in flight. It runs twice:
+
+  before  requests.post per checkout: no pool, no timeout, no idempotency key
+  after   PaymentSwitchClient: pooled, timeouts, retries, idempotency store
+
+Fails if "after" creates any duplicate checkout, surfaces more errors than
+"before", lets a request run past its timeout budget, or is slower overall.
+Then --bookings / 4 checkouts without booking fields (no Idempotency-Key) must
+each reach the switch once, 503s included, and a client's Idempotency-Key
+reused with another amount, or by another user for other bookings at the
+same amount, must get a new checkout.
+
+    python bench_payment_switch.py --bookings 1000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.payment_switch import PaymentSwitchClient, PaymentSwitchError, PaymentSwitchUnavailable
+
+
+class FakeSwitch:
+    def __init__(self, latency, fail_rate, stall_rate, stall, seed):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+        switch = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with switch.lock:
+                    switch.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                status, payload = switch.process(body, self.headers.get("Idempotency-Key"))
+                data = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    pass  # the client gave up (timeout)
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 256
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def reset(self):
+        with self.lock:
+            self.connections = 0
+            self.requests = 0
+            self.by_key = {}       # idempotency key -> checkout
+            self.by_booking = {}   # booking -> transaction ids created
+
+    def process(self, body, key):
+        with self.lock:
+            self.requests += 1
+            roll = self.rng.random()
+        if roll < self.fail_rate:
+            time.sleep(self.latency / 2)
+            return 503, {"error": "upstream acquirer unavailable"}
+        time.sleep(self.stall if roll < self.fail_rate + self.stall_rate else self.latency)
+        metadata = body["metadata"]
+        booking = metadata.get("booking_id") or ",".join(sorted(metadata.get("booking_ids") or [])) or metadata["note"]
+        with self.lock:
+            if key and key in self.by_key:
+                return 200, self.by_key[key]
+            checkout = {"transactionId": f"txn_{uuid.uuid4().hex[:12]}",
+                        "checkoutUrl": f"{self.url}/checkout/{booking}"}
+            if key:
+                self.by_key[key] = checkout
+            self.by_booking.setdefault(booking, set()).add(checkout["transactionId"])
+            return 200, checkout
+
+    def duplicates(self):
+        with self.lock:
+            return sum(len(ids) - 1 for ids in self.by_booking.values())
+
+
+def old_checkout(url, amount_cents, metadata):
+    """What payments.create_checkout did: a fresh requests.post, no timeout."""
+    payload = {"amount": amount_cents, "currency": "ZAR", "storeId": "bench", "metadata": metadata}
+    response = requests.post(f"{url}/api/process-payment", json=payload,
+                             headers={"Content-Type": "application/json", "origin": "http://localhost:5173"})
+    if not response.ok:
+        raise PaymentSwitchError(response.status_code, response.text)
+    return response.json()
+
+
+def workload(args):
+    rng = random.Random(args.seed)
+    submissions = []
+    for i in range(args.bookings):
+        metadata = {"booking_id": f"b{i}", "trip_id": f"trip-{i % 97}", "user_id": f"user-{i}", "seats": 1 + i % 3}
+        submissions.append((metadata, 0.0))
+        if rng.random() < args.repeat_rate:
+            # Double click (at once) or a retry a little later
+            submissions.append((metadata, rng.choice([0.0, args.latency_ms / 1000 * rng.uniform(0.5, 3)])))
+    return submissions
+
+
+def burst(submissions, threads, checkout):
+    latencies, errors = [], {"switch": 0, "unavailable": 0}
+    lock = threading.Lock()
+
+    def one(item):
+        metadata, delay = item
+        time.sleep(delay)
+        start = time.perf_counter()
+        try:
+            checkout(100 * (150 + metadata["seats"]), metadata)
+        except PaymentSwitchError:
+            with lock:
+                errors["switch"] += 1
+        except (PaymentSwitchUnavailable, requests.exceptions.RequestException):
+            with lock:
+                errors["unavailable"] += 1
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, submissions))
+    return time.perf_counter() - start, sorted(latencies), errors
+
+
+def _attempt(client, cents, metadata):
+    try:
+        client.create_checkout(cents, "ZAR", metadata)
+    except (PaymentSwitchError, PaymentSwitchUnavailable):
+        pass
+
+
+def report(label, switch, submissions, elapsed, latencies, errors):
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    print(f"{label:<7} {len(submissions) / elapsed:7.0f}/s  p50 {p(0.5):6.0f}  p99 {p(0.99):6.0f}  "
+          f"max {latencies[-1] * 1000:6.0f} ms  errors {errors['switch']:3d} + {errors['unavailable']:3d} timeouts  "
+          f"duplicates {switch.duplicates():3d}  connections {switch.connections:4d}  switch calls {switch.requests}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bookings", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--repeat-rate", type=float, default=0.2)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--fail-rate", type=float, default=0.05)
+    parser.add_argument("--stall-rate", type=float, default=0.01)
+    parser.add_argument("--stall-s", type=float, default=4.0)
+    parser.add_argument("--read-timeout", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    switch = FakeSwitch(args.latency_ms / 1000, args.fail_rate, args.stall_rate, args.stall_s, args.seed)
+    submissions = workload(args)
+    print(f"{len(submissions)} submissions for {args.bookings} bookings, {args.threads} threads; switch "
+          f"{args.latency_ms:.0f} ms, {args.fail_rate:.0%} 503s, {args.stall_rate:.0%} stall {args.stall_s:.0f} s\n")
+
+    before = burst(submissions, args.threads, lambda cents, metadata: old_checkout(switch.url, cents, metadata))
+    report("before", switch, submissions, *before)
+    before_duplicates = switch.duplicates()
+
+    switch.reset()
+    client = PaymentSwitchClient(base_url=switch.url, store_id="bench", pool_maxsize=args.threads,
+                                 timeout=(1.0, args.read_timeout), retries=2, backoff=0.05)
+    after = burst(submissions, args.threads,
+                  lambda cents, metadata: client.create_checkout(cents, "ZAR", metadata, origin="http://localhost:5173"))
+    report("after", switch, submissions, *after)
+    info = client.info()
+    print(f"\nafter: {info['checkouts']} checkouts, {info['replays']} repeats answered from the store, "
+          f"{info['coalesced']} coalesced in flight, pool hits {info['pool']['hits']} / new {info['pool']['new']}")
+
+    # Unkeyed checkouts: a retried 503 could have been a second checkout
+    switch.reset()
+    unkeyed = [{"note": f"n{i}"} for i in range(args.bookings // 4)]
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(lambda metadata: _attempt(client, 15000, metadata), unkeyed))
+    unkeyed_calls = switch.requests
+    # Same client key, different amounts or payers: one checkout each
+    first = client.create_checkout(15000, "ZAR", {"booking_ids": ["b2", "b1"], "user_id": "u1"}, key="client-key-1")
+    again = client.create_checkout(15000, "ZAR", {"booking_ids": ["b1", "b2"], "user_id": "u1"}, key="client-key-1")
+    other = client.create_checkout(20000, "ZAR", {"booking_ids": ["b3"], "user_id": "u1"}, key="client-key-1")
+    stranger = client.create_checkout(15000, "ZAR", {"booking_ids": ["b4"], "user_id": "u2"}, key="client-key-1")
+    print(f"unkeyed: {len(unkeyed)} checkouts, {unkeyed_calls} switch calls")
+
+    elapsed, latencies, errors = after
+    budget = 3 * (1.0 + args.read_timeout) + 1.0  # (retries + 1) x (connect + read) + backoff
+    checks = {
+        "no duplicate checkouts": switch.duplicates() == 0,
+        "fewer errors than before": sum(errors.values()) < sum(before[2].values()) or not sum(before[2].values()),
+        "no request past its timeout budget": latencies[-1] <= budget,
+        "at least as fast as before": elapsed <= before[0],
+        # A connection that timed out is discarded and replaced
+        "connections bounded by the pool": switch.connections <= args.threads + errors["unavailable"],
+        "unkeyed checkouts never retried": unkeyed_calls == len(unkeyed),
+        "client key bound to the amount, bookings and user": (
+            first["transactionId"] == again["transactionId"]
+            and len({first["transactionId"], other["transactionId"], stranger["transactionId"]}) == 3),
+    }
+    print(f"before created {before_duplicates} duplicate checkouts\n")
+    for name, passed in checks.items():
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+    ok = all(checks.values())
+    print()
+    print("[PASS] pooled, bounded and idempotent checkouts" if ok else "[FAIL] see above")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
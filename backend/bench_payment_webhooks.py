@@ -0,0 +1,378 @@
+"""
+Benchmark: payment webhook ingestion at --rate events/s, then verification.
+
+Starts fake_postgrest, a fake Yoco API (GET /checkouts/{id}, answering
+"completed" after --lookup-ms) and the API under uvicorn in a subprocess,
+with a fresh verification queue file. Then, open loop (requests go out on
+schedule whether or not earlier ones have been answered):
+
+  - one signed payment.succeeded / payment.failed webhook per checkout,
+    --duplicate-rate of them delivered twice (the provider retrying); a
+    checkout pays for --bookings-rate of them, which cost more than was
+    paid for --underpaid-rate, and each of those users has booked the trip
+    again since, which the payment mustn't cover
+  - POST /payments/process for --process-rate of the checkouts (the user
+    coming back from the checkout page), which queues a provider lookup
+
+Latency is measured from each request's scheduled time, so a server that
+falls behind shows up in the percentiles. After the load, it waits for the
+workers to drain the queue and checks the payments and bookings tables, and
+that exactly the paid bookings had their fares held in escrow (holds left
+over from before, on bookings whose payment failed, must be refunded).
+
+Fails if ingestion doesn't sustain --rate, any event isn't accepted, p99
+exceeds --p99-ms, the queue doesn't drain within --drain-s, or any payment
+or booking ends up in the wrong state. On a single-CPU host the load
+generator takes its share of the only core, so instead of the achieved
+rate and p99 it checks the API's CPU time (from /proc): what the payment
+path costs per request beyond an empty endpoint (GET /health at the same
+rate, measured first) must let one core sustain --rate. The whole API's
+per-core capacity, HTTP stack included, is printed next to it.
+
+    python bench_payment_webhooks.py --rate 1000 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest, open_escrow_holds, post_ledger_transaction, settle_escrow_holds
+from app.services.payment_verification import sign_webhook
+
+WEBHOOK_SECRET = "whsec_" + "YmVuY2gtd2ViaG9vay1zZWNyZXQtMzItYnl0ZXMhIQ=="
+
+
+class FakeYoco:
+    def __init__(self, latency):
+        self.latency = latency
+        self.lookups = 0
+        self.lock = threading.Lock()
+        yoco = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with yoco.lock:
+                    yoco.lookups += 1
+                time.sleep(yoco.latency)
+                checkout_id = self.path.rstrip("/").rpartition("/")[2]
+                data = json.dumps({"id": checkout_id, "status": "completed",
+                                   "paymentId": f"p_{checkout_id}"}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 256
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+
+def settle_bookings_on_write(db):
+    """What the payments_settle_bookings trigger does in Postgres (add_payments.sql)."""
+    upsert_rows = db.upsert_rows
+    by_id = {}
+
+    def upsert_and_settle(table, rows, on_conflict="id"):
+        written = upsert_rows(table, rows, on_conflict)
+        if table == "payments":
+            if not by_id:
+                by_id.update((booking["id"], booking) for booking in db.tables.get("bookings", []))
+            with db._lock:
+                for payment in written:
+                    if payment["status"] == "pending" or not payment.get("booking_ids"):
+                        continue
+                    bookings = [by_id[i] for i in payment["booking_ids"] if i in by_id]
+                    result = "paid" if payment["status"] == "succeeded" else payment["status"]
+                    due = round(sum(booking["total_price"] for booking in bookings) * 100)
+                    if result == "paid" and (payment.get("amount_cents") is None or payment["amount_cents"] < due):
+                        result = "underpaid"
+                    for booking in bookings:
+                        if booking["payment_status"] != "paid":
+                            booking["payment_status"] = result
+        return written
+
+    db.upsert_rows = upsert_and_settle
+
+
+def workload(args):
+    """(checkouts, requests in send order). A request is (kind, body, headers)."""
+    rng = random.Random(args.seed)
+    total = int(args.rate * args.seconds)
+    checkouts, sends = {}, []
+    while len(sends) < total:
+        checkout_id = f"ch_{uuid.UUID(int=rng.getrandbits(128)).hex[:16]}"
+        user_id, trip_id = str(uuid.UUID(int=rng.getrandbits(128))), f"trip-{rng.randrange(500)}"
+        status = "succeeded" if rng.random() >= args.failure_rate else "failed"
+        booking_ids = None
+        if rng.random() < args.bookings_rate:
+            booking_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(1 + rng.randrange(2))]
+        # What the bookings cost in all; the checkout pays 450.00
+        price = 500.0 if rng.random() < args.underpaid_rate else 450.0
+        checkouts[checkout_id] = {"user_id": user_id, "trip_id": trip_id, "status": status,
+                                  "booking_ids": booking_ids, "price": price}
+        event = {"id": f"evt_{checkout_id}", "type": f"payment.{status}", "createdDate": "2026-02-14T10:00:00Z",
+                 "payload": {"id": f"p_{checkout_id}", "status": status, "amount": 45000, "currency": "ZAR",
+                             "metadata": {"checkoutId": checkout_id, "user_id": user_id, "trip_id": trip_id,
+                                          "booking_ids": booking_ids}}}
+        sends.append(("webhook", event))
+        if rng.random() < args.duplicate_rate:
+            sends.append(("webhook", event))
+        if status == "succeeded" and rng.random() < args.process_rate:
+            checkouts[checkout_id]["processed"] = True
+            sends.append(("process", {"amount": 450.0, "currency": "ZAR", "user_id": user_id,
+                                      "trip_id": trip_id, "token": checkout_id}))
+    sends = sends[:total]
+    # Late duplicates, as a retrying provider would send them
+    tail = sends[len(sends) // 2:]
+    rng.shuffle(tail)
+    sends[len(sends) // 2:] = tail
+    return checkouts, sends
+
+
+def cpu_seconds(pid):
+    """User + system CPU time of a process (Linux), or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def start_api(args, db_url, yoco_url, queue_path):
+    env = {**os.environ, "SUPABASE_URL": db_url, "SUPABASE_KEY": "bench", "SUPABASE_SERVICE_ROLE_KEY": "bench",
+           "PAYMENT_QUEUE_PATH": queue_path, "YOCO_API_URL": yoco_url, "YOCO_SECRET_KEY": "sk_bench",
+           "YOCO_WEBHOOK_SECRET": WEBHOOK_SECRET, "PAYMENT_VERIFY_WORKERS": str(args.workers),
+           "PAYMENT_VERIFY_RETRY": "0.2"}
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port),
+                                "--log-level", "warning", "--no-access-log"],
+                               cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               stdout=subprocess.DEVNULL)  # the per-request log lines; errors still show
+    return process
+
+
+async def wait_ready(session, base):
+    for _ in range(200):
+        try:
+            async with session.get(f"{base}/health") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("API did not start")
+
+
+async def open_loop(rate, items, one):
+    """Starts one(item, scheduled) for each item at `rate` per second, on schedule. Returns the elapsed time."""
+    tasks = []
+    start = time.perf_counter()
+    for i, item in enumerate(items):
+        scheduled = start + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(item, scheduled)))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - start
+
+
+async def drive(args, base, sends, api_pid):
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    latencies, statuses = [], {}
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await wait_ready(session, base)
+
+        # Baseline: what the HTTP stack costs the API for an empty endpoint at this rate
+        async def health(_, scheduled):
+            async with session.get(f"{base}/health") as response:
+                await response.read()
+
+        baseline_requests = int(args.rate * args.baseline_s)
+        cpu_start = cpu_seconds(api_pid)
+        await open_loop(args.rate, range(baseline_requests), health)
+        baseline = (cpu_seconds(api_pid) - cpu_start) / baseline_requests if cpu_start is not None else None
+
+        async def one(item, scheduled):
+            kind, body = item
+            data = json.dumps(body).encode()
+            headers = {"Content-Type": "application/json"}
+            if kind == "webhook":
+                timestamp = str(int(time.time()))
+                headers.update({"webhook-id": body["id"], "webhook-timestamp": timestamp,
+                                "webhook-signature": "v1," + sign_webhook(WEBHOOK_SECRET, body["id"], timestamp, data)})
+                url = f"{base}/payments/webhook"
+            else:
+                url = f"{base}/payments/process"
+            try:
+                async with session.post(url, data=data, headers=headers) as response:
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError:
+                status = "error"
+            latencies.append(time.perf_counter() - scheduled)
+            statuses[(kind, status)] = statuses.get((kind, status), 0) + 1
+
+        cpu_start = cpu_seconds(api_pid)
+        elapsed = await open_loop(args.rate, sends, one)
+
+        # Drain: wait until the workers have nothing left
+        drain_start = time.perf_counter()
+        stats = None
+        while time.perf_counter() - drain_start < args.drain_s:
+            async with session.get(f"{base}/payments/verification/stats") as response:
+                stats = await response.json()
+            if stats["queue"]["ready"] + stats["queue"]["leased"] == 0:
+                break
+            await asyncio.sleep(0.5)
+        drain = time.perf_counter() - drain_start
+        # Everything the API spent on the load: ingestion, workers, lookups
+        cpu = cpu_seconds(api_pid) - cpu_start if cpu_start is not None else None
+    return elapsed, sorted(latencies), statuses, drain, stats, cpu, baseline
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=1000, help="requests per second")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--process-rate", type=float, default=0.1)
+    parser.add_argument("--bookings-rate", type=float, default=0.5, help="checkouts paying for bookings")
+    parser.add_argument("--underpaid-rate", type=float, default=0.05, help="of those, bookings costing more")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--db-ms", type=float, default=2)
+    parser.add_argument("--lookup-ms", type=float, default=50)
+    parser.add_argument("--p99-ms", type=float, default=250)
+    parser.add_argument("--drain-s", type=float, default=60)
+    parser.add_argument("--baseline-s", type=float, default=2, help="GET /health first, for the HTTP stack's cost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    checkouts, sends = workload(args)
+    db = FakePostgrest(latency=args.db_ms / 1000).start()
+    bookings, expected_booking = [], {}
+    for checkout in checkouts.values():
+        if not checkout["booking_ids"]:
+            continue
+        paid = "failed" if checkout["status"] == "failed" else "paid" if checkout["price"] <= 450 else "underpaid"
+        later = str(uuid.uuid4())
+        for booking_id in checkout["booking_ids"] + [later]:
+            price = 450.0 if booking_id == later else checkout["price"] / len(checkout["booking_ids"])
+            bookings.append({"id": booking_id, "user_id": checkout["user_id"], "trip_id": checkout["trip_id"],
+                             "total_price": price, "status": "confirmed", "payment_status": None})
+            expected_booking[booking_id] = None if booking_id == later else paid
+    db.add_rows("bookings", bookings)
+    db.add_rows("payments", [])
+    drivers = {f"trip-{i}": str(uuid.uuid4()) for i in range(500)}
+    db.add_rows("trips", [{"id": trip_id, "user_id": driver} for trip_id, driver in drivers.items()])
+    # Holds opened at booking time by an older API, on bookings that never got paid
+    stale = [b for b in bookings if expected_booking[b["id"]] == "failed"]
+    db.add_rows("escrow_holds", [{"id": str(uuid.uuid4()), "booking_id": b["id"], "trip_id": b["trip_id"],
+                                  "payer_id": b["user_id"], "driver_id": drivers[b["trip_id"]],
+                                  "amount_cents": int(b["total_price"] * 100), "funded_by": "card", "status": "held",
+                                  "settle_as": None, "release_at": None} for b in stale])
+    for name, fn in (("open_escrow_holds", open_escrow_holds), ("settle_escrow_holds", settle_escrow_holds),
+                     ("post_ledger_transaction", post_ledger_transaction)):
+        db.register_rpc(name, fn)
+    settle_bookings_on_write(db)
+    yoco = FakeYoco(args.lookup_ms / 1000)
+
+    queue_dir = tempfile.mkdtemp(prefix="payment-queue-")
+    api = start_api(args, db.url, yoco.url, os.path.join(queue_dir, "queue.sqlite3"))
+    try:
+        elapsed, latencies, statuses, drain, stats, cpu, baseline = asyncio.run(
+            drive(args, f"http://127.0.0.1:{args.port}", sends, api.pid))
+    finally:
+        api.terminate()
+        api.wait(10)
+
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    webhooks = sum(1 for kind, _ in sends if kind == "webhook")
+    print(f"{len(sends)} requests ({webhooks} webhooks, {len(sends) - webhooks} /process) for {len(checkouts)} "
+          f"checkouts; database {args.db_ms:.0f} ms, provider lookup {args.lookup_ms:.0f} ms, {args.workers} workers\n")
+    print(f"ingest    {len(sends) / elapsed:7.0f} req/s (target {args.rate:.0f})  p50 {p(0.5):5.1f}  "
+          f"p99 {p(0.99):6.1f}  max {latencies[-1] * 1000:6.1f} ms")
+    print(f"responses {', '.join(f'{kind} {status}: {n}' for (kind, status), n in sorted(statuses.items(), key=str))}")
+    print(f"drained   in {drain:.1f} s after the load; queue {stats['queue']}")
+    print(f"workers   {stats['processed']} jobs in {stats['batches']} batches, {stats['retried']} retried, "
+          f"{stats['dead']} dead, {stats['lookups']} provider lookups ({yoco.lookups} received), "
+          f"{stats['payments_written']} payment writes")
+    capacity = len(sends) / cpu if cpu else None
+    if cpu is not None:
+        print(f"api cpu   {cpu * 1000 / len(sends):.2f} ms per request (ingestion and verification): "
+              f"{capacity:.0f} req/s on one core; an empty endpoint (GET /health) costs {baseline * 1000:.2f} ms")
+
+    payments = {row["checkout_id"]: row for row in db.tables.get("payments", [])}
+    wrong = [c for c, expected in checkouts.items()
+             if c not in payments or payments[c]["status"] != expected["status"]]
+    bookings_wrong = [b for b in db.tables.get("bookings", []) if b["payment_status"] != expected_booking[b["id"]]]
+    holds = {h["booking_id"]: h for h in db.tables.get("escrow_holds", [])}
+    stale_ids = {b["id"] for b in stale}
+    held = {b for b in holds if b not in stale_ids}
+    paid_ids = {b for b, state in expected_booking.items() if state == "paid"}
+    stale_kept = [b for b in stale_ids if holds[b]["settle_as"] != "refund" and holds[b]["status"] != "refunded"]
+    print(f"escrow    {len(held)} fares held for {len(paid_ids)} paid bookings; "
+          f"{len(stale_ids) - len(stale_kept)}/{len(stale_ids)} stale holds of failed payments refunded")
+    duplicates_sent = len(sends) - len({(kind, json.dumps(body, sort_keys=True)) for kind, body in sends})
+    db.stop()
+
+    accepted = statuses.get(("webhook", 202), 0) + statuses.get(("process", 200), 0)
+    checks = {}
+    if (os.cpu_count() or 1) > 1 or capacity is None:
+        checks[f"sustained {args.rate:.0f} req/s"] = len(sends) / elapsed >= args.rate * 0.95
+        checks[f"p99 under {args.p99_ms:.0f} ms"] = p(0.99) <= args.p99_ms
+    else:
+        # The load generator and the fakes share the only core with the API, so the
+        # achieved rate and latency say more about the host than the API. Check what
+        # the payment path itself (signature, queue, workers) costs per request, on
+        # top of the HTTP stack's own cost for an empty endpoint on this host
+        added = cpu / len(sends) - baseline
+        print(f"\n(one CPU: the load generator competes with the API; checking CPU cost instead. The payment path "
+              f"adds {added * 1000:.2f} ms per request to the HTTP stack's {baseline * 1000:.2f} ms)")
+        checks[f"payment path keeps up with {args.rate:.0f} req/s on one core"] = added <= 1 / args.rate
+    checks.update({
+        "every request accepted": accepted == len(sends),
+        f"queue drained within {args.drain_s:.0f} s": stats["queue"]["ready"] + stats["queue"]["leased"] == 0,
+        "no dead jobs": stats["dead"] == 0,
+        f"redeliveries ignored ({duplicates_sent} sent)": stats["queue"]["duplicates"] == duplicates_sent,
+        "one payment per checkout, in the right state": not wrong and len(payments) == len(checkouts),
+        "bookings marked paid / underpaid / failed, later ones untouched": not bookings_wrong,
+        "fares held for exactly the paid bookings, stale ones refunded": held == paid_ids and not stale_kept,
+    })
+    print()
+    for name, passed in checks.items():
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+    ok = all(checks.values())
+    print()
+    print("[PASS] webhooks ingested at rate and verified in the background" if ok else "[FAIL] see above")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
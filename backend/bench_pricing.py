@@ -0,0 +1,327 @@
+"""
+Benchmark: the dynamic price table with --trips upcoming trips.
+
+  reprice - in process: --trips trips over routes between a dozen cities
+            (some with a route distance, the rest priced from their listed
+            fare), departing over the next month with 0-4 seats left. Time to
+            load them, a full reprice (every trip), and an incremental one
+            after a burst of searches on one route (only that route's trips
+            may be repriced). Every price must equal the formula worked out
+            from the row, stay within the multiplier bounds, and move the
+            right way with seats, time to departure and demand
+  window  - the sliding-window demand counters against a brute-force count
+            of the same events
+  read    - apply() on pages of search results (the only pricing work on the
+            read path), and over HTTP on fake_postgrest: cached searches with
+            and without a price table (p50 / p99), a demand burst showing up
+            in cached results, and a booking charged the quoted price: also
+            a higher quote from another worker within PRICING_QUOTE_TOLERANCE,
+            while a lower one is charged the current price and one further
+            off is refused without taking a seat
+
+    python bench_pricing.py --trips 100000
+"""
+import argparse
+import datetime
+import gc
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import pricing
+from app.services.pricing import PriceTable, RouteDemand, WindowCounter, route_key, departure_time
+
+CITIES = ["Johannesburg", "Pretoria", "Durban", "Cape Town", "Bloemfontein", "Polokwane", "Mbombela",
+          "Gqeberha", "East London", "Pietermaritzburg", "Stellenbosch", "Kimberley"]
+DISTANCES = {("Johannesburg", "Pretoria"): 58, ("Johannesburg", "Durban"): 568, ("Johannesburg", "Cape Town"): 1398,
+             ("Johannesburg", "Bloemfontein"): 398, ("Johannesburg", "Polokwane"): 320,
+             ("Durban", "Pietermaritzburg"): 80, ("Cape Town", "Stellenbosch"): 50, ("Cape Town", "Gqeberha"): 760,
+             ("Gqeberha", "East London"): 300, ("Pretoria", "Polokwane"): 265}
+NOW = datetime.datetime(2026, 3, 2, 6, 0, tzinfo=datetime.timezone.utc).timestamp()
+
+
+def make_trips(count, rng, now):
+    routes = [(a, b) for a in CITIES for b in CITIES if a != b]
+    rows = []
+    for i in range(count):
+        origin, destination = routes[rng.randrange(len(routes))] if i % 3 else rng.choice(list(DISTANCES))
+        departs = now + rng.uniform(600, 30 * 86400)
+        local = datetime.datetime.fromtimestamp(departs, pricing.trip_zone())
+        row = {"id": str(uuid.UUID(int=rng.getrandbits(128), version=4)), "origin": origin, "destination": destination,
+               "date": local.strftime("%Y-%m-%d"), "time": local.strftime("%H:%M"),
+               "price": float(rng.randrange(80, 900, 10)), "seats_available": rng.randrange(0, 5),
+               "status": "scheduled", "created_at": f"2026-03-01T00:00:00.{i:06d}Z"}
+        if i % 2:
+            # Half carry departs_at (add_pickup_geofences.sql), half only local date and time
+            row["departs_at"] = datetime.datetime.fromtimestamp(departs, datetime.timezone.utc).isoformat()
+        rows.append(row)
+    return rows
+
+
+def reference_price(row, now, demand, distances):
+    """The pricing formula, worked out from the row."""
+    km = distances.get(route_key(row["origin"], row["destination"]))
+    base = max(pricing.PRICING_MIN_FARE, km * pricing.PRICING_RATE_PER_KM) if km is not None else row["price"]
+    seats = row["seats_available"]
+    capacity = max(pricing.PRICING_SEAT_CAPACITY, seats)
+    scarcity = 1 + pricing.PRICING_SCARCITY * (capacity - max(seats, 1)) / max(capacity - 1, 1)
+    hours = int((departure_time(row) - now) // 3600)
+    if hours < pricing.PRICING_LATE_HOURS:
+        timing = 1 + pricing.PRICING_LATE_PREMIUM * (1 - max(hours, 0) / pricing.PRICING_LATE_HOURS)
+    elif hours >= pricing.PRICING_EARLY_DAYS * 24:
+        timing = 1 - pricing.PRICING_EARLY_DISCOUNT
+    else:
+        timing = 1.0
+    factor = min(max(scarcity * timing * demand, pricing.PRICING_MIN_MULTIPLIER), pricing.PRICING_MAX_MULTIPLIER)
+    return round(base * factor / pricing.PRICING_ROUND_TO) * pricing.PRICING_ROUND_TO
+
+
+def distance_table():
+    distances = {}
+    for (a, b), km in DISTANCES.items():
+        distances[route_key(a, b)] = float(km)
+        distances.setdefault(route_key(b, a), float(km))
+    return distances
+
+
+def bench_reprice(args, rng):
+    clock = [NOW]
+    table = PriceTable(clock=lambda: clock[0])
+    table.distances = distance_table()
+    rows = make_trips(args.trips, rng, NOW)
+
+    started = time.perf_counter()
+    for row in rows:
+        table.upsert(row)
+    load_s = time.perf_counter() - started
+
+    # Background demand on every route over the day, so the baseline isn't empty
+    for _ in range(args.searches):
+        row = rows[rng.randrange(len(rows))]
+        table.demand.record(route_key(row["origin"], row["destination"]), 1, NOW - rng.uniform(0, 86400))
+    clock[0] = NOW + 3600
+    started = time.perf_counter()
+    table.reprice_all()
+    full_s = time.perf_counter() - started
+
+    live = [row for row in rows if departure_time(row) > clock[0]]
+    dropped = len(table) == len(live)
+    demand = {route: table._demand[route] for route in table.routes}
+    wrong = sum(1 for row in live
+                if table.price(row["id"]) != reference_price(row, clock[0], demand[route_key(row["origin"], row["destination"])],
+                                                             table.distances))
+    bounds = all(pricing.PRICING_MIN_MULTIPLIER - 0.01 <= table.trips[r["id"]].price / table.trips[r["id"]].base
+                 <= pricing.PRICING_MAX_MULTIPLIER + 0.01 for r in live if table.trips[r["id"]].base >= 50)
+
+    # A rush on one route: only its trips are repriced, and they get dearer
+    hot = max(table.routes, key=lambda r: len(table.routes[r]))
+    before = {trip_id: table.price(trip_id) for trip_id in table.routes[hot]}
+    for _ in range(args.burst):
+        table.record_search(*hot)
+    repriced = table.counters["repriced"]
+    started = time.perf_counter()
+    changed = table.reprice_demand()
+    burst_s = time.perf_counter() - started
+    repriced = table.counters["repriced"] - repriced
+    dearer = all(table.price(t) >= p for t, p in before.items()) and changed > 0
+
+    # Fewer seats, sooner departure, more demand: never cheaper
+    probe = pricing.PricedTrip(hot, 300.0, 300.0, 4, clock[0] + 10 * 86400)
+    monotonic = True
+    for seats in range(4, 0, -1):
+        for hours in (240, 100, 30, 20, 5, 0):
+            probe.seats, probe.departs = seats, clock[0] + hours * 3600
+            quotes = [table.quote(probe, clock[0], d) for d in (0.9, 1.0, 1.3)]
+            monotonic = monotonic and quotes == sorted(quotes)
+    seats_order = [table.quote(pricing.PricedTrip(hot, 300.0, 300.0, s, clock[0] + 50 * 3600), clock[0], 1.0)
+                   for s in (4, 3, 2, 1)]
+    time_order = [table.quote(pricing.PricedTrip(hot, 300.0, 300.0, 4, clock[0] + h * 3600), clock[0], 1.0)
+                  for h in (240, 100, 30, 12, 0)]
+    monotonic = monotonic and seats_order == sorted(seats_order) and time_order == sorted(time_order)
+
+    print(f"reprice: {len(table)} trips on {len(table.routes)} routes; load {load_s * 1000:.0f} ms, "
+          f"full reprice {full_s * 1000:.0f} ms ({len(table) / full_s:,.0f} trips/s); "
+          f"burst on {hot[0]} -> {hot[1]}: {repriced} trips repriced ({changed} changed) in {burst_s * 1000:.1f} ms, "
+          f"demand x{table._demand[hot]}")
+    return [
+        (f"full reprice of {len(table):,} trips within {args.max_reprice_ms:.0f} ms", full_s * 1000 <= args.max_reprice_ms),
+        ("every price matches the formula; departed trips dropped", wrong == 0 and dropped),
+        ("prices within the multiplier bounds", bounds),
+        ("a demand burst reprices only its route, upwards", repriced == len(table.routes[hot]) and dearer),
+        ("fewer seats, less time and more demand never lower a price", monotonic),
+    ]
+
+
+def bench_window(args, rng):
+    window, slices = 3600.0, 60
+    counter = WindowCounter(window, slices)
+    width = window / slices
+    events = {}
+    now, mismatches, checks = NOW, 0, 0
+    for _ in range(args.window_events):
+        now += rng.expovariate(1 / 20)
+        key = rng.randrange(20)
+        counter.add(key, 1, now)
+        events.setdefault(key, []).append(now)
+        if rng.random() < 0.05:
+            probe_key, later = rng.randrange(20), now + rng.uniform(0, 600)
+            # The window covers whole slices: everything since the start of the oldest one kept
+            since = (int(later // width) - slices + 1) * width
+            expected = sum(1 for at in events.get(probe_key, ()) if at >= since)
+            mismatches += counter.total(probe_key, later) != expected
+            checks += 1
+            counter.add(probe_key, 0, later)
+            events.setdefault(probe_key, [])
+            now = max(now, later)
+    print(f"window: {args.window_events} events, {checks} totals checked, {mismatches} wrong")
+    demand = RouteDemand(3600, 86400)
+    route = ("a", "b")
+    for i in range(240):
+        demand.record(route, 1, NOW - 86400 + i * 360)  # 10 an hour all day
+    steady = demand.multiplier(route, NOW)
+    for _ in range(60):
+        demand.record(route, 1, NOW - 60)
+    return [("sliding-window totals equal a brute-force count", mismatches == 0),
+            ("steady demand prices at about x1.0, a rush above it", abs(steady - 1.0) <= 0.02 and demand.multiplier(route, NOW) > 1.0)]
+
+
+def bench_read(args, rng):
+    from fake_postgrest import FakePostgrest, book_seats
+    server = FakePostgrest().start()
+    server.register_rpc("book_seats", book_seats)
+    now = time.time()
+    rows = make_trips(args.http_trips, rng, now)
+    for row in rows:
+        row["origin_norm"], row["destination_norm"] = row["origin"].lower(), row["destination"].lower()
+        row.update(vehicle="Sedan", driver_name="Bench", driver_rating=4.8, driver_image="")
+        row.pop("departs_at", None)
+    server.add_rows("trips", rows)
+    server.add_rows("route_distances", [{"origin": a, "destination": b, "distance_km": km}
+                                        for (a, b), km in DISTANCES.items()])
+    server.create_index("trips", ("date", "time", "id"))
+    os.environ.update(SUPABASE_URL=server.url, SUPABASE_KEY="bench", SUPABASE_SERVICE_ROLE_KEY="bench",
+                      AI_CACHE_ENABLED="0")
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services.pricing import price_table
+
+    # apply() on a page, the read path's only pricing work
+    page = rows[:20]
+    table = PriceTable()
+    for row in rows:
+        table.upsert(row)
+    started = time.perf_counter()
+    for _ in range(args.pages):
+        table.apply(page)
+    apply_us = (time.perf_counter() - started) / args.pages * 1e6
+
+    origin, destination = "Johannesburg", "Durban"
+    url = f"/travel/trips?from_loc={origin}&to_loc={destination}&limit=20"
+
+    def timed(client, count):
+        samples = []
+        for _ in range(count):
+            started = time.perf_counter()
+            response = client.get(url)
+            samples.append((time.perf_counter() - started) * 1000)
+        return response.json(), samples
+
+    with TestClient(app) as client:
+        deadline = time.time() + 30
+        while len(price_table) == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        client.get(url)
+        saved = price_table.prices
+        price_table.prices = {}
+        unpriced, without = timed(client, args.requests)
+        price_table.prices = saved
+        priced, with_table = timed(client, args.requests)
+
+        quoted = all(t["price"] == price_table.price(t["id"]) for t in priced if price_table.price(t["id"]) is not None)
+        # The timed searches were a rush already: start calm, then a rush on the
+        # route reprices it and the cached search shows the new prices at once
+        price_table.demand = RouteDemand()
+        price_table.reprice_all()
+        priced = client.get(url).json()
+        for _ in range(args.burst):
+            price_table.record_search(origin, destination)
+        price_table.reprice_demand()
+        rushed = client.get(url).json()
+        moved = any(a["price"] > b["price"] for a, b in zip(rushed, priced))
+        fresh = all(t["price"] == price_table.price(t["id"]) for t in rushed if price_table.price(t["id"]) is not None)
+
+        trip = next(t for t in rushed if t["seats_available"] > 0 and price_table.price(t["id"]) is not None)
+        booking = client.post("/travel/bookings/batch", json={"trip_id": trip["id"], "user_id": str(uuid.uuid4()),
+                                                               "seats": 1})
+        charged = booking.status_code == 200 and booking.json()["total_price"] == trip["price"]
+        # Another worker, which counted demand a little differently, quoted the traveller
+        # (other trips: a booking reprices its trip)
+        near, low, far = [t for t in rushed if t["seats_available"] > 0 and t["id"] != trip["id"]
+                          and price_table.price(t["id"]) is not None][:3]
+        nearby = near["price"] + pricing.PRICING_ROUND_TO
+        booking = client.post("/travel/bookings/batch", json={"trip_id": near["id"], "user_id": str(uuid.uuid4()),
+                                                               "seats": 1, "quoted_price": nearby})
+        charged_quote = booking.status_code == 200 and booking.json()["total_price"] == nearby
+        # A client can't talk the price down within the tolerance
+        booking = client.post("/travel/bookings/batch", json={"trip_id": low["id"], "user_id": str(uuid.uuid4()),
+                                                               "seats": 1, "quoted_price": low["price"] * 0.95})
+        charged_current = booking.status_code == 200 and booking.json()["total_price"] == low["price"]
+        seats_left = lambda: next(r["seats_available"] for r in server.tables["trips"] if r["id"] == far["id"])
+        seats_before = seats_left()
+        stale = client.post("/travel/bookings/batch", json={"trip_id": far["id"], "user_id": str(uuid.uuid4()),
+                                                             "seats": 1, "quoted_price": far["price"] * 0.5})
+        refused = (stale.status_code == 409 and stale.json()["detail"]["price"] == price_table.price(far["id"])
+                   and seats_left() == seats_before)
+        explained = client.get(f"/travel/trips/{trip['id']}/price").json()
+    server.stop()
+
+    p = lambda samples, q: statistics.quantiles(samples, n=100)[q - 1]
+    print(f"read: apply() {apply_us:.1f} us per 20-trip page; cached search p50/p99 "
+          f"{p(without, 50):.2f}/{p(without, 99):.2f} ms without the table, "
+          f"{p(with_table, 50):.2f}/{p(with_table, 99):.2f} ms with it; "
+          f"quote for {trip['id'][:8]}: {explained.get('price')} (listed {explained.get('listed_price')})")
+    return [
+        (f"apply() within {args.max_apply_us:.0f} us per page", apply_us <= args.max_apply_us),
+        ("searches show the price table's prices", quoted and len(priced) > 0),
+        ("a demand burst shows up in cached searches", moved and fresh),
+        ("bookings are charged the quoted price", charged),
+        ("a higher quote within the tolerance is charged as quoted, one further off refused",
+         charged_quote and refused),
+        ("a lower quote is charged the current price", charged_current),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", type=int, default=100_000)
+    parser.add_argument("--searches", type=int, default=200_000, help="background searches over the day")
+    parser.add_argument("--burst", type=int, default=500, help="searches in a rush on one route")
+    parser.add_argument("--window-events", type=int, default=200_000)
+    parser.add_argument("--http-trips", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--pages", type=int, default=100_000)
+    parser.add_argument("--max-reprice-ms", type=float, default=2000)
+    parser.add_argument("--max-apply-us", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    # As the API runs (tune_garbage_collection in app/main.py)
+    gc.set_threshold(50000, 20, 10)
+    rng = random.Random(args.seed)
+    checks = bench_reprice(args, rng) + bench_window(args, rng) + bench_read(args, rng)
+    ok = True
+    for name, passed in checks:
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+        ok = ok and passed
+    print("[PASS] prices are precomputed, right, and cheap to read" if ok else "[FAIL] see above")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
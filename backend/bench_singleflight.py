@@ -0,0 +1,96 @@
+"""
+Benchmark: a burst of identical reads against a slow upstream.
+
+Fires N simultaneous copies of the get_trip query (same table, same filter)
+at a fake PostgREST that takes --latency-ms per request, once from N threads
+through the pooled sync client and once from N coroutines through the async
+client, with read coalescing off and on. With coalescing on the whole burst
+should cost one upstream request.
+
+    python bench_singleflight.py --clients 500 --latency-ms 50
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest, seed_trips
+from app.services.supabase_rest import create_client
+from app.services.supabase_async import create_async_client
+
+TRIP_ID = "trip-00000007"
+
+
+def sync_burst(server, clients, coalesce):
+    client = create_client(server.url, "bench-key", pool_maxsize=clients, coalesce=coalesce)
+    barrier = threading.Barrier(clients)
+    results = [None] * clients
+
+    def worker(i):
+        barrier.wait()
+        results[i] = client.table("trips").select("*").eq("id", TRIP_ID).execute()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    server.reset_counters()
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = (time.perf_counter() - start) * 1000
+    client.close()
+    return elapsed, results
+
+
+async def async_burst(server, clients, coalesce):
+    client = create_async_client(server.url, "bench-key", max_connections=clients, coalesce=coalesce)
+    query = lambda: client.table("trips").select("*").eq("id", TRIP_ID).execute()
+    await query()  # open the session outside the timed burst
+    server.reset_counters()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(query() for _ in range(clients)))
+    elapsed = (time.perf_counter() - start) * 1000
+    await client.close()
+    return elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    server = FakePostgrest(latency=args.latency_ms / 1000)
+    seed_trips(server, 50)
+    server.start()
+
+    ok = True
+    print(f"{args.clients} identical reads, upstream latency {args.latency_ms:.0f} ms\n")
+    print(f"{'client':>6} {'coalesce':>9} {'upstream':>9} {'wall ms':>9}  all answered")
+    runs = [
+        ("sync", False, lambda c: sync_burst(server, args.clients, c)),
+        ("sync", True, lambda c: sync_burst(server, args.clients, c)),
+        ("async", False, lambda c: asyncio.run(async_burst(server, args.clients, c))),
+        ("async", True, lambda c: asyncio.run(async_burst(server, args.clients, c))),
+    ]
+    for name, coalesce, run in runs:
+        elapsed, results = run(coalesce)
+        upstream = server.request_count
+        answered = all(r.status_code == 200 and r.data and r.data[0]["id"] == TRIP_ID for r in results)
+        print(f"{name:>6} {'on' if coalesce else 'off':>9} {upstream:>9} {elapsed:>9.1f}  {answered}")
+        if coalesce:
+            ok = ok and answered and upstream == 1
+    server.stop()
+
+    print()
+    print("[PASS] each coalesced burst made one upstream request" if ok
+          else "[FAIL] coalesced burst made more than one upstream request")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark: bare requests.get vs the pooled SupabaseClient transport.
+
+Starts a local fake PostgREST server, fires the same trip query N times
+(sequentially and from a thread pool) through both paths, and prints latency,
+TCP connections opened on the server and the client's pool stats.
+
+    python bench_supabase_pool.py --requests 500 --concurrency 16
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest, seed_trips
+from app.services.supabase_rest import create_client
+
+
+def bare_query(base_url, key):
+    # The pre-pool behaviour: a fresh connection per call
+    headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+    response = requests.get(f"{base_url}/rest/v1/trips", headers=headers,
+                            params={"select": "*", "origin": "ilike.%Durban%"})
+    response.raise_for_status()
+    return response.json()
+
+
+def pooled_query(client):
+    return client.table("trips").select("*").ilike("origin", "%Durban%").execute().data
+
+
+def run(label, fn, total, concurrency, server):
+    server.reset_counters()
+    timings = []
+
+    def one(_):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        for i in range(total):
+            one(i)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+
+    timings.sort()
+    p50 = statistics.median(timings) * 1000
+    p99 = timings[int(len(timings) * 0.99) - 1] * 1000
+    print(f"{label:<28} {total / elapsed:>8.0f} req/s   p50 {p50:6.2f} ms   p99 {p99:6.2f} ms   "
+          f"server connections {server.connection_count}")
+
+
+def check_retry(client, server):
+    server.fail_next = 2
+    rows = pooled_query(client)
+    status = "PASS" if rows else "FAIL"
+    print(f"[{status}] GET retried through 2 injected 503s ({len(rows)} rows returned)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    server = FakePostgrest(latency=args.latency_ms / 1000).start()
+    seed_trips(server, 200)
+    key = "bench-key"
+    client = create_client(server.url, key, pool_maxsize=args.concurrency)
+
+    print(f"Fake PostgREST at {server.url} (latency {args.latency_ms} ms)\n")
+    for concurrency in (1, args.concurrency):
+        run(f"bare requests   x{concurrency}", lambda: bare_query(server.url, key), args.requests, concurrency, server)
+        run(f"pooled client   x{concurrency}", lambda: pooled_query(client), args.requests, concurrency, server)
+        print()
+
+    check_retry(client, server)
+    print(f"\nPool stats: {client.pool_stats()}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
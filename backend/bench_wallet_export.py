@@ -0,0 +1,263 @@
+"""
+Benchmark: streaming wallet statements, and paging the history, at --rows transactions.
+
+Seeds fake_postgrest with --rows ledger_transactions for one busy driver,
+--small-rows for a second user and the (created_at, id) index the history
+pages on. (Postgres pages through (user_id, created_at, id); the fake can only
+walk (created_at, id) and skip other users' rows, so the second user is
+exported before the driver's rows are added.) It starts the API under uvicorn in a subprocess (so its memory
+is its own) and:
+
+  export  - GET /wallet/transactions/export for both users, as CSV and as
+            NDJSON, read as a stream: rows/s, MB/s and the API process's peak
+            RSS (sampled from /proc) over its resting RSS. Memory must not
+            depend on the statement's size: the big export may not use more
+            than --max-mb, and every row must arrive once, newest first
+  list    - GET /wallet/transactions: the first page, pages from cursors deep
+            in the history, and pages filtered by type and date range. A deep
+            page may not be more than 3x slower than the first
+
+Each user is identified by an access token signed with the API's
+SUPABASE_JWT_SECRET; without one both endpoints must answer 401.
+
+    python bench_wallet_export.py --rows 1000000
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import jwt
+import requests
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_postgrest import FakePostgrest
+from app.services import ledger
+from app.services.pagination import encode_cursor
+from app.services.wallet_history import HISTORY_SORT, EXPORT_COLUMNS
+
+JWT_SECRET = "bench-jwt-secret"
+KINDS = ["escrow_release"] * 6 + ["withdrawal", "deposit", "escrow_hold", "escrow_refund"]
+
+
+def seed(db, user_id, count, start, rng):
+    """count transactions for user_id, one a minute from start; returns them oldest first."""
+    rows = []
+    for i in range(count):
+        kind = KINDS[i % len(KINDS)]
+        amount = rng.randrange(5000, 90000)
+        roll = rng.random()
+        rows.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "kind": kind,
+            "status": "completed" if roll < 0.97 else ("pending" if roll < 0.99 else "failed"),
+            "user_id": user_id,
+            "counterparty_id": None,
+            "trip_id": f"trip-{i}" if kind.startswith("escrow") else None,
+            "amount_cents": -amount if kind in ("withdrawal", "escrow_hold") else amount,
+            "description": ledger.TRANSACTION_TYPES[kind][0],
+            "reference": f"ref-{i}" if kind in ("deposit", "withdrawal") else None,
+            "counters": [],
+            "created_at": (start + datetime.timedelta(minutes=i)).isoformat(),
+        })
+    db.add_rows("ledger_transactions", rows)
+    return rows
+
+
+def rss_kb(pid, field="VmRSS"):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+class PeakRss:
+    """Samples a process's RSS every few ms while in use; .peak in KiB."""
+
+    def __init__(self, pid, interval=0.005):
+        self.pid, self.interval, self.peak = pid, interval, 0
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_kb(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = rss_kb(self.pid)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_kb(self.pid))
+
+
+def auth(user_id):
+    """Headers with an access token for user_id, as Supabase issues them."""
+    claims = {"sub": user_id, "aud": "authenticated", "exp": int(time.time()) + 3600}
+    return {"Authorization": f"Bearer {jwt.encode(claims, JWT_SECRET, algorithm='HS256')}"}
+
+
+def export(base, pid, user_id, fmt, expected):
+    """Streams one export; returns (stats, problems)."""
+    rest = rss_kb(pid)
+    count, seen, last, problems = 0, set(), None, []
+    started = time.perf_counter()
+    with PeakRss(pid) as peak, requests.get(f"{base}/wallet/transactions/export", params={"format": fmt},
+                                            headers=auth(user_id), stream=True) as response:
+        if response.status_code != 200:
+            return None, [f"{fmt} export answered {response.status_code}"]
+        first = time.perf_counter() - started
+        received = [0]
+
+        def counted(lines):
+            for line in lines:
+                received[0] += len(line) + 1
+                yield line
+
+        lines = counted(response.iter_lines(chunk_size=1 << 16, decode_unicode=True))
+        if fmt == "csv":
+            lines = csv.reader(lines)
+            if tuple(next(lines)) != EXPORT_COLUMNS:
+                problems.append("csv header")
+        for line in lines:
+            row = dict(zip(EXPORT_COLUMNS, line)) if fmt == "csv" else json.loads(line)
+            count += 1
+            key = (row["created_at"], row["id"])
+            if row["id"] in seen or (last is not None and key >= last):
+                problems.append(f"row {count} out of order or repeated")
+                break
+            seen.add(row["id"])
+            last = key
+        size = received[0]
+    elapsed = time.perf_counter() - started
+    if count != expected:
+        problems.append(f"{fmt}: {count} rows, expected {expected}")
+    return {"rows": count, "seconds": elapsed, "first_byte": first, "bytes": size,
+            "rest_mb": rest / 1024, "growth_mb": (peak.peak - rest) / 1024}, problems
+
+
+def timed_get(base, user_id, params):
+    started = time.perf_counter()
+    response = requests.get(f"{base}/wallet/transactions", params=params, headers=auth(user_id))
+    elapsed = time.perf_counter() - started
+    if response.status_code != 200:
+        raise RuntimeError(f"/wallet/transactions answered {response.status_code}: {response.text[:200]}")
+    return elapsed, response
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000, help="transactions of the busy driver")
+    parser.add_argument("--small-rows", type=int, default=10_000, help="transactions of the second user")
+    parser.add_argument("--pages", type=int, default=50, help="list requests per kind")
+    parser.add_argument("--max-mb", type=float, default=64, help="API memory growth allowed during an export")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--seed", type=int, default=34)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    db = FakePostgrest().start()
+    big, small = str(uuid.uuid4()), str(uuid.uuid4())
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    seed(db, small, args.small_rows, start, rng)
+    db.create_index("ledger_transactions", HISTORY_SORT)
+
+    env = {**os.environ, "SUPABASE_URL": db.url, "SUPABASE_KEY": "bench", "SUPABASE_SERVICE_ROLE_KEY": "bench",
+           "PAYMENT_QUEUE_PATH": os.path.join(tempfile.mkdtemp(), "payment_queue.sqlite3"),
+           "SUPABASE_JWT_SECRET": JWT_SECRET}
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port),
+                            "--log-level", "warning", "--no-access-log"],
+                           cwd=os.path.dirname(os.path.abspath(__file__)), env=env, stdout=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{args.port}"
+    problems, results = [], {}
+    try:
+        for _ in range(300):
+            try:
+                if requests.get(f"{base}/health").status_code == 200:
+                    break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("API did not start")
+
+        big_rows = None
+        for user, label, expected in ((small, "small", args.small_rows), (big, "big", args.rows)):
+            if user == big:
+                print(f"seeding {args.rows:,} transactions")
+                big_rows = seed(db, big, args.rows, start, rng)
+                db.create_index("ledger_transactions", HISTORY_SORT)
+            for fmt in ("csv", "ndjson"):
+                stats, found = export(base, api.pid, user, fmt, expected)
+                problems += found
+                if stats:
+                    results[(label, fmt)] = stats
+                    print(f"export    {fmt:6} {stats['rows']:>9,} rows in {stats['seconds']:6.1f} s "
+                          f"({stats['rows'] / stats['seconds']:,.0f} rows/s, "
+                          f"{stats['bytes'] / 2**20 / stats['seconds']:.1f} MB/s, first byte "
+                          f"{stats['first_byte'] * 1000:.0f} ms); API RSS {stats['rest_mb']:.0f} MiB at rest, "
+                          f"peak {stats['growth_mb']:+.1f} MiB")
+
+        # Listing: the first page, pages deep in the history, filtered pages
+        first = [timed_get(base, big, {"limit": 50})[0] for _ in range(args.pages)]
+        deep = []
+        for _ in range(args.pages):
+            row = big_rows[rng.randrange(len(big_rows) // 10, len(big_rows))]
+            elapsed, response = timed_get(base, big, {"limit": 50, "cursor": encode_cursor(row, HISTORY_SORT)})
+            deep.append(elapsed)
+            if len(response.json()) != 50 or response.json()[0]["created_at"] >= row["created_at"]:
+                problems.append("deep page doesn't continue after its cursor")
+        month = (start + datetime.timedelta(minutes=args.rows - 43200)).date().isoformat()
+        filtered = []
+        for _ in range(args.pages):
+            elapsed, response = timed_get(base, big, {"type": "Earnings", "status": "Completed",
+                                                      "date_from": month, "limit": 50})
+            filtered.append(elapsed)
+            if any(t["type"] != "Earnings" or t["status"] != "Completed" or t["created_at"] < month
+                   for t in response.json()):
+                problems.append("filtered page has rows outside the filter")
+        anonymous = [requests.get(f"{base}/wallet/transactions{path}", params={"user_id": big}).status_code
+                     for path in ("", "/export")]
+        print(f"list      p50 first page {statistics.median(first) * 1000:.1f} ms, deep page "
+              f"{statistics.median(deep) * 1000:.1f} ms, filtered (type, status, date) "
+              f"{statistics.median(filtered) * 1000:.1f} ms")
+    finally:
+        api.terminate()
+        api.wait()
+        db.stop()
+
+    growth = max((results[("big", f)]["growth_mb"] for f in ("csv", "ndjson") if ("big", f) in results), default=None)
+    checks = {
+        "every export complete, each row once, newest first": not problems,
+        f"API memory during the {args.rows:,}-row export within {args.max_mb:g} MiB":
+            growth is not None and growth <= args.max_mb,
+        "deep pages within 3x of the first page": statistics.median(deep) <= 3 * statistics.median(first),
+        "no history without an access token": anonymous == [401, 401],
+    }
+    for problem in problems[:10]:
+        print(f"  ! {problem}")
+    print()
+    for name, passed in checks.items():
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+    ok = all(checks.values())
+    print()
+    print("[PASS] statements stream in constant memory and history pages stay fast" if ok else "[FAIL] see above")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
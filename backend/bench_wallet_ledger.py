@@ -0,0 +1,430 @@
+"""
+Benchmark: the wallet ledger at --entries ledger entries (10M by default).
+
+There's no Postgres here, so the ledger lives in SQLite with the tables and
+indexes of add_wallet_ledger.sql, and post() below does what the
+post_ledger_transaction RPC does: append the header and entries, add the
+deltas to the balance snapshots and wallet counters, and roll back if a wallet
+would go negative. The postings themselves come from app/services/ledger.py
+(deposits, card- and wallet-funded escrow holds, releases with the platform
+fee, refunds and withdrawals, spread over a year for --users users).
+
+Then:
+
+  post     - one posting per database transaction, on an empty ledger and
+             again at full size: snapshot maintenance must not grow with history
+  balance  - what /wallet/balance reads (two snapshot rows, the counters row,
+             two monthly rows) against summing the account's entries, for
+             random users and for platform:revenue, which has an entry for
+             most transactions; the snapshots must equal the sums
+  check    - the ledger_check function's statement (translated to SQLite)
+             over every entry and transaction, with one balance snapshot, one
+             counters row and one unbalanced transaction corrupted first and
+             wallet-funded holds posted from another connection while it
+             runs: it must find exactly the corrupted ones; time and peak memory
+
+    python bench_wallet_ledger.py --entries 10000000 --users 200000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import ledger
+
+SCHEMA = """
+CREATE TABLE ledger_transactions (
+    id TEXT PRIMARY KEY, kind TEXT NOT NULL, user_id TEXT NOT NULL, counterparty_id TEXT, trip_id TEXT,
+    amount_cents INTEGER NOT NULL, description TEXT, reference TEXT, counters TEXT NOT NULL, status TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX ledger_transactions_user_created_idx ON ledger_transactions (user_id, created_at DESC, id DESC);
+CREATE TABLE ledger_entries (
+    id INTEGER PRIMARY KEY, transaction_id TEXT NOT NULL, account TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL, created_at TEXT NOT NULL
+);
+CREATE INDEX ledger_entries_transaction_idx ON ledger_entries (transaction_id);
+CREATE INDEX ledger_entries_account_idx ON ledger_entries (account, id);
+CREATE TABLE ledger_balances (
+    account TEXT PRIMARY KEY, balance_cents INTEGER NOT NULL, entry_count INTEGER NOT NULL, updated_at TEXT
+);
+CREATE TABLE wallet_counters (
+    user_id TEXT PRIMARY KEY, total_earned_cents INTEGER NOT NULL, total_spent_cents INTEGER NOT NULL,
+    trips_completed INTEGER NOT NULL, open_holds INTEGER NOT NULL, updated_at TEXT
+);
+CREATE TABLE wallet_monthly (
+    user_id TEXT NOT NULL, month TEXT NOT NULL, earned_cents INTEGER NOT NULL, spent_cents INTEGER NOT NULL,
+    PRIMARY KEY (user_id, month)
+);
+"""
+
+
+# ledger_check (add_wallet_ledger.sql) in SQLite: one statement, so one snapshot
+CHECK_SQL = """
+WITH account_sums AS (
+    SELECT account, SUM(amount_cents) AS balance_cents, COUNT(*) AS entry_count
+    FROM ledger_entries GROUP BY account
+),
+unbalanced AS (
+    SELECT transaction_id, SUM(amount_cents) AS sum_cents
+    FROM ledger_entries GROUP BY transaction_id HAVING SUM(amount_cents) <> 0
+),
+deltas AS (
+    SELECT json_extract(c.value, '$.user_id') AS user_id, substr(t.created_at, 1, 7) || '-01' AS month,
+           COALESCE(json_extract(c.value, '$.earned_cents'), 0) AS earned_cents,
+           COALESCE(json_extract(c.value, '$.spent_cents'), 0) AS spent_cents,
+           COALESCE(json_extract(c.value, '$.trips_completed'), 0) AS trips_completed,
+           COALESCE(json_extract(c.value, '$.open_holds'), 0) AS open_holds
+    FROM ledger_transactions t, json_each(t.counters) c
+),
+user_sums AS (
+    SELECT user_id, SUM(earned_cents) AS earned_cents, SUM(spent_cents) AS spent_cents,
+           SUM(trips_completed) AS trips_completed, SUM(open_holds) AS open_holds
+    FROM deltas GROUP BY user_id
+),
+month_sums AS (
+    SELECT user_id, month, SUM(earned_cents) AS earned_cents, SUM(spent_cents) AS spent_cents
+    FROM deltas GROUP BY user_id, month
+),
+mismatches AS (
+    SELECT 'balance' AS kind, COALESCE(s.account, b.account) AS key
+    FROM account_sums s FULL JOIN ledger_balances b ON b.account = s.account
+    WHERE (COALESCE(s.balance_cents, 0), COALESCE(s.entry_count, 0)) IS NOT (b.balance_cents, b.entry_count)
+    UNION ALL
+    SELECT 'counters', COALESCE(u.user_id, w.user_id)
+    FROM user_sums u FULL JOIN wallet_counters w ON w.user_id = u.user_id
+    WHERE (COALESCE(u.earned_cents, 0), COALESCE(u.spent_cents, 0), COALESCE(u.trips_completed, 0),
+           COALESCE(u.open_holds, 0))
+          IS NOT (COALESCE(w.total_earned_cents, 0), COALESCE(w.total_spent_cents, 0),
+                  COALESCE(w.trips_completed, 0), COALESCE(w.open_holds, 0))
+    UNION ALL
+    SELECT 'monthly', COALESCE(m.user_id, w.user_id) || '/' || COALESCE(m.month, w.month)
+    FROM month_sums m FULL JOIN wallet_monthly w ON w.user_id = m.user_id AND w.month = m.month
+    WHERE (COALESCE(m.earned_cents, 0), COALESCE(m.spent_cents, 0))
+          IS NOT (COALESCE(w.earned_cents, 0), COALESCE(w.spent_cents, 0))
+)
+SELECT json_object(
+    'entries', (SELECT COALESCE(SUM(entry_count), 0) FROM account_sums),
+    'transactions', (SELECT COUNT(*) FROM ledger_transactions),
+    'accounts', (SELECT COUNT(*) FROM account_sums),
+    'unbalanced_transactions', (SELECT json_group_array(transaction_id) FROM unbalanced),
+    'mismatches', (SELECT json_group_array(json_array(kind, key)) FROM mismatches)
+)
+"""
+
+
+class SQLiteLedger:
+    """The post_ledger_transaction RPC over SQLite, statement for statement."""
+
+    def __init__(self, path, create=True):
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.executescript("PRAGMA journal_mode=WAL; PRAGMA synchronous=OFF; PRAGMA cache_size=-262144;")
+        if create:
+            self.db.executescript(SCHEMA)
+
+    def _apply(self, postings):
+        cur = self.db.cursor()
+        cur.executemany(
+            "INSERT INTO ledger_transactions VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            [(t["id"], t["kind"], t["user_id"], t["counterparty_id"], t["trip_id"], t["amount_cents"],
+              t["description"], t["reference"], json.dumps(t["counters"]), t["status"], t["created_at"])
+             for t in (p.transaction for p in postings)])
+        cur.executemany(
+            "INSERT INTO ledger_entries (transaction_id, account, amount_cents, created_at) VALUES (?,?,?,?)",
+            [(p.transaction["id"], e["account"], e["amount_cents"], p.transaction["created_at"])
+             for p in postings for e in p.entries])
+        cur.executemany(
+            "INSERT INTO ledger_balances VALUES (?,?,1,?) ON CONFLICT (account) DO UPDATE SET "
+            "balance_cents = balance_cents + excluded.balance_cents, entry_count = entry_count + 1, "
+            "updated_at = excluded.updated_at",
+            [(e["account"], e["amount_cents"], p.transaction["created_at"]) for p in postings for e in p.entries])
+        counters = [(c, p.transaction["created_at"]) for p in postings for c in p.counters]
+        cur.executemany(
+            "INSERT INTO wallet_counters VALUES (?,?,?,?,?,?) ON CONFLICT (user_id) DO UPDATE SET "
+            "total_earned_cents = total_earned_cents + excluded.total_earned_cents, "
+            "total_spent_cents = total_spent_cents + excluded.total_spent_cents, "
+            "trips_completed = trips_completed + excluded.trips_completed, "
+            "open_holds = open_holds + excluded.open_holds, updated_at = excluded.updated_at",
+            [(c["user_id"], c["earned_cents"], c["spent_cents"], c["trips_completed"], c["open_holds"], at)
+             for c, at in counters])
+        cur.executemany(
+            "INSERT INTO wallet_monthly VALUES (?,?,?,?) ON CONFLICT (user_id, month) DO UPDATE SET "
+            "earned_cents = earned_cents + excluded.earned_cents, spent_cents = spent_cents + excluded.spent_cents",
+            [(c["user_id"], at[:7] + "-01", c["earned_cents"], c["spent_cents"])
+             for c, at in counters if c["earned_cents"] or c["spent_cents"]])
+        return cur
+
+    def post(self, posting):
+        """One posting, one transaction: the request path."""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = self._apply([posting])
+            wallets = [e["account"] for e in posting.entries if e["account"].startswith("wallet:")]
+            if wallets and cur.execute(
+                    f"SELECT 1 FROM ledger_balances WHERE account IN ({','.join('?' * len(wallets))}) "
+                    "AND balance_cents < 0", wallets).fetchone():
+                raise ledger.InsufficientFunds("insufficient funds")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def load(self, postings):
+        """Many postings per transaction, for building the history quickly; same statements."""
+        self.db.execute("BEGIN")
+        self._apply(postings)
+        self.db.execute("COMMIT")
+
+    def summary(self, user_id, this_month, last_month):
+        """What ledger.wallet_summary reads."""
+        db = self.db
+        balances = db.execute("SELECT account, balance_cents FROM ledger_balances WHERE account IN (?, ?)",
+                              (ledger.wallet_account(user_id), ledger.escrow_account(user_id))).fetchall()
+        counters = db.execute("SELECT * FROM wallet_counters WHERE user_id = ?", (user_id,)).fetchone()
+        monthly = db.execute("SELECT month, earned_cents, spent_cents FROM wallet_monthly "
+                             "WHERE user_id = ? AND month IN (?, ?)", (user_id, this_month, last_month)).fetchall()
+        return balances, counters, monthly
+
+
+def workload(users, drivers, target_entries, start, span, rng):
+    """
+    Yields postings until they add up to target_entries entries. Tracks wallet
+    balances so every posting is valid, and keeps a queue of open holds that
+    are released (or refunded) a while later.
+    """
+    wallets = [0] * users
+    open_holds = deque()
+    entries = 0
+    step = span / (target_entries / 2.3)
+    n = 0
+    while entries < target_entries:
+        at = (start + datetime.timedelta(seconds=n * step)).isoformat()
+        n += 1
+        r = rng.random()
+        if r < 0.15:
+            u = rng.randrange(users)
+            amount = rng.randrange(200, 2000) * 100
+            wallets[u] += amount
+            posting = ledger.deposit(ids[u], amount, reference=f"chk_{n}", created_at=at)
+        elif r < 0.55 or not open_holds:
+            payer, driver = rng.randrange(drivers, users), rng.randrange(drivers)
+            amount = rng.randrange(50, 800) * 100 + rng.randrange(100)
+            funded_by = "wallet" if wallets[payer] >= amount and rng.random() < 0.5 else "card"
+            if funded_by == "wallet":
+                wallets[payer] -= amount
+            open_holds.append((payer, driver, f"trip-{n}", amount, funded_by))
+            posting = ledger.escrow_hold(ids[payer], ids[driver], f"trip-{n}", amount, funded_by=funded_by,
+                                         created_at=at)
+        elif r < 0.9:
+            payer, driver, trip, amount, funded_by = open_holds.popleft()
+            if rng.random() < 0.9:
+                posting = ledger.escrow_release(ids[payer], ids[driver], trip, amount, created_at=at)
+                wallets[driver] += posting.transaction["amount_cents"]
+            else:
+                if funded_by == "wallet":
+                    wallets[payer] += amount
+                posting = ledger.escrow_refund(ids[payer], ids[driver], trip, amount, refund_to=funded_by,
+                                               created_at=at)
+        else:
+            u = rng.randrange(drivers)
+            if wallets[u] < 10000:
+                continue
+            amount = rng.randrange(10000, wallets[u] + 1)
+            wallets[u] -= amount
+            posting = ledger.withdrawal(ids[u], amount, reference=f"eft_{n}", created_at=at)
+        entries += len(posting.entries)
+        yield posting
+
+
+ids = []
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def post_latency(store, count, users, drivers, rng):
+    """Deposits and wallet-funded holds, one transaction each: returns seconds per post."""
+    times = []
+    for _ in range(count):
+        u = rng.randrange(drivers, users)
+        posting = ledger.deposit(ids[u], 100000)
+        hold = ledger.escrow_hold(ids[u], ids[rng.randrange(drivers)], "trip-x", 100000, funded_by="wallet")
+        for p in (posting, hold):
+            started = time.perf_counter()
+            store.post(p)
+            times.append(time.perf_counter() - started)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--driver-share", type=float, default=0.1)
+    parser.add_argument("--posts", type=int, default=2000, help="single posts timed on the empty and full ledger")
+    parser.add_argument("--reads", type=int, default=10000, help="wallet summaries timed")
+    parser.add_argument("--sum-reads", type=int, default=200, help="history sums timed")
+    parser.add_argument("--batch", type=int, default=20000, help="postings per transaction while loading")
+    parser.add_argument("--balance-ms", type=float, default=1.0, help="p99 limit for a wallet summary")
+    parser.add_argument("--seed", type=int, default=34)
+    parser.add_argument("--db", default=None, help="SQLite file (default: a temporary one, removed after)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ids.extend(str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(args.users))
+    drivers = max(1, int(args.users * args.driver_share))
+    tmp = None
+    if args.db is None:
+        tmp = tempfile.TemporaryDirectory()
+        args.db = os.path.join(tmp.name, "ledger.sqlite3")
+    store = SQLiteLedger(args.db)
+
+    # Single posts on an empty ledger first, as the baseline for the same at full size
+    empty_posts = post_latency(store, args.posts // 2, args.users, drivers, rng)
+
+    print(f"loading {args.entries:,} entries for {args.users:,} users ({drivers:,} drivers)")
+    start = datetime.datetime(2025, 11, 1, tzinfo=datetime.timezone.utc)
+    span = (datetime.datetime(2026, 11, 1, tzinfo=datetime.timezone.utc) - start).total_seconds()
+    started = time.perf_counter()
+    batch, postings, entries = [], 0, 0
+    for posting in workload(args.users, drivers, args.entries, start, span, rng):
+        batch.append(posting)
+        if len(batch) >= args.batch:
+            store.load(batch)
+            postings += len(batch)
+            entries += sum(len(p.entries) for p in batch)
+            batch = []
+    if batch:
+        store.load(batch)
+        postings += len(batch)
+        entries += sum(len(p.entries) for p in batch)
+    load_s = time.perf_counter() - started
+    total = store.db.execute("SELECT COUNT(*) FROM ledger_entries").fetchone()[0]
+    print(f"load      {postings:,} transactions / {entries:,} entries in {load_s:.1f} s "
+          f"({entries / load_s:,.0f} entries/s, snapshots updated per posting); "
+          f"{total:,} entries in the ledger, {os.path.getsize(args.db) / 2**30:.2f} GiB")
+
+    full_posts = post_latency(store, args.posts // 2, args.users, drivers, rng)
+    empty_p50, full_p50 = statistics.median(empty_posts), statistics.median(full_posts)
+    print(f"post      one posting per transaction: p50 {empty_p50 * 1e6:.0f} us empty, "
+          f"{full_p50 * 1e6:.0f} us at {total:,} entries (p99 {pct(full_posts, 0.99) * 1e6:.0f} us)")
+
+    refused = False
+    try:
+        store.post(ledger.withdrawal(ids[drivers], 10**12))
+    except ledger.InsufficientFunds:
+        refused = True
+
+    # /wallet/balance: a fixed set of point reads, against summing the history
+    sample = [ids[rng.randrange(args.users)] for _ in range(args.reads)]
+    this_month, last_month = "2026-10-01", "2026-09-01"
+    reads = [timed(store.summary, u, this_month, last_month)[0] for u in sample]
+    heavy_snapshot = [timed(lambda: store.db.execute(
+        "SELECT balance_cents FROM ledger_balances WHERE account = ?", (ledger.PLATFORM_REVENUE,)).fetchone())[0]
+        for _ in range(args.reads)]
+    sum_sql = "SELECT COALESCE(SUM(amount_cents), 0) FROM ledger_entries WHERE account = ?"
+    sums, mismatched = [], 0
+    for u in sample[:args.sum_reads]:
+        elapsed, (wallet_sum,) = timed(lambda: store.db.execute(sum_sql, (ledger.wallet_account(u),)).fetchone())
+        sums.append(elapsed)
+        snapshot = store.db.execute("SELECT balance_cents FROM ledger_balances WHERE account = ?",
+                                    (ledger.wallet_account(u),)).fetchone()
+        mismatched += (snapshot[0] if snapshot else 0) != wallet_sum
+    heavy_sum, (revenue_sum,) = timed(lambda: store.db.execute(sum_sql, (ledger.PLATFORM_REVENUE,)).fetchone())
+    revenue_snapshot, revenue_entries = store.db.execute(
+        "SELECT balance_cents, entry_count FROM ledger_balances WHERE account = ?", (ledger.PLATFORM_REVENUE,)).fetchone()
+    print(f"balance   wallet summary (5 rows): p50 {statistics.median(reads) * 1e6:.0f} us, "
+          f"p99 {pct(reads, 0.99) * 1e6:.0f} us; summing a user's entries instead: p50 "
+          f"{statistics.median(sums) * 1e6:.0f} us")
+    print(f"          platform:revenue ({revenue_entries:,} entries): snapshot p50 "
+          f"{statistics.median(heavy_snapshot) * 1e6:.0f} us, sum {heavy_sum * 1000:.0f} ms "
+          f"({heavy_sum / statistics.median(heavy_snapshot):,.0f}x)")
+
+    # Corrupt one of each kind of thing the checker must catch, then check everything
+    victim = store.db.execute("SELECT account FROM ledger_balances WHERE account LIKE 'wallet:%' LIMIT 1").fetchone()[0]
+    counter_victim = store.db.execute("SELECT user_id FROM wallet_counters LIMIT 1").fetchone()[0]
+    store.db.execute("UPDATE ledger_balances SET balance_cents = balance_cents + 1 WHERE account = ?", (victim,))
+    store.db.execute("UPDATE wallet_counters SET trips_completed = trips_completed + 1 WHERE user_id = ?",
+                     (counter_victim,))
+    bogus = str(uuid.uuid4())
+    store.db.execute("INSERT INTO ledger_entries (transaction_id, account, amount_cents, created_at) "
+                     "VALUES (?, ?, 500, '2026-10-01')", (bogus, ledger.PLATFORM_REVENUE))
+    expected = {("balance", victim), ("balance", ledger.PLATFORM_REVENUE), ("counters", counter_victim)}
+
+    # Postings keep landing while the check reads: they must not show up as mismatches
+    writer, checking, posted = SQLiteLedger(args.db, create=False), threading.Event(), [0]
+
+    def keep_posting():
+        post_rng = random.Random(args.seed + 1)
+        while checking.is_set():
+            u = post_rng.randrange(drivers, args.users)
+            writer.post(ledger.deposit(ids[u], 5000))
+            writer.post(ledger.escrow_hold(ids[u], ids[post_rng.randrange(drivers)], "trip-y", 5000,
+                                           funded_by="wallet"))
+            posted[0] += 2
+            time.sleep(0.001)
+
+    checking.set()
+    poster = threading.Thread(target=keep_posting)
+    poster.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    report = json.loads(store.db.execute(CHECK_SQL).fetchone()[0])
+    check_s = time.perf_counter() - started
+    checking.clear()
+    poster.join()
+    writer.db.close()
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    found = {tuple(m) for m in report["mismatches"]}
+    unbalanced = set(report["unbalanced_transactions"])
+    print(f"check     {report['entries']:,} entries, {report['transactions']:,} transactions, "
+          f"{report['accounts']:,} accounts in {check_s:.1f} s ({report['entries'] / check_s:,.0f} entries/s); "
+          f"peak RSS {rss_peak / 1024:.0f} MiB ({(rss_peak - rss_before) / 1024:+.0f} MiB while checking)")
+    print(f"          found {sorted(k for k, _ in found)} mismatches and {len(unbalanced)} unbalanced transaction(s); "
+          f"{posted[0]} transactions posted meanwhile")
+    store.db.close()
+    if tmp:
+        tmp.cleanup()
+
+    checks = {
+        f"{args.entries:,} entries loaded": total >= args.entries,
+        "posting cost doesn't grow with history (p50 within 3x of an empty ledger)": full_p50 <= 3 * empty_p50,
+        "a withdrawal beyond the balance is refused and rolled back": refused,
+        f"wallet summary p99 under {args.balance_ms:g} ms": pct(reads, 0.99) * 1000 <= args.balance_ms,
+        "snapshot read of the busiest account is as fast as anyone's (within 3x)":
+            statistics.median(heavy_snapshot) <= 3 * statistics.median(reads),
+        "snapshots equal the sum of the entries": not mismatched and revenue_snapshot == revenue_sum,
+        "check finds exactly the corrupted snapshots and the unbalanced transaction, not concurrent posts":
+            found == expected and unbalanced == {bogus} and posted[0] > 0,
+    }
+    print()
+    for name, passed in checks.items():
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}")
+    ok = all(checks.values())
+    print()
+    print("[PASS] balances read in constant time and the ledger checks out" if ok else "[FAIL] see above")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,703 @@
+"""
+Minimal in-memory PostgREST stand-in for local tests and benchmarks.
+
+Serves /rest/v1/<table> with the subset of PostgREST our wrapper uses
+(select, eq/neq/gt/gte/lt/lte/like/ilike/in filters, or=(...) / and(...)
+trees, order, limit, offset, inserts, upserts and updates, HEAD + Prefer: count,
+/rpc/<fn>) over HTTP/1.1 keep-alive, and counts requests and TCP connections
+so benchmarks can see what the client actually did. create_index() gives a
+column a sorted index so eq/range filters on it behave like an index scan
+instead of a full scan; an index on a tuple of columns that matches ORDER BY
+lets keyset-paginated reads seek to the cursor and stop at LIMIT.
+
+Run standalone:
+    python fake_postgrest.py --port 54321 --latency-ms 5 --trips 1000
+"""
+import argparse
+import bisect
+import functools
+import json
+import threading
+import time
+import uuid
+from fnmatch import fnmatchcase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+
+def _coerce(raw, sample):
+    """Converts a filter literal to the type of the stored value it is compared against."""
+    if isinstance(sample, bool):
+        return raw.lower() == "true"
+    if isinstance(sample, int):
+        try:
+            return int(raw)
+        except ValueError:
+            return float(raw)
+    if isinstance(sample, float):
+        return float(raw)
+    return raw
+
+
+RESERVED_PARAMS = ("select", "order", "limit", "offset", "columns", "on_conflict")
+
+
+class RpcError(Exception):
+    """Raised by registered RPCs to answer like a Postgres RAISE EXCEPTION through PostgREST."""
+    def __init__(self, message, code="P0001", hint=None, status=400):
+        super().__init__(message)
+        self.payload = {"code": code, "message": message, "details": None, "hint": hint}
+        self.status = status
+
+
+def _filters(params):
+    return [(k, v) for k, v in params if k not in RESERVED_PARAMS]
+
+
+def _split_top(text):
+    """Splits on commas that are not inside parentheses or double quotes."""
+    parts, depth, quoted, start, i = [], 0, False, 0, 0
+    while i < len(text):
+        ch = text[i]
+        if quoted:
+            if ch == "\\":
+                i += 1
+            elif ch == '"':
+                quoted = False
+        elif ch == '"':
+            quoted = True
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+
+def _unquote(raw):
+    if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+        return raw[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return raw
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_logic(op, body):
+    """
+    Parses an or=(...) / and(...) body into (op, children). Children are
+    nested (op, children) tuples or (column, expr) leaves for _match.
+    """
+    body = body.strip()
+    if body.startswith("(") and body.endswith(")"):
+        body = body[1:-1]
+    children = []
+    for part in _split_top(body):
+        part = part.strip()
+        logic = next((l for l in ("and", "or") if part.startswith(l + "(")), None)
+        if logic:
+            children.append(_parse_logic(logic, part[len(logic):]))
+            continue
+        column, _, rest = part.partition(".")
+        operator, _, raw = rest.partition(".")
+        if operator == "not":
+            operator, _, raw = raw.partition(".")
+            operator = f"not.{operator}"
+        children.append((column, f"{operator}.{_unquote(raw)}"))
+    return op, tuple(children)
+
+
+def _eval_logic(row, node):
+    op, children = node
+    results = (_eval_logic(row, c) if isinstance(c[1], tuple) else _match(row, *c) for c in children)
+    return all(results) if op == "and" else any(results)
+
+
+def _keyset_bound(node, columns, op):
+    """
+    If `node` is the keyset tree (a op x) OR (a = x AND b op y) OR ... over
+    `columns`, returns the raw (x, y, ...) values; otherwise None. The
+    "... OR a IS NULL" clauses an ascending cursor adds are dropped: rows with
+    a null sort key aren't in the index.
+    """
+    kind, children = node
+    last = lambda child: child[1][-1] if isinstance(child[1], tuple) else child
+    children = tuple(c for c in children if last(c)[1] != "is.null")
+    if kind != "or" or len(children) != len(columns):
+        return None
+    for i, child in enumerate(children):
+        leaves = [child] if i == 0 else (list(child[1]) if child[0] == "and" and isinstance(child[1], tuple) else None)
+        if leaves is None or len(leaves) != i + 1 or any(isinstance(l[1], tuple) for l in leaves):
+            return None
+        for j, (column, expr) in enumerate(leaves):
+            want = op if j == i else "eq"
+            if column != columns[j] or expr.partition(".")[0] != want:
+                return None
+    return tuple(expr.partition(".")[2] for _, expr in children[-1][1]) if len(columns) > 1 \
+        else (children[0][1].partition(".")[2],)
+
+
+def _index_key(row, column):
+    """Index key for a row: the value, or a tuple for a multi-column index (None if any part is null)."""
+    if isinstance(column, tuple):
+        values = tuple(row.get(c) for c in column)
+        return None if any(v is None for v in values) else values
+    return row.get(column)
+
+
+def _match(row, column, expr):
+    if column in ("or", "and"):
+        return _eval_logic(row, _parse_logic(column, expr))
+    op, _, raw = expr.partition(".")
+    negate = False
+    if op == "not":
+        negate = True
+        op, _, raw = raw.partition(".")
+    value = row.get(column)
+
+    if op == "is":
+        result = value is None if raw == "null" else value == (raw == "true")
+    elif value is None:
+        result = False
+    elif op == "in":
+        options = [v.strip().strip('"') for v in raw.strip("()").split(",")]
+        result = str(value) in options
+    elif op in ("like", "ilike"):
+        pattern = raw.replace("%", "*")
+        if op == "ilike":
+            result = fnmatchcase(str(value).lower(), pattern.lower())
+        else:
+            result = fnmatchcase(str(value), pattern)
+    else:
+        other = _coerce(raw, value)
+        result = {
+            "eq": value == other,
+            "neq": value != other,
+            "gt": value > other,
+            "gte": value >= other,
+            "lt": value < other,
+            "lte": value <= other,
+        }.get(op, False)
+    return not result if negate else result
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the default backlog of 5 drops SYNs under load tests
+
+
+class FakePostgrest:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.tables = {}
+        self.indexes = {}   # (table, column) -> (sorted keys, rows in key order)
+        self.rpcs = {}      # function name -> callable(server, params)
+        self.latency = latency
+        self.request_count = 0
+        self.connection_count = 0
+        self.fail_next = 0  # answer this many upcoming requests with 503
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_rows(self, table, rows):
+        with self._lock:
+            stored = self.tables.setdefault(table, [])
+            for row in rows:
+                row.setdefault("id", str(uuid.uuid4()))
+                stored.append(row)
+                for (name, column), (keys, indexed) in self.indexes.items():
+                    key = _index_key(row, column) if name == table else None
+                    if key is not None:
+                        pos = bisect.bisect_right(keys, key)
+                        keys.insert(pos, key)
+                        indexed.insert(pos, row)
+
+    def upsert_rows(self, table, rows, on_conflict="id"):
+        """Prefer: resolution=merge-duplicates: rows matching on `on_conflict` columns are updated."""
+        columns = on_conflict.split(",")
+        with self._lock:
+            existing = {tuple(r.get(c) for c in columns): r for r in self.tables.get(table, [])}
+            merged, added = [], []
+            for row in rows:
+                match = existing.get(tuple(row.get(c) for c in columns))
+                if match is None:
+                    added.append(row)
+                    continue
+                match.update(row)
+                merged.append(match)
+        self.add_rows(table, added)
+        changed = {k for row in rows for k in row}
+        for name, column in list(self.indexes):
+            indexed = column if isinstance(column, tuple) else (column,)
+            if merged and name == table and changed.intersection(indexed):
+                self.create_index(table, column)
+        return merged + added
+
+    def create_index(self, table, column):
+        """column: a column name, or a tuple of names for a composite (ORDER BY) index."""
+        with self._lock:
+            rows = self.tables.get(table, [])
+            keyed = ((_index_key(r, column), i) for i, r in enumerate(rows))
+            pairs = sorted((k, i) for k, i in keyed if k is not None)
+            self.indexes[(table, column)] = ([k for k, _ in pairs], [rows[i] for _, i in pairs])
+
+    def register_rpc(self, name, fn):
+        self.rpcs[name] = fn
+
+    def lookup(self, table, column, value):
+        """The rows whose `column` equals `value`, through an index on it (created on first use)."""
+        if (table, column) not in self.indexes:
+            self.create_index(table, column)
+        keys, rows = self.indexes[(table, column)]
+        return rows[bisect.bisect_left(keys, value):bisect.bisect_right(keys, value)]
+
+    def _unindex(self, table, columns, rows):
+        """Takes rows out of the table's indexes on any of `columns`, before they change (under _lock)."""
+        for (name, column), (keys, indexed) in self.indexes.items():
+            if name != table or not columns.intersection(column if isinstance(column, tuple) else (column,)):
+                continue
+            for row in rows:
+                key = _index_key(row, column)
+                if key is None:
+                    continue
+                for pos in range(bisect.bisect_left(keys, key), bisect.bisect_right(keys, key)):
+                    if indexed[pos] is row:
+                        del keys[pos], indexed[pos]
+                        break
+
+    def _reindex(self, table, columns, rows):
+        """Puts changed rows back into the indexes _unindex took them out of (under _lock)."""
+        for (name, column), (keys, indexed) in self.indexes.items():
+            if name != table or not columns.intersection(column if isinstance(column, tuple) else (column,)):
+                continue
+            for row in rows:
+                key = _index_key(row, column)
+                if key is not None:
+                    pos = bisect.bisect_right(keys, key)
+                    keys.insert(pos, key)
+                    indexed.insert(pos, row)
+
+    def index_range(self, table, column, op, raw):
+        """Returns (keys, rows, lo, hi) for an indexable filter, or None."""
+        index = self.indexes.get((table, column))
+        if not index or op not in ("eq", "gt", "gte", "lt", "lte"):
+            return None
+        keys, rows = index
+        if not keys:
+            return keys, rows, 0, 0
+        value = _coerce(raw, keys[0])
+        lo, hi = 0, len(keys)
+        if op == "eq":
+            lo, hi = bisect.bisect_left(keys, value), bisect.bisect_right(keys, value)
+        elif op == "gt":
+            lo = bisect.bisect_right(keys, value)
+        elif op == "gte":
+            lo = bisect.bisect_left(keys, value)
+        elif op == "lt":
+            hi = bisect.bisect_left(keys, value)
+        elif op == "lte":
+            hi = bisect.bisect_right(keys, value)
+        return keys, rows, lo, hi
+
+    def reset_counters(self):
+        with self._lock:
+            self.request_count = 0
+            self.connection_count = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # --- query evaluation ---
+
+    def query(self, table, params, count_only=False):
+        rows = self.tables.get(table, [])
+        filters = _filters(params)
+
+        options = dict(params)
+
+        # Use at most one index, like a simple planner would
+        for i, (column, expr) in enumerate(filters):
+            op, _, raw = expr.partition(".")
+            found = self.index_range(table, column, op, raw)
+            if found:
+                _, indexed, lo, hi = found
+                filters = filters[:i] + filters[i + 1:]
+                if count_only and not filters:
+                    return [], hi - lo, 0
+                rows = indexed[lo:hi]
+                break
+        else:
+            if not count_only and "order" in options and "limit" in options:
+                scanned = self._ordered_scan(table, options, filters)
+                if scanned is not None:
+                    return scanned
+
+        result = [r for r in rows if all(_match(r, c, e) for c, e in filters)]
+        if count_only:
+            return [], len(result), 0
+
+        if "order" in options:
+            for part in reversed(options["order"].split(",")):
+                column, _, direction = part.partition(".")
+                result.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=direction.startswith("desc"))
+        total = len(result)
+        offset = int(options.get("offset", 0))
+        limit = options.get("limit")
+        result = result[offset:offset + int(limit)] if limit is not None else result[offset:]
+        return self._project(result, options), total, offset
+
+    def _project(self, rows, options):
+        columns = options.get("select", "*")
+        if columns.strip() != "*" and "(" not in columns:
+            wanted = [c.strip() for c in columns.split(",")]
+            rows = [{c: r.get(c) for c in wanted} for r in rows]
+        return rows
+
+    def _ordered_scan(self, table, options, filters):
+        """
+        ORDER BY ... LIMIT over an index whose columns match the sort: seek past
+        a keyset or=(...) cursor, walk in index order and stop once the page is
+        full. Rows with a null sort key are not indexed and never returned.
+        Returns None when no index fits; the total is not known ("*").
+        """
+        parts = [p.partition(".") for p in options["order"].split(",")]
+        columns = tuple(c for c, _, _ in parts)
+        directions = {d.startswith("desc") for _, _, d in parts}
+        index = self.indexes.get((table, columns if len(columns) > 1 else columns[0]))
+        if not index or len(directions) != 1:
+            return None
+        desc = directions.pop()
+        keys, rows = index
+
+        lo, hi = 0, len(keys)
+        for i, (column, expr) in enumerate(filters):
+            raw = _keyset_bound(_parse_logic(column, expr), columns, "lt" if desc else "gt") \
+                if column == "or" and keys else None
+            if raw is not None:
+                sample = keys[0] if len(columns) > 1 else (keys[0],)
+                bound = tuple(_coerce(v, s) for v, s in zip(raw, sample))
+                bound = bound if len(columns) > 1 else bound[0]
+                if desc:
+                    hi = bisect.bisect_left(keys, bound)
+                else:
+                    lo = bisect.bisect_right(keys, bound)
+                filters = filters[:i] + filters[i + 1:]
+                break
+
+        offset = int(options.get("offset", 0))
+        wanted = offset + int(options["limit"])
+        positions = range(hi - 1, lo - 1, -1) if desc else range(lo, hi)
+        result = []
+        for pos in positions:
+            row = rows[pos]
+            if all(_match(row, c, e) for c, e in filters):
+                result.append(row)
+                if len(result) == wanted:
+                    break
+        return self._project(result[offset:], options), None, offset
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+            wbufsize = 65536  # headers and body leave in one segment
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connection_count += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _table(self):
+                parts = urlsplit(self.path)
+                return parts.path.rsplit("/", 1)[-1], parse_qsl(parts.query, keep_blank_values=True)
+
+            def _send(self, status, payload=None, headers=None):
+                body = b"" if payload is None else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _begin(self):
+                with server._lock:
+                    server.request_count += 1
+                    failing = server.fail_next > 0
+                    if failing:
+                        server.fail_next -= 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if failing:
+                    self._send(503, {"message": "injected failure"})
+                return not failing
+
+            def do_GET(self):
+                if not self._begin():
+                    return
+                table, params = self._table()
+                rows, total, offset = server.query(table, params, count_only=self.command == "HEAD")
+                end = offset + len(rows) - 1
+                total = "*" if total is None else total
+                self._send(200, rows, {"Content-Range": f"{offset}-{end}/{total}" if rows else f"*/{total}"})
+
+            do_HEAD = do_GET
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length) or b"null")
+
+            def do_POST(self):
+                data = self._body()
+                if not self._begin():
+                    return
+                table, params = self._table()
+                if "/rpc/" in self.path:
+                    if table not in server.rpcs:
+                        self._send(404, {"code": "PGRST202", "message": f"function {table} not found"})
+                        return
+                    try:
+                        result = server.rpcs[table](server, data or {})
+                    except RpcError as e:
+                        self._send(e.status, e.payload)
+                        return
+                    self._send(200, result)
+                    return
+                rows = data if isinstance(data, list) else [data]
+                rows = [dict(r) for r in rows]
+                if "merge-duplicates" in self.headers.get("Prefer", ""):
+                    rows = server.upsert_rows(table, rows, dict(params).get("on_conflict", "id"))
+                else:
+                    server.add_rows(table, rows)
+                self._send(201, rows)
+
+            def do_PATCH(self):
+                data = self._body()
+                if not self._begin():
+                    return
+                table, params = self._table()
+                with server._lock:
+                    candidates, filters = server.tables.get(table, []), _filters(params)
+                    for i, (column, expr) in enumerate(filters):
+                        op, _, raw = expr.partition(".")
+                        found = server.index_range(table, column, op, raw)
+                        if found:
+                            candidates, filters = found[1][found[2]:found[3]], filters[:i] + filters[i + 1:]
+                            break
+                    rows = [r for r in candidates if all(_match(r, c, e) for c, e in filters)]
+                    server._unindex(table, set(data), rows)
+                    for row in rows:
+                        row.update(data)
+                    server._reindex(table, set(data), rows)
+                self._send(200, rows)
+
+        return Handler
+
+
+_trip_locks = {}
+_trip_locks_guard = threading.Lock()
+
+
+def book_seats(server, params):
+    """
+    Stand-in for the book_seats SQL function (add_book_seats_rpc.sql): a lock
+    per trip plays the part of SELECT ... FOR UPDATE on that trip's row.
+    Register with server.register_rpc("book_seats", book_seats).
+    """
+    trip_id, passengers = params.get("p_trip_id"), params.get("p_passengers") or []
+    if not passengers:
+        raise RpcError("at least one passenger is required", code="22023")
+    with _trip_locks_guard:
+        lock = _trip_locks.setdefault(trip_id, threading.Lock())
+    with lock:
+        trip = next((t for t in server.tables.get("trips", []) if t.get("id") == trip_id), None)
+        if trip is None:
+            raise RpcError(f"trip {trip_id} not found", code="P0002")
+        left = trip.get("seats_available") or 0
+        if left < len(passengers):
+            raise RpcError(f"only {left} seat(s) left on this trip", hint="sold_out")
+        trip["seats_available"] = left - len(passengers)
+        price = params.get("p_unit_price")
+        rows = [{"trip_id": trip_id, "user_id": params.get("p_user_id"), "status": "confirmed", "seats": 1,
+                 "total_price": trip.get("price") if price is None else price, "passenger_name": name,
+                 "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())} for name in passengers]
+        server.add_rows("bookings", rows)
+        return rows
+
+
+_ledger_lock = threading.Lock()
+
+
+def post_ledger_transaction(server, params):
+    """
+    Stand-in for the post_ledger_transaction SQL function (add_wallet_ledger.sql):
+    one lock plays the part of the database transaction. Register with
+    server.register_rpc("post_ledger_transaction", post_ledger_transaction).
+    """
+    txn, entries, month = dict(params["p_transaction"]), params.get("p_entries") or [], params["p_month"]
+    if len(entries) < 2 or sum(e["amount_cents"] for e in entries) != 0:
+        raise RpcError("entries must be two or more and sum to 0", code="22023", hint="unbalanced")
+    with _ledger_lock:
+        existing = server.lookup("ledger_transactions", "id", txn["id"])
+        if existing:
+            return existing[0]
+        deltas = {}
+        for e in entries:
+            deltas[e["account"]] = deltas.get(e["account"], 0) + e["amount_cents"]
+        balances = {}
+        for account in deltas:
+            for row in server.lookup("ledger_balances", "account", account):
+                balances[account] = row
+        for account, delta in deltas.items():
+            balance = balances.get(account, {}).get("balance_cents", 0) + delta
+            if account.startswith("wallet:") and balance < 0:
+                raise RpcError("insufficient funds", hint="insufficient_funds")
+        txn.setdefault("created_at", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+        txn["counters"] = txn.get("counters") or []
+        server.add_rows("ledger_transactions", [txn])
+        with server._lock:
+            next_id = len(server.tables.get("ledger_entries", [])) + 1
+        server.add_rows("ledger_entries", [{"id": next_id + i, "transaction_id": txn["id"], "account": e["account"],
+                                            "amount_cents": e["amount_cents"], "created_at": txn["created_at"]}
+                                           for i, e in enumerate(entries)])
+        for account, delta in deltas.items():
+            row = balances.get(account)
+            if row is None:
+                server.add_rows("ledger_balances", [{"id": account, "account": account, "balance_cents": delta,
+                                                     "entry_count": sum(e["account"] == account for e in entries),
+                                                     "updated_at": txn["created_at"]}])
+            else:
+                row["balance_cents"] += delta
+                row["entry_count"] += sum(e["account"] == account for e in entries)
+                row["updated_at"] = txn["created_at"]
+        for c in txn["counters"]:
+            row = next(iter(server.lookup("wallet_counters", "user_id", c["user_id"])), None)
+            if row is None:
+                row = {"id": c["user_id"], "user_id": c["user_id"], "total_earned_cents": 0, "total_spent_cents": 0,
+                       "trips_completed": 0, "open_holds": 0}
+                server.add_rows("wallet_counters", [row])
+            row["total_earned_cents"] += c["earned_cents"]
+            row["total_spent_cents"] += c["spent_cents"]
+            row["trips_completed"] += c["trips_completed"]
+            row["open_holds"] += c["open_holds"]
+            if c["earned_cents"] or c["spent_cents"]:
+                row = next(iter(server.lookup("wallet_monthly", "id", f"{c['user_id']}:{month}")), None)
+                if row is None:
+                    row = {"id": f"{c['user_id']}:{month}", "user_id": c["user_id"], "month": month,
+                           "earned_cents": 0, "spent_cents": 0}
+                    server.add_rows("wallet_monthly", [row])
+                row["earned_cents"] += c["earned_cents"]
+                row["spent_cents"] += c["spent_cents"]
+        return txn
+
+
+
+_escrow_lock = threading.Lock()
+
+
+def open_escrow_holds(server, params):
+    """
+    Stand-in for the open_escrow_holds SQL function (add_escrow.sql). Register
+    with server.register_rpc("open_escrow_holds", open_escrow_holds), along
+    with post_ledger_transaction.
+    """
+    opened = 0
+    with _escrow_lock:
+        for h in params.get("p_holds") or []:
+            hold = dict(h["hold"])
+            if server.lookup("escrow_holds", "id", hold["id"]) or \
+                    server.lookup("escrow_holds", "booking_id", hold.get("booking_id")):
+                continue
+            post_ledger_transaction(server, {"p_transaction": h["transaction"], "p_entries": h["entries"],
+                                             "p_month": h["month"]})
+            hold.update(status="held", settle_as=None, release_at=None, dispute_reason=None, settlement_id=None,
+                        created_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), settled_at=None)
+            hold.setdefault("funded_by", "card")
+            server.add_rows("escrow_holds", [hold])
+            opened += 1
+    return opened
+
+
+def settle_escrow_holds(server, params):
+    """
+    Stand-in for the settle_escrow_holds SQL function (add_escrow.sql). Register
+    with server.register_rpc("settle_escrow_holds", settle_escrow_holds).
+    """
+    settled = []
+    with _escrow_lock:
+        for s in sorted(params.get("p_settlements") or [], key=lambda s: s["hold_id"]):
+            hold = next(iter(server.lookup("escrow_holds", "id", s["hold_id"])), None)
+            if hold is None or hold["status"] != s["from"]:
+                continue
+            post_ledger_transaction(server, {"p_transaction": s["transaction"], "p_entries": s["entries"],
+                                             "p_month": s["month"]})
+            hold.update(status=s["status"], settlement_id=s["transaction"]["id"],
+                        settled_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+            for txn in server.lookup("ledger_transactions", "id", hold["id"]):
+                if txn.get("status") == "pending":
+                    txn["status"] = "completed"
+            settled.append(hold["id"])
+    return settled
+
+def seed_trips(server, count):
+    """Seeds `count` synthetic trips over a handful of popular routes."""
+    routes = [("Johannesburg", "Durban"), ("Cape Town", "Stellenbosch"), ("Pretoria", "Polokwane"),
+              ("Durban", "Pietermaritzburg"), ("Johannesburg", "Bloemfontein")]
+    rows = []
+    for i in range(count):
+        origin, destination = routes[i % len(routes)]
+        rows.append({
+            "id": f"trip-{i:08d}",
+            "origin": origin,
+            "destination": destination,
+            # generated columns in Postgres (add_trip_search_indexes.sql)
+            "origin_norm": origin.lower(),
+            "destination_norm": destination.lower(),
+            "date": f"2026-02-{(i % 28) + 1:02d}",
+            "time": f"{(i % 24):02d}:00",
+            "price": 150.0 + (i % 10) * 25,
+            "seats_available": 4,
+            "vehicle": "Sedan",
+            "driver_name": f"Driver {i % 500}",
+            "driver_rating": 4.8,
+            "driver_image": "",
+            "status": "scheduled",
+            "created_at": f"2026-01-01T00:00:00.{i:06d}Z",
+        })
+    server.add_rows("trips", rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake PostgREST server.")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--trips", type=int, default=100)
+    args = parser.parse_args()
+
+    fake = FakePostgrest(port=args.port, latency=args.latency_ms / 1000)
+    seed_trips(fake, args.trips)
+    print(f"Fake PostgREST listening on {fake.url} with {args.trips} trips")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
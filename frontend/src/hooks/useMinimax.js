@@ -5,6 +5,7 @@ export const useMinimax = () => {
     const [messages, setMessages] = useState([]);
     const [isLoading, setIsLoading] = useState(false);
     const [error, setError] = useState(null);
+    const [conversationId, setConversationId] = useState(null);
 
     const sendMessage = async (content) => {
         setIsLoading(true);
@@ -14,12 +15,14 @@ export const useMinimax = () => {
         setMessages(newMessages);
 
         try {
-            // Format messages for Minimax if needed, or pass directly
-            // Assuming Minimax expects standard { role, content } format
-            const response = await travelApi.chat(newMessages);
+            // Only the new message goes up; the server rebuilds the context from the conversation
+            const response = await travelApi.chat(content, conversationId);
+            if (response.data.conversation_id) {
+                setConversationId(response.data.conversation_id);
+            }
 
             // Safely extract reply
-            const reply = response.data.reply ||
+            const reply = response.data.content || response.data.reply ||
                 (response.data.choices && response.data.choices[0] && response.data.choices[0].message && response.data.choices[0].message.content) ||
                 "I'm sorry, I didn't understand that response.";
 
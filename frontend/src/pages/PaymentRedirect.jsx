@@ -23,7 +23,19 @@ const PaymentRedirect = () => {
         mutationFn: (paymentData) => travelApi.processPayment(paymentData),
         onSuccess: (data) => {
             if (data.data.success) {
-                completeBooking();
+                // The seats were booked before the checkout; the payment marks them paid
+                setStatus('success');
+                toast({
+                    title: "Booking Confirmed! 🎉",
+                    description: "Your trip has been successfully booked.",
+                });
+                // Clear pending booking
+                localStorage.removeItem('pending_trip_booking');
+
+                // Redirect after a short delay so user sees success state
+                setTimeout(() => {
+                    navigate('/MyBookings');
+                }, 3000);
             } else {
                 handleError("Payment verification failed. Please contact support.");
             }
@@ -33,27 +45,6 @@ const PaymentRedirect = () => {
         }
     });
 
-    const bookingMutation = useMutation({
-        mutationFn: (bookingData) => travelApi.createBooking(bookingData),
-        onSuccess: () => {
-            setStatus('success');
-            toast({
-                title: "Booking Confirmed! 🎉",
-                description: "Your trip has been successfully booked.",
-            });
-            // Clear pending booking
-            localStorage.removeItem('pending_trip_booking');
-
-            // Redirect after a short delay so user sees success state
-            setTimeout(() => {
-                navigate('/MyBookings');
-            }, 3000);
-        },
-        onError: (err) => {
-            handleError("Payment succeeded, but booking creation failed. Please contact support.");
-        }
-    });
-
     const handleError = (message) => {
         setStatus('error');
         toast({
@@ -63,28 +54,6 @@ const PaymentRedirect = () => {
         });
     };
 
-    const completeBooking = () => {
-        try {
-            const pendingStr = localStorage.getItem('pending_trip_booking');
-            if (!pendingStr) {
-                // If it's missing, maybe they navigated here directly or refreshed.
-                handleError("Booking details not found. Reference ID: " + txId);
-                return;
-            }
-
-            const pendingBooking = JSON.parse(pendingStr);
-
-            bookingMutation.mutate({
-                trip_id: pendingBooking.trip_id,
-                user_id: user.id,
-                seats: pendingBooking.seats
-            });
-
-        } catch (err) {
-            handleError("Invalid booking data.");
-        }
-    };
-
     const initialized = React.useRef(false);
 
     useEffect(() => {
@@ -100,20 +69,17 @@ const PaymentRedirect = () => {
         }
 
         if (txId) {
-            // Verify payment
+            // Verify payment (the amount paid comes from the checkout, not from here)
             const pendingStr = localStorage.getItem('pending_trip_booking');
-            let amount = 0;
             let tripId = "";
             if (pendingStr) {
                 try {
-                    const data = JSON.parse(pendingStr);
-                    amount = data.total;
-                    tripId = data.trip_id;
+                    tripId = JSON.parse(pendingStr).trip_id;
                 } catch (e) { }
             }
 
             paymentMutation.mutate({
-                amount: amount,
+                amount: 0,
                 user_id: user.id,
                 trip_id: tripId,
                 token: txId
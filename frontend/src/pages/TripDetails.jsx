@@ -96,23 +96,26 @@ const TripDetails = () => {
 
         setIsProcessing(true);
         try {
-            // Save pending booking to local storage so we can complete it on return
+            // Hold the seats first: the checkout pays for these bookings, at their price
+            const bookingResponse = await travelApi.createBookingsBatch({
+                trip_id: tripId,
+                user_id: user.id,
+                seats: seatsRequired,
+                quoted_price: basePrice || undefined
+            });
+            const bookingIds = bookingResponse.data.ids;
+
+            // Save pending booking to local storage so we can confirm it on return
             const pendingBooking = {
                 trip_id: tripId,
                 seats: seatsRequired,
-                total: totalPrice
+                booking_ids: bookingIds
             };
             localStorage.setItem('pending_trip_booking', JSON.stringify(pendingBooking));
 
             const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
             const checkoutResponse = await axios.post(`${apiUrl}/payments/create-checkout`, {
-                amount: totalPrice,
-                currency: 'ZAR',
-                metadata: {
-                    trip_id: tripId,
-                    user_id: user.id,
-                    seats: seatsRequired
-                }
+                booking_ids: bookingIds
             });
 
             const checkoutUrl = checkoutResponse.data.checkoutUrl;
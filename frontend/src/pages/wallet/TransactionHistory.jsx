@@ -2,24 +2,66 @@ import React, { useState } from 'react';
 import { useQuery } from '@tanstack/react-query';
 import axios from 'axios';
 import { Link } from 'react-router-dom';
+import { useAuth } from '@/lib/AuthContext';
+
+const PAGE_SIZE = 20;
 
 export default function TransactionHistory() {
+    const { user, session } = useAuth();
+    const authHeaders = { Authorization: `Bearer ${session?.access_token}` };
     const [filterType, setFilterType] = useState('All Types');
     const [filterStatus, setFilterStatus] = useState('All Status');
+    const [applied, setApplied] = useState({ type: 'All Types', status: 'All Status' });
+    // Cursor of every page visited so far; the last one is the current page
+    const [cursors, setCursors] = useState([null]);
+    const page = cursors.length - 1;
+
+    // The server reads the user from the access token
+    const filterParams = {
+        ...(applied.type !== 'All Types' && { type: applied.type }),
+        ...(applied.status !== 'All Status' && { status: applied.status }),
+    };
 
-    // Fetch all transactions
-    const { data: transactions, isLoading } = useQuery({
-        queryKey: ['walletTransactions', 'all'],
+    // A plain link can't send the token: fetch the statement, then save it
+    const exportStatement = async () => {
+        try {
+            const res = await axios.get('http://localhost:8000/wallet/transactions/export', {
+                params: filterParams, headers: authHeaders, responseType: 'blob'
+            });
+            const url = URL.createObjectURL(res.data);
+            const link = document.createElement('a');
+            link.href = url;
+            link.download = 'wallet-statement.csv';
+            link.click();
+            URL.revokeObjectURL(url);
+        } catch (error) {
+            console.error("Error exporting transactions:", error);
+        }
+    };
+
+    // Fetch one page of transactions; the server filters and returns the next page's cursor in a header
+    const { data, isLoading } = useQuery({
+        queryKey: ['walletTransactions', 'all', user?.id, applied, cursors[page]],
+        enabled: !!session?.access_token,
         queryFn: async () => {
             try {
-                const res = await axios.get('http://localhost:8000/wallet/transactions');
-                return res.data;
+                const res = await axios.get('http://localhost:8000/wallet/transactions', {
+                    params: { ...filterParams, limit: PAGE_SIZE, ...(cursors[page] && { cursor: cursors[page] }) },
+                    headers: authHeaders
+                });
+                return { rows: res.data, next: res.headers['x-next-cursor'] || null };
             } catch (error) {
                 console.error("Error fetching transactions:", error);
-                return [];
+                return { rows: [], next: null };
             }
         }
     });
+    const transactions = data?.rows;
+
+    const applyFilters = () => {
+        setApplied({ type: filterType, status: filterStatus });
+        setCursors([null]);
+    };
 
     return (
         <div className="flex-1 w-full max-w-[1280px] mx-auto px-4 sm:px-6 lg:px-8 py-8 font-sans">
@@ -38,7 +80,7 @@ export default function TransactionHistory() {
                         View and manage your payments, refunds, and payouts. Keep track of all financial activities associated with your account.
                     </p>
                 </div>
-                <button className="flex items-center gap-2 h-10 px-4 bg-white dark:bg-slate-800 border border-slate-200 dark:border-slate-700 rounded-lg text-sm font-bold text-slate-700 dark:text-slate-200 hover:bg-slate-50 dark:hover:bg-slate-700 hover:text-blue-600 dark:hover:text-blue-400 transition-all shadow-sm">
+                <button type="button" onClick={exportStatement} className="flex items-center gap-2 h-10 px-4 bg-white dark:bg-slate-800 border border-slate-200 dark:border-slate-700 rounded-lg text-sm font-bold text-slate-700 dark:text-slate-200 hover:bg-slate-50 dark:hover:bg-slate-700 hover:text-blue-600 dark:hover:text-blue-400 transition-all shadow-sm">
                     <span className="material-symbols-outlined text-[20px]">download</span>
                     Export to CSV
                 </button>
@@ -131,7 +173,7 @@ export default function TransactionHistory() {
                                 <span className="material-symbols-outlined text-[18px]">expand_more</span>
                             </div>
                         </div>
-                        <button className="bg-blue-600 hover:bg-blue-700 text-white font-medium py-2.5 px-4 rounded-lg text-sm transition-colors shadow-sm dark:bg-blue-500 dark:text-slate-900 dark:hover:bg-blue-400">
+                        <button onClick={applyFilters} className="bg-blue-600 hover:bg-blue-700 text-white font-medium py-2.5 px-4 rounded-lg text-sm transition-colors shadow-sm dark:bg-blue-500 dark:text-slate-900 dark:hover:bg-blue-400">
                             Filter
                         </button>
                     </div>
@@ -209,27 +251,25 @@ export default function TransactionHistory() {
                         <div>
                             <p className="text-sm text-slate-700 dark:text-slate-300">
                                 Showing
-                                <span className="font-medium mx-1">1</span>
+                                <span className="font-medium mx-1">{transactions?.length ? page * PAGE_SIZE + 1 : 0}</span>
                                 to
-                                <span className="font-medium mx-1">{transactions?.length || 0}</span>
-                                of
-                                <span className="font-medium mx-1">{transactions?.length || 0}</span>
+                                <span className="font-medium mx-1">{page * PAGE_SIZE + (transactions?.length || 0)}</span>
                                 results
                             </p>
                         </div>
                         <div>
                             <nav aria-label="Pagination" className="relative z-0 inline-flex rounded-md shadow-sm -space-x-px">
-                                <a className="relative inline-flex items-center px-2 py-2 rounded-l-md border border-slate-300 dark:border-slate-600 bg-white dark:bg-slate-800 text-sm font-medium text-slate-500 hover:bg-slate-50 dark:hover:bg-slate-700" href="#">
+                                <button disabled={page === 0} onClick={() => setCursors((c) => c.slice(0, -1))} className="relative inline-flex items-center px-2 py-2 rounded-l-md border border-slate-300 dark:border-slate-600 bg-white dark:bg-slate-800 text-sm font-medium text-slate-500 hover:bg-slate-50 dark:hover:bg-slate-700 disabled:opacity-40">
                                     <span className="sr-only">Previous</span>
                                     <span className="material-symbols-outlined text-[20px]">chevron_left</span>
-                                </a>
-                                <a aria-current="page" className="z-10 bg-blue-50 border-blue-600 text-blue-600 dark:border-blue-500 dark:text-blue-400 dark:bg-blue-900/20 relative inline-flex items-center px-4 py-2 border text-sm font-medium" href="#">
-                                    1
-                                </a>
-                                <a className="relative inline-flex items-center px-2 py-2 rounded-r-md border border-slate-300 dark:border-slate-600 bg-white dark:bg-slate-800 text-sm font-medium text-slate-500 hover:bg-slate-50 dark:hover:bg-slate-700" href="#">
+                                </button>
+                                <span aria-current="page" className="z-10 bg-blue-50 border-blue-600 text-blue-600 dark:border-blue-500 dark:text-blue-400 dark:bg-blue-900/20 relative inline-flex items-center px-4 py-2 border text-sm font-medium">
+                                    {page + 1}
+                                </span>
+                                <button disabled={!data?.next} onClick={() => setCursors((c) => [...c, data.next])} className="relative inline-flex items-center px-2 py-2 rounded-r-md border border-slate-300 dark:border-slate-600 bg-white dark:bg-slate-800 text-sm font-medium text-slate-500 hover:bg-slate-50 dark:hover:bg-slate-700 disabled:opacity-40">
                                     <span className="sr-only">Next</span>
                                     <span className="material-symbols-outlined text-[20px]">chevron_right</span>
-                                </a>
+                                </button>
                             </nav>
                         </div>
                     </div>
@@ -2,16 +2,21 @@ import React from 'react';
 import { useQuery } from '@tanstack/react-query';
 import axios from 'axios';
 import { useNavigate } from 'react-router-dom';
+import { useAuth } from '@/lib/AuthContext';
 
 export default function WalletDashboard() {
     const navigate = useNavigate();
+    const { user, session } = useAuth();
+    const authHeaders = { Authorization: `Bearer ${session?.access_token}` };
 
     // Fetch wallet balance and stats
     const { data: balanceData, isLoading: isLoadingBalance } = useQuery({
-        queryKey: ['walletBalance'],
+        queryKey: ['walletBalance', user?.id],
+        enabled: !!session?.access_token,
         queryFn: async () => {
             try {
-                const res = await axios.get('http://localhost:8000/wallet/balance');
+                // The server reads the user from the access token
+                const res = await axios.get('http://localhost:8000/wallet/balance', { headers: authHeaders });
                 return res.data;
             } catch (error) {
                 console.error("Error fetching balance:", error);
@@ -22,10 +27,11 @@ export default function WalletDashboard() {
 
     // Fetch recent transactions (limit to a few for preview)
     const { data: transactions, isLoading: isLoadingTx } = useQuery({
-        queryKey: ['walletTransactions', 'preview'],
+        queryKey: ['walletTransactions', 'preview', user?.id],
+        enabled: !!session?.access_token,
         queryFn: async () => {
             try {
-                const res = await axios.get('http://localhost:8000/wallet/transactions');
+                const res = await axios.get('http://localhost:8000/wallet/transactions', { params: { limit: 5 }, headers: authHeaders });
                 return res.data;
             } catch (error) {
                 console.error("Error fetching transactions:", error);
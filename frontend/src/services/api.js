@@ -9,13 +9,15 @@ const api = axios.create({
 
 export const travelApi = {
     // AI Chat
-    chat: (messages) => api.post('/ai/chat', { messages }),
+    // The server keeps the history: send the new message and the conversation id it returned
+    chat: (message, conversationId) => api.post('/ai/chat', { message, conversation_id: conversationId }),
 
     // Travel Data
     searchTrips: (params) => api.get('/travel/trips', { params }),
     getTrip: (id) => api.get(`/travel/trips/${id}`),
     getBookings: (userId) => api.get('/travel/bookings', { params: { user_id: userId } }),
     createBooking: (data) => api.post('/travel/bookings', data),
+    createBookingsBatch: (data) => api.post('/travel/bookings/batch', data),
     searchFlights: (params) => api.get('/travel/flights', { params }),
     searchHotels: (params) => api.get('/travel/hotels', { params }),
 